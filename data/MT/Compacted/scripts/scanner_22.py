@@ -1,4 +1,4 @@
-from pyscf.pbc.dft.multigrid.multigrid_pair import eval_rho, _update_task_list, _eval_rhoG
+from pyscf.pbc.dft.multigrid.multigrid_pair import NGRIDS, KE_RATIO
 from pyscf.pbc import gto, dft, tools
 from pyscf.scf import addons
 from pyscf import lib
@@ -29,40 +29,27 @@ class _RKS(dft.rks.RKS):
 
 def get_rho(mf, dm):
     # use mulitgrid to get rho; this is fast
-    hermi = 1
-    deriv = 0
-    rhoG = _eval_rhoG(mf.with_df, dm, hermi, np.zeros((1,3)), deriv)
-    mesh = mf.with_df.mesh
-    ngrids = np.prod(mesh)
-    weight = mf.cell.vol / ngrids
-    rhoR = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real *  (1./weight)
-    return rhoR[0]
+    # labels are consumed as float32, so collocate in single precision
+    return mf.with_df.get_rho(dm, dtype=np.float32)
 
 fp = open(f"{argv[1]}")
 natom = int(fp.readline()); fp.readline(); atoms = fp.readlines()[:natom]; fp.close()
 coords = np.array([line.split()[1:4] for line in atoms], dtype=float)
 charge = int(argv[2])
 atoms = [" ".join(line.split()[:4]) for line in atoms]
-geom_cen = np.mean(coords, axis=0)
-
-# rotate 45 degree along y axis to have a smaller box
-coords = coords - geom_cen
-rot_matrix = np.array([[ 0.70710678,  0.        ,  0.70710678], [ 0.        ,  1.        ,  0.        ], [-0.70710678,  0.        ,  0.70710678]])
-coords = coords @ rot_matrix
-geom_cen = np.mean(coords, axis=0)
-
-box = np.max(coords, axis=0)-np.min(coords, axis=0) + margin
-box = np.ceil(box * np.sqrt(2 * cut1) / np.pi / lib.param.BOHR) 
-box = np.diag(box / np.sqrt(2 * cut1) * np.pi * lib.param.BOHR - 1e-4)
-shift = np.diag(box) / 2 - geom_cen
-coords = coords + shift
+# rotate to the principal axes and choose a box in which the meshes of all
+# multigrid levels are FFT friendly
+coords, box, box_info = tools.minimal_box(coords, [cut1, cut2], margin=margin,
+                                          ngrids=NGRIDS, ke_ratio=KE_RATIO)
+print("box", np.diag(box), "predicted FFT cost", box_info['fft_cost'],
+      "(unrotated", box_info['fft_cost_ref'], ")")
 fp = open("centered.xyz", "w")
 print(natom, file=fp); print("", file=fp)
 for line, c in zip(atoms, coords):
-    print(line.split()[0], *c, file=fp)
+    print("%-2s %16.10f %16.10f %16.10f" % (line.split()[0], *c), file=fp)
 fp.close()
 fp = open("centered.xyz"); fp.readline(); fp.readline(); atoms = fp.readlines(); fp.close()
-np.savetxt("box.dat", box)
+np.savetxt("box.dat", box, fmt="%.10f")
 
 opt_cut1 = cut1
 opt_cut2 = cut2
@@ -81,23 +68,14 @@ cell.build()
 lattice_vectors = cell.lattice_vectors().copy()
 #np.save("grid_coords_1.npy", cell11.get_uniform_grids())
 
-cell11 = cell.copy()
-cell11.ke_cutoff = opt_cut1
-cell11.build()
+cell11 = cell.derive(ke_cutoff=opt_cut1)
 
-cell12 = cell11.copy()
-cell12.ke_cutoff = opt_cut2
-cell12.build()
+cell12 = cell11.derive(ke_cutoff=opt_cut2)
 #np.save("grid_coords_2.npy", cell12.get_uniform_grids())
 
-cell21 = cell11.copy()
-cell21.basis = basis2
-cell21.build()
+cell21 = cell11.derive(basis=basis2)
 
-cell22 = cell11.copy()
-cell22.basis = basis2
-cell22.ke_cutoff = opt_cut2
-cell22.build()
+cell22 = cell11.derive(basis=basis2, ke_cutoff=opt_cut2)
 
 cells = {'11': cell11, '12': cell12, '21': cell21, '22': cell22}
 
@@ -1,5 +1,4 @@
 from pyscf.pbc import gto, dft, tools
-from pyscf.scf import addons
 from pyscf import lib
 from sys import argv
 import numpy as np
@@ -36,12 +35,14 @@ for line, c in zip(atoms, coords):
 fp.close()
 fp = open("centered.xyz"); fp.readline(); fp.readline(); atoms = fp.readlines(); fp.close()
 
-opt_cut1 = cut1
-opt_cut2 = cut2
+# the SCF is run once with basis2 at the highest cutoff; the labels of the
+# lower cutoffs (same basis) are its density restricted onto their meshes
+# by Fourier truncation, so all labels of one molecule are consistent
+labels = {'22': cut2, '21': cut1}
 
 cell = gto.Cell()
-cell.basis = basis1
-cell.ke_cutoff = cut1
+cell.basis = basis2
+cell.ke_cutoff = max(labels.values())
 cell.a = box
 cell.pseudo = ppstr
 cell.atom = atoms
@@ -51,27 +52,6 @@ cell.rcut_by_shell_radius = True
 cell.charge = charge
 cell.build()
 lattice_vectors = cell.lattice_vectors().copy()
-#np.save("grid_coords_1.npy", cell11.get_uniform_grids())
-
-cell11 = cell.copy()
-cell11.ke_cutoff = opt_cut1
-cell11.build()
-
-cell12 = cell11.copy()
-cell12.ke_cutoff = opt_cut2
-cell12.build()
-#np.save("grid_coords_2.npy", cell12.get_uniform_grids())
-
-cell21 = cell11.copy()
-cell21.basis = basis2
-cell21.build()
-
-cell22 = cell11.copy()
-cell22.basis = basis2
-cell22.ke_cutoff = opt_cut2
-cell22.build()
-
-cells = {'11': cell11, '12': cell12, '21': cell21, '22': cell22}
 
 def make_mf(cell):
     df = dft.multigrid.MultiGridFFTDF2(cell)
@@ -83,27 +63,30 @@ def make_mf(cell):
     mf.max_cycle = 200
     return mf
 
-mf11 = make_mf(cell11)
-mf12 = make_mf(cell12)
-mf21 = make_mf(cell21)
-mf22 = make_mf(cell22)
-
-mfs = {'11': mf11, '12': mf12, '21': mf21, '22': mf22}
-
-def run_mf(mf, suffix, dm0=None):
-    assert mf is mfs[suffix]
+def run_mf(mf, labels, dm0=None):
     E = mf.kernel(dm0=dm0)
     if not mf.converged:
         print("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@")
-        print("@@@@@@@@@", suffix, "not converged @@@@@@@@@")
+        print("@@@@@@@@@", "not converged @@@@@@@@@")
         print("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@")
-    np.savetxt(f"grid_sizes_{suffix}.dat", mf.grids.mesh, fmt="%d")
     dm = mf.make_rdm1()
-    ni = mf._numint
-    rho = ni.eval_rho(mf.cell, ni.eval_ao(mf.cell, mf.with_df.grids.coords), dm)
-    np.savetxt(f"energy_{suffix}.dat", [E])
-#    np.save(f"dm_{suffix}.npy", dm)
-    np.save(f"rho_{suffix}.npy", rho)
+    mesh = np.asarray(mf.with_df.mesh)
+    rho = mf.with_df.get_rho(dm)
+    suffixes = sorted(labels, key=lambda k: -labels[k])
+    submeshes = [tools.cutoff_to_mesh(lattice_vectors, labels[k])
+                 for k in suffixes[1:]]
+    rhos = [rho]
+    if submeshes:
+        # one forward FFT for all the coarser meshes
+        rho_sub = tools.restrict_by_fft(rho, mesh, submeshes)
+        rhos += list(rho_sub) if len(submeshes) > 1 else [rho_sub]
+    for suffix, m, r in zip(suffixes, [mesh] + submeshes, rhos):
+        nelec = r.sum() * mf.cell.vol / np.prod(m)
+        print("label", suffix, "mesh", m, "nelec", nelec)
+        np.savetxt(f"grid_sizes_{suffix}.dat", m, fmt="%d")
+        np.save(f"rho_{suffix}.npy", r)
+    # only the SCF itself has an energy
+    np.savetxt(f"energy_{suffixes[0]}.dat", [E])
     return dm
 
-run_mf(mf22, '22')
+run_mf(make_mf(cell), labels)
@@ -1,14 +1,11 @@
-for fn in {1..133885}
+store=results.store
+# one call to filter out the molecules already in the store
+for fn in `for i in {1..133885}; do printf "dsgdb9nsd_%06d\n" $i; done | \
+           python -m pyscf.tools.result_store pending $store 22`
 do
-    fn=`printf "dsgdb9nsd_%06d" $fn`
     echo $fn
-    if [ -e results/$fn/rho_22.npy ]
-    then
-        echo "skip $fn"
-        continue
-    fi
-    mkdir results/$fn
-    cd results/$fn
-    python -u ../../scripts/scanner_22.py /path/to/QM9/xyzs/ $fn > scanner.out
+    mkdir -p work/$fn
+    cd work/$fn
+    python -u ../../scripts/scanner_22.py /path/to/QM9/xyzs/ $fn ../../$store > scanner.out
     cd ../../
 done
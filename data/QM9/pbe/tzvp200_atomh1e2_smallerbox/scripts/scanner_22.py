@@ -5,14 +5,18 @@ from sys import argv
 import numpy as np
 from pyscf.pbc.dft.multigrid.multigrid_pair import _eval_rhoG
 from pyscf.data import elements
+from pyscf.tools.result_store import ResultStore
 
 atomic_configuration = elements.NRSRHF_CONFIGURATION
 
 '''
 argv[1]: directory to coordinates
 argv[2]: system name (w/o .xyz)
+argv[3]: (optional) result store; loose files are written if not given
 '''
 
+store = ResultStore(argv[3]) if len(argv) > 3 else None
+
 basis1 = '/path/to/gth-szv2.dat'
 basis2 = 'gth-tzv2p'
 cut1 = 50
@@ -57,10 +61,7 @@ cell.build()
 lattice_vectors = cell.lattice_vectors().copy()
 #np.save("grid_coords_1.npy", cell11.get_uniform_grids())
 
-cell22 = cell.copy()
-cell22.basis = basis2
-cell22.ke_cutoff = opt_cut2
-cell22.build()
+cell22 = cell.derive(basis=basis2, ke_cutoff=opt_cut2)
 
 def make_mf(cell):
     df = dft.multigrid.MultiGridFFTDF2(cell)
@@ -131,9 +132,25 @@ def run_mf(mf, suffix):
     weight = mf.cell.vol / ngrids
     rhoR = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real *  (1./weight)
     rho = rhoR[0]
+    if store is not None:
+        with open("centered.xyz") as fp:
+            xyz = fp.read()
+        store.put(argv[2], suffix, rho, mesh=mf.grids.mesh,
+                  box=mf.cell.lattice_vectors(), xyz=xyz,
+                  provenance={'script': __file__, 'basis': [basis1, basis2],
+                              'ke_cutoff': [cut1, cut2], 'xc': xcstr})
+        return dm0
     np.savetxt(f"grid_sizes_{suffix}.dat", mf.grids.mesh, fmt="%d")
 #    np.save(f"dm_{suffix}.npy", dm0)
     np.save(f"rho_{suffix}.npy", rho)
     return dm0
 
-run_mf(mf22, '22')
+if store is not None and not store.claim(argv[2], '22'):
+    print("skip", argv[2])
+    exit()
+try:
+    run_mf(mf22, '22')
+finally:
+    # no-op after store.put; lets other workers retry a failed scan
+    if store is not None:
+        store.release(argv[2], '22')
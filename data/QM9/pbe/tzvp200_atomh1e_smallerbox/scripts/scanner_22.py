@@ -57,10 +57,7 @@ cell.build()
 lattice_vectors = cell.lattice_vectors().copy()
 #np.save("grid_coords_1.npy", cell11.get_uniform_grids())
 
-cell22 = cell.copy()
-cell22.basis = basis2
-cell22.ke_cutoff = opt_cut2
-cell22.build()
+cell22 = cell.derive(basis=basis2, ke_cutoff=opt_cut2)
 
 def make_mf(cell):
     df = dft.multigrid.MultiGridFFTDF2(cell)
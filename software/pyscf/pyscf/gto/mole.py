@@ -2422,10 +2422,12 @@ class Mole(lib.StreamObject):
         if dump_input and not self._built and self.verbose > logger.NOTE:
             self.dump_input()
 
-        logger.debug3(self, 'arg.atm = %s', str(self._atm))
-        logger.debug3(self, 'arg.bas = %s', str(self._bas))
-        logger.debug3(self, 'arg.env = %s', str(self._env))
-        logger.debug3(self, 'ecpbas  = %s', str(self._ecpbas))
+        if self.verbose >= logger.DEBUG3:
+            # str() of the arrays is not free; skip it when not printed
+            logger.debug3(self, 'arg.atm = %s', str(self._atm))
+            logger.debug3(self, 'arg.bas = %s', str(self._bas))
+            logger.debug3(self, 'arg.env = %s', str(self._env))
+            logger.debug3(self, 'ecpbas  = %s', str(self._ecpbas))
 
         self._built = True
         return self
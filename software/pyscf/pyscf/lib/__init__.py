@@ -33,6 +33,7 @@ from pyscf.lib.linalg_helper import *
 from pyscf.lib.scipy_helper import *
 from pyscf.lib import chkfile
 from pyscf.lib import diis
+from pyscf.lib import profiler
 from pyscf.lib.misc import StreamObject
 
 # TODO following is temporary
@@ -32,6 +32,7 @@
 
 #define MAX_THREADS     256
 #define PTR_RADIUS        5
+#define EXPMIN         -700
 
 static void transform_dm(double* dm_cart, double* dm,
                          double* ish_contr_coeff, double* jsh_contr_coeff,
@@ -104,14 +105,134 @@ static void add_rho_submesh(double* rho, double* pqr,
 }
 
 
-static void _orth_rho(double *rho, double *dm_xyz,
+static void add_rho_submesh_f32(float* rho, double* pqr,
+                                int* mesh_lb, int* mesh_ub, int* submesh_lb,
+                                const int* mesh, const int* submesh)
+{
+    const int x0 = mesh_lb[0];
+    const int y0 = mesh_lb[1];
+    const int z0 = mesh_lb[2];
+
+    const int nx = mesh_ub[0] - x0;
+    const int ny = mesh_ub[1] - y0;
+    const int nz = mesh_ub[2] - z0;
+
+    const int x0_sub = submesh_lb[0];
+    const int y0_sub = submesh_lb[1];
+    const int z0_sub = submesh_lb[2];
+
+    const size_t mesh_yz = ((size_t) mesh[1]) * mesh[2];
+    const size_t submesh_yz = ((size_t) submesh[1]) * submesh[2];
+
+    int ix, iy, iz;
+    for (ix = 0; ix < nx; ix++) {
+        float* __restrict ptr_rho = rho + (ix + x0) * mesh_yz + y0 * mesh[2] + z0;
+        double* __restrict ptr_pqr = pqr + (ix + x0_sub) * submesh_yz + y0_sub * submesh[2] + z0_sub;
+        for (iy = 0; iy < ny; iy++) {
+            #pragma omp simd
+            for (iz = 0; iz < nz; iz++) {
+                ptr_rho[iz] += (float) ptr_pqr[iz];
+            }
+            ptr_rho += mesh[2];
+            ptr_pqr += submesh[2];
+        }
+    }
+}
+
+
+/*
+ * dm_xyz holds comp polynomials, each of size (topl+1)^3, which share
+ * the same Gaussian. They are evaluated on the submesh together, and
+ * the results are stored as comp consecutive submeshes.
+ */
+static double* _orth_pqr(double *dm_xyz, int comp, double fac, int topl, int *grid_slice,
+                         double *xs_exp, double *ys_exp, double *zs_exp,
+                         double *cache)
+{
+    const int l1 = topl + 1;
+    const int l1l1 = l1 * l1;
+    const int ngridx = grid_slice[1] - grid_slice[0];
+    const int ngridy = grid_slice[3] - grid_slice[2];
+    const int ngridz = grid_slice[5] - grid_slice[4];
+
+    const char TRANS_N = 'N';
+    const char TRANS_T = 'T';
+    const double D0 = 0;
+    const double D1 = 1;
+    const int xcols = ngridy * ngridz;
+    const int ncols = comp * l1l1;
+    double *xyr = cache;
+    double *xqr = xyr + ncols * ngridz;
+    double *pqr = xqr + comp * l1 * xcols;
+    int l, ic;
+
+    dgemm_wrapper(TRANS_N, TRANS_N, ngridz, ncols, l1,
+                  fac, zs_exp, ngridz, dm_xyz, l1,
+                  D0, xyr, ngridz);
+    for (l = 0; l < comp * l1; l++) {
+        dgemm_wrapper(TRANS_N, TRANS_T, ngridz, ngridy, l1,
+                      D1, xyr+l*l1*ngridz, ngridz, ys_exp, ngridy,
+                      D0, xqr+l*xcols, ngridz);
+    }
+    for (ic = 0; ic < comp; ic++) {
+        dgemm_wrapper(TRANS_N, TRANS_T, xcols, ngridx, l1,
+                      D1, xqr+ic*l1*xcols, xcols, xs_exp, ngridx,
+                      D0, pqr+((size_t)ic)*ngridx*xcols, xcols);
+    }
+    return pqr;
+}
+
+
+static void _orth_rho_f32(float *rho, double *dm_xyz,
+                          double fac, int topl,
+                          int *mesh, int *grid_slice,
+                          double *xs_exp, double *ys_exp, double *zs_exp,
+                          double *cache)
+{
+    const int nx0 = grid_slice[0];
+    const int ny0 = grid_slice[2];
+    const int nz0 = grid_slice[4];
+    const int ngridx = grid_slice[1] - nx0;
+    const int ngridy = grid_slice[3] - ny0;
+    const int ngridz = grid_slice[5] - nz0;
+    if (ngridx == 0 || ngridy == 0 || ngridz == 0) {
+        return;
+    }
+
+    // the pair density is computed in double precision on the submesh
+    // and then accumulated to the single precision mesh
+    double *pqr = _orth_pqr(dm_xyz, 1, fac, topl, grid_slice,
+                            xs_exp, ys_exp, zs_exp, cache);
+
+    const int submesh[3] = {ngridx, ngridy, ngridz};
+    int lb[3], ub[3];
+    int ix, iy, iz;
+    for (ix = 0; ix < ngridx;) {
+        lb[0] = modulo(ix + nx0, mesh[0]);
+        ub[0] = get_upper_bound(lb[0], mesh[0], ix, ngridx);
+        for (iy = 0; iy < ngridy;) {
+            lb[1] = modulo(iy + ny0, mesh[1]);
+            ub[1] = get_upper_bound(lb[1], mesh[1], iy, ngridy);
+            for (iz = 0; iz < ngridz;) {
+                lb[2] = modulo(iz + nz0, mesh[2]);
+                ub[2] = get_upper_bound(lb[2], mesh[2], iz, ngridz);
+                int lb_sub[3] = {ix, iy, iz};
+                add_rho_submesh_f32(rho, pqr, lb, ub, lb_sub, mesh, submesh);
+                iz += ub[2] - lb[2];
+            }
+            iy += ub[1] - lb[1];
+        }
+        ix += ub[0] - lb[0];
+    }
+}
+
+
+static void _orth_rho(double *rho, double *dm_xyz, int comp,
                       double fac, int topl,
                       int *mesh, int *grid_slice,
                       double *xs_exp, double *ys_exp, double *zs_exp,
                       double *cache)
 {
-    const int l1 = topl + 1;
-    const int l1l1 = l1 * l1;
     const int nx0 = grid_slice[0];
     const int nx1 = grid_slice[1];
     const int ny0 = grid_slice[2];
@@ -125,29 +246,13 @@ static void _orth_rho(double *rho, double *dm_xyz,
         return;
     }
 
-    const char TRANS_N = 'N';
-    const char TRANS_T = 'T';
-    const double D0 = 0;
-    const double D1 = 1;
-    const int xcols = ngridy * ngridz;
-    double *xyr = cache;
-    double *xqr = xyr + l1l1 * ngridz;
-    double *pqr = xqr + l1 * xcols;
-    int ix, iy, iz, l;
-
-    dgemm_wrapper(TRANS_N, TRANS_N, ngridz, l1l1, l1,
-                  fac, zs_exp, ngridz, dm_xyz, l1,
-                  D0, xyr, ngridz);
-    for (l = 0; l <= topl; l++) {
-        dgemm_wrapper(TRANS_N, TRANS_T, ngridz, ngridy, l1,
-                      D1, xyr+l*l1*ngridz, ngridz, ys_exp, ngridy,
-                      D0, xqr+l*xcols, ngridz);
-    }
-    dgemm_wrapper(TRANS_N, TRANS_T, xcols, ngridx, l1,
-                  D1, xqr, xcols, xs_exp, ngridx,
-                  D0, pqr, xcols);
+    double *pqr = _orth_pqr(dm_xyz, comp, fac, topl, grid_slice,
+                            xs_exp, ys_exp, zs_exp, cache);
+    int ix, iy, iz, ic;
 
     const int submesh[3] = {ngridx, ngridy, ngridz};
+    const size_t mesh_size = ((size_t)mesh[0]) * mesh[1] * mesh[2];
+    const size_t submesh_size = ((size_t)ngridx) * ngridy * ngridz;
     int lb[3], ub[3];
     for (ix = 0; ix < ngridx;) {
         lb[0] = modulo(ix + nx0, mesh[0]);
@@ -159,7 +264,10 @@ static void _orth_rho(double *rho, double *dm_xyz,
                 lb[2] = modulo(iz + nz0, mesh[2]);
                 ub[2] = get_upper_bound(lb[2], mesh[2], iz, ngridz);
                 int lb_sub[3] = {ix, iy, iz};
-                add_rho_submesh(rho, pqr, lb, ub, lb_sub, mesh, submesh);
+                for (ic = 0; ic < comp; ic++) {
+                    add_rho_submesh(rho+ic*mesh_size, pqr+ic*submesh_size,
+                                    lb, ub, lb_sub, mesh, submesh);
+                }
                 iz += ub[2] - lb[2];
             }
             iy += ub[1] - lb[1];
@@ -195,12 +303,694 @@ void make_rho_lda_orth(double *rho, double *dm, int comp,
 
         _dm_to_dm_xyz(dm_xyz, dm, li, lj, ri, rj, cache);
 
-        _orth_rho(rho, dm_xyz, fac, topl, mesh, grid_slice,
+        _orth_rho(rho, dm_xyz, 1, fac, topl, mesh, grid_slice,
                   xs_exp, ys_exp, zs_exp, cache);
 }
 
 
-static void _apply_rho(void (*eval_rho)(), double *rho, double *dm,
+void make_rho_lda_orth_f32(float *rho, double *dm, int comp,
+                           int li, int lj, double ai, double aj,
+                           double *ri, double *rj, double fac, double cutoff,
+                           int dimension, double* dh, double *a, double *b,
+                           int *mesh, double *cache)
+{
+        int topl = li + lj;
+        int l1 = topl + 1;
+        int l1l1l1 = l1 * l1 * l1;
+        int grid_slice[6];
+        double *xs_exp, *ys_exp, *zs_exp;
+        int data_size = init_orth_data(&xs_exp, &ys_exp, &zs_exp,
+                                       grid_slice, dh, mesh, topl, cutoff,
+                                       ai, aj, ri, rj, cache);
+
+        if (data_size == 0) {
+                return;
+        }
+        cache += data_size;
+
+        double *dm_xyz = cache;
+        cache += l1l1l1;
+        memset(dm_xyz, 0, l1l1l1*sizeof(double));
+
+        _dm_to_dm_xyz(dm_xyz, dm, li, lj, ri, rj, cache);
+
+        _orth_rho_f32(rho, dm_xyz, fac, topl, mesh, grid_slice,
+                      xs_exp, ys_exp, zs_exp, cache);
+}
+
+
+/*
+ * The pair density sum_{lmn} dm_xyz[l,m,n] X^l Y^m Z^n exp(-aij |r-rij|^2)
+ * with X = x - xi, and its cartesian gradients, as polynomials of
+ * degree topl+1. They are stored in dm_gga as 4 cubes of size (topl+2)^3.
+ * Since the gradient of the product of the two Gaussians is collocated,
+ * the result does not depend on the i/j order of the pair, and the
+ * Hermitian symmetry of the density matrix can be used.
+ */
+static void _dm_xyz_gga(double *dm_gga, double *dm_xyz, int topl,
+                        double ai, double aj, double *ri, double *rj)
+{
+        const int l1 = topl + 1;
+        const int l1l1 = l1 * l1;
+        const int L1 = topl + 2;
+        const int L1L1 = L1 * L1;
+        const size_t L3 = ((size_t)L1L1) * L1;
+        const double aij2 = -2 * (ai + aj);
+        // 2 * aij * (rij - ri)
+        const double xij2 = 2 * aj * (rj[0] - ri[0]);
+        const double yij2 = 2 * aj * (rj[1] - ri[1]);
+        const double zij2 = 2 * aj * (rj[2] - ri[2]);
+        double *rho = dm_gga;
+        double *rhox = rho + L3;
+        double *rhoy = rhox + L3;
+        double *rhoz = rhoy + L3;
+        int lx, ly, lz, p;
+        double d;
+
+        NPdset0(dm_gga, 4*L3);
+        for (lx = 0; lx <= topl; lx++) {
+        for (ly = 0; ly <= topl-lx; ly++) {
+        for (lz = 0; lz <= topl-lx-ly; lz++) {
+                d = dm_xyz[lx*l1l1+ly*l1+lz];
+                if (d == 0) {
+                        continue;
+                }
+                p = lx * L1L1 + ly * L1 + lz;
+                rho[p] += d;
+                rhox[p+L1L1] += aij2 * d;
+                rhox[p] += xij2 * d;
+                rhoy[p+L1] += aij2 * d;
+                rhoy[p] += yij2 * d;
+                rhoz[p+1] += aij2 * d;
+                rhoz[p] += zij2 * d;
+                if (lx > 0) {
+                        rhox[p-L1L1] += lx * d;
+                }
+                if (ly > 0) {
+                        rhoy[p-L1] += ly * d;
+                }
+                if (lz > 0) {
+                        rhoz[p-1] += lz * d;
+                }
+        } } }
+}
+
+
+/*
+ * d/dx [X^l exp(-aij (x-xij)^2)] for l = 0..topl, where X = x - xi.
+ * xs_exp holds the values for l = 0..topl+1 on ngridx grids.
+ */
+static void _orth_deriv_exp(double *dxs_exp, double *xs_exp, int topl, int ngridx,
+                            double aij, double xij2)
+{
+        const double aij2 = -2 * aij;
+        int l, i;
+        double *pxs, *pdxs;
+        for (l = 0; l <= topl; l++) {
+                pxs = xs_exp + l * ngridx;
+                pdxs = dxs_exp + l * ngridx;
+                #pragma omp simd
+                for (i = 0; i < ngridx; i++) {
+                        pdxs[i] = aij2 * pxs[ngridx+i] + xij2 * pxs[i];
+                }
+                if (l > 0) {
+                        #pragma omp simd
+                        for (i = 0; i < ngridx; i++) {
+                                pdxs[i] += l * pxs[i-ngridx];
+                        }
+                }
+        }
+}
+
+
+/*
+ * Density and its gradients on an orthogonal lattice. The gradients are
+ * obtained by differentiating the 1D Gaussians along each direction, so
+ * that the contractions along z and y are shared by the four components.
+ */
+void make_rho_gga_orth(double *rho, double *dm, int comp,
+                       int li, int lj, double ai, double aj,
+                       double *ri, double *rj, double fac, double cutoff,
+                       int dimension, double* dh, double *a, double *b,
+                       int *mesh, double *cache)
+{
+        int topl = li + lj;
+        int l1 = topl + 1;
+        int l1l1 = l1 * l1;
+        int l1l1l1 = l1l1 * l1;
+        int grid_slice[6];
+        double *xs_exp, *ys_exp, *zs_exp;
+        int data_size = init_orth_data(&xs_exp, &ys_exp, &zs_exp,
+                                       grid_slice, dh, mesh, topl+1, cutoff,
+                                       ai, aj, ri, rj, cache);
+
+        if (data_size == 0) {
+                return;
+        }
+        cache += data_size;
+
+        const int nx0 = grid_slice[0];
+        const int ny0 = grid_slice[2];
+        const int nz0 = grid_slice[4];
+        const int ngridx = grid_slice[1] - nx0;
+        const int ngridy = grid_slice[3] - ny0;
+        const int ngridz = grid_slice[5] - nz0;
+        if (ngridx == 0 || ngridy == 0 || ngridz == 0) {
+                return;
+        }
+
+        double aij = ai + aj;
+        double *dxs_exp = cache;
+        double *dys_exp = dxs_exp + l1 * ngridx;
+        double *dzs_exp = dys_exp + l1 * ngridy;
+        cache = dzs_exp + l1 * ngridz;
+        _orth_deriv_exp(dxs_exp, xs_exp, topl, ngridx, aij, 2*aj*(rj[0]-ri[0]));
+        _orth_deriv_exp(dys_exp, ys_exp, topl, ngridy, aij, 2*aj*(rj[1]-ri[1]));
+        _orth_deriv_exp(dzs_exp, zs_exp, topl, ngridz, aij, 2*aj*(rj[2]-ri[2]));
+
+        double *dm_xyz = cache;
+        cache += l1l1l1;
+        memset(dm_xyz, 0, l1l1l1*sizeof(double));
+        _dm_to_dm_xyz(dm_xyz, dm, li, lj, ri, rj, cache);
+
+        const char TRANS_N = 'N';
+        const char TRANS_T = 'T';
+        const double D0 = 0;
+        const double D1 = 1;
+        const int xcols = ngridy * ngridz;
+        const size_t submesh_size = ((size_t)ngridx) * xcols;
+        // xyr, xyr_z (d/dz applied)
+        double *xyr = cache;
+        double *xyr_z = xyr + l1l1 * ngridz;
+        // xqr, xqr_z, xqr_y
+        double *xqr = xyr_z + l1l1 * ngridz;
+        double *xqr_z = xqr + l1 * xcols;
+        double *xqr_y = xqr_z + l1 * xcols;
+        double *pqr = xqr_y + l1 * xcols;
+        int l;
+
+        dgemm_wrapper(TRANS_N, TRANS_N, ngridz, l1l1, l1,
+                      fac, zs_exp, ngridz, dm_xyz, l1,
+                      D0, xyr, ngridz);
+        dgemm_wrapper(TRANS_N, TRANS_N, ngridz, l1l1, l1,
+                      fac, dzs_exp, ngridz, dm_xyz, l1,
+                      D0, xyr_z, ngridz);
+        for (l = 0; l < 2 * l1; l++) {
+                dgemm_wrapper(TRANS_N, TRANS_T, ngridz, ngridy, l1,
+                              D1, xyr+l*l1*ngridz, ngridz, ys_exp, ngridy,
+                              D0, xqr+l*xcols, ngridz);
+        }
+        for (l = 0; l < l1; l++) {
+                dgemm_wrapper(TRANS_N, TRANS_T, ngridz, ngridy, l1,
+                              D1, xyr+l*l1*ngridz, ngridz, dys_exp, ngridy,
+                              D0, xqr_y+l*xcols, ngridz);
+        }
+        dgemm_wrapper(TRANS_N, TRANS_T, xcols, ngridx, l1,
+                      D1, xqr, xcols, xs_exp, ngridx,
+                      D0, pqr, xcols);
+        dgemm_wrapper(TRANS_N, TRANS_T, xcols, ngridx, l1,
+                      D1, xqr, xcols, dxs_exp, ngridx,
+                      D0, pqr+submesh_size, xcols);
+        dgemm_wrapper(TRANS_N, TRANS_T, xcols, ngridx, l1,
+                      D1, xqr_y, xcols, xs_exp, ngridx,
+                      D0, pqr+2*submesh_size, xcols);
+        dgemm_wrapper(TRANS_N, TRANS_T, xcols, ngridx, l1,
+                      D1, xqr_z, xcols, xs_exp, ngridx,
+                      D0, pqr+3*submesh_size, xcols);
+
+        const int submesh[3] = {ngridx, ngridy, ngridz};
+        const size_t mesh_size = ((size_t)mesh[0]) * mesh[1] * mesh[2];
+        int lb[3], ub[3];
+        int ix, iy, iz, ic;
+        for (ix = 0; ix < ngridx;) {
+                lb[0] = modulo(ix + nx0, mesh[0]);
+                ub[0] = get_upper_bound(lb[0], mesh[0], ix, ngridx);
+                for (iy = 0; iy < ngridy;) {
+                        lb[1] = modulo(iy + ny0, mesh[1]);
+                        ub[1] = get_upper_bound(lb[1], mesh[1], iy, ngridy);
+                        for (iz = 0; iz < ngridz;) {
+                                lb[2] = modulo(iz + nz0, mesh[2]);
+                                ub[2] = get_upper_bound(lb[2], mesh[2], iz, ngridz);
+                                int lb_sub[3] = {ix, iy, iz};
+                                for (ic = 0; ic < 4; ic++) {
+                                        add_rho_submesh(rho+ic*mesh_size, pqr+ic*submesh_size,
+                                                        lb, ub, lb_sub, mesh, submesh);
+                                }
+                                iz += ub[2] - lb[2];
+                        }
+                        iy += ub[1] - lb[1];
+                }
+                ix += ub[0] - lb[0];
+        }
+}
+
+
+/*
+ * Transform the polynomial of the cartesian displacements
+ * (X, Y, Z) = r - ri to the fractional displacements (u, v, w), where
+ * r - ri = u a[0] + v a[1] + w a[2]. Horner's scheme is applied to each
+ * cartesian coordinate.
+ */
+static void _dm_xyz_to_frac(double *dm_frac, double *dm_xyz, int topl,
+                            double *a, double *cache)
+{
+        const int l1 = topl + 1;
+        const int l1l1 = l1 * l1;
+        const size_t l3 = ((size_t)l1l1) * l1;
+        double cx[3] = {a[0], a[3], a[6]};
+        double cy[3] = {a[1], a[4], a[7]};
+        double cz[3] = {a[2], a[5], a[8]};
+        double *g = cache;
+        double *h = g + l3;
+        size_t n;
+        int lx, ly, lz;
+
+        NPdset0(dm_frac, l3);
+        for (lx = topl; lx >= 0; lx--) {
+                NPdset0(h, l3);
+                for (ly = topl-lx; ly >= 0; ly--) {
+                        NPdset0(g, l3);
+                        for (lz = topl-lx-ly; lz >= 0; lz--) {
+                                poly_mul_linear(g, cz, l1, topl-lx-ly-lz-1);
+                                g[0] += dm_xyz[lx*l1l1+ly*l1+lz];
+                        }
+                        poly_mul_linear(h, cy, l1, topl-lx-ly-1);
+                        for (n = 0; n < l3; n++) {
+                                h[n] += g[n];
+                        }
+                }
+                poly_mul_linear(dm_frac, cx, l1, topl-lx-1);
+                for (n = 0; n < l3; n++) {
+                        dm_frac[n] += h[n];
+                }
+        }
+}
+
+
+static void _nonorth_rho_z(double *rho, double *rhoz, int comp,
+                           size_t ngrids, int ngridz, int meshz,
+                           int nz0, int nz1, int grid_close_to_zij,
+                           double e_z0z0, double e_z0dz, double e_dzdz,
+                           double _z0dz, double _dzdz)
+{
+        if (e_z0z0 == 0) {
+                return;
+        }
+
+        double exp_2dzdz = e_dzdz * e_dzdz;
+        double exp_z0z0, exp_z0dz;
+        int iz, iz1, ic;
+
+        exp_z0z0 = e_z0z0;
+        exp_z0dz = e_z0dz * e_dzdz;
+        iz1 = grid_close_to_zij % meshz + meshz;
+        for (iz = grid_close_to_zij-nz0; iz < nz1-nz0; iz++, iz1++) {
+                if (iz1 >= meshz) {
+                        iz1 -= meshz;
+                }
+                for (ic = 0; ic < comp; ic++) {
+                        rho[ic*ngrids+iz1] += rhoz[ic*ngridz+iz] * exp_z0z0;
+                }
+                exp_z0z0 *= exp_z0dz;
+                exp_z0dz *= exp_2dzdz;
+        }
+
+        exp_z0z0 = e_z0z0;
+        if (e_z0dz != 0) {
+                exp_z0dz = e_dzdz / e_z0dz;
+        } else {
+                exp_z0dz = exp(_dzdz - _z0dz);
+        }
+        iz1 = (grid_close_to_zij-1) % meshz;
+        for (iz = grid_close_to_zij-nz0-1; iz >= 0; iz--, iz1--) {
+                if (iz1 < 0) {
+                        iz1 += meshz;
+                }
+                exp_z0z0 *= exp_z0dz;
+                exp_z0dz *= exp_2dzdz;
+                for (ic = 0; ic < comp; ic++) {
+                        rho[ic*ngrids+iz1] += rhoz[ic*ngridz+iz] * exp_z0z0;
+                }
+        }
+}
+
+
+static void _nonorth_rho_z_f32(float *rho, double *rhoz, int comp,
+                               size_t ngrids, int ngridz, int meshz,
+                               int nz0, int nz1, int grid_close_to_zij,
+                               double e_z0z0, double e_z0dz, double e_dzdz,
+                               double _z0dz, double _dzdz)
+{
+        if (e_z0z0 == 0) {
+                return;
+        }
+
+        double exp_2dzdz = e_dzdz * e_dzdz;
+        double exp_z0z0, exp_z0dz;
+        int iz, iz1, ic;
+
+        exp_z0z0 = e_z0z0;
+        exp_z0dz = e_z0dz * e_dzdz;
+        iz1 = grid_close_to_zij % meshz + meshz;
+        for (iz = grid_close_to_zij-nz0; iz < nz1-nz0; iz++, iz1++) {
+                if (iz1 >= meshz) {
+                        iz1 -= meshz;
+                }
+                for (ic = 0; ic < comp; ic++) {
+                        rho[ic*ngrids+iz1] += rhoz[ic*ngridz+iz] * exp_z0z0;
+                }
+                exp_z0z0 *= exp_z0dz;
+                exp_z0dz *= exp_2dzdz;
+        }
+
+        exp_z0z0 = e_z0z0;
+        if (e_z0dz != 0) {
+                exp_z0dz = e_dzdz / e_z0dz;
+        } else {
+                exp_z0dz = exp(_dzdz - _z0dz);
+        }
+        iz1 = (grid_close_to_zij-1) % meshz;
+        for (iz = grid_close_to_zij-nz0-1; iz >= 0; iz--, iz1--) {
+                if (iz1 < 0) {
+                        iz1 += meshz;
+                }
+                exp_z0z0 *= exp_z0dz;
+                exp_z0dz *= exp_2dzdz;
+                for (ic = 0; ic < comp; ic++) {
+                        rho[ic*ngrids+iz1] += rhoz[ic*ngridz+iz] * exp_z0z0;
+                }
+        }
+}
+
+
+static void _nonorth_rhoz(double *rhoz, double *xqr, double *xs_exp, int comp,
+                          int l1, int ix, int iy, int ngridx, int ngridy, int ngridz)
+{
+        const size_t xcols = ((size_t)ngridy) * ngridz;
+        int ic, lx, iz;
+        double s;
+        double *pxqr;
+        NPdset0(rhoz, comp*ngridz);
+        for (ic = 0; ic < comp; ic++) {
+                for (lx = 0; lx < l1; lx++) {
+                        s = xs_exp[lx*ngridx+ix];
+                        pxqr = xqr + (ic*l1+lx) * xcols + iy * ngridz;
+                        #pragma omp simd
+                        for (iz = 0; iz < ngridz; iz++) {
+                                rhoz[iz] += s * pxqr[iz];
+                        }
+                }
+                rhoz += ngridz;
+        }
+}
+
+
+/*
+ * Collocate comp polynomials of the fractional displacements (stored in
+ * dm_frac) times the Gaussian exp(-aij |r-rij|^2) on a non-orthogonal
+ * lattice. The Gaussian is evaluated with the recursive relations along
+ * the lattice vectors.
+ */
+static void _nonorth_rho(void *rho, int f32, double *dm_frac, int comp,
+                         double fac, double aij, int topl,
+                         int *mesh, double *a, double *rij_frac,
+                         double *xs_exp, double *ys_exp, double *zs_exp,
+                         int *img_slice, int *grid_slice, double *cache)
+{
+        const int l1 = topl + 1;
+        const int l1l1 = l1 * l1;
+        const int nx0 = grid_slice[0];
+        const int nx1 = grid_slice[1];
+        const int ny0 = grid_slice[2];
+        const int ny1 = grid_slice[3];
+        const int nz0 = grid_slice[4];
+        const int nz1 = grid_slice[5];
+        const int ngridx = nx1 - nx0;
+        const int ngridy = ny1 - ny0;
+        const int ngridz = nz1 - nz0;
+        const size_t ngrids = ((size_t)mesh[0]) * mesh[1] * mesh[2];
+
+        const char TRANS_T = 'T';
+        const char TRANS_N = 'N';
+        const double D0 = 0;
+        const double D1 = 1;
+        double aa_xx = aij * (a[0] * a[0] + a[1] * a[1] + a[2] * a[2]);
+        double aa_xy = aij * (a[0] * a[3] + a[1] * a[4] + a[2] * a[5]);
+        double aa_xz = aij * (a[0] * a[6] + a[1] * a[7] + a[2] * a[8]);
+        double aa_yy = aij * (a[3] * a[3] + a[4] * a[4] + a[5] * a[5]);
+        double aa_yz = aij * (a[3] * a[6] + a[4] * a[7] + a[5] * a[8]);
+        double aa_zz = aij * (a[6] * a[6] + a[7] * a[7] + a[8] * a[8]);
+
+        int ix, iy, ix1, iy1, l;
+        double dx = 1. / mesh[0];
+        double dy = 1. / mesh[1];
+        double dz = 1. / mesh[2];
+
+        int grid_close_to_yij = rint(rij_frac[1] * mesh[1]);
+        int grid_close_to_zij = rint(rij_frac[2] * mesh[2]);
+        grid_close_to_yij = MIN(grid_close_to_yij, ny1);
+        grid_close_to_yij = MAX(grid_close_to_yij, ny0);
+        grid_close_to_zij = MIN(grid_close_to_zij, nz1);
+        grid_close_to_zij = MAX(grid_close_to_zij, nz0);
+
+        double x0xij = -rij_frac[0];
+        double y0yij = dy * grid_close_to_yij - rij_frac[1];
+        double z0zij = dz * grid_close_to_zij - rij_frac[2];
+
+        double _dydy = -dy * dy * aa_yy;
+        double _dzdz = -dz * dz * aa_zz;
+        double _dydz = -dy * dz * aa_yz * 2;
+        double exp_dydy = exp(_dydy);
+        double exp_2dydy = exp_dydy * exp_dydy;
+        double exp_dzdz = exp(_dzdz);
+        double exp_dydz = exp(_dydz);
+        double exp_dydz_i = (exp_dydz == 0) ? 0 : 1./exp_dydz;
+        double x1xij, tmpx, tmpy, tmpz;
+        double _xyz0xyz0, _xyz0dy, _xyz0dz, _z0dz;
+        double exp_xyz0xyz0, exp_xyz0dz;
+        double exp_y0dy, exp_z0z0, exp_z0dz;
+
+        const int xcols = ngridy * ngridz;
+        const int ncols = comp * l1l1;
+        double *xyr = cache;
+        double *xqr = xyr + ncols * ngridz;
+        double *rhoz = xqr + comp * l1 * xcols;
+        size_t off;
+
+        dgemm_wrapper(TRANS_N, TRANS_N, ngridz, ncols, l1,
+                      fac, zs_exp, ngridz, dm_frac, l1,
+                      D0, xyr, ngridz);
+        for (l = 0; l < comp * l1; l++) {
+                dgemm_wrapper(TRANS_N, TRANS_T, ngridz, ngridy, l1,
+                              D1, xyr+l*l1*ngridz, ngridz, ys_exp, ngridy,
+                              D0, xqr+l*xcols, ngridz);
+        }
+
+        ix1 = nx0 % mesh[0] + mesh[0];
+        for (ix = 0; ix < ngridx; ix++, ix1++) {
+                if (ix1 >= mesh[0]) {
+                        ix1 -= mesh[0];
+                }
+
+                x1xij = x0xij + (nx0+ix)*dx;
+                tmpx = x1xij * aa_xx + y0yij * aa_xy + z0zij * aa_xz;
+                tmpy = x1xij * aa_xy + y0yij * aa_yy + z0zij * aa_yz;
+                tmpz = x1xij * aa_xz + y0yij * aa_yz + z0zij * aa_zz;
+                _xyz0xyz0 = -x1xij * tmpx - y0yij * tmpy - z0zij * tmpz;
+                if (_xyz0xyz0 < EXPMIN) {
+                        continue;
+                }
+                _xyz0dy = -2 * dy * tmpy;
+                _xyz0dz = -2 * dz * tmpz;
+                exp_xyz0xyz0 = exp(_xyz0xyz0);
+                exp_xyz0dz = exp(_xyz0dz);
+
+                exp_y0dy = exp(_xyz0dy + _dydy);
+                exp_z0z0 = exp_xyz0xyz0;
+                exp_z0dz = exp_xyz0dz;
+                _z0dz = _xyz0dz;
+                iy1 = grid_close_to_yij % mesh[1] + mesh[1];
+                for (iy = grid_close_to_yij-ny0; iy < ngridy; iy++, iy1++) {
+                        if (exp_z0z0 == 0) {
+                                break;
+                        }
+                        if (iy1 >= mesh[1]) {
+                                iy1 -= mesh[1];
+                        }
+                        _nonorth_rhoz(rhoz, xqr, xs_exp, comp, l1, ix, iy,
+                                      ngridx, ngridy, ngridz);
+                        off = (ix1*mesh[1] + iy1) * ((size_t)mesh[2]);
+                        if (f32) {
+                                _nonorth_rho_z_f32((float *)rho + off, rhoz, comp,
+                                                   ngrids, ngridz, mesh[2],
+                                                   nz0, nz1, grid_close_to_zij,
+                                                   exp_z0z0, exp_z0dz, exp_dzdz,
+                                                   _z0dz, _dzdz);
+                        } else {
+                                _nonorth_rho_z((double *)rho + off, rhoz, comp,
+                                               ngrids, ngridz, mesh[2],
+                                               nz0, nz1, grid_close_to_zij,
+                                               exp_z0z0, exp_z0dz, exp_dzdz,
+                                               _z0dz, _dzdz);
+                        }
+                        _z0dz += _dydz;
+                        exp_z0z0 *= exp_y0dy;
+                        exp_z0dz *= exp_dydz;
+                        exp_y0dy *= exp_2dydy;
+                }
+
+                exp_y0dy = exp(_dydy - _xyz0dy);
+                exp_z0z0 = exp_xyz0xyz0;
+                exp_z0dz = exp_xyz0dz;
+                _z0dz = _xyz0dz;
+                iy1 = (grid_close_to_yij-1) % mesh[1];
+                for (iy = grid_close_to_yij-ny0-1; iy >= 0; iy--, iy1--) {
+                        exp_z0z0 *= exp_y0dy;
+                        if (exp_z0z0 == 0) {
+                                break;
+                        }
+
+                        _z0dz -= _dydz;
+                        if (exp_dydz != 0) {
+                                exp_z0dz *= exp_dydz_i;
+                        } else {
+                                exp_z0dz = exp(_z0dz);
+                        }
+                        exp_y0dy *= exp_2dydy;
+                        if (iy1 < 0) {
+                                iy1 += mesh[1];
+                        }
+                        _nonorth_rhoz(rhoz, xqr, xs_exp, comp, l1, ix, iy,
+                                      ngridx, ngridy, ngridz);
+                        off = (ix1*mesh[1] + iy1) * ((size_t)mesh[2]);
+                        if (f32) {
+                                _nonorth_rho_z_f32((float *)rho + off, rhoz, comp,
+                                                   ngrids, ngridz, mesh[2],
+                                                   nz0, nz1, grid_close_to_zij,
+                                                   exp_z0z0, exp_z0dz, exp_dzdz,
+                                                   _z0dz, _dzdz);
+                        } else {
+                                _nonorth_rho_z((double *)rho + off, rhoz, comp,
+                                               ngrids, ngridz, mesh[2],
+                                               nz0, nz1, grid_close_to_zij,
+                                               exp_z0z0, exp_z0dz, exp_dzdz,
+                                               _z0dz, _dzdz);
+                        }
+                }
+        }
+}
+
+
+static void _make_rho_lda_nonorth(void *rho, int f32, double *dm,
+                                  int li, int lj, double ai, double aj,
+                                  double *ri, double *rj, double fac, double cutoff,
+                                  int dimension, double *a, double *b,
+                                  int *mesh, double *cache)
+{
+        int topl = li + lj;
+        int l1 = topl + 1;
+        int l1l1l1 = l1 * l1 * l1;
+        int img_slice[6];
+        int grid_slice[6];
+        double ri_frac[3];
+        double rij_frac[3];
+        double *xs_exp, *ys_exp, *zs_exp;
+        make_rij_frac(ri_frac, rij_frac, ri, rj, ai, aj, b);
+
+        int data_size = init_nonorth_data(&xs_exp, &ys_exp, &zs_exp,
+                                          img_slice, grid_slice, mesh,
+                                          topl, dimension, cutoff, b,
+                                          ri_frac, rij_frac, cache);
+        if (data_size == 0) {
+                return;
+        }
+        cache += data_size;
+
+        double *dm_xyz = cache;
+        cache += l1l1l1;
+        memset(dm_xyz, 0, l1l1l1*sizeof(double));
+        _dm_to_dm_xyz(dm_xyz, dm, li, lj, ri, rj, cache);
+
+        double *dm_frac = cache;
+        cache += l1l1l1;
+        _dm_xyz_to_frac(dm_frac, dm_xyz, topl, a, cache);
+
+        _nonorth_rho(rho, f32, dm_frac, 1, fac, ai+aj, topl, mesh, a, rij_frac,
+                     xs_exp, ys_exp, zs_exp, img_slice, grid_slice, cache);
+}
+
+
+void make_rho_lda_nonorth(double *rho, double *dm, int comp,
+                          int li, int lj, double ai, double aj,
+                          double *ri, double *rj, double fac, double cutoff,
+                          int dimension, double* dh, double *a, double *b,
+                          int *mesh, double *cache)
+{
+        _make_rho_lda_nonorth(rho, 0, dm, li, lj, ai, aj, ri, rj, fac, cutoff,
+                              dimension, a, b, mesh, cache);
+}
+
+
+void make_rho_lda_nonorth_f32(float *rho, double *dm, int comp,
+                              int li, int lj, double ai, double aj,
+                              double *ri, double *rj, double fac, double cutoff,
+                              int dimension, double* dh, double *a, double *b,
+                              int *mesh, double *cache)
+{
+        _make_rho_lda_nonorth(rho, 1, dm, li, lj, ai, aj, ri, rj, fac, cutoff,
+                              dimension, a, b, mesh, cache);
+}
+
+
+void make_rho_gga_nonorth(double *rho, double *dm, int comp,
+                          int li, int lj, double ai, double aj,
+                          double *ri, double *rj, double fac, double cutoff,
+                          int dimension, double* dh, double *a, double *b,
+                          int *mesh, double *cache)
+{
+        int topl = li + lj;
+        int l1 = topl + 1;
+        int l1l1l1 = l1 * l1 * l1;
+        int L1 = l1 + 1;
+        size_t L3 = ((size_t)L1) * L1 * L1;
+        int img_slice[6];
+        int grid_slice[6];
+        double ri_frac[3];
+        double rij_frac[3];
+        double *xs_exp, *ys_exp, *zs_exp;
+        make_rij_frac(ri_frac, rij_frac, ri, rj, ai, aj, b);
+
+        int data_size = init_nonorth_data(&xs_exp, &ys_exp, &zs_exp,
+                                          img_slice, grid_slice, mesh,
+                                          topl+1, dimension, cutoff, b,
+                                          ri_frac, rij_frac, cache);
+        if (data_size == 0) {
+                return;
+        }
+        cache += data_size;
+
+        double *dm_xyz = cache;
+        cache += l1l1l1;
+        memset(dm_xyz, 0, l1l1l1*sizeof(double));
+        _dm_to_dm_xyz(dm_xyz, dm, li, lj, ri, rj, cache);
+
+        double *dm_gga = cache;
+        cache += 4 * L3;
+        _dm_xyz_gga(dm_gga, dm_xyz, topl, ai, aj, ri, rj);
+
+        double *dm_frac = cache;
+        cache += 4 * L3;
+        int ic;
+        for (ic = 0; ic < 4; ic++) {
+                _dm_xyz_to_frac(dm_frac+ic*L3, dm_gga+ic*L3, topl+1, a, cache);
+        }
+
+        _nonorth_rho(rho, 0, dm_frac, 4, fac, ai+aj, topl+1, mesh, a, rij_frac,
+                     xs_exp, ys_exp, zs_exp, img_slice, grid_slice, cache);
+}
+
+
+static void _apply_rho(void (*eval_rho)(), void *rho, double *dm,
                        PGFPair* pgfpair, int comp, int dimension,
                        double* dh, double *a, double *b, int *mesh,
                        double* ish_gto_norm, double* jsh_gto_norm,
@@ -245,21 +1035,40 @@ static void _apply_rho(void (*eval_rho)(), double *rho, double *dm,
 }
 
 
-static size_t _rho_cache_size(int l, int nprim, int nctr, int* mesh, double radius, double* dh)
+static size_t _rho_cache_size(int l, int comp, int nprim, int nctr, int* mesh, double radius,
+                              double* dh, double* b, int orth)
 {
     size_t size = 0;
     size_t mesh_size = ((size_t)mesh[0]) * mesh[1] * mesh[2];
-    size_t nmx = get_max_num_grid_orth(dh, radius);
     int l1 = 2 * l + 1;
+    if (comp > 1) {
+        l1 += 1; // gradients
+    }
     int l1l1 = l1 * l1;
     int max_mesh = MAX(MAX(mesh[0], mesh[1]), mesh[2]);
     size += (nprim * _LEN_CART[l]) * (nprim * _LEN_CART[l]); // dm_cart
     size += _LEN_CART[l]*_LEN_CART[l]; // dm_pgf
     size += nctr * _LEN_CART[l] * nprim * _LEN_CART[l]; // transform_dm
-    size += l1 * (mesh[0] + mesh[1] + mesh[2]); // xs_exp, ys_exp, zs_exp
     size += l1l1 * l1; // dm_xyz
     size += 3 * (_LEN_CART[l] + l1); // _dm_to_dm_xyz
+    if (comp > 1) {
+        size += comp * l1l1 * l1; // _dm_xyz_gga
+    }
+
+    if (!orth) {
+        size_t nmx = get_max_num_grid_nonorth(b, mesh, radius);
+        size += 3 * l1 * nmx; // xs_exp, ys_exp, zs_exp
+        size += comp * l1l1 * l1; // _dm_xyz_to_frac
+        size_t size_nonorth_rho = comp * (l1l1*nmx + l1*nmx*nmx + nmx); // _nonorth_rho
+        size += MAX(size_nonorth_rho, 2 * l1l1 * l1);
+        return size;
+    }
 
+    size_t nmx = get_max_num_grid_orth(dh, radius);
+    size += l1 * (mesh[0] + mesh[1] + mesh[2]); // xs_exp, ys_exp, zs_exp
+    if (comp > 1) {
+        size += l1 * (mesh[0] + mesh[1] + mesh[2]); // derivatives of xs_exp, ...
+    }
     size_t size_orth_components = l1 * nmx + nmx; // orth_components
     size_t size_orth_rho = 0; // _orth_rho
     if (nmx < max_mesh) {
@@ -267,15 +1076,19 @@ static size_t _rho_cache_size(int l, int nprim, int nctr, int* mesh, double radi
     } else {
         size_orth_rho = l1l1*mesh[2] + l1*mesh[1]*mesh[2] + mesh_size;
     }
-    size += MAX(size_orth_rho, size_orth_components);
+    size += MAX(comp * size_orth_rho, size_orth_components);
     //size += 1000000;
     //printf("Memory allocated per thread for make_rho: %ld MB.\n", (size+mesh_size)*sizeof(double) / 1000000);
     return size;
 }
 
 
-static size_t _rho_core_cache_size(int* mesh, double radius, double* dh)
+static size_t _rho_core_cache_size(int* mesh, double radius, double* dh,
+                                   double* b, int orth)
 {
+    if (!orth) {
+        return _rho_cache_size(0, 1, 1, 1, mesh, radius, dh, b, orth);
+    }
     size_t size = 0;
     size_t mesh_size = ((size_t)mesh[0]) * mesh[1] * mesh[2];
     size_t nmx = get_max_num_grid_orth(dh, radius);
@@ -300,17 +1113,44 @@ static size_t _rho_core_cache_size(int* mesh, double radius, double* dh)
 }
 
 
-void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskList** task_list,
-                        int comp, int hermi, int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
-                        int dimension, double* Ls, double* a, double* b,
-                        int* ish_atm, int* ish_bas, double* ish_env,
-                        int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+static void _omp_fsum_reduce_inplace(float **vec, size_t count)
+{
+    unsigned int nthreads = omp_get_num_threads();
+    unsigned int thread_id = omp_get_thread_num();
+    size_t blksize = (count + nthreads - 1) / nthreads;
+    size_t start = thread_id * blksize;
+    size_t end = MIN(start + blksize, count);
+    float *dst = vec[0];
+    float *src;
+    size_t it, i;
+#pragma omp barrier
+    for (it = 1; it < nthreads; it++) {
+        src = vec[it];
+        for (i = start; i < end; i++) {
+            dst[i] += src[i];
+        }
+    }
+#pragma omp barrier
+}
+
+
+/*
+ * rho_data holds the real-space values of each grid level, which are
+ * stored in double precision, or in single precision if f32 is nonzero.
+ * Levels with NULL rho_data are skipped.
+ */
+static void _collocate_drv(void (*eval_rho)(), void** rho_data, int f32,
+                           double* dm, TaskList** task_list,
+                           int comp, int hermi, int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                           int dimension, double* Ls, double* a, double* b,
+                           int* ish_atm, int* ish_bas, double* ish_env,
+                           int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
 {
     TaskList* tl = *task_list;
     GridLevel_Info* gridlevel_info = tl->gridlevel_info;
     int nlevels = gridlevel_info->nlevels;
-
-    assert (comp == (*rs_rho)->comp);
+    size_t elem_size = f32 ? sizeof(float) : sizeof(double);
+    int orth = is_orth_lattice(a);
 
     const int ish0 = shls_slice[0];
     const int ish1 = shls_slice[1];
@@ -354,20 +1194,20 @@ void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskLi
     int ilevel;
     int *mesh;
     double max_radius;
-    double *rho, *rhobufs[MAX_THREADS];
+    void *rho, *rhobufs[MAX_THREADS];
     Task* task;
     size_t ntasks;
     PGFPair** pgfpairs;
     for (ilevel = 0; ilevel < nlevels; ilevel++) {
         task = (tl->tasks)[ilevel];
         ntasks = task->ntasks;
-        if (ntasks <= 0) {
+        rho = rho_data[ilevel];
+        if (ntasks <= 0 || rho == NULL) {
             continue;
         }
         pgfpairs = task->pgfpairs;
         max_radius = task->radius;
 
-        rho = (*rs_rho)->data[ilevel];
         mesh = gridlevel_info->mesh + ilevel*3;
 
         double dh[9];
@@ -376,9 +1216,10 @@ void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskLi
         int *task_loc;
         int nblock = get_task_loc(&task_loc, pgfpairs, ntasks, ish0, ish1, jsh0, jsh1, hermi);
 
-        size_t cache_size = _rho_cache_size(MAX(ish_lmax,jsh_lmax), 
+        size_t cache_size = _rho_cache_size(MAX(ish_lmax,jsh_lmax), comp,
                                             MAX(ish_nprim_max, jsh_nprim_max),
-                                            MAX(ish_nctr_max, jsh_nctr_max), mesh, max_radius, dh);
+                                            MAX(ish_nctr_max, jsh_nctr_max), mesh, max_radius,
+                                            dh, b, orth);
         size_t ngrids = ((size_t)mesh[0]) * mesh[1] * mesh[2];
 
 #pragma omp parallel
@@ -392,11 +1233,11 @@ void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskLi
     double *cache = dm_pgf + _LEN_CART[ish_lmax]*_LEN_CART[jsh_lmax]; 
 
     int thread_id = omp_get_thread_num();
-    double *rho_priv;
+    void *rho_priv;
     if (thread_id == 0) {
         rho_priv = rho;
     } else {
-        rho_priv = calloc(comp*ngrids, sizeof(double));
+        rho_priv = calloc(comp*ngrids, elem_size);
     }
     rhobufs[thread_id] = rho_priv;
 
@@ -421,7 +1262,11 @@ void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskLi
     }
 
     free(cache0);
-    NPomp_dsum_reduce_inplace(rhobufs, comp*ngrids);
+    if (f32) {
+        _omp_fsum_reduce_inplace((float**)rhobufs, comp*ngrids);
+    } else {
+        NPomp_dsum_reduce_inplace((double**)rhobufs, comp*ngrids);
+    }
     if (thread_id != 0) {
         free(rho_priv);
     }
@@ -438,6 +1283,57 @@ void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskLi
 }
 
 
+void grid_collocate_drv(void (*eval_rho)(), RS_Grid** rs_rho, double* dm, TaskList** task_list,
+                        int comp, int hermi, int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                        int dimension, double* Ls, double* a, double* b,
+                        int* ish_atm, int* ish_bas, double* ish_env,
+                        int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+{
+    assert (comp == (*rs_rho)->comp);
+    _collocate_drv(eval_rho, (void**)(*rs_rho)->data, 0, dm, task_list,
+                   comp, hermi, shls_slice, ish_ao_loc, jsh_ao_loc,
+                   dimension, Ls, a, b, ish_atm, ish_bas, ish_env,
+                   jsh_atm, jsh_bas, jsh_env, cart);
+}
+
+
+void grid_collocate_f32_drv(void (*eval_rho)(), RS_Grid_f32** rs_rho, double* dm, TaskList** task_list,
+                            int comp, int hermi, int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                            int dimension, double* Ls, double* a, double* b,
+                            int* ish_atm, int* ish_bas, double* ish_env,
+                            int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+{
+    assert (comp == (*rs_rho)->comp);
+    _collocate_drv(eval_rho, (void**)(*rs_rho)->data, 1, dm, task_list,
+                   comp, hermi, shls_slice, ish_ao_loc, jsh_ao_loc,
+                   dimension, Ls, a, b, ish_atm, ish_bas, ish_env,
+                   jsh_atm, jsh_bas, jsh_env, cart);
+}
+
+
+/*
+ * Collocate the density of a single grid level onto rho, which must be
+ * zero-initialized and hold comp*ngrids values of that level.
+ */
+void grid_collocate_level_drv(void (*eval_rho)(), void* rho, int ilevel, int f32,
+                              double* dm, TaskList** task_list,
+                              int comp, int hermi, int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                              int dimension, double* Ls, double* a, double* b,
+                              int* ish_atm, int* ish_bas, double* ish_env,
+                              int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+{
+    int nlevels = (*task_list)->nlevels;
+    assert (ilevel >= 0 && ilevel < nlevels);
+    void **rho_data = calloc(nlevels, sizeof(void*));
+    rho_data[ilevel] = rho;
+    _collocate_drv(eval_rho, rho_data, f32, dm, task_list,
+                   comp, hermi, shls_slice, ish_ao_loc, jsh_ao_loc,
+                   dimension, Ls, a, b, ish_atm, ish_bas, ish_env,
+                   jsh_atm, jsh_bas, jsh_env, cart);
+    free(rho_data);
+}
+
+
 void build_core_density(void (*eval_rho)(), double* rho,
                         int* atm, int* bas, int nbas, double* env,
                         int* mesh, int dimension, double* a, double* b, double max_radius)
@@ -449,7 +1345,8 @@ void build_core_density(void (*eval_rho)(), double* rho,
     get_grid_spacing(dh, a, mesh);
 
     double *rhobufs[MAX_THREADS];
-    size_t cache_size =  _rho_core_cache_size(mesh, max_radius, dh);
+    int orth = is_orth_lattice(a);
+    size_t cache_size =  _rho_core_cache_size(mesh, max_radius, dh, b, orth);
 
 #pragma omp parallel
 {
@@ -165,6 +165,20 @@ int get_max_num_grid_orth(double* dh, double radius)
 }
 
 
+int get_max_num_grid_nonorth(double* b, int* mesh, double radius)
+{
+    int i, ngrid;
+    int nmx = 0;
+    double heights_inv;
+    for (i = 0; i < 3; i++) {
+        heights_inv = sqrt(b[i*3]*b[i*3] + b[i*3+1]*b[i*3+1] + b[i*3+2]*b[i*3+2]);
+        ngrid = (int) ceil(2 * radius * heights_inv * mesh[i]) + 2;
+        nmx = MAX(nmx, ngrid);
+    }
+    return nmx;
+}
+
+
 void get_grid_spacing(double* dh, double* a, int* mesh)
 {
     int i, j;
@@ -658,3 +672,152 @@ void get_dm_pgfpair(double* dm_pgf, double* dm_cart,
         }
     }
 }
+
+
+int is_orth_lattice(double *a)
+{
+    return (fabs(a[1]) < 1e-12 && fabs(a[2]) < 1e-12 &&
+            fabs(a[3]) < 1e-12 && fabs(a[5]) < 1e-12 &&
+            fabs(a[6]) < 1e-12 && fabs(a[7]) < 1e-12);
+}
+
+
+void make_rij_frac(double *ri_frac, double *rij_frac,
+                   double *ri, double *rj, double ai, double aj, double *b)
+{
+    double aij = ai + aj;
+    double rij[3];
+    rij[0] = (ai * ri[0] + aj * rj[0]) / aij;
+    rij[1] = (ai * ri[1] + aj * rj[1]) / aij;
+    rij[2] = (ai * ri[2] + aj * rj[2]) / aij;
+    // rij_frac = einsum('ij,j->ik', b, rij)
+    rij_frac[0] = rij[0] * b[0] + rij[1] * b[1] + rij[2] * b[2];
+    rij_frac[1] = rij[0] * b[3] + rij[1] * b[4] + rij[2] * b[5];
+    rij_frac[2] = rij[0] * b[6] + rij[1] * b[7] + rij[2] * b[8];
+    ri_frac[0] = ri[0] * b[0] + ri[1] * b[1] + ri[2] * b[2];
+    ri_frac[1] = ri[0] * b[3] + ri[1] * b[4] + ri[2] * b[5];
+    ri_frac[2] = ri[0] * b[6] + ri[1] * b[7] + ri[2] * b[8];
+}
+
+
+/*
+ * Powers of the fractional displacement (x_frac - xi_frac) on the grids
+ * along one lattice vector. The grids can span several images.
+ */
+int nonorth_components(double *xs_exp, int *img_slice, int *grid_slice,
+                       double *b, int periodic, int nx_per_cell, int topl,
+                       double xi_frac, double xij_frac, double cutoff)
+{
+    double heights_inv = sqrt(b[0]*b[0] + b[1]*b[1] + b[2]*b[2]);
+    double edge0 = xij_frac - cutoff * heights_inv;
+    double edge1 = xij_frac + cutoff * heights_inv;
+    if (edge0 == edge1) {
+        return 0;
+    }
+
+    int nimg0 = 0;
+    int nimg1 = 1;
+    if (periodic) {
+        nimg0 = (int)floor(edge0);
+        nimg1 = (int)ceil (edge1);
+    }
+    int nimg = nimg1 - nimg0;
+    int nmx0 = nimg0 * nx_per_cell;
+
+    int nx0 = (int)floor(edge0 * nx_per_cell);
+    int nx1 = (int)ceil (edge1 * nx_per_cell);
+    if (nimg == 1) {
+        nx0 = MIN(nx0, nmx0 + nx_per_cell);
+        nx0 = MAX(nx0, nmx0);
+        nx1 = MIN(nx1, nmx0 + nx_per_cell);
+        nx1 = MAX(nx1, nmx0);
+    }
+
+    img_slice[0] = nimg0;
+    img_slice[1] = nimg1;
+    grid_slice[0] = nx0;
+    grid_slice[1] = nx1;
+
+    int nx = nx1 - nx0;
+    if (nx <= 0) {
+        return 0;
+    }
+
+    int i, l;
+    double x0;
+    double dx = 1. / nx_per_cell;
+    double *pxs_exp;
+    for (i = 0; i < nx; i++) {
+        xs_exp[i] = 1;
+    }
+    for (l = 1; l <= topl; l++) {
+        pxs_exp = xs_exp + (l-1) * nx;
+        x0 = nx0 * dx - xi_frac;
+        for (i = 0; i < nx; i++, x0+=dx) {
+            xs_exp[l*nx+i] = x0 * pxs_exp[i];
+        }
+    }
+    return nx;
+}
+
+
+int init_nonorth_data(double **xs_exp, double **ys_exp, double **zs_exp,
+                      int *img_slice, int *grid_slice, int *mesh,
+                      int topl, int dimension, double cutoff, double *b,
+                      double *ri_frac, double *rij_frac, double *cache)
+{
+    int l1 = topl + 1;
+    *xs_exp = cache;
+    int ngridx = nonorth_components(*xs_exp, img_slice, grid_slice,
+                                    b, (dimension>=1), mesh[0], topl,
+                                    ri_frac[0], rij_frac[0], cutoff);
+    if (ngridx == 0) {
+        return 0;
+    }
+
+    *ys_exp = *xs_exp + l1 * ngridx;
+    int ngridy = nonorth_components(*ys_exp, img_slice+2, grid_slice+2,
+                                    b+3, (dimension>=2), mesh[1], topl,
+                                    ri_frac[1], rij_frac[1], cutoff);
+    if (ngridy == 0) {
+        return 0;
+    }
+
+    *zs_exp = *ys_exp + l1 * ngridy;
+    int ngridz = nonorth_components(*zs_exp, img_slice+4, grid_slice+4,
+                                    b+6, (dimension>=3), mesh[2], topl,
+                                    ri_frac[2], rij_frac[2], cutoff);
+    if (ngridz == 0) {
+        return 0;
+    }
+
+    return l1 * (ngridx + ngridy + ngridz);
+}
+
+
+/*
+ * p <- p * (c[0] u + c[1] v + c[2] w) for the polynomial p of total
+ * degree deg, stored in a cube of size l1^3 (deg < l1-1).
+ */
+void poly_mul_linear(double *p, double *c, int l1, int deg)
+{
+    const int l1l1 = l1 * l1;
+    int d, i, j, k;
+    double v;
+    for (d = deg+1; d >= 0; d--) {
+    for (i = 0; i <= d; i++) {
+    for (j = 0; j <= d-i; j++) {
+        k = d - i - j;
+        v = 0;
+        if (i > 0) {
+            v += c[0] * p[(i-1)*l1l1+j*l1+k];
+        }
+        if (j > 0) {
+            v += c[1] * p[i*l1l1+(j-1)*l1+k];
+        }
+        if (k > 0) {
+            v += c[2] * p[i*l1l1+j*l1+k-1];
+        }
+        p[i*l1l1+j*l1+k] = v;
+    } } }
+}
@@ -90,4 +90,16 @@ void _dm_xyz_to_dm(double* dm_xyz, double* dm, int li, int lj, double* ri, doubl
 void get_dm_pgfpair(double* dm_pgf, double* dm_cart,
                     PGFPair* pgfpair, int* ish_bas, int* jsh_bas, int hermi);
 int get_max_num_grid_orth(double* dh, double radius);
+int get_max_num_grid_nonorth(double* b, int* mesh, double radius);
+int is_orth_lattice(double *a);
+void make_rij_frac(double *ri_frac, double *rij_frac,
+                   double *ri, double *rj, double ai, double aj, double *b);
+int nonorth_components(double *xs_exp, int *img_slice, int *grid_slice,
+                       double *b, int periodic, int nx_per_cell, int topl,
+                       double xi_frac, double xij_frac, double cutoff);
+int init_nonorth_data(double **xs_exp, double **ys_exp, double **zs_exp,
+                      int *img_slice, int *grid_slice, int *mesh,
+                      int topl, int dimension, double cutoff, double *b,
+                      double *ri_frac, double *rij_frac, double *cache);
+void poly_mul_linear(double *p, double *c, int l1, int deg);
 #endif
@@ -27,13 +27,14 @@
 #include "dft/utils.h"
 
 #define PTR_RADIUS      5
+#define EXPMIN         -700
 
 
-void transform_dm_inverse(double* dm_cart, double* dm, int comp,
-                          double* ish_contr_coeff, double* jsh_contr_coeff,
-                          int* ish_ao_loc, int* jsh_ao_loc,
-                          int* ish_bas, int* jsh_bas, int ish, int jsh,
-                          int ish0, int jsh0, int naoi, int naoj, double* cache)
+static void _transform_dm_inverse(double* dm_cart, double* dm, int comp, double beta,
+                                  double* ish_contr_coeff, double* jsh_contr_coeff,
+                                  int* ish_ao_loc, int* jsh_ao_loc,
+                                  int* ish_bas, int* jsh_bas, int ish, int jsh,
+                                  int ish0, int jsh0, int naoi, int naoj, double* cache)
 {
     int i0 = ish_ao_loc[ish] - ish_ao_loc[ish0];
     int i1 = ish_ao_loc[ish+1] - ish_ao_loc[ish0];
@@ -65,13 +66,25 @@ void transform_dm_inverse(double* dm_cart, double* dm, int comp,
         dgemm_(&TRANS_N, &TRANS_N, &ncol, &nao_i, &nao_j,
                &D1, jsh_contr_coeff, &ncol, dm_cart, &nao_j, &D0, buf, &ncol);
         dgemm_(&TRANS_N, &TRANS_T, &ncol, &nrow, &nao_i,
-               &D1, buf, &ncol, ish_contr_coeff, &nrow, &D0, pdm, &naoj);
+               &D1, buf, &ncol, ish_contr_coeff, &nrow, &beta, pdm, &naoj);
         pdm += ((size_t)naoi) * naoj;
         dm_cart += nao_i * nao_j;
     }
 }
 
 
+void transform_dm_inverse(double* dm_cart, double* dm, int comp,
+                          double* ish_contr_coeff, double* jsh_contr_coeff,
+                          int* ish_ao_loc, int* jsh_ao_loc,
+                          int* ish_bas, int* jsh_bas, int ish, int jsh,
+                          int ish0, int jsh0, int naoi, int naoj, double* cache)
+{
+    _transform_dm_inverse(dm_cart, dm, comp, 0., ish_contr_coeff, jsh_contr_coeff,
+                          ish_ao_loc, jsh_ao_loc, ish_bas, jsh_bas, ish, jsh,
+                          ish0, jsh0, naoi, naoj, cache);
+}
+
+
 static void fill_tril(double* mat, int comp, int* ish_ao_loc, int* jsh_ao_loc,
                       int ish, int jsh, int ish0, int jsh0, int naoi, int naoj)
 {
@@ -1070,6 +1083,355 @@ int eval_mat_gga_orth_ip1(double *weights, double *out, int comp,
 }
 
 
+/*
+ * Transpose of the transformation from the cartesian displacements to
+ * the fractional displacements (_dm_xyz_to_frac in grid_collocate.c).
+ * It maps the integrals of u^lu v^lv w^lw to those of X^lx Y^ly Z^lz.
+ */
+static void _poly_mul_linear_t(double *p, double *c, int l1, int deg)
+{
+        const int l1l1 = l1 * l1;
+        int d, i, j, k;
+        for (d = 0; d <= deg; d++) {
+        for (i = 0; i <= d; i++) {
+        for (j = 0; j <= d-i; j++) {
+                k = d - i - j;
+                p[i*l1l1+j*l1+k] = c[0] * p[(i+1)*l1l1+j*l1+k]
+                                 + c[1] * p[i*l1l1+(j+1)*l1+k]
+                                 + c[2] * p[i*l1l1+j*l1+k+1];
+        } } }
+}
+
+
+static void _mat_frac_to_xyz(double *mat_xyz, double *mat_frac, int topl,
+                             double *a, double *cache)
+{
+        const int l1 = topl + 1;
+        const int l1l1 = l1 * l1;
+        const size_t l3 = ((size_t)l1l1) * l1;
+        double cx[3] = {a[0], a[3], a[6]};
+        double cy[3] = {a[1], a[4], a[7]};
+        double cz[3] = {a[2], a[5], a[8]};
+        double *g = cache;
+        double *h = g + l3;
+        int lx, ly, lz;
+
+        for (lx = 0; lx <= topl; lx++) {
+                if (lx > 0) {
+                        _poly_mul_linear_t(mat_frac, cx, l1, topl-lx);
+                }
+                NPdcopy(h, mat_frac, l3);
+                for (ly = 0; ly <= topl-lx; ly++) {
+                        if (ly > 0) {
+                                _poly_mul_linear_t(h, cy, l1, topl-lx-ly);
+                        }
+                        NPdcopy(g, h, l3);
+                        for (lz = 0; lz <= topl-lx-ly; lz++) {
+                                if (lz > 0) {
+                                        _poly_mul_linear_t(g, cz, l1, topl-lx-ly-lz);
+                                }
+                                mat_xyz[lx*l1l1+ly*l1+lz] = g[0];
+                        }
+                }
+        }
+}
+
+
+static void _nonorth_ints_z(double *wz, double *weights,
+                            int ngridz, int meshz, int nz0, int nz1,
+                            int grid_close_to_zij,
+                            double e_z0z0, double e_z0dz, double e_dzdz,
+                            double _z0dz, double _dzdz)
+{
+        NPdset0(wz, ngridz);
+        if (e_z0z0 == 0) {
+                return;
+        }
+
+        double exp_2dzdz = e_dzdz * e_dzdz;
+        double exp_z0z0, exp_z0dz;
+        int iz, iz1;
+
+        exp_z0z0 = e_z0z0;
+        exp_z0dz = e_z0dz * e_dzdz;
+        iz1 = grid_close_to_zij % meshz + meshz;
+        for (iz = grid_close_to_zij-nz0; iz < nz1-nz0; iz++, iz1++) {
+                if (iz1 >= meshz) {
+                        iz1 -= meshz;
+                }
+                wz[iz] = weights[iz1] * exp_z0z0;
+                exp_z0z0 *= exp_z0dz;
+                exp_z0dz *= exp_2dzdz;
+        }
+
+        exp_z0z0 = e_z0z0;
+        if (e_z0dz != 0) {
+                exp_z0dz = e_dzdz / e_z0dz;
+        } else {
+                exp_z0dz = exp(_dzdz - _z0dz);
+        }
+        iz1 = (grid_close_to_zij-1) % meshz;
+        for (iz = grid_close_to_zij-nz0-1; iz >= 0; iz--, iz1--) {
+                if (iz1 < 0) {
+                        iz1 += meshz;
+                }
+                exp_z0z0 *= exp_z0dz;
+                exp_z0dz *= exp_2dzdz;
+                wz[iz] = weights[iz1] * exp_z0z0;
+        }
+}
+
+
+static void _nonorth_xqr(double *xqr, double *wz, double *xs_exp,
+                         int l1, int ix, int iy, int ngridx, int ngridy, int ngridz)
+{
+        const size_t xcols = ((size_t)ngridy) * ngridz;
+        int lx, iz;
+        double s;
+        double *pxqr;
+        for (lx = 0; lx < l1; lx++) {
+                s = xs_exp[lx*ngridx+ix];
+                pxqr = xqr + lx * xcols + iy * ngridz;
+                #pragma omp simd
+                for (iz = 0; iz < ngridz; iz++) {
+                        pxqr[iz] += s * wz[iz];
+                }
+        }
+}
+
+
+/*
+ * The transpose of _nonorth_rho in grid_collocate.c. The integrals of
+ * the polynomials of the fractional displacements times the Gaussian
+ * exp(-aij |r-rij|^2) are saved in mat_frac.
+ */
+static void _nonorth_ints(double *mat_frac, double *weights,
+                          double fac, double aij, int topl,
+                          int *mesh, double *a, double *rij_frac,
+                          double *xs_exp, double *ys_exp, double *zs_exp,
+                          int *img_slice, int *grid_slice, double *cache)
+{
+        const int l1 = topl + 1;
+        const int l1l1 = l1 * l1;
+        const int nx0 = grid_slice[0];
+        const int nx1 = grid_slice[1];
+        const int ny0 = grid_slice[2];
+        const int ny1 = grid_slice[3];
+        const int nz0 = grid_slice[4];
+        const int nz1 = grid_slice[5];
+        const int ngridx = nx1 - nx0;
+        const int ngridy = ny1 - ny0;
+        const int ngridz = nz1 - nz0;
+
+        const char TRANS_T = 'T';
+        const char TRANS_N = 'N';
+        const double D0 = 0;
+        const double D1 = 1;
+        double aa_xx = aij * (a[0] * a[0] + a[1] * a[1] + a[2] * a[2]);
+        double aa_xy = aij * (a[0] * a[3] + a[1] * a[4] + a[2] * a[5]);
+        double aa_xz = aij * (a[0] * a[6] + a[1] * a[7] + a[2] * a[8]);
+        double aa_yy = aij * (a[3] * a[3] + a[4] * a[4] + a[5] * a[5]);
+        double aa_yz = aij * (a[3] * a[6] + a[4] * a[7] + a[5] * a[8]);
+        double aa_zz = aij * (a[6] * a[6] + a[7] * a[7] + a[8] * a[8]);
+
+        int ix, iy, ix1, iy1, l;
+        double dx = 1. / mesh[0];
+        double dy = 1. / mesh[1];
+        double dz = 1. / mesh[2];
+
+        int grid_close_to_yij = rint(rij_frac[1] * mesh[1]);
+        int grid_close_to_zij = rint(rij_frac[2] * mesh[2]);
+        grid_close_to_yij = MIN(grid_close_to_yij, ny1);
+        grid_close_to_yij = MAX(grid_close_to_yij, ny0);
+        grid_close_to_zij = MIN(grid_close_to_zij, nz1);
+        grid_close_to_zij = MAX(grid_close_to_zij, nz0);
+
+        double x0xij = -rij_frac[0];
+        double y0yij = dy * grid_close_to_yij - rij_frac[1];
+        double z0zij = dz * grid_close_to_zij - rij_frac[2];
+
+        double _dydy = -dy * dy * aa_yy;
+        double _dzdz = -dz * dz * aa_zz;
+        double _dydz = -dy * dz * aa_yz * 2;
+        double exp_dydy = exp(_dydy);
+        double exp_2dydy = exp_dydy * exp_dydy;
+        double exp_dzdz = exp(_dzdz);
+        double exp_dydz = exp(_dydz);
+        double exp_dydz_i = (exp_dydz == 0) ? 0 : 1./exp_dydz;
+        double x1xij, tmpx, tmpy, tmpz;
+        double _xyz0xyz0, _xyz0dy, _xyz0dz, _z0dz;
+        double exp_xyz0xyz0, exp_xyz0dz;
+        double exp_y0dy, exp_z0z0, exp_z0dz;
+
+        const int xcols = ngridy * ngridz;
+        double *xqr = cache;
+        double *xyr = xqr + l1 * xcols;
+        double *wz = xyr + l1l1 * ngridz;
+        double *pweights;
+        NPdset0(xqr, ((size_t)l1) * xcols);
+
+        ix1 = nx0 % mesh[0] + mesh[0];
+        for (ix = 0; ix < ngridx; ix++, ix1++) {
+                if (ix1 >= mesh[0]) {
+                        ix1 -= mesh[0];
+                }
+
+                x1xij = x0xij + (nx0+ix)*dx;
+                tmpx = x1xij * aa_xx + y0yij * aa_xy + z0zij * aa_xz;
+                tmpy = x1xij * aa_xy + y0yij * aa_yy + z0zij * aa_yz;
+                tmpz = x1xij * aa_xz + y0yij * aa_yz + z0zij * aa_zz;
+                _xyz0xyz0 = -x1xij * tmpx - y0yij * tmpy - z0zij * tmpz;
+                if (_xyz0xyz0 < EXPMIN) {
+                        continue;
+                }
+                _xyz0dy = -2 * dy * tmpy;
+                _xyz0dz = -2 * dz * tmpz;
+                exp_xyz0xyz0 = exp(_xyz0xyz0);
+                exp_xyz0dz = exp(_xyz0dz);
+
+                exp_y0dy = exp(_xyz0dy + _dydy);
+                exp_z0z0 = exp_xyz0xyz0;
+                exp_z0dz = exp_xyz0dz;
+                _z0dz = _xyz0dz;
+                iy1 = grid_close_to_yij % mesh[1] + mesh[1];
+                for (iy = grid_close_to_yij-ny0; iy < ngridy; iy++, iy1++) {
+                        if (exp_z0z0 == 0) {
+                                break;
+                        }
+                        if (iy1 >= mesh[1]) {
+                                iy1 -= mesh[1];
+                        }
+                        pweights = weights + (ix1*mesh[1] + iy1) * ((size_t)mesh[2]);
+                        _nonorth_ints_z(wz, pweights, ngridz, mesh[2],
+                                        nz0, nz1, grid_close_to_zij,
+                                        exp_z0z0, exp_z0dz, exp_dzdz, _z0dz, _dzdz);
+                        _nonorth_xqr(xqr, wz, xs_exp, l1, ix, iy,
+                                     ngridx, ngridy, ngridz);
+                        _z0dz += _dydz;
+                        exp_z0z0 *= exp_y0dy;
+                        exp_z0dz *= exp_dydz;
+                        exp_y0dy *= exp_2dydy;
+                }
+
+                exp_y0dy = exp(_dydy - _xyz0dy);
+                exp_z0z0 = exp_xyz0xyz0;
+                exp_z0dz = exp_xyz0dz;
+                _z0dz = _xyz0dz;
+                iy1 = (grid_close_to_yij-1) % mesh[1];
+                for (iy = grid_close_to_yij-ny0-1; iy >= 0; iy--, iy1--) {
+                        exp_z0z0 *= exp_y0dy;
+                        if (exp_z0z0 == 0) {
+                                break;
+                        }
+
+                        _z0dz -= _dydz;
+                        if (exp_dydz != 0) {
+                                exp_z0dz *= exp_dydz_i;
+                        } else {
+                                exp_z0dz = exp(_z0dz);
+                        }
+                        exp_y0dy *= exp_2dydy;
+                        if (iy1 < 0) {
+                                iy1 += mesh[1];
+                        }
+                        pweights = weights + (ix1*mesh[1] + iy1) * ((size_t)mesh[2]);
+                        _nonorth_ints_z(wz, pweights, ngridz, mesh[2],
+                                        nz0, nz1, grid_close_to_zij,
+                                        exp_z0z0, exp_z0dz, exp_dzdz, _z0dz, _dzdz);
+                        _nonorth_xqr(xqr, wz, xs_exp, l1, ix, iy,
+                                     ngridx, ngridy, ngridz);
+                }
+        }
+
+        for (l = 0; l < l1; l++) {
+                dgemm_wrapper(TRANS_N, TRANS_N, ngridz, l1, ngridy,
+                              D1, xqr+l*xcols, ngridz, ys_exp, ngridy,
+                              D0, xyr+l*l1*ngridz, ngridz);
+        }
+        dgemm_wrapper(TRANS_T, TRANS_N, l1, l1l1, ngridz,
+                      fac, zs_exp, ngridz, xyr, ngridz,
+                      D0, mat_frac, l1);
+}
+
+
+static int _nonorth_mat_xyz(double *mat_xyz, double *weights, int topl,
+                            double ai, double aj, double *ri, double *rj,
+                            double fac, double cutoff, int dimension,
+                            double *a, double *b, int *mesh, double *cache)
+{
+        int l1 = topl + 1;
+        int l1l1l1 = l1 * l1 * l1;
+        int img_slice[6];
+        int grid_slice[6];
+        double ri_frac[3];
+        double rij_frac[3];
+        double *xs_exp, *ys_exp, *zs_exp;
+        make_rij_frac(ri_frac, rij_frac, ri, rj, ai, aj, b);
+
+        int data_size = init_nonorth_data(&xs_exp, &ys_exp, &zs_exp,
+                                          img_slice, grid_slice, mesh,
+                                          topl, dimension, cutoff, b,
+                                          ri_frac, rij_frac, cache);
+        if (data_size == 0) {
+                return 0;
+        }
+        cache += data_size;
+
+        double *mat_frac = cache;
+        cache += l1l1l1;
+        _nonorth_ints(mat_frac, weights, fac, ai+aj, topl, mesh, a, rij_frac,
+                      xs_exp, ys_exp, zs_exp, img_slice, grid_slice, cache);
+        _mat_frac_to_xyz(mat_xyz, mat_frac, topl, a, cache);
+        return 1;
+}
+
+
+int eval_mat_lda_nonorth(double *weights, double *out, int comp,
+                         int li, int lj, double ai, double aj,
+                         double *ri, double *rj, double fac, double cutoff,
+                         int dimension, double* dh, double *a, double *b,
+                         int *mesh, double *cache)
+{
+        int topl = li + lj;
+        int l1 = topl+1;
+        int l1l1l1 = l1*l1*l1;
+        double *mat_xyz = cache;
+        cache += l1l1l1;
+        if (!_nonorth_mat_xyz(mat_xyz, weights, topl, ai, aj, ri, rj,
+                              fac, cutoff, dimension, a, b, mesh, cache)) {
+                return 0;
+        }
+        _dm_xyz_to_dm(mat_xyz, out, li, lj, ri, rj, cache);
+        return 1;
+}
+
+
+int eval_mat_lda_nonorth_ip1(double *weights, double *out, int comp,
+                             int li, int lj, double ai, double aj,
+                             double *ri, double *rj, double fac, double cutoff,
+                             int dimension, double* dh, double *a, double *b,
+                             int *mesh, double *cache)
+{
+        int dij = _LEN_CART[li] * _LEN_CART[lj];
+        int topl = li + lj + 1;
+        int l1 = topl+1;
+        int l1l1l1 = l1*l1*l1;
+        double *mat_xyz = cache;
+        cache += l1l1l1;
+        if (!_nonorth_mat_xyz(mat_xyz, weights, topl, ai, aj, ri, rj,
+                              fac, cutoff, dimension, a, b, mesh, cache)) {
+                return 0;
+        }
+        double *pout_x = out;
+        double *pout_y = pout_x + dij;
+        double *pout_z = pout_y + dij;
+        _v1_xyz_to_v1(_vrho_loop_ip1_x, mat_xyz, pout_x, li, lj, ai, aj, ri, rj, cache);
+        _v1_xyz_to_v1(_vrho_loop_ip1_y, mat_xyz, pout_y, li, lj, ai, aj, ri, rj, cache);
+        _v1_xyz_to_v1(_vrho_loop_ip1_z, mat_xyz, pout_z, li, lj, ai, aj, ri, rj, cache);
+        return 1;
+}
+
+
 static void _apply_ints(int (*eval_ints)(), double *weights, double *mat,
                         PGFPair* pgfpair, int comp, double fac, int dimension,
                         double* dh, double *a, double *b, int *mesh,
@@ -1142,10 +1504,10 @@ static void _apply_ints(int (*eval_ints)(), double *weights, double *mat,
 }
 
 
-static size_t _ints_cache_size(int l, int nprim, int nctr, int* mesh, double radius, double* dh, int comp)
+static size_t _ints_cache_size(int l, int nprim, int nctr, int* mesh, double radius, double* dh,
+                               double* b, int orth, int comp)
 {
     size_t size = 0;
-    size_t nmx = get_max_num_grid_orth(dh, radius);
     int max_mesh = MAX(MAX(mesh[0], mesh[1]), mesh[2]);
     int l1 = 2 * l + 1;
     if (comp == 3) {
@@ -1156,6 +1518,18 @@ static size_t _ints_cache_size(int l, int nprim, int nctr, int* mesh, double rad
 
     size += comp * nprim * nprim * ncart * ncart; // dm_cart
     size += comp * ncart * ncart; // out
+    size += nctr * ncart * nprim * ncart;
+
+    if (!orth) {
+        size_t nmx = get_max_num_grid_nonorth(b, mesh, radius);
+        size += 3 * l1 * nmx; // xs_exp, ys_exp, zs_exp
+        size += 2 * l1l1 * l1; // mat_xyz, mat_frac
+        size_t size_nonorth_ints = l1*nmx*nmx + l1l1*nmx + nmx; // _nonorth_ints
+        size += MAX(size_nonorth_ints, MAX(2*l1l1*l1, 3*(ncart+l1)));
+        return size;
+    }
+
+    size_t nmx = get_max_num_grid_orth(dh, radius);
     size += l1 * (mesh[0] + mesh[1] + mesh[2]); // xs_exp, ys_exp, zs_exp
 
     size_t size_orth_components = l1 * nmx + nmx; // orth_components
@@ -1169,15 +1543,18 @@ static size_t _ints_cache_size(int l, int nprim, int nctr, int* mesh, double rad
         size_orth_ints = l1*mesh[2] + l1l1*mesh[0];
     }
     size += MAX(size_orth_components, size_orth_ints);
-    size += nctr * ncart * nprim * ncart;
     //size += 1000000;
     //printf("Memory allocated per thread for make_mat: %ld MB.\n", size*sizeof(double) / 1000000);
     return size;
 }
 
 
-static size_t _ints_core_cache_size(int* mesh, double radius, double* dh, int comp)
+static size_t _ints_core_cache_size(int* mesh, double radius, double* dh,
+                                    double* b, int orth, int comp)
 {
+    if (!orth) {
+        return _ints_cache_size(0, 1, 1, mesh, radius, dh, b, orth, comp);
+    }
     size_t size = 0;
     size_t nmx = get_max_num_grid_orth(dh, radius);
     int max_mesh = MAX(MAX(mesh[0], mesh[1]), mesh[2]);
@@ -1205,14 +1582,19 @@ static size_t _ints_core_cache_size(int* mesh, double radius, double* dh, int co
 }
 
 
-void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskList** task_list,
-                        int comp, int hermi, int grid_level, 
-                        int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
-                        int dimension, double* Ls, double* a, double* b,
-                        int* ish_atm, int* ish_bas, double* ish_env,
-                        int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+/*
+ * Integrate the potential on grid level grid_level. The matrix elements
+ * of each shell pair are added to mat scaled by beta.
+ */
+static void _integrate_level(int (*eval_ints)(), double* mat, double* weights, TaskList* tl,
+                             int comp, int hermi, int grid_level, double beta,
+                             int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                             int dimension, double* Ls, double* a, double* b,
+                             int* ish_atm, int* ish_bas, double* ish_env,
+                             int* jsh_atm, int* jsh_bas, double* jsh_env,
+                             double** gto_norm_i, double** cart2sph_coeff_i,
+                             double** gto_norm_j, double** cart2sph_coeff_j)
 {
-    TaskList* tl = *task_list;
     GridLevel_Info* gridlevel_info = tl->gridlevel_info;
     Task *task = (tl->tasks)[grid_level];
     int ntasks = task->ntasks;
@@ -1230,9 +1612,6 @@ void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskLi
     const int ish1 = shls_slice[1];
     const int jsh0 = shls_slice[2];
     const int jsh1 = shls_slice[3];
-    const int nish = ish1 - ish0;
-    const int njsh = jsh1 - jsh0;
-    //const int nijsh = nish * njsh;
     const int naoi = ish_ao_loc[ish1] - ish_ao_loc[ish0];
     const int naoj = jsh_ao_loc[jsh1] - jsh_ao_loc[jsh0];
 
@@ -1254,24 +1633,14 @@ void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskLi
         jsh_nctr_max = get_nctr_max(jsh0, jsh1, jsh_bas);
     }
 
-    double **gto_norm_i = (double**) malloc(sizeof(double*) * nish);
-    double **cart2sph_coeff_i = (double**) malloc(sizeof(double*) * nish);
-    get_cart2sph_coeff(cart2sph_coeff_i, gto_norm_i, ish0, ish1, ish_bas, ish_env, cart);
-    double **gto_norm_j = gto_norm_i;
-    double **cart2sph_coeff_j = cart2sph_coeff_i;
-    if (hermi != 1) {
-        gto_norm_j = (double**) malloc(sizeof(double*) * njsh);
-        cart2sph_coeff_j = (double**) malloc(sizeof(double*) * njsh);
-        get_cart2sph_coeff(cart2sph_coeff_j, gto_norm_j, jsh0, jsh1, jsh_bas, jsh_env, cart);
-    }
-
     int *task_loc;
     int nblock = get_task_loc(&task_loc, pgfpairs, ntasks, ish0, ish1, jsh0, jsh1, hermi);
 
     size_t cache_size = _ints_cache_size(MAX(ish_lmax,jsh_lmax),
                                          MAX(ish_nprim_max, jsh_nprim_max),
                                          MAX(ish_nctr_max, jsh_nctr_max), 
-                                         mesh, max_radius, dh, comp);
+                                         mesh, max_radius, dh, b,
+                                         is_orth_lattice(a), comp);
 
 #pragma omp parallel
 {
@@ -1304,10 +1673,10 @@ void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskLi
                         ptr_gto_norm_i, ptr_gto_norm_j, ish_atm, ish_bas, ish_env,
                         jsh_atm, jsh_bas, jsh_env, Ls, cache);
         }
-        transform_dm_inverse(dm_cart, mat, comp,
-                             cart2sph_coeff_i[ish], cart2sph_coeff_j[jsh],
-                             ish_ao_loc, jsh_ao_loc, ish_bas, jsh_bas,
-                             ish, jsh, ish0, jsh0, naoi, naoj, cache);
+        _transform_dm_inverse(dm_cart, mat, comp, beta,
+                              cart2sph_coeff_i[ish], cart2sph_coeff_j[jsh],
+                              ish_ao_loc, jsh_ao_loc, ish_bas, jsh_bas,
+                              ish, jsh, ish0, jsh0, naoi, naoj, cache);
         if (hermi == 1 && ish != jsh) {
             fill_tril(mat, comp, ish_ao_loc, jsh_ao_loc,
                       ish, jsh, ish0, jsh0, naoi, naoj);
@@ -1319,6 +1688,52 @@ void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskLi
     if (task_loc) {
         free(task_loc);
     }
+}
+
+
+/*
+ * weights[ilevel] is the potential on grid level ilevel, or NULL if
+ * the level is to be skipped. With beta = 0, the matrix elements from
+ * a single level overwrite those in mat; with beta = 1, contributions
+ * of all levels are accumulated to mat.
+ */
+static void _integrate_drv(int (*eval_ints)(), double* mat, double** weights, TaskList** task_list,
+                           int comp, int hermi, double beta,
+                           int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                           int dimension, double* Ls, double* a, double* b,
+                           int* ish_atm, int* ish_bas, double* ish_env,
+                           int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+{
+    TaskList* tl = *task_list;
+    const int ish0 = shls_slice[0];
+    const int ish1 = shls_slice[1];
+    const int jsh0 = shls_slice[2];
+    const int jsh1 = shls_slice[3];
+    const int nish = ish1 - ish0;
+    const int njsh = jsh1 - jsh0;
+
+    double **gto_norm_i = (double**) malloc(sizeof(double*) * nish);
+    double **cart2sph_coeff_i = (double**) malloc(sizeof(double*) * nish);
+    get_cart2sph_coeff(cart2sph_coeff_i, gto_norm_i, ish0, ish1, ish_bas, ish_env, cart);
+    double **gto_norm_j = gto_norm_i;
+    double **cart2sph_coeff_j = cart2sph_coeff_i;
+    if (hermi != 1) {
+        gto_norm_j = (double**) malloc(sizeof(double*) * njsh);
+        cart2sph_coeff_j = (double**) malloc(sizeof(double*) * njsh);
+        get_cart2sph_coeff(cart2sph_coeff_j, gto_norm_j, jsh0, jsh1, jsh_bas, jsh_env, cart);
+    }
+
+    int ilevel;
+    for (ilevel = 0; ilevel < tl->nlevels; ilevel++) {
+        if (weights[ilevel] == NULL) {
+            continue;
+        }
+        _integrate_level(eval_ints, mat, weights[ilevel], tl, comp, hermi, ilevel, beta,
+                         shls_slice, ish_ao_loc, jsh_ao_loc, dimension, Ls, a, b,
+                         ish_atm, ish_bas, ish_env, jsh_atm, jsh_bas, jsh_env,
+                         gto_norm_i, cart2sph_coeff_i, gto_norm_j, cart2sph_coeff_j);
+    }
+
     del_cart2sph_coeff(cart2sph_coeff_i, gto_norm_i, ish0, ish1);
     if (hermi != 1) {
         del_cart2sph_coeff(cart2sph_coeff_j, gto_norm_j, jsh0, jsh1);
@@ -1326,6 +1741,44 @@ void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskLi
 }
 
 
+void grid_integrate_drv(int (*eval_ints)(), double* mat, double* weights, TaskList** task_list,
+                        int comp, int hermi, int grid_level, 
+                        int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                        int dimension, double* Ls, double* a, double* b,
+                        int* ish_atm, int* ish_bas, double* ish_env,
+                        int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+{
+    TaskList* tl = *task_list;
+    if ((tl->tasks)[grid_level]->ntasks <= 0) {
+        return;
+    }
+    double **weights_levels = calloc(tl->nlevels, sizeof(double*));
+    weights_levels[grid_level] = weights;
+    _integrate_drv(eval_ints, mat, weights_levels, task_list, comp, hermi, 0.,
+                   shls_slice, ish_ao_loc, jsh_ao_loc, dimension, Ls, a, b,
+                   ish_atm, ish_bas, ish_env, jsh_atm, jsh_bas, jsh_env, cart);
+    free(weights_levels);
+}
+
+
+/*
+ * Integrate the potential on all grid levels in one call. The matrix
+ * elements are accumulated to mat, which needs to be initialized by
+ * the caller.
+ */
+void grid_integrate_levels_drv(int (*eval_ints)(), double* mat, double** weights,
+                               TaskList** task_list, int comp, int hermi,
+                               int *shls_slice, int* ish_ao_loc, int* jsh_ao_loc,
+                               int dimension, double* Ls, double* a, double* b,
+                               int* ish_atm, int* ish_bas, double* ish_env,
+                               int* jsh_atm, int* jsh_bas, double* jsh_env, int cart)
+{
+    _integrate_drv(eval_ints, mat, weights, task_list, comp, hermi, 1.,
+                   shls_slice, ish_ao_loc, jsh_ao_loc, dimension, Ls, a, b,
+                   ish_atm, ish_bas, ish_env, jsh_atm, jsh_bas, jsh_env, cart);
+}
+
+
 void int_gauss_charge_v_rs(int (*eval_ints)(), double* out, double* v_rs, int comp,
                            int* atm, int* bas, int nbas, double* env,
                            int* mesh, int dimension, double* a, double* b, double max_radius)
@@ -1333,7 +1786,8 @@ void int_gauss_charge_v_rs(int (*eval_ints)(), double* out, double* v_rs, int co
     double dh[9];
     get_grid_spacing(dh, a, mesh);
 
-    size_t cache_size = _ints_core_cache_size(mesh, max_radius, dh, comp);
+    size_t cache_size = _ints_core_cache_size(mesh, max_radius, dh, b,
+                                              is_orth_lattice(a), comp);
 
 #pragma omp parallel
 {
@@ -121,6 +121,48 @@ void del_rs_grid(RS_Grid** rs_grid)
 }
 
 
+void init_rs_grid_f32(RS_Grid_f32** rs_grid, GridLevel_Info** gridlevel_info, int comp)
+{
+    RS_Grid_f32* rg = (RS_Grid_f32*) malloc(sizeof(RS_Grid_f32));
+    GridLevel_Info* gl_info = *gridlevel_info;
+    int nlevels = gl_info->nlevels;
+    rg->nlevels = nlevels;
+    rg->gridlevel_info = gl_info;
+    rg->comp = comp;
+
+    int i;
+    size_t ngrid;
+    int *mesh = gl_info->mesh;
+    rg->data = (float**)malloc(sizeof(float*) * nlevels);
+    for (i = 0; i < nlevels; i++) {
+        ngrid = ((size_t)mesh[i*3]) * mesh[i*3+1] * mesh[i*3+2];
+        (rg->data)[i] = calloc(comp*ngrid, sizeof(float));
+    }
+    *rs_grid = rg;
+}
+
+
+void del_rs_grid_f32(RS_Grid_f32** rs_grid)
+{
+    RS_Grid_f32* rg = *rs_grid;
+    if (!rg) {
+        return;
+    }
+    if (rg->data) {
+        int i;
+        for (i = 0; i < rg->nlevels; i++) {
+            if (rg->data[i]) {
+                free(rg->data[i]);
+            }
+        }
+        free(rg->data);
+    }
+    rg->gridlevel_info = NULL;
+    free(rg);
+    *rs_grid = NULL;
+}
+
+
 void del_gridlevel_info(GridLevel_Info** gridlevel_info)
 {
     GridLevel_Info* gl_info = *gridlevel_info;
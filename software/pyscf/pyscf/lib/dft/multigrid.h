@@ -23,6 +23,14 @@ typedef struct RS_Grid_struct {
     double** data;
 } RS_Grid;
 
+// Same as RS_Grid, but values are stored in single precision
+typedef struct RS_Grid_f32_struct {
+    int nlevels;
+    GridLevel_Info* gridlevel_info;
+    int comp;
+    float** data;
+} RS_Grid_f32;
+
 typedef struct PGFPair_struct {
     int ish;
     int ipgf;
@@ -30,6 +30,9 @@ from pyscf import __config__
 
 INCORE_SIZE = getattr(__config__, 'lib_diis_incore_size', 10000000)  # 80 MB
 BLOCK_SIZE  = getattr(__config__, 'lib_diis_block_size', 20000000)  # ~ 160/320 MB
+RING_BUFFER = getattr(__config__, 'lib_diis_DIIS_ring_buffer', False)
+VEC_DTYPE = getattr(__config__, 'lib_diis_DIIS_vec_dtype', None)
+PACKED = getattr(__config__, 'lib_diis_DIIS_packed', False)
 
 # PCCP, 4, 11 (2002); DOI:10.1039/B108658H
 # GEDIIS, JCTC, 2, 835 (2006); DOI:10.1021/ct050275a
@@ -44,6 +47,18 @@ class DIIS(object):
             DIIS subspace size. The maximum number of the vectors to be stored.
         min_space
             The minimal size of subspace before DIIS extrapolation.
+        ring_buffer : bool
+            Keep the vectors in memory, in two (space, n) arrays which are
+            overwritten cyclically. The new row of the DIIS matrix is one
+            matrix-vector product and the extrapolation one vector-matrix
+            product. The file given by filename is only a backup then.
+        vec_dtype : dtype
+            If given, e.g. numpy.float32, the vectors in the ring buffer are
+            stored in this precision.
+        packed : bool
+            Store only the lower triangular part of the vectors in the ring
+            buffer, for Hermitian vectors such as Fock matrices of shape
+            (..., n, n). The error vectors may be Hermitian or anti-Hermitian.
 
     Functions:
         update(x, xerr=None) :
@@ -108,35 +123,107 @@ class DIIS(object):
         self.space = 6
         self.min_space = 1
         self.incore = incore
+        self.ring_buffer = RING_BUFFER
+        self.vec_dtype = VEC_DTYPE
+        self.packed = PACKED
 
 ##################################################
 # don't modify the following private variables, they are not input options
         self.filename = filename
         self._diisfile = None
+        self._writer = None
         self._buffer = {}
         self._bookkeep = [] # keep the ordering of input vectors
         self._head = 0
         self._H = None
         self._xprev = None
         self._err_vec_touched = False
+        self._ring = {}
+        self._vec_shape = None
 
     def _store(self, key, value):
-        incore = value.size < INCORE_SIZE or self.incore
+        if self.ring_buffer and key != 'xprev':
+            return self._ring_store(key, value)
+
+        incore = value.size < INCORE_SIZE or self.incore or self.ring_buffer
         if incore:
             self._buffer[key] = value
 
         # save the error vector if filename is given, this file can be used to
         # restore the DIIS state
-        if (not incore) or isinstance(self.filename, str):
-            if self._diisfile is None:
-                self._diisfile = misc.H5TmpFile(self.filename, 'w')
-            if key in self._diisfile:
-                self._diisfile[key][:] = value
+        if not incore:
+            self._dump(key, value)
+        elif isinstance(self.filename, str):
+            # The file is only a backup of the vectors in memory. Write it in
+            # background and keep only the latest vector of each key if the
+            # writes fall behind.
+            if self._writer is None:
+                self._writer = misc.BackgroundWriter()
+            self._writer.submit(key, self._dump, key, value)
+
+    def _ring_store(self, key, value):
+        '''Store value in the row int(key[1:]) of the ring buffer key[0]'''
+        if isinstance(self.filename, str):
+            if self._writer is None:
+                self._writer = misc.BackgroundWriter()
+            self._writer.submit(key, self._dump, key, value.ravel())
+        v = self._compress(value, key[0] == 'e')
+        buf = self._ring.get(key[0])
+        if buf is None or buf.shape[1] != v.size:
+            buf = self._ring[key[0]] = numpy.empty((self.space, v.size), v.dtype)
+        buf[int(key[1:])] = v
+
+    def _packed_dim(self, size=None):
+        shape = self._vec_shape
+        if (self.packed and shape is not None and len(shape) >= 2 and
+                shape[-1] == shape[-2] and (size is None or numpy.prod(shape) == size)):
+            return shape[-1]
+        return None
+
+    def _compress(self, v, is_err_vec=False):
+        n = self._packed_dim(v.size)
+        if n is not None:
+            v = numpy_helper.pack_tril(numpy.asarray(v).reshape(-1,n,n))
+            if is_err_vec:
+                # scale the off-diagonal elements so that the dot product
+                # of the packed vectors equals that of the full matrices
+                diag = numpy.arange(n) * (numpy.arange(n) + 3) // 2
+                v *= numpy.sqrt(2.)
+                v[:,diag] *= numpy.sqrt(.5)
+        v = numpy.asarray(v).ravel()
+        if self.vec_dtype is not None:
+            if numpy.iscomplexobj(v):
+                dtype = numpy.promote_types(self.vec_dtype, numpy.complex64)
             else:
-                self._diisfile[key] = value
+                dtype = numpy.dtype(self.vec_dtype)
+            v = v.astype(dtype)
+        return v
+
+    def _decompress(self, v):
+        n = self._packed_dim()
+        if n is not None:
+            v = numpy_helper.unpack_tril(v.reshape(-1,n*(n+1)//2), numpy_helper.HERMITIAN)
+        return v.ravel()
+
+    def _dump(self, key, value):
+        if self._diisfile is None:
+            self._diisfile = misc.H5TmpFile(self.filename, 'w')
+        if key in self._diisfile:
+            self._diisfile[key][:] = value
+        else:
+            self._diisfile[key] = value
+        if self._vec_shape is not None:
+            # lets restore unpack the vectors of a packed ring buffer
+            self._diisfile.attrs['vec_shape'] = self._vec_shape
 # to avoid "Unable to find a valid file signature" error when reload the hdf5
 # file from a crashed claculation
-            self._diisfile.flush()
+        self._diisfile.flush()
+
+    def flush(self):
+        '''Wait until the vectors are written to the DIIS file.'''
+        if self._writer is not None:
+            self._writer.flush()
+        return self
 
     def push_err_vec(self, xerr):
         self._err_vec_touched = True
@@ -173,7 +260,7 @@ class DIIS(object):
             ekey = 'e%d'%self._head
             xkey = 'x%d'%self._head
             self._store(xkey, x)
-            if x.size < INCORE_SIZE or self.incore:
+            if x.size < INCORE_SIZE or self.incore or self.ring_buffer:
                 self._store(ekey, x - numpy.asarray(self._xprev))
             else:  # not call _store to reduce memory footprint
                 if ekey not in self._diisfile:
@@ -185,13 +272,17 @@ class DIIS(object):
             self._head += 1
 
     def get_err_vec(self, idx):
-        if self._buffer:
+        if self.ring_buffer:
+            return self._ring['e'][idx]
+        elif self._buffer:
             return self._buffer['e%d'%idx]
         else:
             return self._diisfile['e%d'%idx]
 
     def get_vec(self, idx):
-        if self._buffer:
+        if self.ring_buffer:
+            return self._ring['x'][idx]
+        elif self._buffer:
             return self._buffer['x%d'%idx]
         else:
             return self._diisfile['x%d'%idx]
@@ -209,6 +300,7 @@ class DIIS(object):
         the current given vector and the last given vector as the error
         vector to extrapolate the vector.
         '''
+        self._vec_shape = x.shape
         if xerr is not None:
             self.push_err_vec(xerr)
         self.push_vec(x)
@@ -219,15 +311,28 @@ class DIIS(object):
 
         dt = numpy.array(self.get_err_vec(self._head-1), copy=False)
         if self._H is None:
-            self._H = numpy.zeros((self.space+1,self.space+1), dt.dtype)
+            self._H = numpy.zeros((self.space+1,self.space+1),
+                                  numpy.result_type(dt.dtype, numpy.double))
             self._H[0,1:] = self._H[1:,0] = 1
-        for i in range(nd):
+        if self.ring_buffer:
+            # only the row of the new error vector is computed
+            ebuf = self._ring['e']
             tmp = 0
-            dti = self.get_err_vec(i)
             for p0, p1 in misc.prange(0, dt.size, BLOCK_SIZE):
-                tmp += numpy.dot(dt[p0:p1].conj(), dti[p0:p1])
-            self._H[self._head,i+1] = tmp
-            self._H[i+1,self._head] = tmp.conjugate()
+                tmp += numpy.dot(ebuf[:nd,p0:p1], dt[p0:p1].conj())
+            if self._packed_dim(None) is not None and numpy.iscomplexobj(tmp):
+                # the dot products of (anti-)Hermitian matrices are real
+                tmp = tmp.real
+            self._H[self._head,1:nd+1] = tmp
+            self._H[1:nd+1,self._head] = tmp.conjugate()
+        else:
+            for i in range(nd):
+                tmp = 0
+                dti = self.get_err_vec(i)
+                for p0, p1 in misc.prange(0, dt.size, BLOCK_SIZE):
+                    tmp += numpy.dot(dt[p0:p1].conj(), dti[p0:p1])
+                self._H[self._head,i+1] = tmp
+                self._H[i+1,self._head] = tmp.conjugate()
         dt = None
 
         if self._xprev is None:
@@ -264,6 +369,13 @@ class DIIS(object):
                 raise e
         logger.debug1(self, 'diis-c %s', c)
 
+        if self.ring_buffer:
+            xbuf = self._ring['x']
+            xnew = numpy.empty(xbuf.shape[1], numpy.result_type(c.dtype, xbuf.dtype))
+            for p0, p1 in misc.prange(0, xbuf.shape[1], BLOCK_SIZE):
+                xnew[p0:p1] = numpy.dot(c[1:], xbuf[:nd,p0:p1])
+            return self._decompress(xnew)
+
         xnew = None
         for i, ci in enumerate(c[1:]):
             xi = self.get_vec(i)
@@ -275,8 +387,11 @@ class DIIS(object):
 
     def restore(self, filename, inplace=True):
         '''Read diis contents from a diis file and replace the attributes of
-        current diis object if needed, then construct the vector.
+        current diis object if needed, then construct the vector. With
+        ring_buffer, the vectors are loaded into the ring buffer.
         '''
+        if self._writer is not None and self.filename == filename:
+            self._writer.flush()
         fdiis = misc.H5TmpFile(filename)
         if inplace:
             self.filename = filename
@@ -291,7 +406,10 @@ class DIIS(object):
         if nd == 0:
             return self
 
-        if inplace:
+        if self.ring_buffer:
+            nd = self._ring_restore(fdiis, nd)
+
+        elif inplace:
             if fdiis[x_keys[0]].size < INCORE_SIZE or self.incore:
                 for key in diis_keys:
                     self._buffer[key] = numpy.asarray(fdiis[key])
@@ -335,6 +453,27 @@ class DIIS(object):
         return self
 
 
+    def _ring_restore(self, fdiis, nd):
+        '''Load the first nd vectors of the DIIS file into the ring buffer.
+        Returns the number of vectors loaded.'''
+        if nd > self.space:
+            logger.warn(self, 'DIIS file has %d vectors. Only %d are restored '
+                        'in the ring buffer', nd, self.space)
+            nd = self.space
+        if 'vec_shape' in fdiis.attrs:
+            self._vec_shape = tuple(fdiis.attrs['vec_shape'])
+        self._ring = {}
+        for k in ('x', 'e'):
+            for i in range(nd):
+                v = self._compress(fdiis['%s%d' % (k, i)][()], k == 'e')
+                if i == 0:
+                    self._ring[k] = numpy.empty((self.space, v.size), v.dtype)
+                self._ring[k][i] = v
+        if 'xprev' in fdiis:
+            self._xprev = self._buffer['xprev'] = numpy.asarray(fdiis['xprev'])
+        return nd
+
+
 def restore(filename):
     '''Restore/construct diis object based on a diis file'''
     return DIIS().restore(filename)
@@ -35,6 +35,7 @@ SAFE_EIGH_LINDEP = getattr(__config__, 'lib_linalg_helper_safe_eigh_lindep', 1e-
 DAVIDSON_LINDEP = getattr(__config__, 'lib_linalg_helper_davidson_lindep', 1e-14)
 DSOLVE_LINDEP = getattr(__config__, 'lib_linalg_helper_dsolve_lindep', 1e-15)
 MAX_MEMORY = getattr(__config__, 'lib_linalg_helper_davidson_max_memory', 2000)  # 2GB
+LOBPCG_LINDEP = getattr(__config__, 'lib_linalg_helper_lobpcg_lindep', 1e-12)
 
 # sort by similarity has problem which flips the ordering of eigenvalues when
 # the initial guess is closed to excited state.  In this situation, function
@@ -592,6 +593,126 @@ def davidson1(aop, x0, precond, tol=1e-12, max_cycle=50, max_space=12,
     return numpy.asarray(conv), e, x0
 
 
+def lobpcg(h, s, x0, precond=None, tol=1e-7, max_cycle=50, nroots=None,
+           lindep=LOBPCG_LINDEP, verbose=logger.WARN):
+    r'''Block locally optimal preconditioned conjugate gradient (LOBPCG)
+    method for the lowest eigenpairs of the generalized eigenvalue problem
+    h c = s c e.  Ref
+    [1] A.V. Knyazev, SIAM J. Sci. Comput. 23, 517-541 (2001).
+
+    Args:
+        h, s : 2D array
+            Complex Hermitian or real symmetric matrices.  s is positive
+            definite.  s can be None for the ordinary eigenvalue problem.
+        x0 : 2D array
+            Initial guess.  Each column is a trial vector.  The block size
+            is x0.shape[1].
+
+    Kwargs:
+        precond : function(dx, e) => array_like_dx
+            Preconditioner for the residuals dx (one column per eigenvalue
+            in e).  By default, the diagonal preconditioner
+            dx / (diag(h) - e * diag(s)) is used.
+        tol : float
+            Convergence tolerance of the max norm of the residuals
+            h c - s c e.
+        max_cycle : int
+            max number of iterations.
+        nroots : int
+            Number of the lowest eigenpairs to converge.  The remaining
+            columns of the block only accelerate convergence.  Default is
+            the block size.
+        lindep : float
+            Basis vectors of the Rayleigh-Ritz subspace are discarded if the
+            eigenvalues of the subspace metric (relative to the largest one)
+            are smaller than this threshold.
+
+    Returns:
+        conv : bool
+            Whether the lowest nroots eigenpairs are converged.
+        e : 1D array
+            Eigenvalues of the whole block, in ascending order.
+        c : 2D array
+            Eigenvectors (s-orthonormal columns) of the whole block.
+
+    Examples:
+
+    >>> a = numpy.random.random((100,100))
+    >>> a = a + a.T + numpy.diag(numpy.arange(100.))
+    >>> conv, e, c = lib.linalg_helper.lobpcg(a, None, numpy.eye(100)[:,:8], nroots=5)
+    '''
+    log = logger.new_logger(sys.stdout, verbose) if isinstance(verbose, int) else verbose
+    if s is None:
+        s = numpy.eye(h.shape[0], dtype=h.dtype)
+    nvec = x0.shape[1]
+    if nroots is None:
+        nroots = nvec
+    if precond is None:
+        hdiag = h.diagonal().real
+        sdiag = s.diagonal().real
+        def precond(dx, e):
+            diagd = hdiag[:,None] - e * sdiag[:,None]
+            diagd[abs(diagd)<1e-8] = 1e-8
+            return dx / diagd
+
+    def rayleigh_ritz(xs, hxs, sxs):
+        heff = numpy.dot(xs.conj().T, hxs)
+        seff = numpy.dot(xs.conj().T, sxs)
+        heff = (heff + heff.conj().T) * .5
+        seff = (seff + seff.conj().T) * .5
+        seig, t = scipy.linalg.eigh(seff)
+        mask = seig > lindep * seig[-1]
+        t = t[:,mask] / numpy.sqrt(seig[mask])
+        w, v = scipy.linalg.eigh(reduce(numpy.dot, (t.conj().T, heff, t)))
+        return w, numpy.dot(t, v)
+
+    x = x0
+    hx = numpy.dot(h, x)
+    sx = numpy.dot(s, x)
+    e, v = rayleigh_ritz(x, hx, sx)
+    v = v[:,:nvec]
+    e = e[:nvec]
+    x, hx, sx = numpy.dot(x, v), numpy.dot(hx, v), numpy.dot(sx, v)
+    p = hp = sp = None
+    conv = False
+    for icyc in range(max_cycle):
+        r = hx - sx * e
+        rnorm = numpy.linalg.norm(r, axis=0)
+        conv = rnorm[:nroots].max() < tol
+        log.debug1('lobpcg cycle %d  max|r| = %4.3g  e[nroots-1] = %.12g',
+                   icyc, rnorm[:nroots].max(), e[nroots-1])
+        if conv:
+            break
+
+        # Only the unconverged residuals are added to the subspace
+        active = rnorm > tol
+        w = precond(r[:,active], e[active])
+        w /= numpy.linalg.norm(w, axis=0)
+        hw = numpy.dot(h, w)
+        sw = numpy.dot(s, w)
+        if p is None:
+            xs, hxs, sxs = [x, w], [hx, hw], [sx, sw]
+        else:
+            xs, hxs, sxs = [x, w, p], [hx, hw, hp], [sx, sw, sp]
+        xs = numpy.hstack(xs)
+        hxs = numpy.hstack(hxs)
+        sxs = numpy.hstack(sxs)
+        e, v = rayleigh_ritz(xs, hxs, sxs)
+        e = e[:nvec]
+        v = v[:,:nvec]
+        # The search direction is the component outside of x
+        vp = v.copy()
+        vp[:nvec] = 0
+        p, hp, sp = numpy.dot(xs, vp), numpy.dot(hxs, vp), numpy.dot(sxs, vp)
+        x, hx, sx = numpy.dot(xs, v), numpy.dot(hxs, v), numpy.dot(sxs, v)
+        xs = hxs = sxs = None
+
+    log.debug('lobpcg %s in %d cycles, max|r| = %4.3g',
+              'converged' if conv else 'not converged', icyc+1,
+              rnorm[:nroots].max())
+    return conv, e, x
+
+
 def make_diag_precond(diag, level_shift=0):
     '''Generate the preconditioner function with the diagonal function.'''
     def precond(dx, e, *args):
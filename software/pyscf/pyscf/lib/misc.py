@@ -29,6 +29,9 @@ import collections
 import ctypes
 import numpy
 import h5py
+import atexit
+import weakref
+import threading
 from threading import Thread
 from multiprocessing import Queue, Process
 try:
@@ -885,6 +888,123 @@ class call_in_background(object):
             self.executor.shutdown(wait=True)
 
 
+class BackgroundWriter(object):
+    '''Execute write functions (e.g. chkfile or DIIS dumps) in a background
+    thread, built on :class:`call_in_background`.
+
+    The numpy arrays in the arguments of :meth:`submit` are copied before
+    submit returns, so the caller can modify them. Writes are executed in
+    the order they are submitted. If a write with the same key is still
+    pending, it is replaced by the new one, i.e. only the latest data is
+    written when the writes fall behind. Pending writes are finished by
+    :meth:`flush` or :meth:`close`, and for all writers at interpreter exit.
+
+    Attributes:
+        sync (bool): Execute the writes immediately in the calling thread.
+            The default follows the ASYNC_IO setting of call_in_background.
+        nwrites (int): Number of writes executed.
+        ncoalesced (int): Number of writes dropped because they were
+            superseded by newer data of the same key.
+
+    Examples:
+
+    >>> writer = lib.BackgroundWriter()
+    >>> for cycle in range(10):
+    ...     mo = numpy.random.random((4,4))
+    ...     writer.submit('mo', lib.chkfile.dump, 'scf.chk', 'mo_coeff', mo)
+    >>> writer.close()
+    '''
+    def __init__(self, sync=None):
+        if sync is None:
+            sync = not ASYNC_IO
+        self.sync = sync
+        self.nwrites = 0
+        self.ncoalesced = 0
+        self._pending = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._running = False
+        self._handler = None
+        self._bg = call_in_background(self._drain, sync=sync)
+        self._async_drain = self._bg.__enter__()
+        _background_writers.add(self)
+
+    def submit(self, key, fn, *args, **kwargs):
+        '''Schedule fn(*args, **kwargs). A pending call of the same key
+        is discarded.'''
+        args = [_snapshot(x) for x in args]
+        kwargs = dict((k, _snapshot(v)) for k, v in kwargs.items())
+        with self._lock:
+            if key in self._pending:
+                del self._pending[key]
+                self.ncoalesced += 1
+            self._pending[key] = (fn, args, kwargs)
+            start = not self._running
+            self._running = True
+        if start:
+            try:
+                self._handler = self._async_drain()
+            except BaseException:
+                with self._lock:
+                    self._running = False
+                raise
+        return self
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                key, (fn, args, kwargs) = self._pending.popitem(last=False)
+            try:
+                fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self._running = False
+                raise
+            self.nwrites += 1
+
+    def flush(self):
+        '''Wait until all pending writes are finished. The error of a failed
+        write is raised here.'''
+        while True:
+            handler = self._handler
+            try:
+                if hasattr(handler, 'result'):
+                    handler.result()
+                elif hasattr(handler, 'join'):
+                    handler.join()
+            except BaseException:
+                # raise the error only once
+                self._handler = self._bg.handlers[0] = None
+                raise
+            with self._lock:
+                if not self._running:
+                    return self
+
+    def close(self):
+        '''Finish all pending writes and shut down the background thread.'''
+        if self._bg is not None:
+            try:
+                self.flush()
+            finally:
+                bg, self._bg = self._bg, None
+                _background_writers.discard(self)
+                bg.__exit__(None, None, None)
+
+def _snapshot(x):
+    if isinstance(x, numpy.ndarray):
+        return numpy.array(x, copy=True)
+    return x
+
+_background_writers = weakref.WeakSet()
+
+@atexit.register
+def _close_background_writers():
+    for writer in list(_background_writers):
+        writer.close()
+
+
 class H5TmpFile(h5py.File):
     '''Create and return an HDF5 temporary file.
 
@@ -288,3 +288,120 @@ void get_ewald_direct_nuc_grad(double* out, double* chargs, double* coords, doub
         }
     }
 }
+
+
+/*
+ * Real-space Ewald sum on a linked-cell list.  Atoms are sorted by bins
+ * of the (wrapped) fractional coordinates, atoms of bin ib being
+ * coords[bin_loc[ib]:bin_loc[ib+1]].  For each atom, only the atoms of
+ * the bins within nimg[d] bins along each lattice direction are visited;
+ * neighbor bins outside the cell are mapped back with the corresponding
+ * lattice translation.
+ */
+static int _bin_image(int *jbin, int ib, int n)
+{
+    int q = ib / n;
+    if (ib < 0 && q * n != ib) {
+        q -= 1;
+    }
+    *jbin = ib - q * n;
+    return q;
+}
+
+/*
+ * Accumulate the real-space Ewald energy (if ewovrl is not NULL) and
+ * the nuclear gradients (if grad is not NULL) of the atoms in bin ib.
+ */
+static void _ewald_direct_bin(double *ewovrl, double *grad, int ib,
+                              double *chargs, double *coords, double *a,
+                              int *bin_loc, int *nbin, int *nimg,
+                              double beta, double rcut2)
+{
+    int bx = ib / (nbin[1] * nbin[2]);
+    int by = ib / nbin[2] % nbin[1];
+    int bz = ib % nbin[2];
+    int i, j, jb, jx, jy, jz, dx, dy, dz, tx, ty, tz;
+    double *ri, *rj, *pout;
+    double rL[3], rij[3];
+    double r, r2, qi, qq, tmp;
+    double fac = 2. * beta / sqrt(M_PI);
+    double beta2 = beta * beta;
+    double e = 0.;
+    for (i = bin_loc[ib]; i < bin_loc[ib+1]; i++) {
+        ri = coords + i*3;
+        qi = chargs[i];
+        for (dx = -nimg[0]; dx <= nimg[0]; dx++) {
+        tx = _bin_image(&jx, bx+dx, nbin[0]);
+        for (dy = -nimg[1]; dy <= nimg[1]; dy++) {
+        ty = _bin_image(&jy, by+dy, nbin[1]);
+        for (dz = -nimg[2]; dz <= nimg[2]; dz++) {
+            tz = _bin_image(&jz, bz+dz, nbin[2]);
+            rL[0] = tx * a[0] + ty * a[3] + tz * a[6] - ri[0];
+            rL[1] = tx * a[1] + ty * a[4] + tz * a[7] - ri[1];
+            rL[2] = tx * a[2] + ty * a[5] + tz * a[8] - ri[2];
+            jb = (jx * nbin[1] + jy) * nbin[2] + jz;
+            for (j = bin_loc[jb]; j < bin_loc[jb+1]; j++) {
+                rj = coords + j*3;
+                rij[0] = rj[0] + rL[0];
+                rij[1] = rj[1] + rL[1];
+                rij[2] = rj[2] + rL[2];
+                r2 = SQUARE(rij);
+                if (r2 < 1e-20 || r2 >= rcut2) {
+                    continue;
+                }
+                r = sqrt(r2);
+                qq = qi * chargs[j];
+                if (ewovrl != NULL) {
+                    e += qq * erfc(beta * r) / r;
+                }
+                if (grad != NULL) {
+                    tmp = qq * (erfc(beta * r) / (r2 * r) + fac * exp(-beta2 * r2) / r2);
+                    pout = grad + i*3;
+                    pout[0] += tmp * rij[0];
+                    pout[1] += tmp * rij[1];
+                    pout[2] += tmp * rij[2];
+                }
+            }
+        } } }
+    }
+    if (ewovrl != NULL) {
+        *ewovrl += e;
+    }
+}
+
+void get_ewald_direct_cells(double *ewovrl, double *chargs, double *coords,
+                            double *a, int *bin_loc, int *nbin, int *nimg,
+                            double beta, double rcut)
+{
+    int nbins = nbin[0] * nbin[1] * nbin[2];
+    double e = 0.;
+#pragma omp parallel
+{
+    int ib;
+    double e_loc = 0.;
+    #pragma omp for schedule(dynamic)
+    for (ib = 0; ib < nbins; ib++) {
+        _ewald_direct_bin(&e_loc, NULL, ib, chargs, coords, a,
+                          bin_loc, nbin, nimg, beta, rcut*rcut);
+    }
+    #pragma omp critical
+    e += e_loc;
+}
+    *ewovrl = .5 * e;
+}
+
+void get_ewald_direct_cells_nuc_grad(double *out, double *chargs, double *coords,
+                                     double *a, int *bin_loc, int *nbin, int *nimg,
+                                     double beta, double rcut)
+{
+    int nbins = nbin[0] * nbin[1] * nbin[2];
+#pragma omp parallel
+{
+    int ib;
+    #pragma omp for schedule(dynamic)
+    for (ib = 0; ib < nbins; ib++) {
+        _ewald_direct_bin(NULL, out, ib, chargs, coords, a,
+                          bin_loc, nbin, nimg, beta, rcut*rcut);
+    }
+}
+}
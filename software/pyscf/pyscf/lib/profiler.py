@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Machine readable timings of named phases
+
+The code marks its phases with ::
+
+    with lib.profiler.phase('multigrid.xc'):
+        ...
+
+which costs one function call when no profiler is active.  When a
+profiler is active, the wall time, the CPU time (of the process, i.e.
+including the OpenMP threads) and the peak memory (the high-water mark of
+the resident memory of the process) are accumulated per phase name.
+Phases may be nested; the time of a phase includes the time of the phases
+it contains.  A phase nested in a phase of the same name (e.g. the SCF of
+an atomic initial guess within an SCF) is counted but not timed twice.
+
+A profiler is activated by the environment variable PYSCF_PROFILE (or
+lib_profiler_output in the config file) which names a JSON Lines file.
+One record per process is appended to the file at exit.  In a script ::
+
+    with lib.profiler.profile('timings.jsonl', name='dsgdb9nsd_000001'):
+        mf.kernel()
+
+appends one record for the block.  The records of many runs are combined
+by :func:`aggregate` or ::
+
+    python -m pyscf.lib.profiler timings.jsonl [more.jsonl ...]
+
+Format of a record::
+
+    {"version": 1, "start": ..., "host": ..., "pid": ..., "wall": ...,
+     "cpu": ..., "peak_mb": ..., "meta": {...}, "scf": [{...}, ...],
+     "phases": {name: {"count": ..., "wall": ..., "cpu": ...,
+                       "peak_mb": ..., "peak_inc_mb": ...}}}
+
+peak_mb of a phase is the high-water mark at the end of the phase and
+peak_inc_mb is by how much the phase raised it.  scf holds a summary of
+each SCF run (see :func:`pyscf.scf.hf.kernel`).
+'''
+
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import threading
+import contextlib
+from pyscf import __config__
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+OUTPUT = getattr(__config__, 'lib_profiler_output',
+                 os.environ.get('PYSCF_PROFILE', None))
+
+VERSION = 1
+
+def peak_memory():
+    '''High-water mark of the resident memory of the process (in MB)'''
+    if resource is None:
+        return 0.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # in bytes
+        return maxrss / 1e6
+    return maxrss * 1024 / 1e6
+
+
+class Profiler(object):
+    '''Registry of the timings of named phases
+
+    Args:
+        output : str
+            JSON Lines file to which :meth:`dump` appends the records.
+
+    Kwargs are saved in the "meta" field of the record.
+
+    Attributes:
+        phases : dict
+            {name: {'count', 'wall', 'cpu', 'peak_mb', 'peak_inc_mb'}}
+        meta : dict
+        scf : list
+            Summaries of the SCF runs.
+    '''
+    def __init__(self, output=None, **meta):
+        self.output = output
+        self.meta = meta
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        '''Clear the timings and restart the clocks of the record.'''
+        with self._lock:
+            self.phases = {}
+            self.scf = []
+            self._start = time.time()
+            self._t0 = (time.process_time(), time.perf_counter(), peak_memory())
+
+    def _active(self):
+        active = getattr(self._local, 'active', None)
+        if active is None:
+            active = self._local.active = {}
+        return active
+
+    def depth(self, name):
+        '''Nesting depth of the phase name in the current thread.'''
+        return self._active().get(name, 0)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Context manager which records the time spent in its block.'''
+        active = self._active()
+        depth = active.get(name, 0)
+        active[name] = depth + 1
+        cpu0, wall0, peak0 = time.process_time(), time.perf_counter(), peak_memory()
+        try:
+            yield self
+        finally:
+            active[name] = depth
+            if depth == 0:
+                self.add(name, time.perf_counter() - wall0,
+                         time.process_time() - cpu0, peak0, peak_memory())
+            else:
+                self.add(name, 0, 0)
+
+    def add(self, name, wall, cpu, peak0=None, peak1=None):
+        '''Add one call of the phase name which took wall and cpu seconds.'''
+        with self._lock:
+            stat = self.phases.get(name)
+            if stat is None:
+                stat = self.phases[name] = {'count': 0, 'wall': 0., 'cpu': 0.,
+                                            'peak_mb': 0., 'peak_inc_mb': 0.}
+            stat['count'] += 1
+            stat['wall'] += wall
+            stat['cpu'] += cpu
+            if peak1 is not None:
+                stat['peak_mb'] = max(stat['peak_mb'], peak1)
+                stat['peak_inc_mb'] += max(0, peak1 - peak0)
+
+    def record(self, **meta):
+        '''The record (a JSON serializable dict) of the timings so far.'''
+        cpu0, wall0, peak0 = self._t0
+        with self._lock:
+            meta = dict(self.meta, **meta)
+            return {'version': VERSION,
+                    'start': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                           time.localtime(self._start)),
+                    'host': socket.gethostname(),
+                    'pid': os.getpid(),
+                    'wall': time.perf_counter() - wall0,
+                    'cpu': time.process_time() - cpu0,
+                    'peak_mb': peak_memory(),
+                    'meta': meta,
+                    'scf': list(self.scf),
+                    'phases': dict((k, dict(v)) for k, v in self.phases.items())}
+
+    def dump(self, output=None, **meta):
+        '''Append the record to the JSON Lines file output (self.output by
+        default) and reset the timings.  Returns the record.'''
+        if output is None:
+            output = self.output
+        rec = self.record(**meta)
+        if output is not None:
+            line = json.dumps(rec, default=_to_json) + '\n'
+            with open(output, 'a') as f:
+                # several processes may append to the same file
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(line)
+                f.flush()
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        self.reset()
+        return rec
+
+def _to_json(obj):
+    # numpy scalars and arrays in the meta data
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return str(obj)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return None
+    def __exit__(self, *args):
+        return False
+_NULL_PHASE = _NullPhase()
+
+_profiler = None
+
+def current():
+    '''The active profiler, or None.'''
+    return _profiler
+
+def start(output=None, **meta):
+    '''Activate a new profiler. Returns it.'''
+    global _profiler
+    _profiler = Profiler(output, **meta)
+    return _profiler
+
+def stop(dump=True):
+    '''Deactivate the profiler. Its record is appended to its output file
+    if dump is set. Returns the record.'''
+    global _profiler
+    prof, _profiler = _profiler, None
+    if prof is None:
+        return None
+    if dump:
+        return prof.dump()
+    return prof.record()
+
+@contextlib.contextmanager
+def profile(output=None, **meta):
+    '''Context manager which profiles its block. The record is appended to
+    output when the block exits.'''
+    global _profiler
+    prof_last = _profiler
+    _profiler = prof = Profiler(output, **meta)
+    try:
+        yield prof
+    finally:
+        _profiler = prof_last
+        prof.dump()
+
+def phase(name):
+    '''Context manager which records its block as the phase name in the
+    active profiler.'''
+    if _profiler is None:
+        return _NULL_PHASE
+    return _profiler.phase(name)
+
+def add_scf_summary(**summary):
+    '''Add the summary of an SCF run to the record of the active profiler.'''
+    if _profiler is not None:
+        with _profiler._lock:
+            _profiler.scf.append(summary)
+
+
+def load(filenames):
+    '''Records of the JSON Lines files'''
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    records = []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+def aggregate(records):
+    '''Combine the phases of many records.
+
+    Returns:
+        {name: {'runs', 'count', 'wall', 'cpu', 'wall_per_run',
+                'wall_max', 'wall_frac', 'peak_mb_max'}}
+        wall_frac is the fraction of the total wall time of the records.
+    '''
+    if records and isinstance(records[0], str):
+        records = load(records)
+    total_wall = sum(rec['wall'] for rec in records)
+    out = {}
+    for rec in records:
+        for name, stat in rec['phases'].items():
+            agg = out.get(name)
+            if agg is None:
+                agg = out[name] = {'runs': 0, 'count': 0, 'wall': 0., 'cpu': 0.,
+                                   'wall_max': 0., 'peak_mb_max': 0.}
+            agg['runs'] += 1
+            agg['count'] += stat['count']
+            agg['wall'] += stat['wall']
+            agg['cpu'] += stat['cpu']
+            agg['wall_max'] = max(agg['wall_max'], stat['wall'])
+            agg['peak_mb_max'] = max(agg['peak_mb_max'], stat['peak_mb'])
+    for agg in out.values():
+        agg['wall_per_run'] = agg['wall'] / agg['runs']
+        agg['wall_frac'] = agg['wall'] / total_wall if total_wall > 0 else 0.
+    return out
+
+def report(records, stdout=sys.stdout):
+    '''Print the aggregated phases, sorted by the total wall time.'''
+    if records and isinstance(records[0], str):
+        records = load(records)
+    agg = aggregate(records)
+    stdout.write('%d records, total wall time %.2f s\n' %
+                 (len(records), sum(rec['wall'] for rec in records)))
+    stdout.write('%-36s %8s %10s %10s %10s %7s %10s\n' %
+                 ('phase', 'runs', 'calls', 'wall(s)', 'cpu(s)', 'wall%',
+                  'peak(MB)'))
+    for name, a in sorted(agg.items(), key=lambda x: -x[1]['wall']):
+        stdout.write('%-36s %8d %10d %10.2f %10.2f %7.1f %10.1f\n' %
+                     (name, a['runs'], a['count'], a['wall'], a['cpu'],
+                      a['wall_frac']*100, a['peak_mb_max']))
+    return agg
+
+
+def _dump_at_exit():
+    if _profiler is not None and _profiler.output is not None:
+        stop(dump=True)
+
+if OUTPUT:
+    start(OUTPUT, argv=sys.argv, cwd=os.getcwd())
+    atexit.register(_dump_at_exit)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write('Usage: python -m pyscf.lib.profiler timings.jsonl ...\n')
+        sys.exit(1)
+    report(sys.argv[1:])
@@ -75,6 +75,77 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(abs(a.dot(x) - b).max(), 0, 6)
         self.assertAlmostEqual(abs(x - numpy.linalg.solve(a,b)).max(), 0, 6)
 
+    def test_restore_incore(self):
+        # vectors in memory are backed up to the file in background
+        a, b, adiag, arest, x = make_ab(16)
+        ftmp = tempfile.NamedTemporaryFile()
+        ad = lib.diis.DIIS(filename=ftmp.name)
+        for i in range(8):
+            x = (b - arest.dot(x)) / adiag
+            x = ad.update(x)
+        x_ref = ad.extrapolate()
+        ad.flush()
+
+        ad1 = lib.diis.DIIS().restore(ftmp.name, inplace=False)
+        self.assertAlmostEqual(abs(ad1.extrapolate() - x_ref).max(), 0, 9)
+
+    def test_ring_buffer(self):
+        numpy.random.seed(2)
+        n = 7
+        def hermi(a):
+            return a + a.transpose(0,2,1).conj()
+        for dtype in (float, complex):
+            xs = numpy.random.random((8,2,n,n)).astype(dtype)
+            es = numpy.random.random((8,2,n,n)).astype(dtype)
+            if dtype == complex:
+                xs = xs + numpy.random.random((8,2,n,n)) * .5j
+                es = es + numpy.random.random((8,2,n,n)) * .5j
+            xs = numpy.array([hermi(x) for x in xs])
+            es = es - es.transpose(0,1,3,2).conj()
+            es *= .1**numpy.arange(8)[:,None,None,None]
+            ref = lib.diis.DIIS()
+            ad1 = lib.diis.DIIS()
+            ad1.ring_buffer = True
+            ad2 = lib.diis.DIIS()
+            ad2.ring_buffer = ad2.packed = True
+            ad3 = lib.diis.DIIS()
+            ad3.ring_buffer = ad3.packed = True
+            ad3.vec_dtype = numpy.float32
+            for x, e in zip(xs, es):
+                x_ref = ref.update(x, e)
+                self.assertAlmostEqual(abs(ad1.update(x, e) - x_ref).max(), 0, 12)
+                self.assertAlmostEqual(abs(ad2.update(x, e) - x_ref).max(), 0, 9)
+                self.assertAlmostEqual(abs(ad3.update(x, e) - x_ref).max(), 0, 4)
+            self.assertEqual(ad2._ring['x'].shape, (6, 2*n*(n+1)//2))
+            if dtype == float:
+                self.assertEqual(ad3._ring['e'].dtype, numpy.float32)
+            else:
+                self.assertEqual(ad3._ring['e'].dtype, numpy.complex64)
+
+    def test_ring_buffer_restore(self):
+        numpy.random.seed(3)
+        n = 6
+        xs = numpy.random.random((5,n,n))
+        es = numpy.random.random((5,n,n)) * .1**numpy.arange(5)[:,None,None]
+        xs = xs + xs.transpose(0,2,1)
+        es = es - es.transpose(0,2,1)
+        ftmp = tempfile.NamedTemporaryFile()
+        ad = lib.diis.DIIS(filename=ftmp.name)
+        ad.ring_buffer = ad.packed = True
+        for x, e in zip(xs, es):
+            ad.update(x, e)
+        x_ref = ad.extrapolate()
+        ad.flush()
+
+        ad1 = lib.diis.DIIS()
+        ad1.ring_buffer = ad1.packed = True
+        ad1.restore(ftmp.name, inplace=False)
+        self.assertTrue(ad1.ring_buffer)
+        self.assertEqual(ad1._ring['x'].shape, (6, n*(n+1)//2))
+        self.assertAlmostEqual(abs(ad1.extrapolate() - x_ref).max(), 0, 9)
+        x = xs[0] * .5
+        self.assertAlmostEqual(abs(ad1.update(x, es[0]) - ad.update(x, es[0])).max(), 0, 9)
+
     def test_extrapolate(self):
         a, b, adiag, arest, x = make_ab(16)
         ad = lib.diis.DIIS()
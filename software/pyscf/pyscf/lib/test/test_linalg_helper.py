@@ -19,11 +19,31 @@ import unittest
 import numpy
 import scipy.linalg
 import tempfile
+from functools import reduce
 from pyscf import gto
 from pyscf import scf
 from pyscf import fci
 
 class KnownValues(unittest.TestCase):
+    def test_lobpcg(self):
+        from pyscf.lib import linalg_helper
+        numpy.random.seed(12)
+        n = 200
+        a = numpy.random.random((n,n)) * .01
+        a = a + a.T + numpy.diag(numpy.arange(n) * .1)
+        b = numpy.random.random((n,n)) * .01
+        s = numpy.eye(n) + b.dot(b.T)
+        e_ref = scipy.linalg.eigh(a, s)[0]
+        x0 = numpy.eye(n)[:,:12]
+        conv, e, c = linalg_helper.lobpcg(a, s, x0, nroots=8, tol=1e-8)
+        self.assertTrue(conv)
+        self.assertAlmostEqual(abs(e[:8] - e_ref[:8]).max(), 0, 9)
+        self.assertAlmostEqual(abs(reduce(numpy.dot, (c.T, s, c)) - numpy.eye(12)).max(), 0, 9)
+
+        conv, e, c = linalg_helper.lobpcg(a, None, x0, nroots=8, tol=1e-8)
+        self.assertTrue(conv)
+        self.assertAlmostEqual(abs(e[:8] - numpy.linalg.eigh(a)[0][:8]).max(), 0, 9)
+
     def test_davidson(self):
         mol = gto.Mole()
         mol.verbose = 0
@@ -30,6 +30,38 @@ class KnownValues(unittest.TestCase):
 
         self.assertRaises(lib.ThreadRuntimeError, bg_raise)
 
+    def test_background_writer(self):
+        import threading
+        started = threading.Event()
+        release = threading.Event()
+        out = []
+        def write(key, x):
+            if key == 'a':
+                started.set()
+                release.wait()
+            out.append((key, x.copy()))
+        writer = lib.BackgroundWriter(sync=False)
+        x = numpy.zeros(3)
+        writer.submit('a', write, 'a', x)
+        started.wait()
+        for i in range(3):
+            x[:] = i + 1
+            writer.submit('b', write, 'b', x)
+        release.set()
+        writer.close()
+        self.assertEqual([k for k, v in out], ['a', 'b'])
+        self.assertAlmostEqual(abs(out[0][1]).max(), 0, 12)
+        self.assertAlmostEqual(abs(out[1][1] - 3).max(), 0, 12)
+        self.assertEqual(writer.nwrites, 2)
+        self.assertEqual(writer.ncoalesced, 2)
+
+        def raise1():
+            raise ValueError
+        writer = lib.BackgroundWriter(sync=False)
+        writer.submit('a', raise1)
+        self.assertRaises(ValueError, writer.flush)
+        writer.close()
+
     def test_index_tril_to_pair(self):
         i_j = (numpy.random.random((2,30)) * 100).astype(int)
         i0 = numpy.max(i_j, axis=0)
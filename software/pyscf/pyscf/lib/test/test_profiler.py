@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import time
+import unittest
+import tempfile
+import threading
+from pyscf import lib, gto, scf
+from pyscf.lib import profiler
+
+class KnownValues(unittest.TestCase):
+    def test_phase(self):
+        self.assertTrue(profiler.current() is None)
+        with profiler.phase('a'):
+            pass
+        with profiler.profile() as prof:
+            self.assertTrue(profiler.current() is prof)
+            with profiler.phase('a'):
+                time.sleep(.01)
+                # nested phase of the same name is counted, not timed twice
+                with profiler.phase('a'):
+                    time.sleep(.01)
+                with profiler.phase('b'):
+                    pass
+                self.assertEqual(prof.depth('a'), 1)
+            self.assertEqual(prof.depth('a'), 0)
+
+            def f():
+                with profiler.phase('b'):
+                    pass
+            threads = [threading.Thread(target=f) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            rec = prof.record()
+        self.assertTrue(profiler.current() is None)
+        self.assertEqual(rec['phases']['a']['count'], 2)
+        self.assertEqual(rec['phases']['b']['count'], 5)
+        self.assertTrue(.02 <= rec['phases']['a']['wall'] < rec['wall'])
+
+    def test_dump_aggregate(self):
+        mol = gto.M(atom='H 0 0 0; H 0 0 .74', basis='631g', verbose=0)
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as tmpf:
+            for i in range(2):
+                with profiler.profile(tmpf.name, name='h2_%d' % i):
+                    e = scf.RHF(mol).kernel()
+            recs = profiler.load(tmpf.name)
+            self.assertEqual(len(recs), 2)
+            self.assertEqual(recs[1]['meta']['name'], 'h2_1')
+            summary = recs[0]['scf']
+            self.assertEqual(len(summary), 1)
+            self.assertTrue(summary[0]['converged'])
+            self.assertAlmostEqual(summary[0]['e_tot'], e, 12)
+            self.assertEqual(summary[0]['nao'], 4)
+            for name in ('scf.kernel', 'scf.get_veff', 'scf.eig', 'scf.diis'):
+                self.assertTrue(name in recs[0]['phases'])
+
+            agg = profiler.aggregate([tmpf.name])
+            self.assertEqual(agg['scf.kernel']['runs'], 2)
+            self.assertEqual(agg['scf.kernel']['count'], 2)
+            self.assertTrue(0 < agg['scf.kernel']['wall_frac'] <= 1)
+            out = io.StringIO()
+            profiler.report(recs, out)
+            self.assertTrue('scf.kernel' in out.getvalue())
+
+if __name__ == "__main__":
+    print("Full Tests for profiler")
+    unittest.main()
@@ -4,7 +4,9 @@
 #
 
 import socket
+import selectors
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
 def actualunixsocketname(name):
@@ -319,7 +321,7 @@ class SocketClients:
         if paces is None:
             paces = [1] * len(hosts)
         if logs is None:
-            paces = [None] * len(hosts)
+            logs = [None] * len(hosts)
 
         self.hosts = hosts
         self.ports = ports
@@ -336,7 +338,7 @@ class SocketClients:
         self.istep = 0
 
     def close(self):
-        for i in len(self.hosts):
+        for i in range(len(self.hosts)):
             if not self.closed[i]:
                 self.logs[i](f'Close SocketClient {i}')
                 self.closed[i] = True
@@ -353,7 +355,15 @@ class SocketClients:
 
         return energy, forces, virial
 
-    def run(self, atoms_list, use_stress=None):
+    def run(self, atoms_list, use_stress=None, concurrent=False,
+            max_workers=None):
+        """Serve all clients until one of the servers sends EXIT.
+
+        By default the clients are served one after another.  With
+        concurrent=True, see run_concurrent."""
+        if concurrent:
+            return self.run_concurrent(atoms_list, use_stress, max_workers)
+
         assert len(atoms_list) == len(self.hosts)
         if use_stress is None:
             use_stress = False
@@ -422,6 +432,125 @@ class SocketClients:
                 else:
                     raise KeyError('Bad message', msgs[i])
 
+    def run_concurrent(self, atoms_list, use_stress=None, max_workers=None):
+        """Event-driven version of run.
+
+        The sockets of all clients needed at the current step are watched
+        with a selector.  Positions are received from whichever server
+        sends them first and the force evaluations are dispatched to a
+        pool of max_workers threads (one per client by default), so
+        independent replicas or force fields are evaluated at the same
+        time.  A client is not read from while its evaluation is running;
+        once it finishes, the forces are sent as soon as its server asks
+        for them, regardless of the other clients.
+
+        As in run, client i only takes part in the steps which are
+        multiples of paces[i], and the next step starts when every client
+        of the current step has sent its forces and answered the
+        following STATUS.  The function returns when a server sends EXIT
+        or closes the connection.
+        """
+        nhosts = len(self.hosts)
+        assert len(atoms_list) == nhosts
+        if use_stress is None:
+            use_stress = False
+        if max_workers is None:
+            max_workers = nhosts
+
+        sel = selectors.DefaultSelector()
+        # a finished evaluation wakes the selector through this pair
+        wakeup_r, wakeup_w = socket.socketpair()
+        wakeup_r.setblocking(False)
+        sel.register(wakeup_r, selectors.EVENT_READ, None)
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+
+        # same meaning of status as in run
+        status = [2] * nhosts
+        futures = [None] * nhosts
+        results = [None] * nhosts
+
+        def wakeup(future):
+            try:
+                wakeup_w.send(b'\0')
+            except OSError:
+                pass
+
+        def start_step():
+            while True:
+                active = [i for i in range(nhosts)
+                          if self.istep % self.paces[i] == 0]
+                if active:
+                    break
+                self.istep += 1
+            for i in active:
+                status[i] = 0
+                sel.register(self.protocols[i].socket,
+                             selectors.EVENT_READ, i)
+
+        try:
+            start_step()
+            while True:
+                for key, _ in sel.select():
+                    i = key.data
+                    if i is None:
+                        # collect the finished evaluations
+                        try:
+                            while wakeup_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        for j, future in enumerate(futures):
+                            if future is not None and future.done():
+                                futures[j] = None
+                                results[j] = future.result()
+                                self.states[j] = 'HAVEDATA'
+                                sel.register(self.protocols[j].socket,
+                                             selectors.EVENT_READ, j)
+                        continue
+
+                    protocol = self.protocols[i]
+                    try:
+                        msg = protocol.recvmsg()
+                    except SocketClosed:
+                        msg = 'EXIT'
+
+                    if msg == 'EXIT':
+                        return
+                    elif msg == 'STATUS':
+                        protocol.sendmsg(self.states[i])
+                        if status[i] > 0:
+                            status[i] += 1
+                            # this client has done its job in this step
+                            sel.unregister(protocol.socket)
+                    elif msg == 'POSDATA':
+                        assert self.states[i] == 'READY'
+                        cell, icell, positions = protocol.recvposdata()
+                        atoms_list[i].set_positions_box(positions, cell)
+                        # do not read from this client until it is done
+                        sel.unregister(protocol.socket)
+                        futures[i] = pool.submit(self.calculate, atoms_list[i],
+                                                 use_stress)
+                        futures[i].add_done_callback(wakeup)
+                    elif msg == 'GETFORCE':
+                        assert self.states[i] == 'HAVEDATA', self.states[i]
+                        protocol.sendforce(*results[i])
+                        results[i] = None
+                        self.states[i] = 'READY'
+                        status[i] = 1
+                    else:
+                        raise KeyError('Bad message', msg)
+
+                if all(s == 2 for s in status):
+                    # every client finishes its job, move on to next step
+                    self.istep += 1
+                    start_step()
+        finally:
+            pool.shutdown(wait=True)
+            sel.close()
+            wakeup_r.close()
+            wakeup_w.close()
+            self.close()
+
 
 
 class Atoms:
@@ -452,7 +581,7 @@ if __name__ == "__main__":
     from pyscf.pbc import gto as pbcgto
     from pyscf.pbc import dft as pbcdft
     from pyscf.pbc.dft import multigrid
-    from pyscf.pbc.grad import rks as rks_grad
+    from pyscf.md.rks_engine import RKSEngine
 
     #ABC = numpy.vectorize(float)("9.8752224 9.8752224 9.8752224".split())
     #fp = open("../../spcfw_equil/equil.xyz")
@@ -502,33 +631,29 @@ if __name__ == "__main__":
         cell.build()
         return cell
 
+    engine = []
+
     def efv_scan(coords, box, init_dict=None):
         '''
         return energy, force, virial given atom coords[N][3] and box[3][3] in Bohr
         and return init_dict for next step if possible
         kwargs can accept some info from previous MD step \
         to accelerate calculation of this step, such as initial DM
-        '''
-
-        cell2 = make_mol2(coords, box)
-
-        df = multigrid.MultiGridFFTDF2(cell2)
-        mf = pbcdft.RKS(cell2)
-        mf.xc = 'pbe'
-        mf.init_guess='atom' # atom guess is fast
-        mf.with_df = df
-        d3 = None
 
-        if init_dict is not None:
-            e = mf.kernel(dm0=init_dict['dm0'])
-        else:
-            e = mf.kernel()
-        f = -rks_grad.Gradients(mf).kernel()
-        v = None
+        The SCF object is built at the first step and reused by RKSEngine
+        in the following steps.
+        '''
+        if not engine:
+            cell2 = make_mol2(coords, box)
 
-        init_dict = {'dm0': mf.make_rdm1()}
+            df = multigrid.MultiGridFFTDF2(cell2)
+            mf = pbcdft.RKS(cell2)
+            mf.xc = 'pbe'
+            mf.init_guess='atom' # atom guess is fast
+            mf.with_df = df
+            engine.append(RKSEngine(mf))
 
-        return e, f, v, init_dict
+        return engine[0](coords, box, init_dict)
 
     atoms = Atoms(efv_scan)
     client = SocketClient(unixsocket='driver', log=stdout)
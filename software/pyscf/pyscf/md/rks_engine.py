@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Persistent energy/force engine for molecular dynamics
+
+One gamma-point RKS object with MultiGridFFTDF2 is kept alive for the
+whole trajectory.  At every step the atomic coordinates are updated in
+place, only the data depending on the atomic positions are dropped, and
+the SCF starts from the density of the previous step(s).  The G-space
+caches, autotuned grid levels, SCCS state and the basis/pseudopotential
+setup of the cell are reused.  When the lattice vectors change, the cell
+is rebuilt and the SCF object is reset instead.
+
+The engine can be used as the efv_scan function of
+pyscf.md.ipi_driver2.Atoms::
+
+    engine = RKSEngine(mf)
+    atoms = ipi_driver2.Atoms(engine)
+    ipi_driver2.SocketClient(unixsocket='driver').run(atoms)
+'''
+
+import numpy as np
+from pyscf import lib
+from pyscf.lib import logger
+from pyscf.data import nist
+from pyscf.gto.mole import PTR_COORD
+from pyscf import __config__
+
+# lattice vectors (in Bohr) differing less than this are considered unchanged
+BOX_TOL = getattr(__config__, 'md_rks_engine_box_tol', 1e-10)
+# initial density of each step, 'linear' (2*dm[n-1] - dm[n-2]) or 'none'
+# (dm[n-1])
+DM_EXTRAPOLATION = getattr(__config__, 'md_rks_engine_dm_extrapolation', 'linear')
+
+
+class RKSEngine(lib.StreamObject):
+    '''Energy and forces of a sequence of geometries with one SCF object
+
+    Attributes:
+        mf : RKS
+            The SCF object.  mf.cell is modified in place.
+        dm_extrapolation : str
+            How the initial density of a step is obtained from the
+            previous steps.  'linear' extrapolates the last two density
+            matrices, which typically saves a few SCF cycles for smooth
+            trajectories.  'none' starts from the last density matrix.
+        istep : int
+            Number of steps computed so far.
+        timings : list of dict
+            Wall time (in seconds) of the geometry update ('geom'), the SCF
+            ('scf'), the nuclear gradients ('grad') and the whole step
+            ('total'), and the number of SCF cycles ('scf_cycles') of each
+            step.
+        dm : ndarray
+            Density matrix of the last step.
+    '''
+    def __init__(self, mf):
+        self.mf = mf
+        self.cell = mf.cell
+        self.verbose = mf.verbose
+        self.stdout = mf.stdout
+        self.box_tol = BOX_TOL
+        self.dm_extrapolation = DM_EXTRAPOLATION
+        self.istep = 0
+        self.timings = []
+        self.dm = None
+        self._dm_last = None
+        self.e_tot = None
+        self.forces = None
+        self._grad = None
+
+    def set_geom_(self, coords, box=None):
+        '''Update the atomic coordinates (and the lattice vectors) of
+        mf.cell in place.  coords and box are in Bohr.
+
+        If only the atoms move, only the data depending on the atomic
+        positions are dropped.  If the lattice vectors change, the cell is
+        rebuilt (mesh, rcut, Ewald parameters) and mf is reset, which drops
+        all lattice-dependent state of mf, mf.grids and mf.with_df.
+        '''
+        cell = self.cell
+        mydf = self.mf.with_df
+        coords = np.asarray(coords, dtype=float).reshape(cell.natm, 3)
+        if isinstance(cell.unit, str) and cell.unit.upper().startswith(('B', 'AU')):
+            unit = 1.
+        else:
+            unit = nist.BOHR
+
+        symbols = [a[0] for a in cell._atom]
+        if box is not None:
+            box = np.asarray(box, dtype=float)
+            if abs(box - cell.lattice_vectors()).max() > self.box_tol:
+                logger.debug(self, 'Lattice vectors changed. Rebuild the cell')
+                return self._set_box_(coords, box, unit)
+
+        cell.atom = list(zip(symbols, (coords * unit).tolist()))
+        cell._atom = list(zip(symbols, coords.tolist()))
+        ptr = cell._atm[:,PTR_COORD]
+        cell._env[ptr+0] = coords[:,0]
+        cell._env[ptr+1] = coords[:,1]
+        cell._env[ptr+2] = coords[:,2]
+        cell.enuc = None
+
+        if hasattr(mydf, 'reset_geom'):
+            mydf.reset_geom()
+        else:
+            mydf.reset(cell)
+        return self
+
+    def _set_box_(self, coords, box, unit):
+        mf = self.mf
+        cell = self.cell
+        mesh0 = np.asarray(cell.mesh)
+        symbols = [a[0] for a in cell._atom]
+        cell.a = box * unit
+        cell.atom = list(zip(symbols, (coords * unit).tolist()))
+        cell.build(False, False)
+        cell.__dict__.pop('_memo', None)
+        # meshes which followed the cell follow its new mesh
+        for obj in (mf.grids, mf.with_df, getattr(mf.with_df, 'grids', None)):
+            mesh = getattr(obj, 'mesh', None)
+            if mesh is not None and np.array_equal(mesh, mesh0):
+                obj.mesh = cell.mesh
+        mf.reset(cell)
+        mf._eri = None
+        return self
+
+    def kernel(self, coords, box=None):
+        '''Energy and forces (in atomic units) at the given geometry.'''
+        mf = self.mf
+        log = logger.new_logger(self)
+        t0 = t1 = (logger.process_clock(), logger.perf_counter())
+        timing = {}
+
+        self.set_geom_(coords, box)
+        t1, timing['geom'] = self._lap(log, 'geometry update', t1)
+
+        cycles = [0]
+        callback = mf.callback
+        def count_cycles(envs):
+            cycles[0] = envs['cycle'] + 1
+            if callable(callback):
+                callback(envs)
+        mf.callback = count_cycles
+        try:
+            e_tot = mf.kernel(dm0=self.get_init_guess())
+        finally:
+            mf.callback = callback
+        if not mf.converged:
+            log.warn('SCF not converged at step %d', self.istep)
+        self.dm, self._dm_last = mf.make_rdm1(), self.dm
+        timing['scf_cycles'] = cycles[0]
+        t1, timing['scf'] = self._lap(log, 'SCF', t1)
+
+        if self._grad is None:
+            from pyscf.pbc.grad import rks as rks_grad
+            self._grad = rks_grad.Gradients(mf)
+        self._grad.verbose = mf.verbose
+        forces = -self._grad.kernel()
+        t1, timing['grad'] = self._lap(log, 'nuclear gradients', t1)
+
+        timing['total'] = t1[1] - t0[1]
+        self.timings.append(timing)
+        log.info('MD step %d  E = %.15g  geom %.3f s  SCF %.3f s (%d cycles)  '
+                 'grad %.3f s  total %.3f s', self.istep, e_tot, timing['geom'],
+                 timing['scf'], timing['scf_cycles'], timing['grad'],
+                 timing['total'])
+        self.istep += 1
+        self.e_tot = e_tot
+        self.forces = forces
+        return e_tot, forces
+
+    def get_init_guess(self):
+        '''Initial density matrix of the next step.'''
+        dm, dm_last = self.dm, self._dm_last
+        if self.dm_extrapolation == 'linear' and dm is not None and dm_last is not None:
+            return 2 * dm - dm_last
+        return dm
+
+    def _lap(self, log, label, t0):
+        t1 = log.timer(label, *t0)
+        return t1, t1[1] - t0[1]
+
+    def __call__(self, coords, box, init_dict=None):
+        '''The efv_scan interface of pyscf.md.ipi_driver2.Atoms.
+
+        Returns:
+            energy, forces, virial (None) and init_dict for the next step.
+        '''
+        if self.dm is None and init_dict is not None:
+            self.dm = init_dict.get('dm0')
+        e_tot, forces = self.kernel(coords, box)
+        return e_tot, forces, None, {'dm0': self.dm}
@@ -0,0 +1,138 @@
+import os
+import socket
+import threading
+import unittest
+import numpy
+from pyscf.md import ipi_driver2
+
+
+class FakeServer:
+    '''Minimal i-PI server on a Unix socket.  It runs nsteps MD steps,
+    each sending the positions of the step and collecting the forces,
+    and then sends EXIT.'''
+    def __init__(self, name, positions, nsteps):
+        self.name = name
+        self.filename = ipi_driver2.actualunixsocketname(name)
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.bind(self.filename)
+        self.sock.listen(1)
+        self.positions = positions
+        self.nsteps = nsteps
+        self.box = numpy.eye(3) * 10.
+        self.energies = []
+        self.forces = []
+        self.error = None
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def join(self, timeout=30):
+        self.thread.join(timeout)
+        os.unlink(self.filename)
+        if self.error is not None:
+            raise self.error
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        conn.settimeout(30)
+        proto = ipi_driver2.IPIProtocol(conn)
+        try:
+            for step in range(self.nsteps):
+                proto.sendmsg('STATUS')
+                assert proto.recvmsg() == 'READY'
+                proto.sendmsg('POSDATA')
+                proto.send(self.box.T, numpy.float64)
+                proto.send(numpy.linalg.inv(self.box).T, numpy.float64)
+                proto.send(numpy.array([len(self.positions[step])]), numpy.int32)
+                proto.send(self.positions[step], numpy.float64)
+                proto.sendmsg('STATUS')
+                assert proto.recvmsg() == 'HAVEDATA'
+                proto.sendmsg('GETFORCE')
+                assert proto.recvmsg() == 'FORCEREADY'
+                self.energies.append(proto.recv(1, numpy.float64)[0])
+                natm = int(proto.recv(1, numpy.int32)[0])
+                self.forces.append(proto.recv((natm, 3), numpy.float64))
+                proto.recv((3, 3), numpy.float64)
+                nbytes = int(proto.recv(1, numpy.int32)[0])
+                proto.recv(nbytes, numpy.byte)
+            proto.sendmsg('STATUS')
+            proto.recvmsg()
+            proto.sendmsg('EXIT')
+        except (ipi_driver2.SocketClosed, ConnectionError):
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+            self.sock.close()
+
+def harmonic(coords, box, init_dict):
+    return .5 * (coords**2).sum(), -coords, None, init_dict
+
+def make_servers(nservers, nsteps):
+    servers = []
+    for i in range(nservers):
+        pos = [numpy.sin(numpy.arange(6.).reshape(2,3) + i + .1*step)
+               for step in range(nsteps[i])]
+        name = 'test_%d_%d' % (os.getpid(), i)
+        servers.append(FakeServer(name, pos, nsteps[i]).start())
+    return servers
+
+class KnownValues(unittest.TestCase):
+    def test_run_concurrent(self):
+        nclients = 3
+        # the evaluations only pass the barrier if they run simultaneously
+        barrier = threading.Barrier(nclients, timeout=10)
+        def efv_scan(coords, box, init_dict):
+            barrier.wait()
+            return harmonic(coords, box, init_dict)
+
+        servers = make_servers(nclients, [3] * nclients)
+        clients = ipi_driver2.SocketClients(
+            unixsockets=[s.name for s in servers], timeouts=[30] * nclients)
+        clients.run([ipi_driver2.Atoms(efv_scan) for s in servers],
+                    concurrent=True)
+        for s in servers:
+            s.join()
+            self.assertEqual(len(s.energies), 3)
+            for pos, e, f in zip(s.positions, s.energies, s.forces):
+                self.assertAlmostEqual(e, .5 * (pos**2).sum(), 12)
+                self.assertAlmostEqual(abs(f + pos).max(), 0, 12)
+        self.assertTrue(all(clients.closed))
+
+    def test_run_concurrent_paces(self):
+        # client 1 is needed at steps 0, 2, 4; the run ends when server 0
+        # sends EXIT after 5 steps
+        servers = make_servers(2, [5, 3])
+        clients = ipi_driver2.SocketClients(
+            unixsockets=[s.name for s in servers], timeouts=[30, 30],
+            paces=[1, 2])
+        clients.run([ipi_driver2.Atoms(harmonic) for s in servers],
+                    concurrent=True, max_workers=2)
+        for s in servers:
+            s.join()
+        self.assertEqual(len(servers[0].energies), 5)
+        self.assertEqual(len(servers[1].energies), 3)
+        self.assertEqual(clients.istep, 5)
+        for pos, f in zip(servers[1].positions, servers[1].forces):
+            self.assertAlmostEqual(abs(f + pos).max(), 0, 12)
+
+    def test_run_sequential(self):
+        servers = make_servers(2, [2, 2])
+        clients = ipi_driver2.SocketClients(
+            unixsockets=[s.name for s in servers], timeouts=[30, 30])
+        clients.run([ipi_driver2.Atoms(harmonic) for s in servers])
+        clients.close()
+        for s in servers:
+            s.join()
+            self.assertEqual(len(s.energies), 2)
+            for pos, f in zip(s.positions, s.forces):
+                self.assertAlmostEqual(abs(f + pos).max(), 0, 12)
+
+if __name__ == '__main__':
+    print("Full Tests for ipi_driver2")
+    unittest.main()
@@ -1,15 +1,20 @@
+from pyscf.pbc.lib.kpts_helper import gamma_point
 from .multigrid import MultiGridFFTDF
 from .multigrid import (
     multigrid_fftdf as multigrid_fftdf,
     nr_rks as nr_rks_v1,
     nr_rks_fxc as nr_rks_fxc,
     nr_rks_fxc_st as nr_rks_fxc_st,
-    nr_uks as nr_uks,
-    nr_uks_fxc as nr_uks_fxc
+    nr_uks as nr_uks_v1,
+    nr_uks_fxc as nr_uks_fxc,
+    _gen_rhf_response as _gen_rhf_response,
+    _gen_uhf_response as _gen_uhf_response_v1
 )
 
 from .multigrid_pair import MultiGridFFTDF2
 from .multigrid_pair import nr_rks as nr_rks_v2
+from .multigrid_pair import nr_uks as nr_uks_v2
+from .multigrid_pair import _gen_uhf_response as _gen_uhf_response_v2
 
 def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
            kpts_band=None, with_j=False, return_j=False, verbose=None):
@@ -23,3 +28,25 @@ def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
                          return_j=return_j, verbose=verbose)
     else:
         raise TypeError("Wrong density fitting type for multigrid DFT.")
+
+def nr_uks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
+           kpts_band=None, with_j=False, return_j=False, verbose=None):
+    # MultiGridFFTDF2 supports the gamma point only. With k-points (KUKS)
+    # the MultiGridFFTDF code is used.
+    if isinstance(mydf, MultiGridFFTDF2) and (kpts is None or gamma_point(kpts)):
+        return nr_uks_v2(mydf, xc_code, dm_kpts, hermi=hermi, kpts=kpts,
+                         kpts_band=kpts_band, with_j=with_j,
+                         return_j=return_j, verbose=verbose)
+    elif isinstance(mydf, MultiGridFFTDF):
+        return nr_uks_v1(mydf, xc_code, dm_kpts, hermi=hermi, kpts=kpts,
+                         kpts_band=kpts_band, with_j=with_j,
+                         return_j=return_j, verbose=verbose)
+    else:
+        raise TypeError("Wrong density fitting type for multigrid DFT.")
+
+def _gen_uhf_response(mf, dm0, with_j=True, hermi=0):
+    kpts = getattr(mf, 'kpts', None)
+    if isinstance(mf.with_df, MultiGridFFTDF2) and (kpts is None or gamma_point(kpts)):
+        return _gen_uhf_response_v2(mf, dm0, with_j, hermi)
+    else:
+        return _gen_uhf_response_v1(mf, dm0, with_j, hermi)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Autotuning of the grid levels of MultiGridFFTDF2
+
+On the first Fock build, a few candidate (ngrids, ke_ratio, rel_cutoff)
+configurations are timed.  The number of electrons and the Coulomb + XC
+energy of each candidate are compared against a single-level reference,
+and the fastest candidate within tolerance is used for the rest of the
+calculation.  The choice is remembered per (basis, ke_cutoff, box size
+class), in memory and optionally in a JSON file, so that later
+calculations on similar cells skip the benchmark.
+'''
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import numpy as np
+from pyscf import __config__
+from pyscf.lib import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+AUTOTUNE_CANDIDATES = getattr(__config__, 'pbc_dft_multigrid_autotune_candidates',
+                              ((4, 3.0, 20.0), (3, 3.0, 20.0), (5, 2.5, 20.0),
+                               (4, 2.0, 20.0), (3, 4.0, 20.0), (4, 3.0, 15.0)))
+# tolerance of the Coulomb + XC energy (in Hartree) against the reference
+AUTOTUNE_ETOL = getattr(__config__, 'pbc_dft_multigrid_autotune_etol', 1e-6)
+# tolerance of the number of electrons against the reference
+AUTOTUNE_NELEC_TOL = getattr(__config__, 'pbc_dft_multigrid_autotune_nelec_tol', 1e-5)
+# width (in Bohr) of the bins of the lattice vector lengths in the cache key
+AUTOTUNE_BOX_BIN = getattr(__config__, 'pbc_dft_multigrid_autotune_box_bin', 2.0)
+# each candidate is timed this many times and the fastest run is kept
+AUTOTUNE_REPEAT = getattr(__config__, 'pbc_dft_multigrid_autotune_repeat', 2)
+
+# choices made in this process, keyed by autotune_key
+_choices = {}
+
+def _basis_signature(cell):
+    basis = cell.basis
+    if isinstance(basis, str):
+        return basis.lower()
+    elif isinstance(basis, dict) and all(isinstance(b, str) for b in basis.values()):
+        return ','.join('%s:%s' % (k, basis[k].lower()) for k in sorted(basis))
+    # explicitly given basis functions
+    s = repr(sorted((k, v) for k, v in cell._basis.items()))
+    return hashlib.md5(s.encode()).hexdigest()[:16]
+
+def autotune_key(cell, ke_cutoff=None, box_bin=AUTOTUNE_BOX_BIN):
+    '''
+    Key under which the autotuned configuration is stored. The lengths
+    of the lattice vectors are rounded up to multiples of box_bin.
+    '''
+    if ke_cutoff is None:
+        ke_cutoff = cell.ke_cutoff
+    lengths = np.sort(np.linalg.norm(cell.lattice_vectors(), axis=1))
+    box = np.ceil(lengths / box_bin - 1e-8) * box_bin
+    return '%s|%.6g|%s' % (_basis_signature(cell), ke_cutoff,
+                           'x'.join('%g' % x for x in box))
+
+def load(filename):
+    '''
+    Read the autotuned configurations stored in filename.
+    '''
+    if filename is None or not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def dump(filename, choices):
+    '''
+    Merge choices into filename. The file is replaced atomically so that
+    concurrent runs never see a partially written file, and the merge is
+    serialized by a lock on filename.lock so that concurrent runs do not
+    drop each other's choices.
+    '''
+    with open(os.path.abspath(filename) + '.lock', 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            data = load(filename)
+            data.update(choices)
+            dirname = os.path.dirname(os.path.abspath(filename))
+            fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.autotune',
+                                           suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, indent=1, sort_keys=True)
+                os.replace(tmpname, filename)
+            except BaseException:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+                raise
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _apply(mydf, config):
+    mydf.ngrids = int(config[0])
+    mydf.ke_ratio = float(config[1])
+    mydf.rel_cutoff = float(config[2])
+
+def _benchmark(mydf, fn, config, xc_code, dm, hermi, kpts, repeat):
+    _apply(mydf, config)
+    wall = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        nelec, excsum, veff = fn(mydf, xc_code, dm, hermi, kpts, with_j=True,
+                                 verbose=logger.QUIET)
+        t1 = time.perf_counter() - t0
+        if wall is None or t1 < wall:
+            wall = t1
+    e = np.sum(veff.ecoul) + np.sum(excsum)
+    return wall, np.sum(nelec), e
+
+def autotune(mydf, xc_code, dm, hermi=1, kpts=None, fn=None, verbose=None):
+    '''
+    Set mydf.ngrids, mydf.ke_ratio and mydf.rel_cutoff to the fastest
+    configuration in mydf.autotune_candidates which reproduces the
+    single-level reference within mydf.autotune_etol and
+    mydf.autotune_nelec_tol.
+
+    Args:
+        fn : function
+            nr_rks or nr_uks of multigrid_pair, used for the benchmark.
+
+    Returns:
+        The chosen configuration as a dict.
+    '''
+    from pyscf.pbc.dft.multigrid import multigrid_pair
+    if fn is None:
+        fn = multigrid_pair.nr_rks
+    log = logger.new_logger(mydf, verbose)
+    key = autotune_key(mydf.cell)
+    mydf._autotune_key = key
+
+    filename = mydf.autotune_file
+    choice = _choices.get(key)
+    if choice is None:
+        choice = load(filename).get(key)
+    if choice is not None:
+        _choices[key] = choice
+        _apply(mydf, (choice['ngrids'], choice['ke_ratio'], choice['rel_cutoff']))
+        log.info('Multigrid autotune: reuse ngrids = %d, ke_ratio = %g, '
+                 'rel_cutoff = %g for %s', mydf.ngrids, mydf.ke_ratio,
+                 mydf.rel_cutoff, key)
+        return choice
+
+    cput0 = (logger.process_clock(), logger.perf_counter())
+    config0 = (mydf.ngrids, mydf.ke_ratio, mydf.rel_cutoff)
+    sccs, mydf.sccs = mydf.sccs, None
+    try:
+        ref = _benchmark(mydf, fn, (1, config0[1], config0[2]),
+                         xc_code, dm, hermi, kpts, 1)
+        log.debug('Multigrid autotune reference: nelec = %.10f  E = %.12g',
+                  ref[1], ref[2])
+        results = []
+        for config in mydf.autotune_candidates:
+            wall, nelec, e = _benchmark(mydf, fn, config, xc_code, dm,
+                                        hermi, kpts, AUTOTUNE_REPEAT)
+            nelec_err = abs(nelec - ref[1])
+            e_err = abs(e - ref[2])
+            ok = nelec_err < mydf.autotune_nelec_tol and e_err < mydf.autotune_etol
+            log.debug('Multigrid autotune: ngrids = %d, ke_ratio = %g, '
+                      'rel_cutoff = %g  %.4f s  dE = %.3g  dN = %.3g  %s',
+                      config[0], config[1], config[2], wall, e_err,
+                      nelec_err, 'ok' if ok else 'rejected')
+            results.append((not ok, wall if ok else e_err, config, wall, e_err))
+    finally:
+        mydf.sccs = sccs
+
+    if results:
+        # the fastest accepted candidate, or the most accurate one if
+        # none of them is within tolerance
+        results.sort(key=lambda r: r[:2])
+        rejected, _, config, wall, e_err = results[0]
+        if rejected:
+            log.warn('Multigrid autotune: no candidate within tolerance. '
+                     'Use the most accurate one (dE = %.3g)', e_err)
+    else:
+        config, wall, e_err = config0, ref[0], 0.
+    _apply(mydf, config)
+    choice = {'ngrids': mydf.ngrids, 'ke_ratio': mydf.ke_ratio,
+              'rel_cutoff': mydf.rel_cutoff, 'wall_time': wall,
+              'energy_error': e_err}
+    _choices[key] = choice
+    if filename is not None:
+        dump(filename, {key: choice})
+    log.info('Multigrid autotune: ngrids = %d, ke_ratio = %g, rel_cutoff = %g '
+             'for %s', mydf.ngrids, mydf.ke_ratio, mydf.rel_cutoff, key)
+    log.timer('multigrid autotune', *cput0)
+    return choice
@@ -1602,23 +1602,28 @@ def _primitive_gto_cutoff(cell, precision=None):
         precision = cell.precision * EXTRA_PREC
     log_prec = min(numpy.log(precision), 0)
 
-    rcut = []
-    ke_cutoff = []
-    for ib in range(cell.nbas):
-        l = cell.bas_angular(ib)
-        es = cell.bas_exp(ib)
-        cs = abs(cell.bas_ctr_coeff(ib)).max(axis=1)
-        r = 5.
-        r = (((l+2)*numpy.log(r)+numpy.log(4*numpy.pi*cs) - log_prec) / es)**.5
-        r = (((l+2)*numpy.log(r)+numpy.log(4*numpy.pi*cs) - log_prec) / es)**.5
+    def compute(shls):
+        out = []
+        for ib in shls:
+            l = cell.bas_angular(ib)
+            es = cell.bas_exp(ib)
+            cs = abs(cell.bas_ctr_coeff(ib)).max(axis=1)
+            r = 5.
+            r = (((l+2)*numpy.log(r)+numpy.log(4*numpy.pi*cs) - log_prec) / es)**.5
+            r = (((l+2)*numpy.log(r)+numpy.log(4*numpy.pi*cs) - log_prec) / es)**.5
 
 # Errors in total number of electrons were observed with the default
 # precision. The energy cutoff (or the integration mesh) is not enough to
 # produce the desired accuracy. Scale precision by 0.1 to decrease the error.
-        ke_guess = gto.cell._estimate_ke_cutoff(es, l, cs, precision*0.1)
-
-        rcut.append(r)
-        ke_cutoff.append(ke_guess)
+            ke_guess = gto.cell._estimate_ke_cutoff(es, l, cs, precision*0.1)
+            out.append((r, ke_guess))
+        return out
+
+    # shared by the cells with the same basis through the cache of cell.py
+    vals, inv = gto.cell._cached_by_shells(cell, 'primitive_gto_cutoff',
+                                           precision, compute)
+    rcut = [vals[i][0].copy() for i in inv]
+    ke_cutoff = [vals[i][1].copy() for i in inv]
     return rcut, ke_cutoff
 
 
@@ -18,6 +18,8 @@
 
 import ctypes
 import numpy as np
+import scipy.fft
+from concurrent.futures import ThreadPoolExecutor
 from pyscf import __config__
 from pyscf import lib
 from pyscf.lib import logger
@@ -26,9 +28,12 @@ from pyscf.pbc import tools
 from pyscf.pbc.lib.kpts_helper import gamma_point
 from pyscf.pbc.df import fft
 from pyscf.pbc.df.df_jk import _format_dms, _format_kpts_band, _format_jks
+from pyscf.dft import numint
 from pyscf.pbc.dft.multigrid.pp import make_rho_core, get_pp_nuc_grad, vpploc_part1_nuc_grad
 from pyscf.pbc.dft.multigrid.utils import _take_4d, _take_5d, _takebak_4d, _takebak_5d
 from pyscf.pbc.dft.multigrid.multigrid import MultiGridFFTDF
+from pyscf.pbc.dft.multigrid.autotune import (AUTOTUNE_CANDIDATES, AUTOTUNE_ETOL,
+                                               AUTOTUNE_NELEC_TOL)
 
 NGRIDS = getattr(__config__, 'pbc_dft_multigrid_ngrids', 4)
 KE_RATIO = getattr(__config__, 'pbc_dft_multigrid_ke_ratio', 3.0)
@@ -40,6 +45,17 @@ RHOG_HIGH_ORDER = getattr(__config__, 'pbc_dft_multigrid_rhog_high_order', False
 PTR_EXPDROP = 16
 EXPDROP = getattr(__config__, 'pbc_dft_multigrid_expdrop', 1e-12)
 IMAG_TOL = 1e-9
+# XC functional is not evaluated on grids where density is below this value
+XC_SCREEN_THRESHOLD = getattr(__config__, 'pbc_dft_multigrid_xc_screen_threshold', 0.)
+# number of grids per block when XC functional is evaluated block by block
+XC_BLKSIZE = getattr(__config__, 'pbc_dft_multigrid_xc_blksize', 16384)
+# collocate and transform the density one grid level at a time
+RHOG_STREAM = getattr(__config__, 'pbc_dft_multigrid_rhog_stream', False)
+# max memory (in MB) for caching G-space quantities; no caching if <= 0
+GSPACE_CACHE_MAX_MEMORY = getattr(__config__, 'pbc_dft_multigrid_gspace_cache_max_memory', 2000)
+# choose ngrids, ke_ratio and rel_cutoff on the first Fock build, see autotune.py
+AUTOTUNE = getattr(__config__, 'pbc_dft_multigrid_autotune', False)
+AUTOTUNE_FILE = getattr(__config__, 'pbc_dft_multigrid_autotune_file', None)
 
 libdft = lib.load_library('libdft')
 
@@ -63,6 +79,15 @@ class RS_Grid(ctypes.Structure):
                 # data is list of 1d arrays
                 ("data", ctypes.POINTER(ctypes.POINTER(ctypes.c_double)))]
 
+class RS_Grid_f32(ctypes.Structure):
+    '''
+    Values on real space multigrid in single precision.
+    '''
+    _fields_ = [("nlevels", ctypes.c_int),
+                ("gridlevel_info", ctypes.POINTER(GridLevel_Info)),
+                ("comp", ctypes.c_int),
+                ("data", ctypes.POINTER(ctypes.POINTER(ctypes.c_float)))]
+
 class PGFPair(ctypes.Structure):
     '''
     A primitive Gaussian function pair.
@@ -95,18 +120,25 @@ class TaskList(ctypes.Structure):
                 ("tasks", ctypes.POINTER(ctypes.POINTER(Task)))]
 
 
-def multi_grids_tasks(cell, ke_cutoff=None, hermi=0,
-                      ngrids=NGRIDS, ke_ratio=KE_RATIO, rel_cutoff=REL_CUTOFF):
-    if ke_cutoff is None:
-        ke_cutoff = cell.ke_cutoff
-    if ke_cutoff is None:
-        raise ValueError("cell.ke_cutoff is not set.")
+def _level_cutoffs(ke_cutoff, ngrids, ke_ratio):
+    '''
+    Kinetic energy cutoffs of the grid levels, from the coarsest to the finest.
+    '''
     ke1 = ke_cutoff
     cutoff = [ke1,]
     for i in range(ngrids-1):
         ke1 /= ke_ratio
         cutoff.append(ke1)
     cutoff.reverse()
+    return cutoff
+
+def multi_grids_tasks(cell, ke_cutoff=None, hermi=0,
+                      ngrids=NGRIDS, ke_ratio=KE_RATIO, rel_cutoff=REL_CUTOFF):
+    if ke_cutoff is None:
+        ke_cutoff = cell.ke_cutoff
+    if ke_cutoff is None:
+        raise ValueError("cell.ke_cutoff is not set.")
+    cutoff = _level_cutoffs(ke_cutoff, ngrids, ke_ratio)
     a = cell.lattice_vectors()
     mesh = []
     for ke in cutoff:
@@ -135,22 +167,94 @@ def _update_task_list(mydf, hermi=0, ngrids=None, ke_ratio=None, rel_cutoff=None
     else:
         hermi_orig = task_list.contents.hermi
         nlevels = task_list.contents.nlevels
-        rel_cutoff_orig = task_list.contents.gridlevel_info.contents.rel_cutoff
-        #TODO also need to check kenetic energy cutoff change
+        gridlevel_info = task_list.contents.gridlevel_info.contents
+        rel_cutoff_orig = gridlevel_info.rel_cutoff
         if (hermi_orig > hermi or
                 nlevels != ngrids or
                 abs(rel_cutoff_orig-rel_cutoff) > 1e-12):
             need_update = True
+        else:
+            cutoff_orig = np.ctypeslib.as_array(gridlevel_info.cutoff, shape=(nlevels,))
+            cutoff = _level_cutoffs(cell.ke_cutoff, ngrids, ke_ratio)
+            if abs(cutoff_orig - cutoff).max() > 1e-9 * cell.ke_cutoff:
+                need_update = True
 
     if need_update:
         if task_list is not None:
             free_task_list(task_list)
-        task_list = multi_grids_tasks(cell, hermi=hermi, ngrids=ngrids,
-                                      ke_ratio=ke_ratio, rel_cutoff=rel_cutoff)
+        with lib.profiler.phase('multigrid.task_list'):
+            task_list = multi_grids_tasks(cell, hermi=hermi, ngrids=ngrids,
+                                          ke_ratio=ke_ratio, rel_cutoff=rel_cutoff)
         mydf.task_list = task_list
     return task_list
 
 
+def _new_gspace_cache_stats():
+    return {'hits': 0, 'misses': 0, 'nbytes': 0, 'time_saved': 0.}
+
+def _gspace_cached(mydf, name, mesh, fn):
+    '''
+    Return fn(), cached in mydf by (name, mesh, lattice vectors).
+    The cached arrays are read-only.
+    '''
+    cache = getattr(mydf, '_gspace_cache', None)
+    if cache is None:
+        return fn()
+    stats = mydf._gspace_cache_stats
+    a = mydf.cell.lattice_vectors()
+    key = (name, tuple(int(n) for n in mesh), a.tobytes())
+    if key in cache:
+        val, cost = cache[key]
+        stats['hits'] += 1
+        stats['time_saved'] += cost
+        return val
+
+    t0 = logger.perf_counter()
+    val = fn()
+    cost = logger.perf_counter() - t0
+    stats['misses'] += 1
+    if isinstance(val, tuple):
+        arrays = val
+    else:
+        arrays = (val,)
+    nbytes = sum(x.nbytes for x in arrays)
+    if stats['nbytes'] + nbytes <= mydf.gspace_cache_max_memory * 1e6:
+        for x in arrays:
+            x.setflags(write=False)
+        cache[key] = (val, cost)
+        stats['nbytes'] += nbytes
+    return val
+
+def _report_gspace_cache(mydf, stats0, log):
+    '''
+    Log the G-space cache hits and the time saved since stats0 was taken.
+    '''
+    stats = getattr(mydf, '_gspace_cache_stats', None)
+    if not stats or not stats0:
+        return
+    log.debug('G-space cache: %d hits, %d misses, %.3f MB cached, %.4f s saved',
+              stats['hits'] - stats0['hits'], stats['misses'] - stats0['misses'],
+              stats['nbytes'] / 1e6, stats['time_saved'] - stats0['time_saved'])
+
+def _get_coulG(mydf, mesh):
+    return _gspace_cached(mydf, 'coulG', mesh,
+                          lambda: tools.get_coulG(mydf.cell, mesh=mesh))
+
+def _get_Gv(mydf, mesh):
+    return _gspace_cached(mydf, 'Gv', mesh, lambda: mydf.cell.get_Gv(mesh))
+
+def _get_fftfreq(mydf, mesh):
+    '''
+    Indices of the G-vectors of a grid level in the reciprocal-space mesh.
+    '''
+    def fn():
+        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
+        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
+        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
+        return gx, gy, gz
+    return _gspace_cached(mydf, 'fftfreq', mesh, fn)
+
+
 def init_gridlevel_info(cutoff, rel_cutoff, mesh):
     if cutoff[0] < 1e-15:
         cutoff = cutoff[1:]
@@ -177,12 +281,16 @@ def free_gridlevel_info(gridlevel_info):
         raise RuntimeError("Failed to free grid level info. %s" % e)
 
 
-def init_rs_grid(gridlevel_info, comp):
+def init_rs_grid(gridlevel_info, comp, dtype=np.double):
     '''
     Initialize values on real space multigrid
     '''
-    rs_grid = ctypes.POINTER(RS_Grid)()
-    fn = getattr(libdft, "init_rs_grid", None)
+    if dtype == np.float32:
+        rs_grid = ctypes.POINTER(RS_Grid_f32)()
+        fn = getattr(libdft, "init_rs_grid_f32", None)
+    else:
+        rs_grid = ctypes.POINTER(RS_Grid)()
+        fn = getattr(libdft, "init_rs_grid", None)
     try:
         fn(ctypes.byref(rs_grid),
            ctypes.byref(gridlevel_info),
@@ -193,7 +301,10 @@ def init_rs_grid(gridlevel_info, comp):
 
 
 def free_rs_grid(rs_grid):
-    fn = getattr(libdft, "del_rs_grid", None)
+    if isinstance(rs_grid, ctypes.POINTER(RS_Grid_f32)):
+        fn = getattr(libdft, "del_rs_grid_f32", None)
+    else:
+        fn = getattr(libdft, "del_rs_grid", None)
     try:
         fn(ctypes.byref(rs_grid))
     except Exception as e:
@@ -307,14 +418,28 @@ def free_task_list(task_list):
 
 def eval_rho(cell, dm, task_list, shls_slice=None, hermi=0, xctype='LDA', kpts=None,
              dimension=None, cell1=None, shls_slice1=None, Ls=None,
-             a=None, ignore_imag=False):
+             a=None, ignore_imag=False, dtype=np.double, ilevel=None, out=None):
     '''
     Collocate density (opt. gradients) on the real-space grid.
     The two sets of Gaussian functions can be different.
 
+    Kwargs:
+        dtype : np.double or np.float32
+            Precision of the real space multigrids. In single precision,
+            the contribution of each primitive Gaussian pair is still
+            computed in double precision, but accumulated to float32
+            grids. Only LDA is supported, for orthogonal and
+            non-orthogonal lattices.
+        ilevel : int
+            If given, only the density on this grid level is computed,
+            and is added to :obj:`out`.
+        out : (n_dm, comp, ngrids) array
+            Output buffer for the density on grid level :obj:`ilevel`.
+
     Returns:
-        rho: RS_Grid object
-            Densities on real space multigrids.
+        rho: RS_Grid (or RS_Grid_f32) object
+            Densities on real space multigrids. If :obj:`ilevel` is given,
+            :obj:`out` is returned instead.
     '''
     cell0 = cell
     shls_slice0 = shls_slice
@@ -394,19 +519,31 @@ def eval_rho(cell, dm, task_list, shls_slice=None, hermi=0, xctype='LDA', kpts=N
     if xctype == 'LDA':
         comp = 1
     elif xctype == 'GGA':
-        if hermi == 1:
-            raise RuntimeError('hermi=1 is not supported for GGA functional')
         comp = 4
     else:
         raise NotImplementedError('meta-GGA')
 
     eval_fn = 'make_rho_' + xctype.lower() + lattice_type
     drv = getattr(libdft, "grid_collocate_drv", None)
+    if dtype == np.float32:
+        if xctype != 'LDA':
+            raise NotImplementedError('single precision collocation for %s'
+                                      % xctype)
+        eval_fn += '_f32'
+        drv = getattr(libdft, "grid_collocate_f32_drv", None)
+
+    if ilevel is not None:
+        level_drv = getattr(libdft, "grid_collocate_level_drv", None)
+        def drv(eval_fn, rs_rho, *args):
+            level_drv(eval_fn, rs_rho.ctypes.data_as(ctypes.c_void_p),
+                      ctypes.c_int(ilevel), ctypes.c_int(dtype == np.float32), *args)
 
     def make_rho_(rs_rho, dm):
         try:
+            if ilevel is None:
+                rs_rho = ctypes.byref(rs_rho)
             drv(getattr(libdft, eval_fn, None),
-                ctypes.byref(rs_rho),
+                rs_rho,
                 dm.ctypes.data_as(ctypes.c_void_p),
                 ctypes.byref(task_list),
                 ctypes.c_int(comp), ctypes.c_int(hermi),
@@ -428,10 +565,20 @@ def eval_rho(cell, dm, task_list, shls_slice=None, hermi=0, xctype='LDA', kpts=N
             raise RuntimeError("Failed to compute rho. %s" % e)
         return rs_rho
 
+    if ilevel is not None:
+        assert out.dtype == dtype and out.flags.c_contiguous
+        out = out.reshape(n_dm, comp, -1)
+        for i, dm_i in enumerate(dm):
+            if dimension == 0 or kpts is None or gamma_point(kpts):
+                make_rho_(out[i], dm_i)
+            else:
+                raise NotImplementedError
+        return out
+
     gridlevel_info = task_list.contents.gridlevel_info
-    rs_rho = init_rs_grid(gridlevel_info, comp)
     rho = []
     for i, dm_i in enumerate(dm):
+        rs_rho = init_rs_grid(gridlevel_info, comp, dtype)
         if dimension == 0 or kpts is None or gamma_point(kpts):
             make_rho_(rs_rho, dm_i)
         else:
@@ -443,8 +590,55 @@ def eval_rho(cell, dm, task_list, shls_slice=None, hermi=0, xctype='LDA', kpts=N
     return rho
 
 
+def _fft_f32(f, mesh):
+    '''Single precision counterpart of :func:`tools.fft`.'''
+    f3d = f.reshape(-1, *mesh)
+    g3d = scipy.fft.fftn(f3d, axes=(1,2,3), workers=lib.num_threads())
+    return g3d.reshape(f.shape)
+
+
+def _ifft_f32(g, mesh):
+    '''Single precision counterpart of :func:`tools.ifft`.'''
+    g3d = g.reshape(-1, *mesh)
+    f3d = scipy.fft.ifftn(g3d, axes=(1,2,3), workers=lib.num_threads())
+    return f3d.reshape(g.shape)
+
+
+def _fft_inplace(a, mesh, func='fft'):
+    '''tools.fft (func='fft') or tools.ifft (func='ifft') of the C-contiguous
+    complex array a, overwriting a. complex64 arrays are transformed by
+    scipy.fft. For complex128 arrays the FFTW engine transforms in place;
+    other FFT engines return a new array, which is copied back to a.'''
+    a3d = a.reshape(-1, *mesh)
+    if a.dtype == np.complex64:
+        fn = scipy.fft.fftn if func == 'fft' else scipy.fft.ifftn
+        out = fn(a3d, axes=(1,2,3), overwrite_x=True, workers=lib.num_threads())
+    elif tools.pbc.FFT_ENGINE == 'FFTW':
+        out = tools.pbc._complex_fftn_fftw(a3d, mesh, func, out=a3d)
+    elif func == 'fft':
+        out = tools.pbc._fftn_wrapper(a3d)
+    else:
+        out = tools.pbc._ifftn_wrapper(a3d)
+    if not np.shares_memory(out, a3d):
+        a3d[:] = out
+    return a
+
+
 def _eval_rhoG(mydf, dm_kpts, hermi=1, kpts=np.zeros((1,3)), deriv=0,
-               rhog_high_order=RHOG_HIGH_ORDER):
+               rhog_high_order=None, dtype=np.double):
+    '''
+    Density in reciprocal space, scaled by the integration weight.
+
+    For GGA (deriv=1), the density gradients are collocated on the real
+    space grids if rhog_high_order is True (the default is RHOG_HIGH_ORDER).
+    Otherwise, they are computed from the density in reciprocal space.
+
+    With dtype=np.float32, the density is collocated on single precision
+    real space multigrids and transformed by complex64 FFTs, and
+    a complex64 array is returned (see :func:`get_rho` for the accuracy).
+
+    If mydf.rhog_stream is True, see :func:`_eval_rhoG_stream`.
+    '''
     assert(deriv < 2)
     cell = mydf.cell
 
@@ -455,6 +649,9 @@ def _eval_rhoG(mydf, dm_kpts, hermi=1, kpts=np.zeros((1,3)), deriv=0,
     task_list = _update_task_list(mydf, hermi=hermi, ngrids=mydf.ngrids,
                                   ke_ratio=mydf.ke_ratio, rel_cutoff=mydf.rel_cutoff)
 
+    if rhog_high_order is None:
+        rhog_high_order = RHOG_HIGH_ORDER
+
     gga_high_order = False
     if deriv == 0:
         xctype = 'LDA'
@@ -473,13 +670,45 @@ def _eval_rhoG(mydf, dm_kpts, hermi=1, kpts=np.zeros((1,3)), deriv=0,
         raise NotImplementedError
         assert(hermi == 1 or gamma_point(kpts))
 
+    if getattr(mydf, 'rhog_stream', False):
+        rhoG = _eval_rhoG_stream(mydf, dms, task_list, hermi, kpts, xctype,
+                                 rhodim, dtype)
+    else:
+        rhoG = _eval_rhoG_levels(mydf, dms, task_list, hermi, kpts, xctype,
+                                 rhodim, dtype)
+
+    rhoG = rhoG.reshape(nset,rhodim,-1)
+    if gga_high_order:
+        Gv = _get_Gv(mydf, mydf.mesh)
+        #rhoG1 = np.einsum('np,px->nxp', 1j*rhoG[:,0], Gv)
+        rhoG1 = tools.gradient_gs(rhoG, Gv)
+        rhoG = lib.concatenate([rhoG, rhoG1], axis=1)
+        Gv = rhoG1 = None
+    return rhoG
+
+
+def _eval_rhoG_levels(mydf, dms, task_list, hermi, kpts, xctype, rhodim,
+                      dtype=np.double):
+    '''
+    Collocate the density on all grid levels at once, then transform
+    each level to the reciprocal space.
+    '''
+    cell = mydf.cell
+    nset, nkpts = dms.shape[:2]
     ignore_imag = (hermi == 1)
+    with lib.profiler.phase('multigrid.collocate'):
+        rs_rho = eval_rho(cell, dms, task_list, hermi=hermi, xctype=xctype, kpts=kpts,
+                          ignore_imag=ignore_imag, dtype=dtype)
 
-    rs_rho = eval_rho(cell, dms, task_list, hermi=hermi, xctype=xctype, kpts=kpts,
-                      ignore_imag=ignore_imag)
+    if dtype == np.float32:
+        fft_level = _fft_f32
+        rhoG_dtype = np.complex64
+    else:
+        fft_level = tools.fft
+        rhoG_dtype = np.complex128
 
     nx, ny, nz = mydf.mesh
-    rhoG = np.zeros((nset*rhodim,nx,ny,nz), dtype=np.complex128)
+    rhoG = np.zeros((nset*rhodim,nx,ny,nz), dtype=rhoG_dtype)
     nlevels = task_list.contents.nlevels
     meshes = task_list.contents.gridlevel_info.contents.mesh
     meshes = np.ctypeslib.as_array(meshes, shape=(nlevels,3))
@@ -489,18 +718,19 @@ def _eval_rhoG(mydf, dm_kpts, hermi=1, kpts=np.zeros((1,3)), deriv=0,
         if nset > 1:
             rho = []
             for i in range(nset):
-                rho.append(np.ctypeslib.as_array(rs_rho[i].contents.data[ilevel], shape=(ngrids,)))
+                rho.append(np.ctypeslib.as_array(rs_rho[i].contents.data[ilevel],
+                                                 shape=(rhodim*ngrids,)))
             rho = np.asarray(rho)
         else:
-            rho = np.ctypeslib.as_array(rs_rho.contents.data[ilevel], shape=(ngrids,))
+            rho = np.ctypeslib.as_array(rs_rho.contents.data[ilevel],
+                                        shape=(rhodim*ngrids,))
 
         weight = 1./nkpts * cell.vol/ngrids
-        rho_freq = tools.fft(rho.reshape(nset*rhodim, -1), mesh)
+        with lib.profiler.phase('multigrid.fft'):
+            rho_freq = fft_level(rho.reshape(nset*rhodim, -1), mesh)
         rho = None
         rho_freq *= weight
-        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
-        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
-        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
+        gx, gy, gz = _get_fftfreq(mydf, mesh)
         _takebak_4d(rhoG, rho_freq.reshape((-1,) + tuple(mesh)), (None, gx, gy, gz))
         rho_freq = None
 
@@ -510,20 +740,126 @@ def _eval_rhoG(mydf, dm_kpts, hermi=1, kpts=np.zeros((1,3)), deriv=0,
     else:
         free_rs_grid(rs_rho)
     rs_rho = None
+    return rhoG
 
-    rhoG = rhoG.reshape(nset,rhodim,-1)
-    if gga_high_order:
-        Gv = cell.get_Gv(mydf.mesh)
-        #rhoG1 = np.einsum('np,px->nxp', 1j*rhoG[:,0], Gv)
-        rhoG1 = tools.gradient_gs(rhoG, Gv)
-        rhoG = lib.concatenate([rhoG, rhoG1], axis=1)
-        Gv = rhoG1 = None
+
+def _eval_rhoG_stream(mydf, dms, task_list, hermi, kpts, xctype, rhodim,
+                      dtype=np.double):
+    '''
+    Same as :func:`_eval_rhoG_levels`, but the density is collocated,
+    Fourier transformed and added to rhoG one grid level at a time. The
+    real-space buffer and the buffer of the FFT are reused across levels,
+    and the FFTs run in place (:func:`_fft_inplace`). The finest level is
+    processed first and, if it spans the full mesh, its density is copied
+    to rhoG and transformed there. The memory beyond rhoG is thus bounded
+    by the buffers of the largest level, independent of the number of grid
+    levels.
+    '''
+    log = logger.new_logger(mydf)
+    cell = mydf.cell
+    nset, nkpts = dms.shape[:2]
+    ignore_imag = (hermi == 1)
+    if dtype == np.float32:
+        rhoG_dtype = np.complex64
+    else:
+        rhoG_dtype = np.complex128
+
+    nx, ny, nz = mydf.mesh
+    rhoG = np.zeros((nset*rhodim,nx,ny,nz), dtype=rhoG_dtype)
+    nlevels = task_list.contents.nlevels
+    meshes = task_list.contents.gridlevel_info.contents.mesh
+    meshes = np.ctypeslib.as_array(meshes, shape=(nlevels,3))
+    levels = sorted(range(nlevels), key=lambda i: -np.prod(meshes[i]))
+    rho_buf = freq_buf = None
+    mem_peak = lib.current_memory()[0]
+    for ilevel in levels:
+        mesh = meshes[ilevel]
+        ngrids = np.prod(mesh)
+        size = nset * rhodim * ngrids
+        if rho_buf is None or rho_buf.size < size:
+            rho_buf = None
+            rho_buf = np.empty(size, dtype=dtype)
+        rho = rho_buf[:size]
+        rho[:] = 0
+        with lib.profiler.phase('multigrid.collocate'), \
+                lib.profiler.phase('multigrid.collocate.level%d' % ilevel):
+            eval_rho(cell, dms, task_list, hermi=hermi, xctype=xctype, kpts=kpts,
+                     ignore_imag=ignore_imag, dtype=dtype, ilevel=ilevel, out=rho)
+        mem_peak = max(mem_peak, lib.current_memory()[0])
+
+        weight = 1./nkpts * cell.vol/ngrids
+        if ilevel == levels[0] and tuple(mesh) == (nx, ny, nz):
+            rhoG[:] = rho.reshape(rhoG.shape)
+            rho = rho_buf = None
+            with lib.profiler.phase('multigrid.fft'):
+                _fft_inplace(rhoG, mesh)
+            rhoG *= weight
+        else:
+            if freq_buf is None or freq_buf.size < size:
+                freq_buf = None
+                freq_buf = np.empty(size, dtype=rhoG_dtype)
+            rho_freq = freq_buf[:size]
+            rho_freq[:] = rho
+            rho = None
+            with lib.profiler.phase('multigrid.fft'):
+                _fft_inplace(rho_freq, mesh)
+            rho_freq *= weight
+            gx, gy, gz = _get_fftfreq(mydf, mesh)
+            _takebak_4d(rhoG, rho_freq.reshape((-1,) + tuple(mesh)), (None, gx, gy, gz))
+            rho_freq = None
+        mem_now = lib.current_memory()[0]
+        mem_peak = max(mem_peak, mem_now)
+        log.debug1('rhoG level %d mesh %s, current memory %.1f MB',
+                   ilevel, mesh, mem_now)
+    rho_buf = freq_buf = None
+    log.debug('rhoG computed level by level, peak memory %.1f MB', mem_peak)
     return rhoG
 
 
+def get_rho(mydf, dm, kpts=np.zeros((1,3)), dtype=np.double):
+    '''Density in real space
+
+    Kwargs:
+        dtype : np.double or np.float32
+            If np.float32, the density is collocated, Fourier transformed
+            and returned in single precision, which halves the memory
+            footprint and is sufficient for generating density labels.
+            The error relative to the double precision result is bounded
+            by ~1e-6 * max(abs(rho)), dominated by the float32 accumulation
+            on the real space grids.
+    '''
+    cell = mydf.cell
+    hermi = 1
+    rhoG = _eval_rhoG(mydf, np.asarray(dm), hermi, kpts, deriv=0, dtype=dtype)
+
+    mesh = mydf.mesh
+    ngrids = np.prod(mesh)
+    weight = cell.vol / ngrids
+    # *(1./weight) because rhoR is scaled by weight in _eval_rhoG.  When
+    # computing rhoR with IFFT, the weight factor is not needed.
+    if dtype == np.float32:
+        rhoR = _ifft_f32(rhoG.reshape(ngrids), mesh).real
+        rhoR *= np.float32(1./weight)
+    else:
+        rhoR = tools.ifft(rhoG.reshape(ngrids), mesh).real * (1./weight)
+    return rhoR
+
+
 def eval_mat(cell, weights, task_list, shls_slice=None, comp=1, hermi=0, deriv=0,
              xctype='LDA', kpts=None, grid_level=None, dimension=None, mesh=None,
-             cell1=None, shls_slice1=None, Ls=None, a=None):
+             cell1=None, shls_slice1=None, Ls=None, a=None, out=None):
+    '''
+    Integrate the potential on the real-space grids.
+
+    Kwargs:
+        grid_level : int
+            The grid level of the potential. If None, weights holds the
+            potential on all grid levels, concatenated level by level along
+            the last axis, and all levels are integrated in one libdft call.
+        out : array
+            Only for grid_level=None. If given, the matrix elements are
+            added to it.
+    '''
 
     cell0 = cell
     shls_slice0 = shls_slice
@@ -597,20 +933,31 @@ def eval_mat(cell, weights, task_list, shls_slice=None, comp=1, hermi=0, deriv=0
     else:
         lattice_type = '_nonorth'
 
+    if grid_level is None:
+        nlevels = task_list.contents.nlevels
+        meshes = task_list.contents.gridlevel_info.contents.mesh
+        meshes = np.ctypeslib.as_array(meshes, shape=(nlevels,3))
+        level_loc = np.append(0, np.cumsum(np.prod(meshes, axis=1)))
+        ngrids = level_loc[-1]
+    else:
+        ngrids = np.prod(mesh)
+
     weights = np.asarray(weights, order='C')
     assert(weights.dtype == np.double)
     xctype = xctype.upper()
     n_mat = None
     if xctype == 'LDA':
+        wcomp = 1
         if weights.ndim == 1:
-            weights = weights.reshape(-1, np.prod(mesh))
+            weights = weights.reshape(-1, ngrids)
         else:
             n_mat = weights.shape[0]
     elif xctype == 'GGA':
         #if hermi == 1:
         #    raise RuntimeError('hermi=1 is not supported for GGA functional')
+        wcomp = 4
         if weights.ndim == 2:
-            weights = weights.reshape(-1, 4, np.prod(mesh))
+            weights = weights.reshape(-1, 4, ngrids)
         else:
             n_mat = weights.shape[0]
     else:
@@ -624,21 +971,34 @@ def eval_mat(cell, weights, task_list, shls_slice=None, comp=1, hermi=0, deriv=0
             eval_fn += '_ip1'
         else:
             raise NotImplementedError
-    drv = getattr(libdft, "grid_integrate_drv", None)
+    if grid_level is None:
+        drv = getattr(libdft, "grid_integrate_levels_drv", None)
+    else:
+        drv = getattr(libdft, "grid_integrate_drv", None)
 
-    def make_mat(wv):
-        if comp == 1:
+    def make_mat(wv, mat=None):
+        if mat is None and comp == 1:
             mat = np.zeros((naoi, naoj))
-        else:
+        elif mat is None:
             mat = np.zeros((comp, naoi, naoj))
-
+        assert mat.flags.c_contiguous
+
+        if grid_level is None:
+            # the potential of each level is a (wcomp, ngrids) block
+            wv = wv.ravel()
+            level_args = ((ctypes.c_void_p*nlevels)(*[wv[p0*wcomp:].ctypes.data
+                                                      for p0 in level_loc[:-1]]),
+                          ctypes.byref(task_list),
+                          ctypes.c_int(comp), ctypes.c_int(hermi))
+        else:
+            level_args = (wv.ctypes.data_as(ctypes.c_void_p),
+                          ctypes.byref(task_list),
+                          ctypes.c_int(comp), ctypes.c_int(hermi),
+                          ctypes.c_int(grid_level))
         try:
             drv(getattr(libdft, eval_fn, None),
                 mat.ctypes.data_as(ctypes.c_void_p),
-                wv.ctypes.data_as(ctypes.c_void_p),
-                ctypes.byref(task_list),
-                ctypes.c_int(comp), ctypes.c_int(hermi),
-                ctypes.c_int(grid_level),
+                *level_args,
                 (ctypes.c_int*4)(i0, i1, j0, j1),
                 ao_loc0.ctypes.data_as(ctypes.c_void_p),
                 ao_loc1.ctypes.data_as(ctypes.c_void_p),
@@ -657,6 +1017,19 @@ def eval_mat(cell, weights, task_list, shls_slice=None, comp=1, hermi=0, deriv=0
             raise RuntimeError("Failed to compute rho. %s" % e)
         return mat
 
+    if out is not None:
+        assert grid_level is None
+        if comp == 1:
+            out = out.reshape(len(weights), naoi, naoj)
+        else:
+            out = out.reshape(len(weights), comp, naoi, naoj)
+        for i, wv in enumerate(weights):
+            if dimension == 0 or kpts is None or gamma_point(kpts):
+                make_mat(wv, out[i])
+            else:
+                raise NotImplementedError
+        return out
+
     out = []
     for wv in weights:
         if dimension == 0 or kpts is None or gamma_point(kpts):
@@ -671,6 +1044,14 @@ def eval_mat(cell, weights, task_list, shls_slice=None, comp=1, hermi=0, deriv=0
 
 
 def _get_j_pass2(mydf, vG, kpts=np.zeros((1,3)), hermi=1, verbose=None):
+    '''
+    Integrate the potential vG, given on the full mesh in the reciprocal
+    space, with the AO pairs. The real-space potential of every grid level
+    is written to one preallocated pool, and all levels are integrated by
+    a single libdft call accumulating to one output matrix. The inverse
+    FFTs run in place in one buffer of the largest level
+    (:func:`_fft_inplace`).
+    '''
     cell = mydf.cell
     nkpts = len(kpts)
     nao = cell.nao_nr()
@@ -681,35 +1062,32 @@ def _get_j_pass2(mydf, vG, kpts=np.zeros((1,3)), hermi=1, verbose=None):
     task_list = _update_task_list(mydf, hermi=hermi, ngrids=mydf.ngrids,
                                   ke_ratio=mydf.ke_ratio, rel_cutoff=mydf.rel_cutoff)
 
-    at_gamma_point = gamma_point(kpts)
-    if at_gamma_point:
-        vj_kpts = np.zeros((nset,nkpts,nao,nao))
-    else:
-        vj_kpts = np.zeros((nset,nkpts,nao,nao), dtype=np.complex128)
+    if not gamma_point(kpts):
+        raise NotImplementedError
 
     nlevels = task_list.contents.nlevels
     meshes = task_list.contents.gridlevel_info.contents.mesh
     meshes = np.ctypeslib.as_array(meshes, shape=(nlevels,3))
+    level_ngrids = np.prod(meshes, axis=1)
+    level_loc = np.append(0, np.cumsum(level_ngrids))
+    vR = np.empty((nset, level_loc[-1]))
+    fft_buf = np.empty(nset*level_ngrids.max(), dtype=np.complex128)
     for ilevel in range(nlevels):
         mesh = meshes[ilevel]
-        ngrids = np.prod(mesh)
+        p0, p1 = level_loc[ilevel:ilevel+2]
 
-        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
-        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
-        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
-        sub_vG = _take_4d(vG, (None, gx, gy, gz)).reshape(nset,ngrids)
+        gx, gy, gz = _get_fftfreq(mydf, mesh)
+        sub_vG = _take_4d(vG, (None, gx, gy, gz), out=fft_buf)
+        with lib.profiler.phase('multigrid.fft'):
+            _fft_inplace(sub_vG, mesh, 'ifft')
+        vR[:,p0:p1] = sub_vG.reshape(nset,-1).real
+        sub_vG = None
+    fft_buf = None
 
-        v_rs = tools.ifft(sub_vG, mesh).reshape(nset,ngrids)
-        vR = np.asarray(v_rs.real, order='C')
-        vI = np.asarray(v_rs.imag, order='C')
-        if at_gamma_point:
-            v_rs = vR
-
-        mat = eval_mat(cell, vR, task_list, comp=1, hermi=hermi,
-                       xctype='LDA', kpts=kpts, grid_level=ilevel, mesh=mesh)
-        vj_kpts += np.asarray(mat).reshape(nset,-1,nao,nao)
-        if not at_gamma_point and abs(vI).max() > IMAG_TOL:
-            raise NotImplementedError
+    vj_kpts = np.zeros((nset,nkpts,nao,nao))
+    with lib.profiler.phase('multigrid.integrate'):
+        eval_mat(cell, vR, task_list, comp=1, hermi=hermi,
+                 xctype='LDA', kpts=kpts, out=vj_kpts)
 
     if nset == 1:
         vj_kpts = vj_kpts[0]
@@ -746,9 +1124,7 @@ def _get_j_pass2_ip1(mydf, vG, kpts=np.zeros((1,3)), hermi=0, deriv=1, verbose=N
         mesh = meshes[ilevel]
         ngrids = np.prod(mesh)
 
-        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
-        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
-        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
+        gx, gy, gz = _get_fftfreq(mydf, mesh)
         sub_vG = _take_4d(vG, (None, gx, gy, gz)).reshape(nset,ngrids)
 
         v_rs = tools.ifft(sub_vG, mesh).reshape(nset,ngrids)
@@ -791,15 +1167,16 @@ def _get_gga_pass2(mydf, vG, kpts=np.zeros((1,3)), hermi=1, verbose=None):
         mesh = meshes[ilevel]
         ngrids = np.prod(mesh)
 
-        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
-        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
-        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
+        gx, gy, gz = _get_fftfreq(mydf, mesh)
         sub_vG = _take_5d(vG, (None, None, gx, gy, gz)).reshape(-1,ngrids)
-        wv = tools.ifft(sub_vG, mesh).real.reshape(nset,4,ngrids)
+        with lib.profiler.phase('multigrid.fft'):
+            wv = tools.ifft(sub_vG, mesh).real.reshape(nset,4,ngrids)
         wv = np.asarray(wv, order='C')
 
-        mat = np.asarray(eval_mat(cell, wv, task_list, comp=1, hermi=hermi,
-                         xctype='GGA', kpts=kpts, grid_level=ilevel, mesh=mesh)).reshape(nset,-1,nao,nao)
+        with lib.profiler.phase('multigrid.integrate'), \
+                lib.profiler.phase('multigrid.integrate.level%d' % ilevel):
+            mat = np.asarray(eval_mat(cell, wv, task_list, comp=1, hermi=hermi,
+                             xctype='GGA', kpts=kpts, grid_level=ilevel, mesh=mesh)).reshape(nset,-1,nao,nao)
         #veff += mat #+ mat.conj().transpose(0,1,3,2)
         veff = lib.add(veff, mat, out=veff)
         if not gamma_point(kpts):
@@ -840,9 +1217,7 @@ def _get_gga_pass2_ip1(mydf, vG, kpts=np.zeros((1,3)), hermi=0, deriv=1, verbose
         mesh = meshes[ilevel]
         ngrids = np.prod(mesh)
 
-        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
-        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
-        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
+        gx, gy, gz = _get_fftfreq(mydf, mesh)
         sub_vG = _take_5d(vG, (None, None, gx, gy, gz)).reshape(-1,ngrids)
 
         v_rs = tools.ifft(sub_vG, mesh).reshape(nset,4,ngrids)
@@ -872,16 +1247,25 @@ def _rks_gga_wv0(rho, vxc, weight):
     return wv
 
 
-def _rks_gga_wv0_pw(cell, rho, vxc, weight, mesh):
+def _rks_gga_wv0_pw(cell, rho, vxc, weight, mesh, Gv=None):
     vrho, vgamma = vxc[:2]
     ngrid = vrho.size
     buf = np.empty((3,ngrid))
     for i in range(1, 4):
         buf[i-1] = lib.multiply(vgamma, rho[i], out=buf[i-1])
+    return _gga_wv_pw(cell, vrho, buf, weight, mesh, Gv)
+
 
+def _gga_wv_pw(cell, vrho, buf, weight, mesh, Gv=None):
+    '''
+    GGA potential in reciprocal space, given vrho and
+    buf = vsigma * nabla rho on the real-space mesh.
+    '''
+    ngrid = vrho.size
     vrho_freq = tools.fft(vrho, mesh).reshape((1,ngrid))
     buf_freq = tools.fft(buf, mesh).reshape((3,ngrid))
-    Gv = cell.get_Gv(mesh)
+    if Gv is None:
+        Gv = cell.get_Gv(mesh)
     #out  = vrho_freq - 2j * np.einsum('px,xp->p', Gv, buf_freq)
     #out *= weight
 
@@ -895,6 +1279,186 @@ def _rks_gga_wv0_pw(cell, rho, vxc, weight, mesh):
     return out
 
 
+def _eval_xc_screened(ni, xc_code, rho, spin=0, deriv=1,
+                      threshold=XC_SCREEN_THRESHOLD):
+    '''
+    Evaluate the XC functional only on the grids where the density is
+    larger than threshold. exc and vxc are set to zero on the other grids.
+
+    Returns:
+        exc, vxc, and the fraction of the grids being skipped.
+    '''
+    rho = np.asarray(rho)
+    ngrids = rho.shape[-1]
+    if spin == 0:
+        den = rho.reshape(-1,ngrids)[0]
+    else:
+        den = rho[0].reshape(-1,ngrids)[0] + rho[1].reshape(-1,ngrids)[0]
+    idx = np.where(den > threshold)[0]
+    skipped = 1. - float(idx.size) / ngrids
+    if idx.size == ngrids:
+        exc, vxc = ni.eval_xc(xc_code, rho, spin=spin, deriv=deriv)[:2]
+        return exc, vxc, skipped
+    if idx.size == 0:
+        # evaluate one grid point to get the shapes of the outputs
+        idx = np.argmax(den).reshape(1)
+
+    exc_sub, vxc_sub = ni.eval_xc(xc_code, rho[...,idx], spin=spin, deriv=deriv)[:2]
+    exc = np.zeros((ngrids,))
+    exc[idx] = exc_sub
+    vxc = []
+    for v_sub in vxc_sub:
+        if v_sub is None:
+            vxc.append(None)
+        else:
+            v_sub = np.asarray(v_sub)
+            v = np.zeros((ngrids,) + v_sub.shape[1:])
+            v[idx] = v_sub
+            vxc.append(v)
+    if skipped == 1:
+        exc[idx] = 0
+        for v in vxc:
+            if v is not None:
+                v[idx] = 0
+    return exc, tuple(vxc), skipped
+
+
+def _eval_xc(mydf, xc_code, rho, spin=0, deriv=1, log=None):
+    '''
+    Evaluate the XC functional on the real-space mesh, with the grids of
+    low density screened if :attr:`mydf.xc_screen_threshold` is set.
+    '''
+    ni = mydf._numint
+    threshold = getattr(mydf, 'xc_screen_threshold', XC_SCREEN_THRESHOLD)
+    if threshold is None or threshold <= 0:
+        return ni.eval_xc(xc_code, rho, spin=spin, deriv=deriv)[:2]
+
+    exc, vxc, skipped = _eval_xc_screened(ni, xc_code, rho, spin=spin,
+                                          deriv=deriv, threshold=threshold)
+    if log is not None:
+        log.debug('XC functional skipped on %.2f%% of the grids (rho < %g)',
+                  skipped*100, threshold)
+    return exc, vxc
+
+
+def _xc_mem_estimate(xctype, ngrids):
+    '''
+    Memory (in MB) of the temporary arrays needed to evaluate the XC
+    functional and its potential on the full mesh at once.
+    '''
+    if xctype == 'LDA':
+        # exc, vrho, libxc output buffer and wv
+        nbuf = 4
+    else:
+        # exc, vrho, vsigma, libxc output buffer, vsigma*nabla rho,
+        # and the complex arrays in _rks_gga_wv0_pw
+        nbuf = 16
+    return nbuf * ngrids * 8e-6
+
+
+def _xc_blocked(mydf, xctype, ngrids):
+    '''
+    Whether to evaluate the XC functional block by block, which is the
+    case if the full-mesh evaluation would exceed :attr:`mydf.max_memory`.
+    '''
+    mem_avail = mydf.max_memory - lib.current_memory()[0]
+    return _xc_mem_estimate(xctype, ngrids) > mem_avail
+
+
+def _eval_xc_blocked(mydf, xc_code, rho, xctype, exc=None, wv=None,
+                     blksize=None, log=None):
+    '''
+    Evaluate the XC functional block by block over the real-space mesh.
+    The blocks are distributed over a thread pool, and the results are
+    written into the preallocated buffers exc and wv.
+
+    Returns:
+        exc : (ngrids,) array
+        wv : (comp, ngrids) array
+            wv[0] is vrho. For GGA, wv[1:4] is vsigma * nabla rho.
+    '''
+    ni = mydf._numint
+    if blksize is None:
+        blksize = getattr(mydf, 'xc_blksize', XC_BLKSIZE)
+    threshold = getattr(mydf, 'xc_screen_threshold', XC_SCREEN_THRESHOLD)
+    if threshold is None:
+        threshold = 0
+
+    rho = np.asarray(rho)
+    ngrids = rho.shape[-1]
+    rho = rho.reshape(-1,ngrids)
+    if xctype == 'LDA':
+        comp = 1
+    elif xctype == 'GGA':
+        comp = 4
+    else:
+        raise NotImplementedError
+    if exc is None:
+        exc = np.empty((ngrids,))
+    if wv is None:
+        wv = np.empty((comp,ngrids))
+    assert exc.shape == (ngrids,) and wv.shape == (comp,ngrids)
+
+    def eval_block(p0):
+        p1 = min(p0+blksize, ngrids)
+        rho_blk = rho[:,p0:p1]
+        # each block is evaluated by one thread
+        with lib.with_omp_threads(1):
+            if threshold > 0:
+                exc_blk, vxc_blk, skipped = _eval_xc_screened(
+                        ni, xc_code, rho_blk, spin=0, deriv=1, threshold=threshold)
+            else:
+                exc_blk, vxc_blk = ni.eval_xc(xc_code, rho_blk, spin=0, deriv=1)[:2]
+                skipped = 0
+        exc[p0:p1] = exc_blk
+        wv[0,p0:p1] = vxc_blk[0]
+        if comp == 4:
+            for i in range(1, 4):
+                np.multiply(vxc_blk[1], rho_blk[i], out=wv[i,p0:p1])
+        return skipped * (p1-p0)
+
+    nthreads = max(1, lib.num_threads())
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        nskip = sum(executor.map(eval_block, range(0, ngrids, blksize)))
+
+    if log is not None:
+        log.debug('XC functional evaluated in %d blocks of %d grids with %d threads',
+                  (ngrids+blksize-1)//blksize, blksize, nthreads)
+        if threshold > 0:
+            log.debug('XC functional skipped on %.2f%% of the grids (rho < %g)',
+                      nskip*100./ngrids, threshold)
+    return exc, wv
+
+
+def _get_xc_wv_freq_blocked(mydf, xc_code, rho, xctype, weight, mesh, log=None):
+    '''
+    Same as the full-mesh evaluation in :func:`nr_rks`, but with the XC
+    functional evaluated by :func:`_eval_xc_blocked`.
+
+    Returns:
+        exc : (ngrids,) array
+        wv_freq : (comp, ngrids) array
+            The XC potential in reciprocal space.
+    '''
+    cell = mydf.cell
+    ngrids = np.prod(mesh)
+    with lib.profiler.phase('multigrid.xc'):
+        exc, wv = _eval_xc_blocked(mydf, xc_code, rho, xctype, log=log)
+    if xctype == 'LDA':
+        wv = lib.multiply(weight, wv, out=wv)
+        with lib.profiler.phase('multigrid.fft'):
+            wv_freq = tools.fft(wv, mesh)
+    elif GGA_METHOD.upper() == 'FFT':
+        Gv = _get_Gv(mydf, mesh)
+        wv_freq = _gga_wv_pw(cell, wv[0], wv[1:4], weight, mesh, Gv).reshape(1,ngrids)
+    else:
+        wv[0] *= weight
+        wv[1:4] *= weight * 2
+        with lib.profiler.phase('multigrid.fft'):
+            wv_freq = tools.fft(wv, mesh)
+    return exc, wv_freq
+
+
 def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
            kpts_band=None, with_j=False, return_j=False, verbose=None):
     '''
@@ -902,6 +1466,10 @@ def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
     '''
     if kpts is None: kpts = mydf.kpts
     log = logger.new_logger(mydf, verbose)
+    if mydf.autotune and mydf._autotune_key is None:
+        from pyscf.pbc.dft.multigrid.autotune import autotune
+        autotune(mydf, xc_code, dm_kpts, hermi, kpts, fn=nr_rks, verbose=log)
+    cache_stats0 = dict(getattr(mydf, '_gspace_cache_stats', {}))
     cell = mydf.cell
     dm_kpts = lib.asarray(dm_kpts, order='C')
     dms = _format_dms(dm_kpts, kpts)
@@ -914,12 +1482,13 @@ def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
         deriv = 0
     elif xctype == 'GGA':
         deriv = 1
-    rhoG = _eval_rhoG(mydf, dm_kpts, hermi, kpts, deriv)
+    with lib.profiler.phase('multigrid.rhoG'):
+        rhoG = _eval_rhoG(mydf, dm_kpts, hermi, kpts, deriv)
 
     mesh = mydf.mesh
     ngrids = np.prod(mesh)
 
-    coulG = tools.get_coulG(cell, mesh=mesh)
+    coulG = _get_coulG(mydf, mesh)
     #vG = np.einsum('ng,g->ng', rhoG[:,0], coulG)
     vG = np.empty_like(rhoG[:,0], dtype=np.result_type(rhoG[:,0], coulG))
     for i, rhoG_i in enumerate(rhoG[:,0]):
@@ -948,38 +1517,52 @@ def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
     weight = cell.vol / ngrids
     # *(1./weight) because rhoR is scaled by weight in _eval_rhoG.  When
     # computing rhoR with IFFT, the weight factor is not needed.
-    rhoR = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real * (1./weight)
+    with lib.profiler.phase('multigrid.fft'):
+        rhoR = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real * (1./weight)
     rhoR = rhoR.reshape(nset,-1,ngrids)
     wv_freq = []
     nelec = np.zeros(nset)
     excsum = np.zeros(nset)
+    xc_blocked = _xc_blocked(mydf, xctype, ngrids)
     for i in range(nset):
-        exc, vxc = ni.eval_xc(xc_code, rhoR[i], spin=0, deriv=1)[:2]
-        if xctype == 'LDA':
-            wv = vxc[0].reshape(1,ngrids) * weight
-            wv_freq.append(tools.fft(wv, mesh))
-            wv = None
-        elif xctype == 'GGA':
-            if GGA_METHOD.upper() == 'FFT':
-                wv_freq.append(_rks_gga_wv0_pw(cell, rhoR[i], vxc, weight, mesh).reshape(1,ngrids))
-            else:
-                wv = _rks_gga_wv0(rhoR[i], vxc, weight)
-                wv_freq.append(tools.fft(wv, mesh))
-                wv = None
+        if xc_blocked:
+            exc, wv_freq_i = _get_xc_wv_freq_blocked(mydf, xc_code, rhoR[i], xctype,
+                                                     weight, mesh, log=log)
+            wv_freq.append(wv_freq_i)
+            wv_freq_i = None
         else:
-            raise NotImplementedError
+            with lib.profiler.phase('multigrid.xc'):
+                exc, vxc = _eval_xc(mydf, xc_code, rhoR[i], spin=0, deriv=1, log=log)
+            if xctype == 'LDA':
+                wv = vxc[0].reshape(1,ngrids) * weight
+                with lib.profiler.phase('multigrid.fft'):
+                    wv_freq.append(tools.fft(wv, mesh))
+                wv = None
+            elif xctype == 'GGA':
+                if GGA_METHOD.upper() == 'FFT':
+                    Gv = _get_Gv(mydf, mesh)
+                    wv_freq.append(_rks_gga_wv0_pw(cell, rhoR[i], vxc, weight, mesh,
+                                                   Gv).reshape(1,ngrids))
+                else:
+                    wv = _rks_gga_wv0(rhoR[i], vxc, weight)
+                    with lib.profiler.phase('multigrid.fft'):
+                        wv_freq.append(tools.fft(wv, mesh))
+                    wv = None
+            else:
+                raise NotImplementedError
+            vxc = None
 
         nelec[i]  += lib.sum(rhoR[i,0]) * weight
-        excsum[i] += lib.sum(lib.multiply(rhoR[i,0], exc)) * weight
-        exc = vxc = None
+        excsum[i] += lib.sum(lib.multiply(rhoR[i,0], exc, out=exc)) * weight
+        exc = None
 
     # potential from implicit solvation
     if mydf.sccs:
         assert nset == 1
-        rho_core = make_rho_core(cell)
-        e_pol, phi_sccs = mydf.sccs.kernel(rhoR[0][0], rho_core)
+        if mydf._rho_core is None:
+            mydf._rho_core = make_rho_core(cell)
+        e_pol, phi_sccs = mydf.sccs.kernel(rhoR[0][0], mydf._rho_core)
         ecoul[0] += e_pol
-        rho_core = None
         phi_sccs = lib.multiply(weight, phi_sccs, out=phi_sccs)
         wv_freq[0][0] += tools.fft(phi_sccs, mesh)
 
@@ -1009,23 +1592,25 @@ def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
     log.debug('Multigrid exc %s  nelec %s', excsum, nelec)
 
     kpts_band, input_band = _format_kpts_band(kpts_band, kpts), kpts_band
-    if xctype == 'LDA':
-        if with_j:
-            wv_freq[:,0] += vG.reshape(nset,*mesh)
-        veff = _get_j_pass2(mydf, wv_freq, kpts_band, verbose=log)
-    elif xctype == 'GGA':
-        if with_j:
-            #wv_freq[:,0] += vG.reshape(nset,*mesh)
-            wv_freq[:,0] = lib.add(wv_freq[:,0], vG.reshape(nset,*mesh), out=wv_freq[:,0])
-        if GGA_METHOD.upper() == 'FFT':
+    with lib.profiler.phase('multigrid.pass2'):
+        if xctype == 'LDA':
+            if with_j:
+                wv_freq[:,0] += vG.reshape(nset,*mesh)
             veff = _get_j_pass2(mydf, wv_freq, kpts_band, verbose=log)
-        else:
-            veff = _get_gga_pass2(mydf, wv_freq, kpts_band, hermi=hermi, verbose=log)
+        elif xctype == 'GGA':
+            if with_j:
+                #wv_freq[:,0] += vG.reshape(nset,*mesh)
+                wv_freq[:,0] = lib.add(wv_freq[:,0], vG.reshape(nset,*mesh), out=wv_freq[:,0])
+            if GGA_METHOD.upper() == 'FFT':
+                veff = _get_j_pass2(mydf, wv_freq, kpts_band, verbose=log)
+            else:
+                veff = _get_gga_pass2(mydf, wv_freq, kpts_band, hermi=hermi, verbose=log)
     wv_freq = None
     veff = _format_jks(veff, dm_kpts, input_band, kpts)
 
     if return_j:
-        vj = _get_j_pass2(mydf, vG, kpts_band, verbose=log)
+        with lib.profiler.phase('multigrid.pass2'):
+            vj = _get_j_pass2(mydf, vG, kpts_band, verbose=log)
         vj = _format_jks(veff, dm_kpts, input_band, kpts)
     else:
         vj = None
@@ -1033,10 +1618,263 @@ def nr_rks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
 
     if vk is not None:
         veff += vk
+    veff = lib.tag_array(veff, ecoul=ecoul, exc=excsum, vj=vj, vk=None)
+    _report_gspace_cache(mydf, cache_stats0, log)
+    return nelec, excsum, veff
+
+
+def _uks_gga_wv0_pw(cell, rho, vxc, weight, mesh, Gv=None):
+    '''
+    UKS GGA potential of both spins in reciprocal space.
+    '''
+    wva, wvb = numint._uks_gga_wv0(rho, vxc, 1.)
+    ngrid = wva.shape[-1]
+    # wv[0] is scaled by .5 in _uks_gga_wv0 and wv[1:4] = 2 * vsigma * nabla rho
+    wv_freq = np.empty((2,ngrid), dtype=np.complex128)
+    wv_freq[0] = _gga_wv_pw(cell, wva[0]*2, wva[1:4]*.5, weight, mesh, Gv)
+    wv_freq[1] = _gga_wv_pw(cell, wvb[0]*2, wvb[1:4]*.5, weight, mesh, Gv)
+    return wv_freq
+
+
+def nr_uks(mydf, xc_code, dm_kpts, hermi=1, kpts=None,
+           kpts_band=None, with_j=False, return_j=False, verbose=None):
+    '''
+    Same as multigrid.nr_uks, but based on the task list of MultiGridFFTDF2.
+    The densities of both spins are collocated with the same task list.
+
+    Returns:
+        nelec : (2,) array
+        excsum : XC energy
+        veff : (2, nao, nao) ndarray for the alpha and beta spins
+    '''
+    if kpts is None: kpts = mydf.kpts
+    log = logger.new_logger(mydf, verbose)
+    cell = mydf.cell
+    dm_kpts = lib.asarray(dm_kpts, order='C')
+    dms = _format_dms(dm_kpts, kpts)
+    nset, nkpts, nao = dms.shape[:3]
+    assert(nset == 2)
+    if mydf.sccs:
+        raise NotImplementedError('SCCS for UKS')
+    if mydf.autotune and mydf._autotune_key is None:
+        from pyscf.pbc.dft.multigrid.autotune import autotune
+        autotune(mydf, xc_code, dm_kpts, hermi, kpts, fn=nr_uks, verbose=log)
+    kpts_band, input_band = _format_kpts_band(kpts_band, kpts), kpts_band
+
+    ni = mydf._numint
+    xctype = ni._xc_type(xc_code)
+    if xctype == 'LDA':
+        deriv = 0
+    elif xctype == 'GGA':
+        deriv = 1
+    else:
+        raise NotImplementedError
+    rhoG = _eval_rhoG(mydf, dm_kpts, hermi, kpts, deriv)
+
+    mesh = mydf.mesh
+    ngrids = np.prod(mesh)
+
+    coulG = _get_coulG(mydf, mesh)
+    vG = lib.add(rhoG[0,0], rhoG[1,0])
+    vG = lib.multiply(vG, coulG, out=vG)
+    coulG = None
+
+    if mydf.vpplocG_part1 is not None and not mydf.pp_with_erf:
+        vG = lib.add(vG, lib.multiply(2., mydf.vpplocG_part1), out=vG)
+
+    ecoul = .5 * (lib.vdot(rhoG[0,0], vG) + lib.vdot(rhoG[1,0], vG)).real
+    ecoul /= cell.vol
+    log.debug('Multigrid Coulomb energy %s', ecoul)
+
+    if mydf.vpplocG_part1 is not None and not mydf.pp_with_erf:
+        vG = lib.subtract(vG, mydf.vpplocG_part1, out=vG)
+
+    weight = cell.vol / ngrids
+    # *(1./weight) because rhoR is scaled by weight in _eval_rhoG.  When
+    # computing rhoR with IFFT, the weight factor is not needed.
+    rhoR = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real * (1./weight)
+    rhoR = rhoR.reshape(2,-1,ngrids)
+    rhoG = None
+
+    exc, vxc = _eval_xc(mydf, xc_code, rhoR, spin=1, deriv=1, log=log)
+    if xctype == 'LDA':
+        vrho = vxc[0]
+        wv = np.empty((2,ngrids))
+        wv[0] = lib.multiply(weight, vrho[:,0], out=wv[0])
+        wv[1] = lib.multiply(weight, vrho[:,1], out=wv[1])
+        wv_freq = tools.fft(wv, mesh).reshape(2,1,*mesh)
+        wv = None
+    elif GGA_METHOD.upper() == 'FFT':
+        Gv = _get_Gv(mydf, mesh)
+        wv_freq = _uks_gga_wv0_pw(cell, rhoR, vxc, weight, mesh, Gv)
+        wv_freq = wv_freq.reshape(2,1,*mesh)
+    else:
+        wva, wvb = numint._uks_gga_wv0(rhoR, vxc, weight)
+        # v+v.T is not applied in _get_gga_pass2
+        wva[0] *= 2
+        wvb[0] *= 2
+        wv_freq = tools.fft(np.vstack((wva,wvb)), mesh).reshape(2,4,*mesh)
+        wva = wvb = None
+    vxc = None
+
+    nelec = np.zeros(2)
+    nelec[0] = lib.sum(rhoR[0,0]) * weight
+    nelec[1] = lib.sum(rhoR[1,0]) * weight
+    rho_tot = lib.add(rhoR[0,0], rhoR[1,0])
+    excsum = lib.sum(lib.multiply(rho_tot, exc, out=exc)) * weight
+    rhoR = rho_tot = exc = None
+    log.debug('Multigrid exc %s  nelec %s', excsum, nelec)
+
+    if with_j:
+        wv_freq[:,0] = lib.add(wv_freq[:,0], vG.reshape(*mesh), out=wv_freq[:,0])
+    if xctype == 'GGA' and GGA_METHOD.upper() != 'FFT':
+        veff = _get_gga_pass2(mydf, wv_freq, kpts_band, hermi=hermi, verbose=log)
+    else:
+        veff = _get_j_pass2(mydf, wv_freq, kpts_band, verbose=log)
+    wv_freq = None
+    veff = _format_jks(veff, dm_kpts, input_band, kpts)
+
+    if return_j:
+        vj = _get_j_pass2(mydf, vG, kpts_band, verbose=log)
+        vj = _format_jks(vj, dm_kpts, input_band, kpts)
+    else:
+        vj = None
+    vG = None
+
     veff = lib.tag_array(veff, ecoul=ecoul, exc=excsum, vj=vj, vk=None)
     return nelec, excsum, veff
 
 
+def cache_xc_kernel(mydf, xc_code, dm, spin=0, kpts=None):
+    '''
+    Compute the 0th order density, Vxc and fxc on the finest mesh.
+    '''
+    if kpts is None:
+        kpts = np.zeros((1,3))
+    cell = mydf.cell
+    mesh = mydf.mesh
+    ngrids = np.prod(mesh)
+
+    ni = mydf._numint
+    xctype = ni._xc_type(xc_code)
+    if xctype == 'LDA':
+        deriv = 0
+        comp = 1
+    elif xctype == 'GGA':
+        deriv = 1
+        comp = 4
+    else:
+        raise NotImplementedError
+
+    hermi = 1
+    weight = cell.vol / ngrids
+    rhoG = _eval_rhoG(mydf, dm, hermi, kpts, deriv)
+    rho = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real * (1./weight)
+    if spin == 0:
+        rho = rho.reshape(comp,ngrids)
+    else:
+        rho = rho.reshape(2,comp,ngrids)
+
+    vxc, fxc = ni.eval_xc(xc_code, rho, spin=spin, deriv=2)[1:3]
+    return rho, vxc, fxc
+
+
+def nr_uks_fxc(mydf, xc_code, dm0, dms, hermi=1, with_j=False,
+               rho0=None, vxc=None, fxc=None, kpts=None, verbose=None):
+    '''
+    Same as multigrid.nr_uks_fxc, but based on the task list of
+    MultiGridFFTDF2.
+    '''
+    if kpts is None:
+        kpts = np.zeros((1,3))
+    log = logger.new_logger(mydf, verbose)
+    cell = mydf.cell
+    mesh = mydf.mesh
+    ngrids = np.prod(mesh)
+
+    dm_kpts = lib.asarray(dms, order='C')
+    dms = _format_dms(dm_kpts, kpts)
+    nset, nkpts, nao = dms.shape[:3]
+    assert(nset == 2)
+
+    ni = mydf._numint
+    xctype = ni._xc_type(xc_code)
+    if xctype == 'LDA':
+        deriv = 0
+    elif xctype == 'GGA':
+        deriv = 1
+    else:
+        raise NotImplementedError
+
+    weight = cell.vol / ngrids
+    if rho0 is None:
+        rhoG = _eval_rhoG(mydf, dm0, 1, kpts, deriv)
+        rho0 = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real * (1./weight)
+        rho0 = rho0.reshape(nset,-1,ngrids)
+
+    if vxc is None or fxc is None:
+        vxc, fxc = ni.eval_xc(xc_code, rho0, spin=1, deriv=2)[1:3]
+
+    rhoG = _eval_rhoG(mydf, dms, hermi, kpts, deriv)
+    rho1 = tools.ifft(rhoG.reshape(-1,ngrids), mesh).real * (1./weight)
+    rho1 = rho1.reshape(nset,-1,ngrids)
+    if with_j:
+        coulG = _get_coulG(mydf, mesh)
+        vG = (rhoG[0,0] + rhoG[1,0]) * coulG
+        vG = vG.reshape(mesh)
+    rhoG = None
+
+    if xctype == 'LDA':
+        u_u, u_d, d_d = fxc[0].T
+        wv = np.asarray([u_u * rho1[0,0] + u_d * rho1[1,0],
+                         u_d * rho1[0,0] + d_d * rho1[1,0]])
+        wv *= weight
+        wv_freq = tools.fft(wv, mesh).reshape(nset,1,*mesh)
+    elif GGA_METHOD.upper() == 'FFT':
+        Gv = _get_Gv(mydf, mesh)
+        wva, wvb = numint._uks_gga_wv1(rho0, rho1, vxc, fxc, 1.)
+        wv_freq = np.empty((2,ngrids), dtype=np.complex128)
+        wv_freq[0] = _gga_wv_pw(cell, wva[0]*2, wva[1:4]*.5, weight, mesh, Gv)
+        wv_freq[1] = _gga_wv_pw(cell, wvb[0]*2, wvb[1:4]*.5, weight, mesh, Gv)
+        wv_freq = wv_freq.reshape(nset,1,*mesh)
+    else:
+        wva, wvb = numint._uks_gga_wv1(rho0, rho1, vxc, fxc, weight)
+        wva[0] *= 2
+        wvb[0] *= 2
+        wv_freq = tools.fft(np.vstack((wva,wvb)), mesh).reshape(nset,4,*mesh)
+    wv = wva = wvb = None
+
+    if with_j:
+        wv_freq[:,0] += vG
+    if xctype == 'GGA' and GGA_METHOD.upper() != 'FFT':
+        veff = _get_gga_pass2(mydf, wv_freq, kpts, verbose=log)
+    else:
+        veff = _get_j_pass2(mydf, wv_freq, kpts, verbose=log)
+    return veff.reshape(dm_kpts.shape)
+
+
+def _gen_uhf_response(mf, dm0, with_j=True, hermi=0):
+    '''
+    Same as multigrid._gen_uhf_response, but based on MultiGridFFTDF2.
+    '''
+    if getattr(mf, 'kpts', None) is not None:
+        kpts = mf.kpts
+    else:
+        kpts = mf.kpt.reshape(1,3)
+
+    rho0, vxc, fxc = cache_xc_kernel(mf.with_df, mf.xc, dm0, 1, kpts)
+    dm0 = None
+
+    def vind(dm1):
+        if hermi == 2:
+            return np.zeros_like(dm1)
+
+        v1 = nr_uks_fxc(mf.with_df, mf.xc, dm0, dm1, hermi,
+                        with_j, rho0, vxc, fxc, kpts)
+        return v1
+    return vind
+
+
 def get_veff_ip1(mydf, dm_kpts, xc_code=None, kpts=np.zeros((1,3)), kpts_band=None):
     cell = mydf.cell
     dm_kpts = lib.asarray(dm_kpts, order='C')
@@ -1056,7 +1894,7 @@ def get_veff_ip1(mydf, dm_kpts, xc_code=None, kpts=np.zeros((1,3)), kpts_band=No
 
     mesh = mydf.mesh
     ngrids = np.prod(mesh)
-    coulG = tools.get_coulG(cell, mesh=mesh)
+    coulG = _get_coulG(mydf, mesh)
     #vG = np.einsum('ng,g->ng', rhoG[:,0], coulG)
     vG = np.empty_like(rhoG[:,0], dtype=np.result_type(rhoG[:,0], coulG))
     for i, rhoG_i in enumerate(rhoG[:,0]):
@@ -1083,13 +1921,15 @@ def get_veff_ip1(mydf, dm_kpts, xc_code=None, kpts=np.zeros((1,3)), kpts_band=No
 
     wv_freq = []
     for i in range(nset):
-        exc, vxc = ni.eval_xc(xc_code, rhoR[i], spin=0, deriv=1)[:2]
+        exc, vxc = _eval_xc(mydf, xc_code, rhoR[i], spin=0, deriv=1)
         if xctype == 'LDA':
             wv = vxc[0].reshape(1,ngrids) * weight
             wv_freq.append(tools.fft(wv, mesh))
         elif xctype == 'GGA':
             if GGA_METHOD.upper() == 'FFT':
-                wv_freq.append(_rks_gga_wv0_pw(cell, rhoR[i], vxc, weight, mesh).reshape(1,ngrids))
+                Gv = _get_Gv(mydf, mesh)
+                wv_freq.append(_rks_gga_wv0_pw(cell, rhoR[i], vxc, weight, mesh,
+                                               Gv).reshape(1,ngrids))
             else:
                 wv = _rks_gga_wv0(rhoR[i], vxc, weight)
                 wv_freq.append(tools.fft(wv, mesh))
@@ -1136,7 +1976,7 @@ def get_k_kpts(mydf, dm_kpts, hermi=0, kpts=None,
 
     mesh = mydf.mesh
     ngrids = np.prod(mesh)
-    coulG = tools.get_coulG(cell, mesh=mesh).reshape(-1, *mesh)
+    coulG = _get_coulG(mydf, mesh).reshape(-1, *mesh)
 
     task_list = _update_task_list(mydf, hermi=hermi, ngrids=mydf.ngrids,
                                   ke_ratio=mydf.ke_ratio, rel_cutoff=mydf.rel_cutoff)
@@ -1210,9 +2050,7 @@ def get_k_kpts(mydf, dm_kpts, hermi=0, kpts=None,
         mesh = meshes[ilevel]
         ngrids = np.prod(mesh)
 
-        gx = np.fft.fftfreq(mesh[0], 1./mesh[0]).astype(np.int32)
-        gy = np.fft.fftfreq(mesh[1], 1./mesh[1]).astype(np.int32)
-        gz = np.fft.fftfreq(mesh[2], 1./mesh[2]).astype(np.int32)
+        gx, gy, gz = _get_fftfreq(mydf, mesh)
         sub_coulG = _take_4d(coulG, (None, gx, gy, gz)).reshape(-1,ngrids)
 
         for iset in range(nset):
@@ -1240,11 +2078,48 @@ class MultiGridFFTDF2(MultiGridFFTDF):
             It is cached in nuclear gradient calculations to reduce cost.
         sccs : SCCS instance
             Whether to use self-consistent continuum solvation model.
+        xc_screen_threshold : float
+            If larger than 0, the XC functional is only evaluated on the
+            grids where the density is larger than this value, e.g., to
+            skip the vacuum region of molecular systems. Default is 0.
+        xc_blksize : int
+            Number of grids per block when the XC functional is evaluated
+            block by block, which happens automatically if evaluating it
+            on the full mesh would exceed :attr:`max_memory`.
+        rhog_stream : bool
+            Whether to compute the density in the reciprocal space one
+            grid level at a time, to bound the memory usage for large
+            meshes. Default is False.
+        gspace_cache_max_memory : float
+            Max memory (in MB) for caching the Coulomb kernel, G-vectors
+            and the FFT indices of each grid level, which are reused
+            across SCF iterations. The cache is keyed by mesh and lattice
+            vectors, and is cleared by :meth:`reset`. No caching if <= 0.
+        autotune : bool
+            Whether to choose :attr:`ngrids`, :attr:`ke_ratio` and
+            :attr:`rel_cutoff` on the first Fock build by timing the
+            configurations in :attr:`autotune_candidates`. The fastest one
+            whose energy and number of electrons agree with a single-level
+            reference within :attr:`autotune_etol` and
+            :attr:`autotune_nelec_tol` is used. Default is False.
+        autotune_file : str
+            JSON file storing the autotuned configurations keyed by basis,
+            kinetic energy cutoff and box size, to be reused by later
+            calculations. If None, the choices are only kept in memory.
     '''
     pp_with_erf = getattr(__config__, 'pbc_dft_multigrid_pp_with_erf', False)
     ngrids = getattr(__config__, 'pbc_dft_multigrid_ngrids', 4)
     ke_ratio = getattr(__config__, 'pbc_dft_multigrid_ke_ratio', 3.0)
     rel_cutoff = getattr(__config__, 'pbc_dft_multigrid_rel_cutoff', 20.0)
+    xc_screen_threshold = XC_SCREEN_THRESHOLD
+    xc_blksize = XC_BLKSIZE
+    rhog_stream = RHOG_STREAM
+    gspace_cache_max_memory = GSPACE_CACHE_MAX_MEMORY
+    autotune = AUTOTUNE
+    autotune_file = AUTOTUNE_FILE
+    autotune_candidates = AUTOTUNE_CANDIDATES
+    autotune_etol = AUTOTUNE_ETOL
+    autotune_nelec_tol = AUTOTUNE_NELEC_TOL
 
     def __init__(self, cell, kpts=np.zeros((1,3))):
         fft.FFTDF.__init__(self, cell, kpts)
@@ -1252,16 +2127,40 @@ class MultiGridFFTDF2(MultiGridFFTDF):
         self.vpplocG_part1 = None
         self.rhoG = None
         self.sccs = None
+        self._gspace_cache = {}
+        self._gspace_cache_stats = _new_gspace_cache_stats()
+        self._autotune_key = None
+        self._rho_core = None
         self._keys = self._keys.union(['task_list','vpplocG_part1', 'rhoG', 'sccs'])
 
     def reset(self, cell=None):
         self.vpplocG_part1 = None
         self.rhoG = None
+        self._gspace_cache = {}
+        self._gspace_cache_stats = _new_gspace_cache_stats()
+        self._autotune_key = None
+        self._rho_core = None
         if self.task_list is not None:
             free_task_list(self.task_list)
             self.task_list = None
         fft.FFTDF.reset(self, cell=cell)
 
+    def reset_geom(self):
+        '''
+        Drop the data that depend on the atomic positions, i.e. the task
+        list, the local pseudopotential, the core density and the cached
+        density, after the coordinates of :attr:`cell` are changed in
+        place. The G-space cache, the autotuned grid levels and the SCCS
+        solver state are kept.
+        '''
+        self.vpplocG_part1 = None
+        self.rhoG = None
+        self._rho_core = None
+        if self.task_list is not None:
+            free_task_list(self.task_list)
+            self.task_list = None
+        return self
+
     def __del__(self):
         self.reset()
 
@@ -1277,3 +2176,4 @@ class MultiGridFFTDF2(MultiGridFFTDF):
 
     get_pp_nuc_grad = get_pp_nuc_grad
     vpploc_part1_nuc_grad = vpploc_part1_nuc_grad
+    get_rho = get_rho
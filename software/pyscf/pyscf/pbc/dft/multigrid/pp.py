@@ -28,7 +28,6 @@ def make_rho_core(cell, mesh=None, precision=None, atm_id=None):
         lattice_type = '_orth'
     else:
         lattice_type = '_nonorth'
-        raise NotImplementedError
     eval_fn = 'make_rho_lda' + lattice_type
 
     b = numpy.asarray(numpy.linalg.inv(a.T), order='C', dtype=float)
@@ -308,7 +307,6 @@ def vpploc_part1_nuc_grad(mydf, dm, kpts=numpy.zeros((1,3)), atm_id=None, precis
         lattice_type = '_orth'
     else:
         lattice_type = '_nonorth'
-        raise NotImplementedError
     eval_fn = 'eval_mat_lda' + lattice_type + '_ip1'
 
     b = numpy.asarray(numpy.linalg.inv(a.T), order='C', dtype=float)
@@ -1,20 +1,20 @@
 import numpy
 from pyscf import lib
 
-def _take_4d(a, indices):
+def _take_4d(a, indices, out=None):
     a_shape = a.shape
     ranges = []
     for i, s in enumerate(indices):
         if s is None:
             idx = numpy.arange(a_shape[i], dtype=numpy.int32)
         else:
-            idx = numpy.asarray(s, dtype=numpy.int32)
+            idx = numpy.array(s, dtype=numpy.int32)
             idx[idx < 0] += a_shape[i]
         ranges.append(idx)
     idx = ranges[0][:,None] * a_shape[1] + ranges[1]
     idy = ranges[2][:,None] * a_shape[3] + ranges[3]
     a = a.reshape(a_shape[0]*a_shape[1], a_shape[2]*a_shape[3])
-    out = lib.take_2d(a, idx.ravel(), idy.ravel())
+    out = lib.take_2d(a, idx.ravel(), idy.ravel(), out=out)
     return out.reshape([len(s) for s in ranges])
 
 def _takebak_4d(out, a, indices):
@@ -25,7 +25,7 @@ def _takebak_4d(out, a, indices):
         if s is None:
             idx = numpy.arange(a_shape[i], dtype=numpy.int32)
         else:
-            idx = numpy.asarray(s, dtype=numpy.int32)
+            idx = numpy.array(s, dtype=numpy.int32)
             idx[idx < 0] += out_shape[i]
         assert(len(idx) == a_shape[i])
         ranges.append(idx)
@@ -27,6 +27,7 @@ See Also:
 
 
 import numpy
+import scipy.linalg
 import pyscf.dft
 from pyscf import lib
 from pyscf.lib import logger
@@ -155,6 +156,108 @@ def get_rho(mf, dm=None, grids=None, kpt=None):
     return rho
 
 
+EIGENSOLVER = getattr(__config__, 'pbc_dft_rks_RKS_eigensolver', 'eigh')
+# number of virtual orbitals computed on top of the occupied orbitals
+EIG_NVIR = getattr(__config__, 'pbc_dft_rks_RKS_eig_nvir', 16)
+# dense eigh is used when nao is smaller than this
+EIG_MIN_NAO = getattr(__config__, 'pbc_dft_rks_RKS_eig_min_nao', 2000)
+EIG_MAX_CYCLE = getattr(__config__, 'pbc_dft_rks_RKS_eig_max_cycle', 15)
+# with smearing, the computed orbitals cover mu + EIG_SMEARING_WIDTH * sigma
+EIG_SMEARING_WIDTH = getattr(__config__, 'pbc_dft_rks_RKS_eig_smearing_width', 40)
+
+def eig_lobpcg(ks, h, s):
+    '''Lowest orbitals of the generalized eigenvalue problem h c = s c e
+    by LOBPCG.
+
+    The occupied orbitals plus ks.eig_nvir virtual orbitals are computed,
+    starting from the orbitals of the previous call.  The preconditioner
+    is the spectral decomposition of the last dense diagonalization.
+    Dense eigh is used for the first call, for systems smaller than
+    ks.eig_min_nao, and whenever LOBPCG does not converge.
+
+    Returns:
+        mo_energy and mo_coeff of the computed orbitals only.  At the end of
+        the SCF, RKS._finalize completes them by one dense diagonalization
+        of the last Fock matrix.
+    '''
+    ks._eig_h = h
+    nao = h.shape[0]
+    nocc = ks.cell.nelectron // 2
+    nroots = min(nao, max(ks._eig_nroots, nocc + ks.eig_nvir))
+    nvec = min(nao, nroots + ks.eig_nvir)
+    x0 = ks._eig_x0
+    if (nao < ks.eig_min_nao or nvec == nao or ks._eig_ref is None or
+            x0 is None or x0.shape != (nao, nvec)):
+        return _eig_dense(ks, h, s, nroots, nvec)
+
+    if ks.eig_conv_tol is None:
+        tol = min(1e-6, numpy.sqrt(ks.conv_tol) * .1)
+    else:
+        tol = ks.eig_conv_tol
+    e_ref, c_ref = ks._eig_ref
+    def precond(r, e, floor=.1):
+        de = e_ref[:,None] - e
+        de[abs(de) < floor] = numpy.copysign(floor, de[abs(de) < floor])
+        return lib.dot(c_ref, lib.dot(c_ref.conj().T, r) / de)
+
+    ks._eig_s = s
+    log = logger.new_logger(ks)
+    conv, e, c = lib.linalg_helper.lobpcg(h, s, x0, precond, tol,
+                                          ks.eig_max_cycle, nroots, verbose=log)
+    if not conv:
+        log.debug('LOBPCG not converged. Switch to dense eigh')
+        return _eig_dense(ks, h, s, nroots, nvec)
+
+    mu = getattr(ks, 'mu', None)
+    if getattr(ks, 'sigma', None) and mu is not None:
+        if e[nroots-1] < mu + EIG_SMEARING_WIDTH * ks.sigma:
+            log.debug('Not enough virtual orbitals for smearing. '
+                      'Switch to dense eigh')
+            return _eig_dense(ks, h, s, nroots, nvec)
+
+    idx = numpy.argmax(abs(c.real), axis=0)
+    c[:,c[idx,numpy.arange(nvec)].real<0] *= -1
+    ks._eig_x0 = c
+    return e[:nroots], c[:,:nroots]
+
+def _eig_dense(ks, h, s, nroots, nvec):
+    e, c = pbchf.RHF.eig(ks, h, s)
+    mu = getattr(ks, 'mu', None)
+    if getattr(ks, 'sigma', None) and mu is not None:
+        # extend the computed orbitals to cover the smearing window
+        nroots = max(nroots, numpy.count_nonzero(
+            e < mu + EIG_SMEARING_WIDTH * ks.sigma))
+        nvec = min(e.size, nroots + ks.eig_nvir)
+    ks._eig_nroots = nroots
+    ks._eig_ref = (e, c)
+    ks._eig_x0 = c[:,:nvec]
+    ks._eig_s = s
+    return e, c
+
+def get_grad(ks, mo_coeff, mo_occ, fock=None):
+    '''Orbital gradients.  When mo_coeff contains only part of the virtual
+    orbitals (see eig_lobpcg), the gradients against the missing virtual
+    orbitals are included through the residual
+    r = F C_occ - S C_occ (C_occ^\dagger F C_occ),  |g|^2 = r^\dagger S^{-1} r.
+    '''
+    nao, nmo = mo_coeff.shape
+    if nmo == nao:
+        return pbchf.RHF.get_grad(ks, mo_coeff, mo_occ, fock)
+    if fock is None:
+        dm1 = ks.make_rdm1(mo_coeff, mo_occ)
+        fock = ks.get_hcore(ks.cell) + ks.get_veff(ks.cell, dm1)
+    s = ks._eig_s
+    if s is None or s.shape[0] != nao:
+        s = ks._eig_s = ks.get_ovlp()
+    if ks._eig_s_chol is None or ks._eig_s_chol[0] is not s:
+        ks._eig_s_chol = (s, scipy.linalg.cho_factor(s, lower=True))
+    orbo = mo_coeff[:,mo_occ>0]
+    fo = lib.dot(fock, orbo)
+    r = fo - lib.dot(lib.dot(s, orbo), lib.dot(orbo.conj().T, fo))
+    l = ks._eig_s_chol[1][0]
+    g = scipy.linalg.solve_triangular(l, r, lower=True) * 2
+    return g.ravel()
+
 def _dft_common_init_(mf, xc='LDA,VWN'):
     mf.xc = xc
     mf.grids = gen_grid.UniformGrids(mf.cell)
@@ -192,17 +295,89 @@ class RKS(KohnShamDFT, pbchf.RHF):
 
     This is a literal duplication of the molecular RKS class with some `mol`
     variables replaced by `cell`.
+
+    Attributes for the eigensolver:
+        eigensolver : str
+            'eigh' (default) diagonalizes the Fock matrix densely.  'lobpcg'
+            computes only the occupied and eig_nvir virtual orbitals by
+            LOBPCG, warm-started from the previous SCF cycle.  During the
+            SCF, mo_energy and mo_coeff hold the computed orbitals only
+            and get_grad returns the residuals of the occupied orbitals
+            (nao*nocc elements).  After kernel(), the orbitals are
+            completed by one dense diagonalization, so mo_energy,
+            mo_coeff, the chkfile and get_grad have the usual shapes.
+        eig_nvir : int
+            Number of virtual orbitals computed by LOBPCG.  The block size
+            of LOBPCG is nocc + 2*eig_nvir.  With smearing, more virtual
+            orbitals are added to cover the smearing window.
+        eig_min_nao : int
+            Dense eigh is used for systems with fewer AOs.
+        eig_conv_tol : float
+            Convergence tolerance of the LOBPCG residuals.  Default is
+            0.1*sqrt(conv_tol), at most 1e-6.
+        eig_max_cycle : int
+            Max LOBPCG iterations before falling back to dense eigh.
     '''
     def __init__(self, cell, kpt=numpy.zeros(3), xc='LDA,VWN',
                  exxdiv=getattr(__config__, 'pbc_scf_SCF_exxdiv', 'ewald')):
         pbchf.RHF.__init__(self, cell, kpt, exxdiv=exxdiv)
         KohnShamDFT.__init__(self, xc)
+        self.eigensolver = EIGENSOLVER
+        self.eig_nvir = EIG_NVIR
+        self.eig_min_nao = EIG_MIN_NAO
+        self.eig_conv_tol = None
+        self.eig_max_cycle = EIG_MAX_CYCLE
+        self._eig_reset()
+        self._keys = self._keys.union(['eigensolver', 'eig_nvir', 'eig_min_nao',
+                                       'eig_conv_tol', 'eig_max_cycle'])
 
     def dump_flags(self, verbose=None):
         pbchf.RHF.dump_flags(self, verbose)
         KohnShamDFT.dump_flags(self, verbose)
+        if self.eigensolver != 'eigh':
+            logger.info(self, 'eigensolver = %s  eig_nvir = %d  eig_min_nao = %d',
+                        self.eigensolver, self.eig_nvir, self.eig_min_nao)
         return self
 
+    def reset(self, cell=None):
+        KohnShamDFT.reset(self, cell)
+        self._eig_reset()
+        return self
+
+    def _eig_reset(self):
+        self._eig_nroots = 0
+        self._eig_ref = None
+        self._eig_x0 = None
+        self._eig_s = None
+        self._eig_s_chol = None
+        self._eig_h = None
+
+    def eig(self, h, s):
+        if self.eigensolver == 'eigh':
+            return pbchf.RHF.eig(self, h, s)
+        elif self.eigensolver == 'lobpcg':
+            return eig_lobpcg(self, h, s)
+        else:
+            raise NotImplementedError('eigensolver %s' % self.eigensolver)
+
+    def get_grad(self, mo_coeff, mo_occ, fock=None):
+        return get_grad(self, mo_coeff, mo_occ, fock)
+
+    def _finalize(self):
+        mo_coeff = self.mo_coeff
+        if (mo_coeff is not None and mo_coeff.shape[1] < mo_coeff.shape[0]
+                and self._eig_h is not None):
+            # LOBPCG leaves part of the virtual orbitals out.  Complete the
+            # orbitals so that newton, stability, project_mo etc. see the
+            # full set.
+            logger.debug(self, 'Complete the LOBPCG orbitals by dense eigh')
+            self.mo_energy, self.mo_coeff = pbchf.RHF.eig(self, self._eig_h,
+                                                          self._eig_s)
+            self.mo_occ = self.get_occ(self.mo_energy, self.mo_coeff)
+            self.dump_chk({'e_tot': self.e_tot, 'mo_energy': self.mo_energy,
+                           'mo_coeff': self.mo_coeff, 'mo_occ': self.mo_occ})
+        return pbchf.RHF._finalize(self)
+
     get_veff = get_veff
     energy_elec = pyscf.dft.rks.energy_elec
     get_rho = get_rho
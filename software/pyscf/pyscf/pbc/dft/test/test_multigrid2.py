@@ -47,6 +47,431 @@ class KnownValues(unittest.TestCase):
         e1 = mf1.kernel()
         self.assertAlmostEqual(abs(e_ref-e1).max(), 0, 6)
 
+    def test_orth_rks_gga_xc_screen(self):
+        mf1.xc = 'pbe,pbe'
+        e_ref = mf1.kernel()
+        mf2 = dft.RKS(cell)
+        mf2.xc = mf1.xc
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2.with_df.xc_screen_threshold = 1e-10
+        e1 = mf2.kernel()
+        self.assertAlmostEqual(abs(e_ref-e1).max(), 0, 7)
+
+    def test_orth_rks_xc_blocked(self):
+        mf_ref = dft.RKS(cell)
+        mf_ref.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2 = dft.RKS(cell)
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2.with_df.max_memory = 0  # enforce blocked XC evaluation
+        mf2.with_df.xc_blksize = 1000
+        dm = mf_ref.get_init_guess()
+        for xc in ('lda,vwn', 'pbe,pbe'):
+            mf_ref.xc = mf2.xc = xc
+            v_ref = mf_ref.get_veff(cell, dm)
+            v1 = mf2.get_veff(cell, dm)
+            self.assertAlmostEqual(abs(v_ref-v1).max(), 0, 9)
+            self.assertAlmostEqual(abs(v_ref.exc-v1.exc).max(), 0, 9)
+
+    def test_get_rho_f32(self):
+        dm = mf1.get_init_guess()
+        rho_ref = mf1.with_df.get_rho(dm)
+        rho = mf1.with_df.get_rho(dm, dtype=numpy.float32)
+        self.assertEqual(rho.dtype, numpy.float32)
+        self.assertAlmostEqual(abs(rho-rho_ref).max()/abs(rho_ref).max(), 0, 6)
+
+        # non-orthogonal lattice
+        from pyscf.pbc.dft.multigrid import multigrid_pair
+        cell1 = cell.copy()
+        cell1.a = numpy.array([[5.,0,0],[1.2,5.,0],[0.7,-0.9,5.5]])
+        cell1.build()
+        dm = dft.RKS(cell1).get_init_guess()
+        task_list = multigrid_pair.multi_grids_tasks(cell1, ngrids=2, hermi=1)
+        nlevels = task_list.contents.nlevels
+        meshes = task_list.contents.gridlevel_info.contents.mesh
+        meshes = numpy.ctypeslib.as_array(meshes, shape=(nlevels,3))
+        rs_ref = multigrid_pair.eval_rho(cell1, dm, task_list, hermi=1)
+        rs_f32 = multigrid_pair.eval_rho(cell1, dm, task_list, hermi=1,
+                                         dtype=numpy.float32)
+        for ilevel, mesh in enumerate(meshes):
+            ngrids = numpy.prod(mesh)
+            rho_ref = numpy.ctypeslib.as_array(rs_ref.contents.data[ilevel],
+                                               shape=(ngrids,))
+            rho = numpy.ctypeslib.as_array(rs_f32.contents.data[ilevel],
+                                           shape=(ngrids,))
+            self.assertEqual(rho.dtype, numpy.float32)
+            self.assertTrue(abs(rho-rho_ref).max()/abs(rho_ref).max() < 1e-6)
+        multigrid_pair.free_rs_grid(rs_ref)
+        multigrid_pair.free_rs_grid(rs_f32)
+        multigrid_pair.free_task_list(task_list)
+
+    def test_gspace_cache(self):
+        mf2 = dft.RKS(cell)
+        mf2.xc = 'pbe,pbe'
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2.with_df.gspace_cache_max_memory = 0
+        dm = mf2.get_init_guess()
+        v_ref = mf2.get_veff(cell, dm)
+        self.assertEqual(len(mf2.with_df._gspace_cache), 0)
+
+        mf2.with_df.reset()
+        mf2.with_df.gspace_cache_max_memory = 2000
+        v0 = mf2.get_veff(cell, dm)
+        v1 = mf2.get_veff(cell, dm)
+        stats = mf2.with_df._gspace_cache_stats
+        self.assertTrue(stats['hits'] > 0)
+        self.assertAlmostEqual(abs(v_ref-v0).max(), 0, 12)
+        self.assertAlmostEqual(abs(v_ref-v1).max(), 0, 12)
+        mf2.with_df.reset()
+        self.assertEqual(len(mf2.with_df._gspace_cache), 0)
+
+    def test_eval_rhoG_stream(self):
+        df = multigrid.MultiGridFFTDF2(cell)
+        dm = mf1.get_init_guess()
+        rho_ref = df.get_rho(dm)
+        rho32_ref = df.get_rho(dm, dtype=numpy.float32)
+        df.rhog_stream = True
+        # the FFTs of all but the full-mesh level run in one reused buffer
+        from pyscf.pbc.dft.multigrid import multigrid_pair
+        bufs = []
+        def fft_inplace(a, mesh, func='fft'):
+            bufs.append(a.ctypes.data)
+            return fft_inplace_orig(a, mesh, func)
+        fft_inplace_orig = multigrid_pair._fft_inplace
+        try:
+            multigrid_pair._fft_inplace = fft_inplace
+            rho = df.get_rho(dm)
+        finally:
+            multigrid_pair._fft_inplace = fft_inplace_orig
+        self.assertEqual(len(bufs), df.task_list.contents.nlevels)
+        self.assertEqual(len(set(bufs[1:])), 1)
+        rho32 = df.get_rho(dm, dtype=numpy.float32)
+        self.assertAlmostEqual(abs(rho-rho_ref).max(), 0, 12)
+        self.assertAlmostEqual(abs(rho32-rho32_ref).max(), 0, 5)
+
+        mf_ref = dft.RKS(cell)
+        mf_ref.xc = 'pbe,pbe'
+        mf_ref.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2 = dft.RKS(cell)
+        mf2.xc = 'pbe,pbe'
+        mf2.with_df = df
+        v_ref = mf_ref.get_veff(cell, dm)
+        v1 = mf2.get_veff(cell, dm)
+        self.assertAlmostEqual(abs(v_ref-v1).max(), 0, 9)
+
+    def test_profiler_phases(self):
+        from pyscf.lib import profiler
+        mf2 = dft.RKS(cell)
+        mf2.xc = 'pbe,pbe'
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2.with_df.rhog_stream = True
+        dm = mf1.get_init_guess()
+        with profiler.profile() as prof:
+            mf2.get_veff(cell, dm)
+            rec = prof.record()
+        nlevels = mf2.with_df.task_list.contents.nlevels
+        for name in ('multigrid.task_list', 'multigrid.collocate', 'multigrid.fft',
+                     'multigrid.xc', 'multigrid.integrate', 'multigrid.pass2',
+                     'multigrid.rhoG', 'multigrid.collocate.level0'):
+            self.assertTrue(name in rec['phases'])
+        self.assertEqual(rec['phases']['multigrid.collocate.level%d' % (nlevels-1)]['count'], 1)
+
+    def test_get_j_pass2(self):
+        from pyscf.pbc import tools
+        from pyscf.pbc.dft.multigrid import multigrid_pair
+        df = multigrid.MultiGridFFTDF2(cell)
+        dm = mf1.get_init_guess()
+        vG = multigrid_pair._eval_rhoG(df, dm)[:,0]
+        vG = vG.reshape(-1, *df.mesh)
+        # the inverse FFTs of all levels run in one reused buffer
+        bufs = []
+        def fft_inplace(a, mesh, func='fft'):
+            bufs.append(a.ctypes.data)
+            return fft_inplace_orig(a, mesh, func)
+        fft_inplace_orig = multigrid_pair._fft_inplace
+        try:
+            multigrid_pair._fft_inplace = fft_inplace
+            vj = multigrid_pair._get_j_pass2(df, vG)
+        finally:
+            multigrid_pair._fft_inplace = fft_inplace_orig
+        self.assertEqual(len(bufs), df.task_list.contents.nlevels)
+        self.assertEqual(len(set(bufs)), 1)
+
+        task_list = df.task_list
+        nlevels = task_list.contents.nlevels
+        meshes = task_list.contents.gridlevel_info.contents.mesh
+        meshes = numpy.ctypeslib.as_array(meshes, shape=(nlevels,3))
+        vj_ref = 0
+        for ilevel, mesh in enumerate(meshes):
+            gx, gy, gz = [numpy.fft.fftfreq(n, 1./n).astype(int) for n in mesh]
+            sub_vG = vG[:,gx[:,None,None],gy[:,None],gz].reshape(1,-1)
+            vR = tools.ifft(sub_vG, mesh).real[0]
+            vj_ref += multigrid_pair.eval_mat(cell, vR, task_list, hermi=1,
+                                              grid_level=ilevel, mesh=mesh)
+        self.assertAlmostEqual(abs(vj-vj_ref).max(), 0, 12)
+
+    def test_eval_rho_gga(self):
+        from pyscf.pbc.dft.multigrid import multigrid_pair
+        cell1 = cell.copy()
+        cell1.a = numpy.array([[5.,0,0],[1.2,5.,0],[0.7,-0.9,5.5]])
+        cell1.build()
+        for c in (cell, cell1):
+            dm = dft.RKS(c).get_init_guess()
+            dm = dm + numpy.random.RandomState(2).rand(*dm.shape) * .01
+            dm = dm + dm.T
+            task_list = multigrid_pair.multi_grids_tasks(c, ngrids=1, hermi=1)
+            mesh = task_list.contents.gridlevel_info.contents.mesh
+            mesh = numpy.ctypeslib.as_array(mesh, shape=(3,))
+            ao = dft.numint.eval_ao(c, c.get_uniform_grids(mesh), deriv=1)
+            rho_ref = dft.numint.eval_rho(c, ao, dm, xctype='GGA')
+            rs_rho = multigrid_pair.eval_rho(c, dm, task_list, hermi=1, xctype='GGA')
+            rho = numpy.ctypeslib.as_array(rs_rho.contents.data[0],
+                                           shape=(4,numpy.prod(mesh)))
+            self.assertAlmostEqual(abs(rho-rho_ref).max(), 0, 7)
+            multigrid_pair.free_rs_grid(rs_rho)
+
+    def test_nonorth_core_density_and_mat(self):
+        from pyscf.pbc.dft.multigrid import multigrid_pair, pp
+        from pyscf.pbc.gto.pseudo import pp_int
+        cell1 = cell.copy()
+        cell1.a = numpy.array([[5.,0,0],[1.2,5.,0],[0.7,-0.9,5.5]])
+        cell1.build()
+        coords = cell1.get_uniform_grids(cell1.mesh)
+        fakecell = pp_int.fake_cell_vloc_part1(cell1)[0]
+        rho_ref = 0
+        for ib in range(fakecell.nbas):
+            ia = fakecell.bas_atom(ib)
+            alpha = fakecell.bas_exp(ib)[0]
+            coeff = fakecell._env[fakecell._bas[ib,6]]
+            for L in cell1.get_lattice_Ls(rcut=15.):
+                r = coords - fakecell.atom_coord(ia) - L
+                rho_ref = rho_ref - (cell1.atom_charge(ia) * coeff *
+                                     numpy.exp(-alpha * numpy.einsum('gx,gx->g', r, r)))
+        rho = pp.make_rho_core(cell1)
+        self.assertAlmostEqual(abs(rho-rho_ref).max(), 0, 9)
+
+        task_list = multigrid_pair.multi_grids_tasks(cell1, ngrids=1, hermi=1)
+        mesh = task_list.contents.gridlevel_info.contents.mesh
+        mesh = numpy.ctypeslib.as_array(mesh, shape=(3,))
+        coords = cell1.get_uniform_grids(mesh)
+        v = numpy.cos(coords[:,0]) * numpy.sin(2*coords[:,1]+coords[:,2]) + 1.
+        v *= cell1.vol / numpy.prod(mesh)
+        ao = dft.numint.eval_ao(cell1, coords)
+        mat_ref = ao.T.dot(ao * v[:,None])
+        mat = multigrid_pair.eval_mat(cell1, v, task_list, hermi=1,
+                                      grid_level=0, mesh=mesh)
+        self.assertAlmostEqual(abs(mat-mat_ref).max(), 0, 7)
+
+        mf_ref = dft.RKS(cell1)
+        mf_ref.with_df = multigrid.MultiGridFFTDF(cell1)
+        mf2 = dft.RKS(cell1)
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell1)
+        self.assertAlmostEqual(mf2.kernel()-mf_ref.kernel(), 0, 6)
+
+        dm = mf2.make_rdm1()
+        rho_ref = mf2.with_df.get_rho(dm)
+        rho = mf2.with_df.get_rho(dm, dtype=numpy.float32)
+        self.assertAlmostEqual(abs(rho-rho_ref).max()/abs(rho_ref).max(), 0, 6)
+
+    def test_orth_uks(self):
+        mf_ref = dft.RKS(cell)
+        mf_ref.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2 = dft.UKS(cell)
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf3 = dft.UKS(cell)
+        mf3.with_df = multigrid.MultiGridFFTDF(cell)
+        dm = mf_ref.get_init_guess()
+        for xc in ('lda,vwn', 'pbe,pbe'):
+            mf_ref.xc = mf2.xc = mf3.xc = xc
+            v_ref = mf_ref.get_veff(cell, dm)
+            v1 = mf2.get_veff(cell, numpy.array((dm*.5, dm*.5)))
+            self.assertAlmostEqual(abs(v1[0]-v_ref).max(), 0, 12)
+            self.assertAlmostEqual(abs(v1[1]-v_ref).max(), 0, 12)
+            self.assertAlmostEqual(abs(v1.exc-v_ref.exc).max(), 0, 12)
+            self.assertAlmostEqual(abs(v1.ecoul-v_ref.ecoul).max(), 0, 12)
+        # kernel() caches vpplocG_part1 in with_df which changes veff
+        for xc in ('lda,vwn', 'pbe,pbe'):
+            mf2.xc = mf3.xc = xc
+            self.assertAlmostEqual(abs(mf2.kernel()-mf3.kernel()), 0, 6)
+
+        dm0 = mf2.make_rdm1()
+        dm1 = numpy.random.RandomState(1).rand(*dm0.shape) * .01
+        dm1 = dm1 + dm1.transpose(0,2,1)
+        eps = 1e-4
+        v_ref = (mf2.get_veff(cell, dm0+eps*dm1) -
+                 mf2.get_veff(cell, dm0-eps*dm1)) / (2*eps)
+        v1 = mf2.gen_response(hermi=1)(dm1)
+        self.assertAlmostEqual(abs(v1-v_ref).max(), 0, 8)
+
+    def test_gen_response(self):
+        from pyscf.pbc.dft.multigrid import multigrid_pair
+        calls = []
+        def cache_xc_kernel(*args, **kwargs):
+            calls.append(1)
+            return cache_xc_kernel_orig(*args, **kwargs)
+        cache_xc_kernel_orig = multigrid_pair.cache_xc_kernel
+        mf2 = dft.UKS(cell)
+        mf2.xc = 'lda,vwn'
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf2.kernel()
+        try:
+            multigrid_pair.cache_xc_kernel = cache_xc_kernel
+            mf2.gen_response(hermi=1)
+        finally:
+            multigrid_pair.cache_xc_kernel = cache_xc_kernel_orig
+        self.assertEqual(len(calls), 1)
+
+        mf_r = dft.RKS(cell)
+        mf_r.xc = 'lda,vwn'
+        mf_r.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf_r.kernel()
+        dm0 = mf_r.make_rdm1()
+        dm1 = numpy.random.RandomState(1).rand(*dm0.shape) * .01
+        dm1 = dm1 + dm1.T
+        eps = 1e-4
+        v_ref = (mf_r.get_veff(cell, dm0+eps*dm1) -
+                 mf_r.get_veff(cell, dm0-eps*dm1)) / (2*eps)
+        v1 = mf_r.gen_response(hermi=1)(dm1)
+        self.assertAlmostEqual(abs(v1-v_ref).max(), 0, 8)
+
+    def test_kuks_kpts(self):
+        kpts = cell.make_kpts([2,1,1])
+        mf_ref = dft.KUKS(cell, kpts)
+        mf_ref.with_df = multigrid.MultiGridFFTDF(cell)
+        mf2 = dft.KUKS(cell, kpts)
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+        dm = mf_ref.get_init_guess()
+        v_ref = mf_ref.get_veff(cell, dm)
+        v1 = mf2.get_veff(cell, dm)
+        self.assertAlmostEqual(abs(v1-v_ref).max(), 0, 7)
+
+    def test_autotune(self):
+        import os, tempfile
+        from pyscf.pbc.dft.multigrid import autotune
+        mf_ref = dft.RKS(cell)
+        mf_ref.xc = 'lda,vwn'
+        mf_ref.with_df = multigrid.MultiGridFFTDF2(cell)
+        mf_ref.with_df.ngrids = 1
+        e_ref = mf_ref.kernel()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'autotune.json')
+            mf2 = dft.RKS(cell)
+            mf2.xc = 'lda,vwn'
+            mf2.with_df = multigrid.MultiGridFFTDF2(cell)
+            mf2.with_df.autotune = True
+            mf2.with_df.autotune_file = fname
+            mf2.with_df.autotune_candidates = ((4, 3., 20.), (2, 4., 20.), (2, 30., 1.))
+            e1 = mf2.kernel()
+            self.assertAlmostEqual(e1, e_ref, 5)
+            config = (mf2.with_df.ngrids, mf2.with_df.ke_ratio, mf2.with_df.rel_cutoff)
+            self.assertTrue(config != (2, 30., 1.))
+            key = autotune.autotune_key(cell)
+            self.assertEqual(autotune.load(fname)[key]['ngrids'], config[0])
+
+            # the stored choice is reused without benchmarking
+            autotune._choices.clear()
+            mf3 = dft.RKS(cell)
+            mf3.xc = 'lda,vwn'
+            mf3.with_df = multigrid.MultiGridFFTDF2(cell)
+            mf3.with_df.autotune = True
+            mf3.with_df.autotune_file = fname
+            mf3.with_df.autotune_candidates = ()
+            self.assertAlmostEqual(mf3.kernel(), e1, 9)
+            self.assertEqual((mf3.with_df.ngrids, mf3.with_df.ke_ratio,
+                              mf3.with_df.rel_cutoff), config)
+
+            # concurrent runs merge their choices into the same file
+            import multiprocessing
+            ctx = multiprocessing.get_context('fork')
+            procs = [ctx.Process(target=autotune.dump,
+                                 args=(fname, {'key%d' % i: {'ngrids': i}}))
+                     for i in range(8)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            data = autotune.load(fname)
+            self.assertEqual([data['key%d' % i]['ngrids'] for i in range(8)],
+                             list(range(8)))
+            self.assertTrue(key in data)
+
+    def test_sccs_warm_start(self):
+        from pyscf.solvent import sccs
+        from pyscf.pbc.dft.multigrid.pp import make_rho_core
+        dm = mf1.get_init_guess()
+        rho = mf1.with_df.get_rho(dm).ravel()
+        rho_core = make_rho_core(cell)
+        sol = sccs.SCCS(cell, cell.mesh)
+        sol.conv_tol = 1e-8
+        sol.adaptive_conv_tol = False
+        e0 = sol.kernel(rho, rho_core)[0]
+        ncycle = sol.cycles
+        # restarting from the converged polarization density
+        e1 = sol.kernel(rho, rho_core)[0]
+        self.assertAlmostEqual(e1, e0, 9)
+        self.assertTrue(sol.cycles < 5)
+        self.assertEqual(sol.total_cycles, ncycle + sol.cycles)
+        self.assertEqual(len(sol._gspace), 1)
+
+        sol.reset()
+        sol.adaptive_conv_tol = True
+        e2 = sol.kernel(rho, rho_core)[0]
+        self.assertTrue(sol.cycles < ncycle)
+        self.assertAlmostEqual(e2, e0, 3)
+
+    def test_rks_engine(self):
+        from pyscf.md.rks_engine import RKSEngine
+        cell1 = cell.copy()
+        mf2 = dft.RKS(cell1, xc='pbe')
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell1)
+        engine = RKSEngine(mf2)
+        coords0 = cell.atom_coords()
+        box = cell.lattice_vectors()
+        for step in range(3):
+            coords = coords0 + numpy.sin(numpy.arange(9).reshape(3,3) + step) * .02
+            e, f, v, init_dict = engine(coords, box)
+
+        cell2 = cell.copy()
+        cell2.unit = 'B'
+        cell2.a = box
+        cell2.atom = [(cell.atom_symbol(i), x) for i, x in enumerate(coords)]
+        cell2.build()
+        ref = dft.RKS(cell2, xc='pbe')
+        ref.with_df = multigrid.MultiGridFFTDF2(cell2)
+        self.assertAlmostEqual(e, ref.kernel(), 8)
+        self.assertAlmostEqual(abs(f + rks_grad.Gradients(ref).kernel()).max(), 0, 5)
+        self.assertEqual(len(engine.timings), 3)
+        self.assertTrue(engine.timings[2]['scf_cycles'] < engine.timings[0]['scf_cycles'])
+        self.assertTrue(len(mf2.with_df._gspace_cache) > 0)
+
+    def test_rks_engine_box(self):
+        from pyscf.md.rks_engine import RKSEngine
+        cell1 = cell.copy()
+        mf2 = dft.RKS(cell1, xc='pbe')
+        mf2.with_df = multigrid.MultiGridFFTDF2(cell1)
+        engine = RKSEngine(mf2)
+        coords = cell.atom_coords()
+        engine(coords, cell.lattice_vectors())
+        mesh0 = cell1.mesh.copy()
+        # the box shrinks: the mesh, grids and G-space data must follow
+        box = cell.lattice_vectors() * .9
+        e, f = engine(coords, box)[:2]
+        self.assertAlmostEqual(abs(cell1.lattice_vectors() - box).max(), 0, 12)
+        self.assertTrue(any(cell1.mesh != mesh0))
+        self.assertEqual(list(mf2.grids.mesh), list(cell1.mesh))
+        self.assertEqual(list(mf2.with_df.mesh), list(cell1.mesh))
+
+        cell2 = cell.copy()
+        cell2.unit = 'B'
+        cell2.a = box
+        cell2.atom = [(cell.atom_symbol(i), x) for i, x in enumerate(coords)]
+        cell2.build()
+        self.assertEqual(list(cell2.mesh), list(cell1.mesh))
+        ref = dft.RKS(cell2, xc='pbe')
+        ref.with_df = multigrid.MultiGridFFTDF2(cell2)
+        self.assertAlmostEqual(e, ref.kernel(), 8)
+        self.assertAlmostEqual(abs(f + rks_grad.Gradients(ref).kernel()).max(), 0, 5)
+
     def test_orth_rks_grad_lda(self):
         mf1.xc = 'lda, vwn'
         mf1.kernel()
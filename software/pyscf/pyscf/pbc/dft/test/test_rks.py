@@ -123,6 +123,68 @@ class KnownValues(unittest.TestCase):
         mf.conv_check = False
         self.assertAlmostEqual(mf.scf(dm), -4.7090816314173365, 8)
 
+    def test_lobpcg_eigensolver(self):
+        from pyscf.pbc.scf import addons, chkfile
+        L = 4.
+        cell = pbcgto.Cell()
+        cell.a = np.eye(3)*L
+        cell.atom =[['He' , ( L/2+0., L/2+0. ,   L/2+1.)],
+                    ['He' , ( L/2+1., L/2+0. ,   L/2+1.)]]
+        cell.basis = {'He': 'ccpvdz'}
+        cell.mesh = [21] * 3
+        cell.build()
+        mf0 = pbcdft.RKS(cell)
+        e_ref = mf0.kernel()
+        mf = pbcdft.RKS(cell)
+        mf.eigensolver = 'lobpcg'
+        mf.eig_min_nao = 0
+        mf.eig_nvir = 2
+        self.assertAlmostEqual(mf.kernel(), e_ref, 8)
+        # the orbitals are completed after the SCF
+        self.assertEqual(mf.mo_coeff.shape, mf0.mo_coeff.shape)
+        self.assertAlmostEqual(abs(mf.mo_energy - mf0.mo_energy).max(), 0, 5)
+        g = mf.get_grad(mf.mo_coeff, mf.mo_occ)
+        self.assertEqual(g.shape, mf0.get_grad(mf0.mo_coeff, mf0.mo_occ).shape)
+        self.assertAlmostEqual(np.linalg.norm(g), 0, 4)
+        mo_coeff = chkfile.load(mf.chkfile, 'scf/mo_coeff')
+        self.assertEqual(mo_coeff.shape, mf0.mo_coeff.shape)
+
+        mf = addons.smearing_(pbcdft.RKS(cell), .1, 'fermi')
+        e_ref = mf.kernel()
+        mf = addons.smearing_(pbcdft.RKS(cell), .1, 'fermi')
+        mf.eigensolver = 'lobpcg'
+        mf.eig_min_nao = 0
+        mf.eig_nvir = 2
+        self.assertAlmostEqual(mf.kernel(), e_ref, 8)
+
+    def test_lobpcg_new_geometry(self):
+        L = 4.
+        cell = pbcgto.Cell()
+        cell.a = np.eye(3)*L
+        cell.atom =[['He' , ( L/2+0., L/2+0. ,   L/2+1.)],
+                    ['He' , ( L/2+1., L/2+0. ,   L/2+1.)]]
+        cell.basis = {'He': 'ccpvdz'}
+        cell.mesh = [21] * 3
+        cell.verbose = 0
+        cell.build()
+        mf = pbcdft.RKS(cell)
+        mf.eigensolver = 'lobpcg'
+        mf.eig_min_nao = 0
+        mf.eig_nvir = 2
+        mf.kernel()
+        # move an atom and restart without reset(), which would discard the
+        # eigensolver state; only the incore ERIs depend on the geometry.
+        # The overlap used by get_grad must follow the geometry.
+        cell.set_geom_([['He' , ( L/2+0., L/2+0. ,   L/2+1.)],
+                        ['He' , ( L/2+.8, L/2+.1 ,   L/2+1.)]], inplace=True)
+        mf._eri = None
+        e1 = mf.kernel(mf.make_rdm1())
+        self.assertTrue(mf._eig_s is not None)
+        self.assertAlmostEqual(abs(mf._eig_s - mf.get_ovlp()).max(), 0, 12)
+        self.assertAlmostEqual(np.linalg.norm(mf.get_grad(mf.mo_coeff, mf.mo_occ)), 0, 4)
+        e_ref = pbcdft.RKS(cell).kernel()
+        self.assertAlmostEqual(e1, e_ref, 8)
+
     def test_density_fit(self):
         L = 4.
         cell = pbcgto.Cell()
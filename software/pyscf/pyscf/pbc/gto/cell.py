@@ -21,6 +21,8 @@ import sys
 import json
 import ctypes
 import warnings
+import threading
+import collections
 import numpy as np
 import scipy.linalg
 try:
@@ -52,6 +54,9 @@ WITH_GAMMA = getattr(__config__, 'pbc_gto_cell_make_kpts_with_gamma', True)
 EXP_DELIMITER = getattr(__config__, 'pbc_gto_cell_split_basis_exp_delimiter',
                         [1.0, 0.5, 0.25, 0.1, 0])
 RCUT_EPS = 1e-3
+# Number of shells kept in the process-wide cache of screening radii and
+# energy cutoffs (0 to disable the cache)
+SCREENING_CACHE_SIZE = getattr(__config__, 'pbc_gto_cell_screening_cache_size', 8192)
 # cutoff penalty due to lattice summation
 LATTICE_SUM_PENALTY = 1e-1
 
@@ -179,6 +184,7 @@ def copy(cell):
     import copy
     newcell = mole.copy(cell)
     newcell._pseudo = copy.deepcopy(cell._pseudo)
+    newcell._memo = {}
     return newcell
 
 def pack(cell):
@@ -209,7 +215,7 @@ def unpack(celldic):
 def dumps(cell):
     '''Serialize Cell object to a JSON formatted str.
     '''
-    exclude_keys = set(('output', 'stdout', '_keys'))
+    exclude_keys = set(('output', 'stdout', '_keys', '_memo'))
 
     celldic = dict(cell.__dict__)
     for k in exclude_keys:
@@ -540,9 +546,13 @@ def _rcut_by_shells_c(cell, precision=None, rcut=5., return_pgf_radius=False):
     # each type of atoms.
     if precision is None:
         precision = cell.precision
+    return _rcut_by_shells_bas(cell._bas, cell._env, precision, rcut,
+                               return_pgf_radius)
 
-    bas = np.asarray(cell._bas, order='C')
-    env = np.asarray(cell._env, order='C')
+def _rcut_by_shells_bas(bas, env, precision, rcut=5., return_pgf_radius=False):
+    '''_rcut_by_shells_c for the shells bas'''
+    bas = np.asarray(bas, order='C', dtype=np.int32)
+    env = np.asarray(env, order='C', dtype=float)
     nbas = len(bas)
     shell_radius = np.empty((nbas,), order='C', dtype=float)
     if return_pgf_radius:
@@ -566,6 +576,62 @@ def _rcut_by_shells_c(cell, precision=None, rcut=5., return_pgf_radius=False):
         return shell_radius, pgf_radius
     return shell_radius
 
+# Process-wide cache of per-shell screening data.  The keys hold the
+# content of the shell (angular momentum, exponents and contraction
+# coefficients) rather than the element and basis name, so that cells of
+# different molecules with the same element/basis pairs share the entries,
+# and a modified basis (custom basis, exp_to_discard, changed _env) can
+# never hit a stale entry.  The parameters of the estimate (precision, ...)
+# are part of the keys.  clear_screening_cache() empties the cache.
+_screening_cache = collections.OrderedDict()
+_screening_cache_lock = threading.Lock()
+
+def clear_screening_cache():
+    '''Empty the process-wide cache of shell radii and energy cutoffs'''
+    with _screening_cache_lock:
+        _screening_cache.clear()
+
+def _unique_shells(cell):
+    '''Content keys of the distinct shells of cell and the index of each
+    shell in the list of distinct shells.'''
+    env = cell._env
+    # Atoms of the same type share the exponents and coefficients in _env
+    sig = cell._bas[:,[mole.ANG_OF, mole.NPRIM_OF, mole.NCTR_OF,
+                       mole.PTR_EXP, mole.PTR_COEFF]].tolist()
+    uniq = {}
+    inv = [uniq.setdefault(tuple(x), len(uniq)) for x in sig]
+    ish = np.empty(len(uniq), dtype=int)
+    ish[inv] = np.arange(len(sig))
+    keys = [(l, nprim, nctr, env[pexp:pexp+nprim].tobytes(),
+             env[pcoeff:pcoeff+nprim*nctr].tobytes())
+            for l, nprim, nctr, pexp, pcoeff in uniq]
+    return keys, ish, np.asarray(inv)
+
+def _cached_by_shells(cell, kind, params, compute):
+    '''Per-shell values from the screening cache.  compute(shell_ids)
+    evaluates the missing ones for the given shells of cell.'''
+    if len(cell._bas) == 0:
+        return [], np.zeros(0, dtype=int)
+    keys, ish, inv = _unique_shells(cell)
+    keys = [(kind, params, k) for k in keys]
+    vals = [None] * len(keys)
+    with _screening_cache_lock:
+        for i, k in enumerate(keys):
+            vals[i] = _screening_cache.get(k)
+            if vals[i] is not None:
+                _screening_cache.move_to_end(k)
+    missing = [i for i, v in enumerate(vals) if v is None]
+    if missing:
+        for i, v in zip(missing, compute(ish[missing])):
+            vals[i] = v
+        if SCREENING_CACHE_SIZE > 0:
+            with _screening_cache_lock:
+                for i in missing:
+                    _screening_cache[keys[i]] = vals[i]
+                while len(_screening_cache) > SCREENING_CACHE_SIZE:
+                    _screening_cache.popitem(last=False)
+    return vals, inv
+
 def rcut_by_atom_types(cell, precision=None, rcut=5., atom_types=None):
     if precision is None:
         precision = cell.precision
@@ -587,9 +653,35 @@ def rcut_by_shells(cell, precision=None, rcut=5., return_pgf_radius=False):
     if precision is None:
         precision = cell.precision
 
-    # C code is much faster
-    return _rcut_by_shells_c(cell, precision=precision, rcut=rcut,
-                             return_pgf_radius=return_pgf_radius)
+    # Memoized for the current content of _bas and _env
+    key = ('rcut_by_shells', precision, rcut, return_pgf_radius)
+    data = (cell._bas.tobytes(), cell._env.tobytes())
+    memo = _memo(cell)
+    hit = memo.get(key)
+    if hit is not None and hit[0] == data:
+        out = hit[1]
+    else:
+        def compute(shls):
+            # C code is much faster
+            r, pgf_r = _rcut_by_shells_bas(cell._bas[shls], cell._env,
+                                           precision, rcut, True)
+            nprim = cell._bas[shls,mole.NPRIM_OF]
+            return [(r[i], pgf_r[i,:n].copy()) for i, n in enumerate(nprim)]
+        vals, inv = _cached_by_shells(cell, 'rcut_by_shells',
+                                      (precision, rcut, RCUT_EPS), compute)
+        shell_radius = np.array([v[0] for v in vals], dtype=float)[inv]
+        if return_pgf_radius:
+            nprim = max([len(v[1]) for v in vals] + [0])
+            pgf_radius = np.zeros((len(vals), nprim))
+            for i, v in enumerate(vals):
+                pgf_radius[i,:len(v[1])] = v[1]
+            out = (shell_radius, pgf_radius[inv])
+        else:
+            out = shell_radius
+        memo[key] = (data, out)
+    if return_pgf_radius:
+        return out[0].copy(), out[1].copy()
+    return out.copy()
 
     if len(cell._atom) != (np.unique(cell._bas[:,0]).max() + 1):
         # possibly a concatenated cell, for which atom types are unknown
@@ -637,14 +729,23 @@ def _estimate_ke_cutoff(alpha, l, c, precision=INTEGRAL_PRECISION, weight=1.):
 
 def estimate_ke_cutoff(cell, precision=INTEGRAL_PRECISION):
     '''Energy cutoff estimation'''
-    Ecut_max = 0
-    for i in range(cell.nbas):
-        l = cell.bas_angular(i)
-        es = cell.bas_exp(i)
-        cs = abs(cell.bas_ctr_coeff(i)).max(axis=1)
-        ke_guess = _estimate_ke_cutoff(es, l, cs, precision)
-        Ecut_max = max(Ecut_max, ke_guess.max())
-    return Ecut_max
+    def compute(shls):
+        ke = []
+        for i in shls:
+            l = cell.bas_angular(i)
+            es = cell.bas_exp(i)
+            cs = abs(cell.bas_ctr_coeff(i)).max(axis=1)
+            ke.append(_estimate_ke_cutoff(es, l, cs, precision).max())
+        return ke
+    vals = _cached_by_shells(cell, 'ke_cutoff', precision, compute)[0]
+    return max([0] + vals)
+
+def _bas_rcuts(cell, precision=INTEGRAL_PRECISION):
+    '''bas_rcut of all shells'''
+    def compute(shls):
+        return [bas_rcut(cell, i, precision) for i in shls]
+    vals, inv = _cached_by_shells(cell, 'bas_rcut', precision, compute)
+    return np.array(vals, dtype=float)[inv]
 
 def error_for_ke_cutoff(cell, ke_cutoff):
     kmax = np.sqrt(ke_cutoff*2)
@@ -904,21 +1005,16 @@ def ewald(cell, ew_eta=None, ew_cut=None):
     if cell.natm == 0:
         return 0
 
+    from pyscf.pbc.gto import ewald_methods
     if cell.dimension == 3:
-        from pyscf.pbc.gto import ewald_methods
         return ewald_methods.particle_mesh_ewald(cell, ew_eta, ew_cut)
 
     if ew_eta is None: ew_eta = cell.get_ewald_params()[0]
     if ew_cut is None: ew_cut = cell.get_ewald_params()[1]
     chargs = cell.atom_charges()
     coords = cell.atom_coords()
-    Lall = cell.get_lattice_Ls(rcut=ew_cut)
 
-    rLij = coords[:,None,:] - coords[None,:,:] + Lall[:,None,None,:]
-    r = np.sqrt(np.einsum('Lijx,Lijx->Lij', rLij, rLij))
-    rLij = None
-    r[r<1e-16] = 1e200
-    ewovrl = .5 * np.einsum('i,j,Lij->', chargs, chargs, erfc(ew_eta * r) / r)
+    ewovrl = ewald_methods._get_ewald_direct(cell, ew_eta, ew_cut)
 
     # last line of Eq. (F.5) in Martin
     ewself  = -.5 * np.dot(chargs,chargs) * 2 * ew_eta / np.sqrt(np.pi)
@@ -1166,6 +1262,106 @@ def tot_electrons(cell, nkpts=1):
     nelectron = int(nelectron+0.5)
     return nelectron
 
+def _build_rcut(cell):
+    '''Set cell.rcut from the basis and precision (as in Cell.build).'''
+    if not cell.rcut_by_shell_radius:
+        cell._rcut = max(_bas_rcuts(cell, cell.precision).tolist() + [0])
+    else:
+        cell._rcut = max(0, rcut_by_shells(cell).max())
+    cell._rcut_from_build = True
+    return cell._rcut
+
+def _build_mesh(cell):
+    '''Set cell.mesh from ke_cutoff (as in Cell.build). Returns the
+    kinetic energy cutoff used.'''
+    if cell.ke_cutoff is None:
+        ke_cutoff = estimate_ke_cutoff(cell, cell.precision)
+    else:
+        ke_cutoff = cell.ke_cutoff
+    cell._mesh = pbctools.cutoff_to_mesh(cell.lattice_vectors(), ke_cutoff)
+
+    if (cell.dimension < 2 or
+        (cell.dimension == 2 and cell.low_dim_ft_type == 'inf_vacuum')):
+        cell._mesh[cell.dimension:] = _mesh_inf_vaccum(cell)
+    cell._mesh_from_build = True
+
+    # Set minimal mesh grids to handle the case mesh==0. since Madelung
+    # constant may be computed even if the unit cell has 0 atoms. In this
+    # system, cell.mesh was initialized to 0.
+    cell._mesh[cell._mesh == 0] = 30
+    return ke_cutoff
+
+# Attributes which derive() can change without a full build
+_DERIVE_KEYS = set(('ke_cutoff', 'mesh', 'precision', 'rcut', 'basis',
+                    'verbose', 'max_memory', 'stdout'))
+
+def derive(cell, **kwargs):
+    '''A new cell which differs from the built cell only in the given
+    attributes, e.g. ``cell.derive(ke_cutoff=200, basis='gth-tzv2p')``.
+
+    The parsed atoms, pseudopotential and ECP tables are shared with cell
+    and only the data invalidated by the changed attributes are
+    recomputed: the mesh for ke_cutoff, _bas/_env and rcut for basis,
+    rcut and mesh for precision.  The nuclear repulsion energy is kept if
+    only the basis changes.  Other attributes (atom, a, pseudo, ...) or
+    cells which need a special setup (exp_to_discard, symmetry, no lattice
+    vectors) fall back to copy() + build().
+    '''
+    import copy as _copy
+    basis_changed = 'basis' in kwargs
+    if (not cell._built or cell.a is None or cell.symmetry or
+        set(kwargs).difference(_DERIVE_KEYS) or
+        (basis_changed and cell.exp_to_discard is not None)):
+        newcell = cell.copy()
+        for key, val in kwargs.items():
+            setattr(newcell, key, val)
+        return newcell.build(False, False)
+
+    newcell = _copy.copy(cell)
+    newcell._env = cell._env.copy()
+    newcell._memo = {}
+    for key, val in kwargs.items():
+        setattr(newcell, key, val)
+
+    if basis_changed:
+        basis = newcell.basis
+        uniq_atoms = set([a[0] for a in cell._atom])
+        if isinstance(basis, (str, unicode, tuple, list)):
+            _basis = dict(((a, basis) for a in uniq_atoms))
+        elif 'default' in basis:
+            _basis = dict(((a, basis['default']) for a in uniq_atoms))
+            _basis.update(basis)
+            del(_basis['default'])
+        else:
+            _basis = basis
+        newcell._basis = newcell.format_basis(_basis)
+        env = cell._env[:mole.PTR_ENV_START]
+        newcell._atm, newcell._bas, newcell._env = \
+                newcell.make_env(cell._atom, newcell._basis, env,
+                                 cell.nucmod, cell.nucprop)
+        newcell._atm, newcell._ecpbas, newcell._env = \
+                newcell.make_ecp_env(newcell._atm, cell._ecp, newcell._env)
+
+    if ((basis_changed or 'precision' in kwargs) and 'rcut' not in kwargs
+        and newcell._rcut_from_build):
+        _build_rcut(newcell)
+    if ('mesh' not in kwargs and newcell._mesh_from_build and
+        ('ke_cutoff' in kwargs or
+         (newcell.ke_cutoff is None and (basis_changed or 'precision' in kwargs)))):
+        _build_mesh(newcell)
+    if set(kwargs).intersection(('mesh', 'ke_cutoff', 'precision')):
+        # the Ewald parameters depend on the mesh and precision
+        newcell.enuc = None
+    return newcell
+
+def _memo(cell):
+    '''Per-cell storage of memoized results.  Entries are validated by
+    the caller against the data they were computed from.'''
+    memo = cell.__dict__.get('_memo')
+    if memo is None:
+        memo = cell.__dict__['_memo'] = {}
+    return memo
+
 def _mesh_inf_vaccum(cell):
     #prec ~ exp(-0.436392335*mesh -2.99944305)*nelec
     meshz = (np.log(cell.nelectron/cell.precision)-2.99944305)/0.436392335
@@ -1527,12 +1723,7 @@ class Cell(mole.Mole):
             return self
 
         if self.rcut is None or self._rcut_from_build:
-            if not self.rcut_by_shell_radius:
-                self._rcut = max([self.bas_rcut(ib, self.precision)
-                                  for ib in range(self.nbas)] + [0])
-            else:
-                self._rcut = max(0, rcut_by_shells(self).max())
-            self._rcut_from_build = True
+            _build_rcut(self)
 
         _a = self.lattice_vectors()
         if np.linalg.det(_a) < 0:
@@ -1550,21 +1741,7 @@ class Cell(mole.Mole):
                                  % (Lz_guess*param.BOHR, Lz_guess))
 
         if self.mesh is None or self._mesh_from_build:
-            if self.ke_cutoff is None:
-                ke_cutoff = estimate_ke_cutoff(self, self.precision)
-            else:
-                ke_cutoff = self.ke_cutoff
-            self._mesh = pbctools.cutoff_to_mesh(_a, ke_cutoff)
-
-            if (self.dimension < 2 or
-                (self.dimension == 2 and self.low_dim_ft_type == 'inf_vacuum')):
-                self._mesh[self.dimension:] = _mesh_inf_vaccum(self)
-            self._mesh_from_build = True
-
-            # Set minimal mesh grids to handle the case mesh==0. since Madelung
-            # constant may be computed even if the unit cell has 0 atoms. In this
-            # system, cell.mesh was initialized to 0.
-            self._mesh[self._mesh == 0] = 30
+            ke_cutoff = _build_mesh(self)
 
         if dump_input and not _built and self.verbose > logger.NOTE:
             self.dump_input()
@@ -1774,6 +1951,8 @@ class Cell(mole.Mole):
     rcut_by_atom_types = rcut_by_atom_types
     rcut_by_shells = rcut_by_shells
 
+    derive = derive
+
     get_lattice_Ls = pbctools.get_lattice_Ls
 
     get_nimgs = get_nimgs
@@ -1853,6 +2032,8 @@ class Cell(mole.Mole):
         mol = self.view(mole.Mole)
         delattr(mol, 'a')
         delattr(mol, '_mesh')
+        # the memo of the cell (see derive) is not JSON serializable
+        mol.__dict__.pop('_memo', None)
         mol.enuc = None #reset nuclear energy
         if mol.symmetry:
             mol._build_symmetry()
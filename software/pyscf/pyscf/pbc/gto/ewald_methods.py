@@ -2,6 +2,7 @@ import ctypes
 import numpy as np
 import scipy
 from pyscf import lib
+from pyscf import __config__
 from pyscf.lib import logger
 from pyscf.gto import mole
 from pyscf.pbc import tools
@@ -10,6 +11,12 @@ from pyscf.pbc.gto.cell import _cut_mesh_for_ewald
 libpbc = lib.load_library('libpbc')
 
 INTERPOLATION_ORDER = 10
+# Evaluate the real-space sum on a linked-cell list, which costs O(natm)
+# memory and time.  Otherwise all atom pairs are looped over for every
+# lattice image within the cutoff.
+LINKED_CELL = getattr(__config__, 'pbc_gto_ewald_linked_cell', True)
+# number of atoms per block when spreading the charges onto the mesh
+PME_BLKSIZE = getattr(__config__, 'pbc_gto_ewald_pme_blksize', 1024)
 
 def _bspline(u, n=4):
     fac = 1. / scipy.special.factorial(n-1)
@@ -50,15 +57,74 @@ def bspline(u, ng, n=4, deriv=0):
             dM[np.arange(u.size),idx[i]] += _bspline_grad(val[i], n)
         M = [M, dM]
 
+    b = _bspline_moduli(ng, n)
+    return M, b, idx
+
+def _bspline_moduli(ng, n=4):
     m = np.arange(ng)
     b = np.exp(2*np.pi*1j*(n-1)*m/ng)
     tmp = 0
     for k in range(n-1):
-        tmp += _bspline(k+1, n) * np.exp(2*np.pi*1j*m*k/ng) 
+        tmp += _bspline(k+1, n) * np.exp(2*np.pi*1j*m*k/ng)
     b /= tmp
     if n % 2 > 0 and ng % 2 == 0 :
         b[ng//2] = 0
-    return M, b, idx
+    return b
+
+def _bspline_compact(u, ng, n=4, deriv=0):
+    '''
+    The n non-zero B-spline weights of each point and their mesh indices.
+    Unlike bspline, no (len(u), ng) array is built.
+    '''
+    u = np.asarray(u).ravel()
+    u_floor = np.floor(u)
+    val = (u - u_floor)[:,None] + np.arange(n)
+    idx = np.rint((u_floor[:,None] - np.arange(n)) % ng).astype(int)
+    M = _bspline(val, n)
+    if deriv > 0:
+        if deriv > 1:
+            raise NotImplementedError
+        return M, _bspline_grad(val, n), idx
+    return M, idx
+
+def _linked_cells(cell, rcut):
+    '''
+    Sort the atoms into bins of the fractional coordinates which are at
+    least rcut wide along the periodic directions.  The atoms are wrapped
+    into the reference cell.
+
+    Returns:
+        order : the atom indices sorted by bins
+        coords : the wrapped coordinates of the sorted atoms
+        bin_loc : atoms of bin ib are coords[bin_loc[ib]:bin_loc[ib+1]]
+        nbin : number of bins along each lattice vector
+        nimg : number of neighboring bins to visit along each lattice vector
+    '''
+    a = cell.lattice_vectors()
+    b = np.linalg.inv(a.T)
+    heights_inv = lib.norm(b, axis=1)
+    dimension = cell.dimension
+    coords = cell.atom_coords()
+    scaled = np.dot(coords, b.T)
+    shift = np.zeros_like(scaled)
+    shift[:,:dimension] = np.floor(scaled[:,:dimension])
+    scaled -= shift
+    coords = coords - np.dot(shift, a)
+
+    nbin = np.ones(3, dtype=np.int32)
+    nimg = np.zeros(3, dtype=np.int32)
+    if rcut > 0:
+        nbin[:dimension] = np.maximum(1, 1. / (heights_inv[:dimension] * rcut))
+        nimg[:dimension] = np.ceil(rcut * heights_inv[:dimension] * nbin[:dimension])
+    ids = np.zeros_like(scaled, dtype=int)
+    ids[:,:dimension] = np.minimum(scaled[:,:dimension] * nbin[:dimension],
+                                   nbin[:dimension] - 1)
+    bin_ids = np.ravel_multi_index(ids.T, nbin)
+    order = np.argsort(bin_ids, kind='stable')
+    bin_loc = np.zeros(np.prod(nbin)+1, dtype=np.int32)
+    np.cumsum(np.bincount(bin_ids, minlength=np.prod(nbin)), out=bin_loc[1:])
+    coords = np.asarray(coords[order], order='C')
+    return order, coords, bin_loc, nbin, nimg
 
 def _get_ewald_direct(cell, ew_eta=None, ew_cut=None):
     if ew_eta is None:
@@ -67,12 +133,27 @@ def _get_ewald_direct(cell, ew_eta=None, ew_cut=None):
         ew_cut = cell.get_ewald_params()[1]
 
     chargs = np.asarray(cell.atom_charges(), order='C', dtype=float)
+    ewovrl = np.zeros([1])
+    if LINKED_CELL:
+        order, coords, bin_loc, nbin, nimg = _linked_cells(cell, ew_cut)
+        chargs = np.asarray(chargs[order], order='C')
+        a = np.asarray(cell.lattice_vectors(), order='C')
+        fun = getattr(libpbc, "get_ewald_direct_cells")
+        fun(ewovrl.ctypes.data_as(ctypes.c_void_p),
+            chargs.ctypes.data_as(ctypes.c_void_p),
+            coords.ctypes.data_as(ctypes.c_void_p),
+            a.ctypes.data_as(ctypes.c_void_p),
+            bin_loc.ctypes.data_as(ctypes.c_void_p),
+            nbin.ctypes.data_as(ctypes.c_void_p),
+            nimg.ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_double(ew_eta), ctypes.c_double(ew_cut))
+        return ewovrl[0]
+
     coords = np.asarray(cell.atom_coords(), order='C')
     Lall = np.asarray(cell.get_lattice_Ls(rcut=ew_cut), order='C')
 
     natm = len(chargs)
     nL = len(Lall)
-    ewovrl = np.zeros([1])
     fun = getattr(libpbc, "get_ewald_direct")
     fun(ewovrl.ctypes.data_as(ctypes.c_void_p),
         chargs.ctypes.data_as(ctypes.c_void_p),
@@ -80,7 +161,7 @@ def _get_ewald_direct(cell, ew_eta=None, ew_cut=None):
         Lall.ctypes.data_as(ctypes.c_void_p),
         ctypes.c_double(ew_eta), ctypes.c_double(ew_cut),
         ctypes.c_int(natm), ctypes.c_int(nL))
-    return ewovrl[0] 
+    return ewovrl[0]
 
 def _get_ewald_direct_nuc_grad(cell, ew_eta=None, ew_cut=None):
     if ew_eta is None:
@@ -89,12 +170,28 @@ def _get_ewald_direct_nuc_grad(cell, ew_eta=None, ew_cut=None):
         ew_cut = cell.get_ewald_params()[1]
 
     chargs = np.asarray(cell.atom_charges(), order='C', dtype=float)
+    natm = len(chargs)
+    grad = np.zeros([natm,3], order='C', dtype=float)
+    if LINKED_CELL:
+        order, coords, bin_loc, nbin, nimg = _linked_cells(cell, ew_cut)
+        chargs = np.asarray(chargs[order], order='C')
+        a = np.asarray(cell.lattice_vectors(), order='C')
+        fun = getattr(libpbc, "get_ewald_direct_cells_nuc_grad")
+        fun(grad.ctypes.data_as(ctypes.c_void_p),
+            chargs.ctypes.data_as(ctypes.c_void_p),
+            coords.ctypes.data_as(ctypes.c_void_p),
+            a.ctypes.data_as(ctypes.c_void_p),
+            bin_loc.ctypes.data_as(ctypes.c_void_p),
+            nbin.ctypes.data_as(ctypes.c_void_p),
+            nimg.ctypes.data_as(ctypes.c_void_p),
+            ctypes.c_double(ew_eta), ctypes.c_double(ew_cut))
+        grad[order] = grad.copy()
+        return grad
+
     coords = np.asarray(cell.atom_coords(), order='C')
     Lall = np.asarray(cell.get_lattice_Ls(rcut=ew_cut), order='C')
 
-    natm = len(chargs)
     nL = len(Lall)
-    grad = np.zeros([natm,3], order='C', dtype=float)
     fun = getattr(libpbc, "get_ewald_direct_nuc_grad")
     fun(grad.ctypes.data_as(ctypes.c_void_p),
         chargs.ctypes.data_as(ctypes.c_void_p),
@@ -105,6 +202,43 @@ def _get_ewald_direct_nuc_grad(cell, ew_eta=None, ew_cut=None):
     return grad
 
 
+def _pme_weights(cell, mesh, order, deriv=0):
+    b = cell.reciprocal_vectors(norm_to=1)
+    u = np.dot(cell.atom_coords(), b.T) * mesh[None,:]
+    return [_bspline_compact(u[:,i], mesh[i], order, deriv) for i in range(3)]
+
+def _pme_address(idx, idy, idz, mesh):
+    return ((idx[:,:,None,None] * mesh[1] + idy[:,None,:,None]) * mesh[2]
+            + idz[:,None,None,:])
+
+def _pme_spread(chargs, weights, mesh, blksize=PME_BLKSIZE):
+    '''
+    Spread the charges onto the mesh, blksize atoms at a time.
+    '''
+    (Mx, idx), (My, idy), (Mz, idz) = [(w[0], w[-1]) for w in weights]
+    ngrids = np.prod(mesh)
+    Q = np.zeros(ngrids)
+    for a0, a1 in lib.prange(0, len(chargs), blksize):
+        Q_s = np.einsum('a,ax,ay,az->axyz', chargs[a0:a1], Mx[a0:a1],
+                        My[a0:a1], Mz[a0:a1])
+        addr = _pme_address(idx[a0:a1], idy[a0:a1], idz[a0:a1], mesh)
+        Q += np.bincount(addr.ravel(), weights=Q_s.ravel(), minlength=ngrids)
+    return Q.reshape(*mesh)
+
+def _pme_potential(cell, Q, mesh, order, ew_eta):
+    bx, by, bz = [_bspline_moduli(ng, order) for ng in mesh]
+    B = np.einsum('x,y,z->xyz', bx*bx.conj(), by*by.conj(), bz*bz.conj())
+
+    Gv, Gvbase, weights = cell.get_Gv_weights(mesh)
+    absG2 = lib.multiply_sum(Gv, Gv, axis=1)
+    absG2[absG2==0] = 1e200
+    coulG = 4*np.pi / absG2
+    C = weights * coulG * np.exp(-absG2/(4*ew_eta**2))
+    C = C.reshape(*mesh)
+
+    Q_ifft = tools.ifft(Q, mesh).reshape(*mesh)
+    return tools.fft(B * C * Q_ifft, mesh).real.reshape(*mesh)
+
 #XXX The default interpolation order may be too high
 def particle_mesh_ewald(cell, ew_eta=None, ew_cut=None,
                         order=INTERPOLATION_ORDER):
@@ -117,7 +251,6 @@ def particle_mesh_ewald(cell, ew_eta=None, ew_cut=None,
         ew_cut = cell.get_ewald_params()[1]
 
     chargs = cell.atom_charges()
-    coords = cell.atom_coords()
 
     ewovrl = _get_ewald_direct(cell, ew_eta, ew_cut)
     ewself  = -.5 * np.dot(chargs,chargs) * 2 * ew_eta / np.sqrt(np.pi)
@@ -125,38 +258,8 @@ def particle_mesh_ewald(cell, ew_eta=None, ew_cut=None,
         ewself += -.5 * np.sum(chargs)**2 * np.pi/(ew_eta**2 * cell.vol)
 
     mesh = _cut_mesh_for_ewald(cell, cell.mesh)
-
-    b = cell.reciprocal_vectors(norm_to=1)
-    u = np.dot(coords, b.T) * mesh[None,:]
-
-    Mx, bx, idx = bspline(u[:,0], mesh[0], order)
-    My, by, idy = bspline(u[:,1], mesh[1], order)
-    Mz, bz, idz = bspline(u[:,2], mesh[2], order)
-
-    idx = np.asarray(idx).T
-    idy = np.asarray(idy).T
-    idz = np.asarray(idz).T
-    Mx_s = Mx[np.indices(idx.shape)[0], idx]
-    My_s = My[np.indices(idy.shape)[0], idy]
-    Mz_s = Mz[np.indices(idz.shape)[0], idz]
-
-    #Q = np.einsum('i,ix,iy,iz->xyz', chargs, Mx, My, Mz)
-    Q = np.zeros([*mesh])
-    for ia in range(len(chargs)):
-        Q_s = np.einsum('x,y,z->xyz', Mx_s[ia], My_s[ia], Mz_s[ia])
-        Q[np.ix_(idx[ia], idy[ia], idz[ia])] += chargs[ia] * Q_s
-
-    B = np.einsum('x,y,z->xyz', bx*bx.conj(), by*by.conj(), bz*bz.conj())
-
-    Gv, Gvbase, weights = cell.get_Gv_weights(mesh)
-    absG2 = lib.multiply_sum(Gv, Gv, axis=1)
-    absG2[absG2==0] = 1e200
-    coulG = 4*np.pi / absG2
-    C = weights * coulG * np.exp(-absG2/(4*ew_eta**2))
-    C = C.reshape(*mesh)
-
-    Q_ifft = tools.ifft(Q, mesh).reshape(*mesh)
-    tmp = tools.fft(B * C * Q_ifft, mesh).real.reshape(*mesh)
+    Q = _pme_spread(chargs, _pme_weights(cell, mesh, order), mesh)
+    tmp = _pme_potential(cell, Q, mesh, order, ew_eta)
     ewg = 0.5 * np.prod(mesh) * np.einsum('xyz,xyz->', Q, tmp)
 
     logger.debug(cell, 'Ewald components = %.15g, %.15g, %.15g', ewovrl, ewself, ewg)
@@ -175,61 +278,24 @@ def particle_mesh_ewald_nuc_grad(cell, ew_eta=None, ew_cut=None,
     grad_dir = _get_ewald_direct_nuc_grad(cell, ew_eta, ew_cut)
 
     chargs = cell.atom_charges()
-    coords = cell.atom_coords()
     mesh = _cut_mesh_for_ewald(cell, cell.mesh)
 
-    b = cell.reciprocal_vectors(norm_to=1)
-    u = np.dot(coords, b.T) * mesh[None,:]
-
-    [Mx, dMx], bx, idx = bspline(u[:,0], mesh[0], order, deriv=1)
-    [My, dMy], by, idy = bspline(u[:,1], mesh[1], order, deriv=1)
-    [Mz, dMz], bz, idz = bspline(u[:,2], mesh[2], order, deriv=1)
-
-    idx = np.asarray(idx).T
-    idy = np.asarray(idy).T
-    idz = np.asarray(idz).T
-    Mx_s = Mx[np.indices(idx.shape)[0], idx]
-    My_s = My[np.indices(idy.shape)[0], idy]
-    Mz_s = Mz[np.indices(idz.shape)[0], idz]
-    dMx_s = dMx[np.indices(idx.shape)[0], idx]
-    dMy_s = dMy[np.indices(idy.shape)[0], idy]
-    dMz_s = dMz[np.indices(idz.shape)[0], idz]
-
-    Q = np.zeros([*mesh])
-    for ia in range(len(chargs)):
-        Q_s = np.einsum('x,y,z->xyz', Mx_s[ia], My_s[ia], Mz_s[ia])
-        Q[np.ix_(idx[ia], idy[ia], idz[ia])] += chargs[ia] * Q_s
-
-    B = np.einsum('x,y,z->xyz', bx*bx.conj(), by*by.conj(), bz*bz.conj())
-
-    Gv, Gvbase, weights = cell.get_Gv_weights(mesh)
-    absG2 = lib.multiply_sum(Gv, Gv, axis=1)
-    absG2[absG2==0] = 1e200
-    coulG = 4*np.pi / absG2
-    C = weights * coulG * np.exp(-absG2/(4*ew_eta**2))
-    C = C.reshape(*mesh)
-
-    Q_ifft = tools.ifft(Q, mesh).reshape(*mesh)
-    tmp = tools.fft(B * C * Q_ifft, mesh).real.reshape(*mesh)
+    weights = _pme_weights(cell, mesh, order, deriv=1)
+    (Mx, dMx, idx), (My, dMy, idy), (Mz, dMz, idz) = weights
+    Q = _pme_spread(chargs, weights, mesh)
+    tmp = _pme_potential(cell, Q, mesh, order, ew_eta).ravel()
 
     ng = np.prod(mesh)
+    b = cell.reciprocal_vectors(norm_to=1)
     bK = b * mesh[:,None]
-    grad_rec = np.zeros_like(grad_dir) 
-    for ia in range(len(chargs)):
-        mask = np.ix_(idx[ia], idy[ia], idz[ia])
-        dQ_s = np.einsum('x,y,z->xyz', dMx_s[ia], My_s[ia], Mz_s[ia])
-        dQdr = np.einsum('x,abc->xabc', bK[0], dQ_s)
-        grad_rec[ia] += np.einsum('xabc,abc->x', dQdr, tmp[mask])
-
-        dQ_s = np.einsum('x,y,z->xyz', Mx_s[ia], dMy_s[ia], Mz_s[ia])
-        dQdr = np.einsum('x,abc->xabc', bK[1], dQ_s)
-        grad_rec[ia] += np.einsum('xabc,abc->x', dQdr, tmp[mask])
-
-        dQ_s = np.einsum('x,y,z->xyz', Mx_s[ia], My_s[ia], dMz_s[ia])
-        dQdr = np.einsum('x,abc->xabc', bK[2], dQ_s)
-        grad_rec[ia] += np.einsum('xabc,abc->x', dQdr, tmp[mask])
-
-        grad_rec[ia] *= chargs[ia] * ng
+    grad_rec = np.zeros_like(grad_dir)
+    for a0, a1 in lib.prange(0, len(chargs), PME_BLKSIZE):
+        tmp_s = tmp[_pme_address(idx[a0:a1], idy[a0:a1], idz[a0:a1], mesh)]
+        g = np.empty((a1-a0, 3))
+        g[:,0] = np.einsum('ax,ay,az,axyz->a', dMx[a0:a1], My[a0:a1], Mz[a0:a1], tmp_s)
+        g[:,1] = np.einsum('ax,ay,az,axyz->a', Mx[a0:a1], dMy[a0:a1], Mz[a0:a1], tmp_s)
+        g[:,2] = np.einsum('ax,ay,az,axyz->a', Mx[a0:a1], My[a0:a1], dMz[a0:a1], tmp_s)
+        grad_rec[a0:a1] = np.dot(g, bK) * (chargs[a0:a1] * ng)[:,None]
 
     # reciprocal space summation does not conserve momentum
     shift = -np.sum(grad_rec, axis=0) / len(grad_rec)
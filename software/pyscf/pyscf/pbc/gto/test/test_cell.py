@@ -18,11 +18,13 @@
 
 import unittest
 import ctypes
+import tempfile
 import numpy
 import numpy as np
 from pyscf import gto
 from pyscf import lib
 from pyscf.pbc import gto as pgto
+from pyscf.pbc.tools import pbc as pbctools
 
 
 L = 1.5
@@ -144,6 +146,29 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(cell.ewald(2, 10), -2.3711356723457615, 9)
         self.assertAlmostEqual(cell.ewald(2,  5), -2.3711356723457615, 9)
 
+    def test_ewald_linked_cell(self):
+        from pyscf.pbc.gto import ewald_methods
+        numpy.random.seed(4)
+        for dimension in (3, 2):
+            a = numpy.random.random((3,3)) + numpy.eye(3) * 5
+            if dimension == 2:
+                a[2] = [0, 0, 8]
+                a[:2,2] = 0
+            cell = pgto.M(atom=[['He', x] for x in numpy.random.random((12,3))*7-1],
+                          a=a, unit='B', basis=[[0, (1.0, 1.0)]],
+                          dimension=dimension, verbose=0)
+            for ew_eta, ew_cut in [(1., 6.), (.4, 20.)]:
+                try:
+                    ewald_methods.LINKED_CELL = False
+                    e0 = ewald_methods._get_ewald_direct(cell, ew_eta, ew_cut)
+                    g0 = ewald_methods._get_ewald_direct_nuc_grad(cell, ew_eta, ew_cut)
+                finally:
+                    ewald_methods.LINKED_CELL = True
+                e1 = ewald_methods._get_ewald_direct(cell, ew_eta, ew_cut)
+                g1 = ewald_methods._get_ewald_direct_nuc_grad(cell, ew_eta, ew_cut)
+                self.assertAlmostEqual(e1, e0, 11)
+                self.assertAlmostEqual(abs(g1 - g0).max(), 0, 11)
+
     def test_ewald_2d_inf_vacuum(self):
         cell = pgto.Cell()
         cell.a = numpy.eye(3) * 4
@@ -413,6 +438,103 @@ class KnownValues(unittest.TestCase):
             self.assertAlmostEqual(abs(es - es1).max(), 0, 15)
             self.assertAlmostEqual(abs(cs - cs1).max(), 0, 15)
 
+    def test_derive(self):
+        cell = pgto.M(atom='C 0 0 0; H 1 1 1; H -1 -1 1',
+                      a=np.eye(3) * 6, basis='gth-szv', pseudo='gth-pade',
+                      ke_cutoff=40, precision=1e-6,
+                      rcut_by_shell_radius=True)
+        for kwargs in [{'ke_cutoff': 80}, {'basis': 'gth-dzvp'},
+                       {'basis': 'gth-dzvp', 'ke_cutoff': None},
+                       {'precision': 1e-8}]:
+            ref = cell.copy()
+            for key, val in kwargs.items():
+                setattr(ref, key, val)
+            ref.build()
+            cell1 = cell.derive(**kwargs)
+            self.assertTrue(cell1._pseudo is cell._pseudo)
+            self.assertEqual(cell1.mesh.tolist(), ref.mesh.tolist())
+            self.assertAlmostEqual(cell1.rcut, ref.rcut, 12)
+            self.assertEqual(cell1.nao, ref.nao)
+            self.assertTrue((cell1._bas == ref._bas).all())
+            self.assertTrue((cell1._env == ref._env).all())
+            self.assertAlmostEqual(cell1.energy_nuc(), ref.energy_nuc(), 9)
+        self.assertEqual(cell.ke_cutoff, 40)
+        self.assertEqual(cell.nao, 6)
+
+        # unsupported attributes fall back to a full build
+        cell1 = cell.derive(pseudo='gth-pbe')
+        self.assertFalse(cell1._pseudo is cell._pseudo)
+
+    def test_memoized_lattice_Ls(self):
+        cell = pgto.M(atom='He 0 0 0; He 1 1 1', a=np.eye(3)*3 + np.eye(3)[::-1]*.5,
+                      basis='ccpvdz', precision=1e-6)
+        Ls = cell.get_lattice_Ls()
+        self.assertTrue(abs(Ls - pbctools._get_lattice_Ls(cell)).max() == 0)
+        Ls[:] = 0
+        self.assertTrue(abs(cell.get_lattice_Ls()).max() > 0)
+        n0 = len(cell.get_lattice_Ls())
+        cell.atom = 'He 0 0 0; He 4 1 1'
+        cell.build()
+        self.assertTrue(len(cell.get_lattice_Ls()) != n0)
+        self.assertTrue(abs(cell.get_lattice_Ls() -
+                            pbctools._get_lattice_Ls(cell)).max() == 0)
+        rs = cell.rcut_by_shells()
+        self.assertTrue(cell.rcut_by_shells() is not rs)
+        self.assertTrue(abs(rs - cell.rcut_by_shells()).max() == 0)
+
+    def test_to_mol_chkfile(self):
+        from pyscf import scf
+        cell = pgto.M(atom='He 0 0 0; He 1 1 1', a=np.eye(3)*3,
+                      basis='ccpvdz', verbose=0)
+        cell.rcut_by_shells()
+        cell.get_lattice_Ls()
+        mol = cell.to_mol()
+        self.assertFalse('_memo' in mol.__dict__)
+        mf = scf.RHF(mol)
+        with tempfile.NamedTemporaryFile() as ftmp:
+            mf.chkfile = ftmp.name
+            mf.kernel()
+            mol1 = lib.chkfile.load_mol(ftmp.name)
+        self.assertEqual(mol1.natm, 2)
+
+    def test_screening_cache(self):
+        from pyscf.pbc.gto import cell as cell_module
+        cell_module.clear_screening_cache()
+        cell = pgto.M(atom='C 0 0 0; H 1 1 1; H -1 -1 1; O 0 0 2',
+                      a=np.eye(3) * 6, basis='gth-dzvp', pseudo='gth-pade',
+                      precision=1e-6)
+        ke = cell_module.estimate_ke_cutoff(cell, 1e-6)
+        r, pgf_r = cell.rcut_by_shells(return_pgf_radius=True)
+        r0, pgf_r0 = cell_module._rcut_by_shells_c(cell, 1e-6,
+                                                    return_pgf_radius=True)
+        self.assertTrue(abs(r - r0).max() == 0)
+        for ib, nprim in enumerate(cell._bas[:,gto.NPRIM_OF]):
+            self.assertTrue(abs(pgf_r[ib,:nprim] - pgf_r0[ib,:nprim]).max() == 0)
+        ncached = len(cell_module._screening_cache)
+        # bas_rcut and ke_cutoff (from build) and rcut_by_shells per shell
+        nuniq = len(cell_module._unique_shells(cell)[0])
+        self.assertEqual(nuniq, 8)
+        self.assertEqual(ncached, 3 * nuniq)
+
+        # Same element/basis pairs in another molecule hit the cache
+        cell1 = pgto.M(atom='O 0 0 0; H 0 1 1; H 0 -1 1', a=np.eye(3) * 5,
+                       basis='gth-dzvp', pseudo='gth-pade', precision=1e-6)
+        self.assertEqual(len(cell_module._screening_cache), ncached)
+        ke1 = max([cell_module._estimate_ke_cutoff(
+            cell1.bas_exp(ib), cell1.bas_angular(ib),
+            abs(cell1.bas_ctr_coeff(ib)).max(axis=1), 1e-6).max()
+            for ib in range(cell1.nbas)])
+        self.assertEqual(cell_module.estimate_ke_cutoff(cell1, 1e-6), ke1)
+        self.assertEqual(len(cell_module._screening_cache), ncached)
+
+        # A modified basis does not share the entries
+        cell1.exp_to_discard = .2
+        cell1.build()
+        self.assertTrue(abs(cell1.rcut_by_shells() -
+                            cell_module._rcut_by_shells_c(cell1)).max() == 0)
+        self.assertTrue(len(cell_module._screening_cache) > ncached)
+        self.assertTrue(ke > 0)
+
 
 if __name__ == '__main__':
     print("Full Tests for pbc.gto.cell")
@@ -22,7 +22,6 @@ from functools import reduce
 import numpy
 import scipy.linalg
 import scipy.special
-import scipy.optimize
 from pyscf import lib
 from pyscf.pbc import gto as pbcgto
 from pyscf.lib import logger
@@ -32,6 +31,50 @@ from pyscf import __config__
 SMEARING_METHOD = getattr(__config__, 'pbc_scf_addons_smearing_method', 'fermi')
 
 
+def _fermi_smearing_occ(mu, mo_energy, sigma):
+    '''Fermi-Dirac occupancies and their derivatives with respect to mu'''
+    occ = scipy.special.expit((mu - mo_energy) / sigma)
+    return occ, occ * (1 - occ) / sigma
+
+def _gaussian_smearing_occ(mu, mo_energy, sigma):
+    '''Gaussian occupancies and their derivatives with respect to mu'''
+    x = (mo_energy - mu) / sigma
+    return .5 * scipy.special.erfc(x), numpy.exp(-x**2) / (numpy.sqrt(numpy.pi) * sigma)
+
+def _smearing_solve_mu(f_occ, mo_energy, nelectron, sigma, mu0, factor=1,
+                       tol=1e-13, max_cycle=200):
+    '''Find mu such that factor * sum(f_occ(mu)) equals nelectron.
+
+    Newton iterations starting from mu0, with bisection whenever a Newton
+    step leaves the bracket of mu.  mo_energy is the 1D array of the
+    orbital energies of all k-points and spins.
+
+    Returns:
+        mu, the occupancies, their derivatives, and the number of iterations
+    '''
+    lo = mo_energy.min() - 50 * sigma
+    hi = mo_energy.max() + 50 * sigma
+    mu = min(max(mu0, lo), hi)
+    for cycle in range(max_cycle):
+        occ, docc = f_occ(mu, mo_energy, sigma)
+        dn = factor * occ.sum() - nelectron
+        if abs(dn) < tol * max(nelectron, 1):
+            break
+        if dn < 0:
+            lo = mu
+        else:
+            hi = mu
+        deriv = factor * docc.sum()
+        if deriv > 0:
+            mu_new = mu - dn / deriv
+        if deriv <= 0 or not lo < mu_new < hi:
+            mu_new = (lo + hi) * .5
+        if mu_new == mu:
+            break
+        mu = mu_new
+    return mu, occ, docc, cycle + 1
+
+
 def project_mo_nr2nr(cell1, mo1, cell2, kpts=None):
     r''' Project orbital coefficients
 
@@ -64,14 +107,6 @@ def smearing_(mf, sigma=None, method=SMEARING_METHOD, mu0=None):
     is_rhf = (not is_uhf) and (not is_ghf)
     is_khf = isinstance(mf, khf.KSCF)
 
-    def fermi_smearing_occ(m, mo_energy_kpts, sigma):
-        occ = numpy.zeros_like(mo_energy_kpts)
-        de = (mo_energy_kpts - m) / sigma
-        occ[de<40] = 1./(numpy.exp(de[de<40])+1.)
-        return occ
-    def gaussian_smearing_occ(m, mo_energy_kpts, sigma):
-        return 0.5 * scipy.special.erfc((mo_energy_kpts - m) / sigma)
-
     def partition_occ(mo_occ, mo_energy_kpts):
         mo_occ_kpts = []
         p1 = 0
@@ -110,35 +145,35 @@ def smearing_(mf, sigma=None, method=SMEARING_METHOD, mu0=None):
             mo_es = numpy.hstack(mo_energy_kpts)
 
         if mf.smearing_method.lower() == 'fermi':  # Fermi-Dirac smearing
-            f_occ = fermi_smearing_occ
+            f_occ = _fermi_smearing_occ
         else:  # Gaussian smearing
-            f_occ = gaussian_smearing_occ
+            f_occ = _gaussian_smearing_occ
 
-        mo_energy = numpy.sort(mo_es.ravel())
+        mo_es = mo_es.ravel()
+        mo_energy = numpy.sort(mo_es)
 
         # If mu0 is given, fix mu instead of electron number. XXX -Chong Sun
         sigma = mf.sigma
         fermi = mo_energy[nocc-1]
         if mu0 is None:
-            def nelec_cost_fn(m):
-                mo_occ_kpts = f_occ(m, mo_es, sigma)
-                if is_rhf:
-                    mo_occ_kpts *= 2
-                return (mo_occ_kpts.sum() - nelectron)**2
-            res = scipy.optimize.minimize(nelec_cost_fn, fermi, method='Powell')
-            mu = res.x
-            mo_occs = f = f_occ(mu, mo_es, sigma)
+            # start from mu of the previous SCF cycle
+            mu = fermi if mf.mu is None else mf.mu
+            mu, mo_occs, docc, cycle = _smearing_solve_mu(
+                f_occ, mo_es, nelectron, sigma, mu, factor=(2 if is_rhf else 1))
+            logger.debug(mf, '    mu converged in %d iterations', cycle)
+            mf.mu = mu
         else:
             mu = mu0
-            mo_occs = f = f_occ(mu, mo_es, sigma)
+            mo_occs, docc = f_occ(mu, mo_es, sigma)
+        f = mo_occs
 
         # See https://www.vasp.at/vasp-workshop/slides/k-points.pdf
         if mf.smearing_method.lower() == 'fermi':
-            f = f[(f>0) & (f<1)]
-            mf.entropy = -(f*numpy.log(f) + (1-f)*numpy.log(1-f)).sum() / nkpts
+            mf.entropy = -(scipy.special.xlogy(f, f) +
+                           scipy.special.xlogy(1-f, 1-f)).sum() / nkpts
         else:
-            mf.entropy = (numpy.exp(-((mo_es-mu)/mf.sigma)**2).sum()
-                          / (2*numpy.sqrt(numpy.pi)) / nkpts)
+            # exp(-((mo_es-mu)/sigma)**2) / (2*sqrt(pi)) = docc * sigma / 2
+            mf.entropy = docc.sum() * sigma * .5 / nkpts
         if is_rhf:
             mo_occs *= 2
             mf.entropy *= 2
@@ -206,8 +241,9 @@ def smearing_(mf, sigma=None, method=SMEARING_METHOD, mu0=None):
     mf.entropy = None
     mf.e_free = None
     mf.e_zero = None
+    mf.mu = None
     mf._keys = mf._keys.union(['sigma', 'smearing_method',
-                               'entropy', 'e_free', 'e_zero'])
+                               'entropy', 'e_free', 'e_zero', 'mu'])
 
     mf.get_occ = get_occ
     mf.energy_tot = energy_tot
@@ -104,6 +104,31 @@ class KnownValues(unittest.TestCase):
         occ = mf.get_occ(mo_energy)
         self.assertAlmostEqual(mf.entropy, 0.42189309944541731, 9)
 
+    def test_smearing_mu(self):
+        mf = pscf.KUHF(cell, cell.make_kpts([2,1,1]))
+        pscf.addons.smearing_(mf, 0.01, 'fermi')
+        numpy.random.seed(3)
+        mo_energy = numpy.sort(numpy.random.random((2,2,40)), axis=-1)
+        nelec = mf.cell.tot_electrons(2)
+        for method in ('fermi', 'gauss'):
+            mf.smearing_method = method
+            mf.mu = None
+            occ = mf.get_occ(mo_energy)
+            self.assertAlmostEqual(numpy.sum(occ), nelec, 11)
+            mu = mf.mu
+            es = mo_energy.ravel()
+            if method == 'fermi':
+                self.assertAlmostEqual(abs(numpy.asarray(occ).ravel() -
+                                           1/(numpy.exp((es-mu)/.01)+1)).max(), 0, 12)
+            # warm start from the previous Fermi level
+            f_occ = (pscf.addons._fermi_smearing_occ if method == 'fermi'
+                     else pscf.addons._gaussian_smearing_occ)
+            mu1, occ1, docc1, ncycle = pscf.addons._smearing_solve_mu(
+                f_occ, es + 1e-4, nelec, .01, mu)
+            self.assertAlmostEqual(mu1, mu + 1e-4, 9)
+            self.assertAlmostEqual(occ1.sum(), nelec, 11)
+            self.assertTrue(ncycle <= 4)
+
     def test_project_mo_nr2nr(self):
         nao = cell.nao_nr()
         kpts = cell.make_kpts([3,1,1])
@@ -67,14 +67,16 @@ if FFT_ENGINE == 'FFTW':
     except OSError:
         raise RuntimeError("Failed to load libfft")
 
-    def _complex_fftn_fftw(f, mesh, func):
+    def _complex_fftn_fftw(f, mesh, func, out=None):
+        # out may be f (complex128, C-contiguous) for an in-place transform
         if f.dtype == np.double and f.flags.c_contiguous:
             f = lib.copy(f, dtype=np.complex128)
         else:
             f = np.asarray(f, order='C', dtype=np.complex128)
         mesh = np.asarray(mesh, order='C', dtype=np.int32)
         rank = len(mesh)
-        out = np.empty_like(f)
+        if out is None:
+            out = np.empty_like(f)
         fn = getattr(libfft, func)
         for i, fi in enumerate(f):
             fn(fi.ctypes.data_as(ctypes.c_void_p),
@@ -521,7 +523,27 @@ def get_monkhorst_pack_size(cell, kpts):
 
 def get_lattice_Ls(cell, nimgs=None, rcut=None, dimension=None, discard=True):
     '''Get the (Cartesian, unitful) lattice translation vectors for nearby images.
-    The translation vectors can be used for the lattice summation.'''
+    The translation vectors can be used for the lattice summation.
+
+    The result is memoized on the cell for the current lattice vectors,
+    atomic coordinates and rcut.'''
+    from pyscf.pbc.gto.cell import _memo
+    if nimgs is not None:
+        nimgs = tuple(int(n) for n in np.ravel(nimgs))
+    if rcut is None and nimgs is None:
+        rcut = cell.rcut
+    if dimension is None:
+        dimension = cell.dimension
+    key = (nimgs, rcut, dimension, discard, cell.lattice_vectors().tobytes(),
+           cell.atom_coords().tobytes())
+    memo = _memo(cell)
+    hit = memo.get('lattice_Ls')
+    if hit is None or hit[0] != key:
+        Ls = _get_lattice_Ls(cell, nimgs, rcut, dimension, discard)
+        memo['lattice_Ls'] = hit = (key, Ls)
+    return hit[1].copy()
+
+def _get_lattice_Ls(cell, nimgs=None, rcut=None, dimension=None, discard=True):
     a = cell.lattice_vectors()
     b = cell.reciprocal_vectors(norm_to=1)
     heights_inv = lib.norm(b, axis=1)
@@ -712,6 +734,161 @@ def mesh_to_cutoff(a, mesh):
     # scale down Gmax to get the real energy cutoff for non-orthogonal lattice
     return ke_cutoff / _cubic2nonorth_factor(a)
 
+def is_smooth_number(n, primes=(2,3,5,7)):
+    '''Whether the integer n has no prime factors other than primes'''
+    n = int(n)
+    if n < 1:
+        return False
+    for p in primes:
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+def fft_cost(meshes):
+    '''Predicted cost of the 3D FFTs on the given meshes.
+
+    The cost of the 1D FFT of length n is estimated by the operation count
+    of the mixed-radix algorithm, n * (p1 + p2 + ...) for n = p1 * p2 * ...
+    It is a relative measure which favors the meshes with small prime
+    factors.
+    '''
+    meshes = np.asarray(meshes).reshape(-1,3)
+    cost = 0.
+    for mesh in meshes:
+        ngrids = float(np.prod(mesh))
+        for n in mesh:
+            cost += ngrids * sum(_prime_factors(n))
+    return cost
+
+def _prime_factors(n):
+    n = int(n)
+    factors = []
+    p = 2
+    while p * p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+def minimal_box(coords, ke_cutoff, margin=4., ngrids=1, ke_ratio=3.,
+                primes=(2,3,5,7), rotate=True, unit='Angstrom', verbose=None):
+    '''Place a molecule in an orthorhombic box with a small volume and
+    FFT-friendly meshes.
+
+    The molecule is rotated to its principal axes if this reduces the volume
+    of the box. The box length along each axis is at least the extent of the
+    molecule plus margin, and is chosen such that the meshes of all
+    multigrid levels (as generated by multigrid.multi_grids_tasks with ngrids
+    and ke_ratio) of all cutoffs have no prime factors other than primes.
+    For the same meshes the box is then made as large as possible.
+
+    Args:
+        coords : (natm,3) ndarray
+            Atomic coordinates in the unit given by unit.
+        ke_cutoff : float or list of floats
+            KE energy cutoffs in a.u.
+
+    Kwargs:
+        margin : float
+            The vacuum to add to the extent of the molecule along each axis,
+            in the unit given by unit.
+        ngrids, ke_ratio :
+            The multigrid levels of each cutoff.
+        rotate : bool
+            Whether to try the principal axes of the molecule.
+
+    Returns:
+        coords : (natm,3) ndarray
+            Atomic coordinates centered in the box.
+        a : (3,3) ndarray
+            Lattice vectors, in the unit given by unit.
+        info : dict
+            'rotation': the rotation matrix applied to the centered coords,
+            'meshes': the mesh of each cutoff and each level,
+            'fft_cost': the predicted FFT cost of the meshes,
+            'fft_cost_ref': the predicted FFT cost without rotation and
+            smoothing the meshes.
+    '''
+    coords = np.asarray(coords, dtype=float)
+    if isinstance(unit, str) and unit.upper().startswith(('B', 'AU')):
+        unit_in_bohr = 1.
+    elif isinstance(unit, str):
+        unit_in_bohr = 1. / lib.param.BOHR
+    else:
+        unit_in_bohr = 1. / unit
+    if verbose is None:
+        verbose = logger.NOTE
+    log = logger.Logger(verbose=verbose)
+
+    ke_cutoff = np.asarray(ke_cutoff, dtype=float).ravel()
+    level_cutoffs = []
+    for ke in ke_cutoff:
+        level_cutoffs.extend(ke / ke_ratio**np.arange(ngrids))
+    level_cutoffs = np.asarray(level_cutoffs)
+    # number of grids along an axis of length L: ceil(L * c)
+    c = np.sqrt(2 * level_cutoffs) / np.pi
+
+    center = (coords.max(axis=0) + coords.min(axis=0)) * .5
+    coords = coords - center
+    rotations = [np.eye(3)]
+    if rotate and len(coords) > 1:
+        w, v = scipy.linalg.eigh(np.dot(coords.T, coords))
+        v = v[:,::-1]
+        # make the axes deterministic
+        idx = np.argmax(abs(v), axis=0)
+        v *= np.sign(v[idx,np.arange(3)])
+        if np.linalg.det(v) < 0:
+            v[:,2] *= -1
+        rotations.append(v)
+
+    def box_extent(rot):
+        r = np.dot(coords, rot)
+        return r.max(axis=0) - r.min(axis=0) + margin
+    extents = [box_extent(rot) for rot in rotations]
+    volumes = [np.prod(e) for e in extents]
+    irot = int(np.argmin(volumes))
+    rot = rotations[irot]
+    lmin = extents[irot] * unit_in_bohr
+
+    box = np.empty(3)
+    meshes = np.empty((len(level_cutoffs), 3), dtype=int)
+    tol = 1e-4
+    for x in range(3):
+        length = lmin[x]
+        while True:
+            n = np.ceil(length * c).astype(int)
+            smooth = np.array([is_smooth_number(i, primes) for i in n])
+            if smooth.all():
+                break
+            # the next box length at which a non-smooth mesh changes
+            length = min(n[~smooth] / c[~smooth]) * (1 + 1e-12)
+        # the largest box for these meshes
+        box[x] = max(min(n / c) - tol, length)
+        meshes[:,x] = n
+
+    a = np.diag(box)
+    for ke, mesh in zip(level_cutoffs, meshes):
+        assert all(cutoff_to_mesh(a, ke) == mesh)
+
+    mesh_ref = [cutoff_to_mesh(np.diag(extents[0] * unit_in_bohr), ke)
+                for ke in level_cutoffs]
+    info = {'rotation': rot,
+            'meshes': meshes.reshape(len(ke_cutoff), ngrids, 3),
+            'fft_cost': fft_cost(meshes),
+            'fft_cost_ref': fft_cost(mesh_ref)}
+    log.info('minimal_box: box %s, volume %.6g (molecule + margin %.6g, '
+             'unrotated %.6g), meshes %s', box / unit_in_bohr,
+             np.prod(box / unit_in_bohr), volumes[irot], volumes[0],
+             meshes[::ngrids].tolist())
+    log.info('minimal_box: predicted FFT cost %.4g (unrotated, unsmoothed %.4g)',
+             info['fft_cost'], info['fft_cost_ref'])
+
+    coords = np.dot(coords, rot) + box * (.5 / unit_in_bohr)
+    return coords, a / unit_in_bohr, info
+
 def _cubic2nonorth_factor(a):
     '''The factors to transform the energy cutoff from cubic lattice to
     non-orthogonal lattice. Energy cutoff is estimated based on cubic lattice.
@@ -779,8 +956,12 @@ def gradient_by_fdiff(cell, f, mesh=None):
         mesh = cell.mesh
     mesh = np.asarray(mesh, order='C', dtype=np.int32)
     a = cell.lattice_vectors()
-    # cube
-    dr = [a[i,i] / mesh[i] for i in range(3)]
+    orth = abs(a - np.diag(a.diagonal())).max() < 1e-12
+    if orth:
+        dr = [a[i,i] / mesh[i] for i in range(3)]
+    else:
+        # derivatives with respect to the fractional coordinates
+        dr = 1. / mesh
     dr = np.asarray(dr, order='C', dtype=float)
     f = np.asarray(f, order='C')
     df = np.empty([3,*mesh], order='C', dtype=float)
@@ -789,7 +970,11 @@ def gradient_by_fdiff(cell, f, mesh=None):
         df.ctypes.data_as(ctypes.c_void_p),
         mesh.ctypes.data_as(ctypes.c_void_p),
         dr.ctypes.data_as(ctypes.c_void_p))
-    return df.reshape(3,-1)
+    df = df.reshape(3,-1)
+    if not orth:
+        b = np.linalg.inv(a.T)
+        df = np.dot(b.T, df)
+    return df
 
 def laplacian_gs(f_gs, Gv):
     '''
@@ -827,6 +1012,8 @@ def laplacian_by_fdiff(cell, f, mesh=None):
     mesh = np.asarray(mesh, order='C', dtype=np.int32)
     assert f.size == np.prod(mesh)
     a = cell.lattice_vectors()
+    if abs(a - np.diag(a.diagonal())).max() > 1e-12:
+        return _laplacian_by_fdiff_nonorth(a, f, mesh)
     # cube
     dr = [a[i,i] / mesh[i] for i in range(3)]
     dr = np.asarray(dr, order='C', dtype=float)
@@ -839,6 +1026,29 @@ def laplacian_by_fdiff(cell, f, mesh=None):
         dr.ctypes.data_as(ctypes.c_void_p))
     return lf.ravel()
 
+def _laplacian_by_fdiff_nonorth(a, f, mesh):
+    '''
+    Central difference Laplacian on a non-orthogonal lattice,
+    :math:`\Delta f = \sum_{ij} (b_i \cdot b_j) \partial_i \partial_j f`,
+    where :math:`\partial_i` is the derivative with respect to the
+    fractional coordinate along the lattice vector :math:`a_i`.
+    '''
+    b = np.linalg.inv(a.T)
+    metric = np.dot(b, b.T)
+    f = f.reshape(mesh)
+    lf = np.zeros_like(f)
+    for i in range(3):
+        fp = np.roll(f, -1, axis=i)
+        fm = np.roll(f, 1, axis=i)
+        lf += (metric[i,i] * mesh[i]**2) * (fp + fm - 2 * f)
+        for j in range(i+1, 3):
+            if abs(metric[i,j]) < 1e-14:
+                continue
+            fac = metric[i,j] * mesh[i] * mesh[j] * .5
+            lf += fac * (np.roll(fp, -1, axis=j) - np.roll(fp, 1, axis=j)
+                         - np.roll(fm, -1, axis=j) + np.roll(fm, 1, axis=j))
+    return lf.ravel()
+
 def solve_poisson(cell, rho, coulG=None, Gv=None, mesh=None,
                   compute_potential=True, compute_gradient=False,
                   real_potential=True):
@@ -206,6 +206,38 @@ C  15.16687337 15.16687337 15.16687337
         v = tools.ifft(a, [8,n,8]).ravel()
         self.assertAlmostEqual(abs(ref-v).max(), 0, 10)
 
+    def test_minimal_box(self):
+        from pyscf.pbc.dft.multigrid import multigrid_pair
+        coords = numpy.random.RandomState(3).rand(20,3) * [9., 2., 4.]
+        theta = .6
+        rot = numpy.array([[numpy.cos(theta), -numpy.sin(theta), 0],
+                           [numpy.sin(theta),  numpy.cos(theta), 0],
+                           [0, 0, 1]])
+        coords = coords.dot(rot.T)
+        c, a, info = tools.minimal_box(coords, [50., 200.], margin=4.,
+                                       ngrids=4, ke_ratio=3.)
+        d0 = numpy.linalg.norm(coords[:,None] - coords, axis=2)
+        d1 = numpy.linalg.norm(c[:,None] - c, axis=2)
+        self.assertAlmostEqual(abs(d0-d1).max(), 0, 12)
+        self.assertTrue(all(c.min(axis=0) > 1.9))
+        self.assertTrue(all(c.max(axis=0) < a.diagonal() - 1.9))
+        self.assertTrue(info['fft_cost'] < info['fft_cost_ref'])
+
+        cell = pbcgto.M(atom=[['He', x] for x in c], a=a, basis='gth-szv',
+                        pseudo='gth-pade', ke_cutoff=200., spin=None)
+        task_list = multigrid_pair.multi_grids_tasks(cell, ngrids=4, ke_ratio=3.)
+        meshes = task_list.contents.gridlevel_info.contents.mesh
+        meshes = numpy.ctypeslib.as_array(meshes, shape=(4,3))
+        self.assertTrue(abs(meshes - info['meshes'][1][::-1]).max() == 0)
+        for n in meshes.ravel():
+            self.assertTrue(tools.is_smooth_number(n))
+        multigrid_pair.free_task_list(task_list)
+
+        c1, a1, info1 = tools.minimal_box(coords, [50., 200.], margin=4.,
+                                          ngrids=4, ke_ratio=3.)
+        self.assertTrue(abs(c1-c).max() == 0)
+        self.assertTrue(abs(a1-a).max() == 0)
+
 
 if __name__ == '__main__':
     print("Full Tests for pbc.tools")
@@ -25,6 +25,15 @@ from pyscf import lib
 from pyscf.lib import logger
 from pyscf.scf import hf, rohf, uhf, ghf, dhf
 
+def _is_multigrid(mf):
+    '''Whether mf is a PBC DFT object with the multigrid integrator
+    (MultiGridFFTDF or MultiGridFFTDF2)'''
+    with_df = getattr(mf, 'with_df', None)
+    if with_df is None or getattr(mf, 'cell', None) is None:
+        return False
+    from pyscf.pbc.dft import multigrid
+    return isinstance(with_df, multigrid.MultiGridFFTDF)
+
 def _gen_rhf_response(mf, mo_coeff=None, mo_occ=None,
                       singlet=None, hermi=0, max_memory=None):
     '''Generate a function to compute the product of RHF response function and
@@ -52,8 +61,7 @@ def _gen_rhf_response(mf, mo_coeff=None, mo_occ=None,
         hybrid = abs(hyb) > 1e-10
 
         # mf can be pbc.dft.RKS object with multigrid
-        if (not hybrid and
-            'MultiGridFFTDF' == getattr(mf, 'with_df', None).__class__.__name__):
+        if not hybrid and _is_multigrid(mf):
             from pyscf.pbc.dft import multigrid
             dm0 = mf.make_rdm1(mo_coeff, mo_occ)
             return multigrid._gen_rhf_response(mf, dm0, singlet, hermi)
@@ -164,8 +172,7 @@ def _gen_uhf_response(mf, mo_coeff=None, mo_occ=None,
         hybrid = abs(hyb) > 1e-10
 
         # mf can be pbc.dft.UKS object with multigrid
-        if (not hybrid and
-            'MultiGridFFTDF' == getattr(mf, 'with_df', None).__class__.__name__):
+        if not hybrid and _is_multigrid(mf):
             from pyscf.pbc.dft import multigrid
             dm0 = mf.make_rdm1(mo_coeff, mo_occ)
             return multigrid._gen_uhf_response(mf, dm0, with_j, hermi)
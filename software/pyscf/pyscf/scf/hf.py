@@ -114,6 +114,14 @@ def kernel(mf, conv_tol=1e-10, conv_tol_grad=None,
     >>> print('conv = %s, E(HF) = %.12f' % (conv, e))
     conv = True, E(HF) = -1.081170784378
     '''
+    with lib.profiler.phase('scf.kernel'):
+        return _kernel(mf, conv_tol, conv_tol_grad, dump_chk, dm0, callback,
+                       conv_check, **kwargs)
+
+def _kernel(mf, conv_tol=1e-10, conv_tol_grad=None,
+            dump_chk=True, dm0=None, callback=None, conv_check=True, **kwargs):
+    '''The SCF driver of :func:`kernel`, with its phases recorded by
+    :mod:`pyscf.lib.profiler`.'''
     if 'init_dm' in kwargs:
         raise RuntimeError('''
 You see this error message because of the API updates in pyscf v0.11.
@@ -124,7 +132,8 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         logger.info(mf, 'Set gradient conv threshold to %g', conv_tol_grad)
 
     mol = mf.mol
-    s1e = mf.get_ovlp(mol)
+    with lib.profiler.phase('scf.int1e'):
+        s1e = mf.get_ovlp(mol)
     if not hasattr(mol, 'rcut'):
         if mf.verbose >= logger.DEBUG and mol.nao < 2000:
             cond = lib.cond(s1e, p=1)
@@ -150,12 +159,15 @@ Keyword argument "init_dm" is replaced by "dm0"''')
             mf._eigh = eigh
 
     if dm0 is None:
-        dm = mf.get_init_guess(mol, mf.init_guess, s1e=s1e)
+        with lib.profiler.phase('scf.init_guess'):
+            dm = mf.get_init_guess(mol, mf.init_guess, s1e=s1e)
     else:
         dm = dm0
 
-    h1e = mf.get_hcore(mol)
-    vhf = mf.get_veff(mol, dm)
+    with lib.profiler.phase('scf.int1e'):
+        h1e = mf.get_hcore(mol)
+    with lib.profiler.phase('scf.get_veff'):
+        vhf = mf.get_veff(mol, dm)
     e_tot = mf.energy_tot(dm, h1e, vhf)
     logger.info(mf, 'init E= %.15g', e_tot)
 
@@ -165,8 +177,10 @@ Keyword argument "init_dm" is replaced by "dm0"''')
     # Skip SCF iterations. Compute only the total energy of the initial density
     if mf.max_cycle <= 0:
         fock = mf.get_fock(h1e, s1e, vhf, dm)  # = h1e + vhf, no DIIS
-        mo_energy, mo_coeff = mf.eig(fock, s1e)
+        with lib.profiler.phase('scf.eig'):
+            mo_energy, mo_coeff = mf.eig(fock, s1e)
         mo_occ = mf.get_occ(mo_energy, mo_coeff)
+        _profiler_summary(mf, scf_conv, e_tot, 0)
         return scf_conv, e_tot, mo_energy, mo_coeff, mo_occ
 
     if isinstance(mf.diis, lib.diis.DIIS):
@@ -179,10 +193,13 @@ Keyword argument "init_dm" is replaced by "dm0"''')
     else:
         mf_diis = None
 
+    chk_writer = None
     if dump_chk and mf.chkfile:
         # Explicit overwrite the mol object in chkfile
         # Note in pbc.scf, mf.mol == mf.cell, cell is saved under key "mol"
         chkfile.save_mol(mol, mf.chkfile)
+        # chkfile is written in background, off the SCF iterations
+        chk_writer = lib.BackgroundWriter()
 
     # A preprocessing hook before the SCF iteration
     mf.pre_kernel(locals())
@@ -192,13 +209,16 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         dm_last = dm
         last_hf_e = e_tot
 
-        fock = mf.get_fock(h1e, s1e, vhf, dm, cycle, mf_diis)
-        mo_energy, mo_coeff = mf.eig(fock, s1e)
+        with lib.profiler.phase('scf.get_fock'):
+            fock = mf.get_fock(h1e, s1e, vhf, dm, cycle, mf_diis)
+        with lib.profiler.phase('scf.eig'):
+            mo_energy, mo_coeff = mf.eig(fock, s1e)
         mo_occ = mf.get_occ(mo_energy, mo_coeff)
         dm = mf.make_rdm1(mo_coeff, mo_occ)
         # attach mo_coeff and mo_occ to dm to improve DFT get_veff efficiency
         dm = lib.tag_array(dm, mo_coeff=mo_coeff, mo_occ=mo_occ)
-        vhf = mf.get_veff(mol, dm, dm_last, vhf)
+        with lib.profiler.phase('scf.get_veff'):
+            vhf = mf.get_veff(mol, dm, dm_last, vhf)
         e_tot = mf.energy_tot(dm, h1e, vhf)
 
         # Here Fock matrix is h1e + vhf, without DIIS.  Calling get_fock
@@ -218,7 +238,8 @@ Keyword argument "init_dm" is replaced by "dm0"''')
             scf_conv = True
 
         if dump_chk:
-            mf.dump_chk(locals())
+            with lib.profiler.phase('scf.dump_chk'):
+                _dump_chk(mf, locals(), chk_writer)
 
         if callable(callback):
             callback(locals())
@@ -231,11 +252,13 @@ Keyword argument "init_dm" is replaced by "dm0"''')
     if scf_conv and conv_check:
         # An extra diagonalization, to remove level shift
         #fock = mf.get_fock(h1e, s1e, vhf, dm)  # = h1e + vhf
-        mo_energy, mo_coeff = mf.eig(fock, s1e)
+        with lib.profiler.phase('scf.eig'):
+            mo_energy, mo_coeff = mf.eig(fock, s1e)
         mo_occ = mf.get_occ(mo_energy, mo_coeff)
         dm, dm_last = mf.make_rdm1(mo_coeff, mo_occ), dm
         dm = lib.tag_array(dm, mo_coeff=mo_coeff, mo_occ=mo_occ)
-        vhf = mf.get_veff(mol, dm, dm_last, vhf)
+        with lib.profiler.phase('scf.get_veff'):
+            vhf = mf.get_veff(mol, dm, dm_last, vhf)
         e_tot, last_hf_e = mf.energy_tot(dm, h1e, vhf), e_tot
 
         fock = mf.get_fock(h1e, s1e, vhf, dm)
@@ -253,8 +276,16 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         logger.info(mf, 'Extra cycle  E= %.15g  delta_E= %4.3g  |g|= %4.3g  |ddm|= %4.3g',
                     e_tot, e_tot-last_hf_e, norm_gorb, norm_ddm)
         if dump_chk:
-            mf.dump_chk(locals())
-
+            with lib.profiler.phase('scf.dump_chk'):
+                _dump_chk(mf, locals(), chk_writer)
+
+    if chk_writer is not None:
+        with lib.profiler.phase('scf.dump_chk'):
+            chk_writer.close()
+        logger.debug(mf, 'chkfile written %d times, %d outdated dumps skipped',
+                     chk_writer.nwrites, chk_writer.ncoalesced)
+    if isinstance(mf_diis, lib.diis.DIIS):
+        mf_diis.flush()
     logger.timer(mf, 'scf_cycle', *cput0)
     # A post-processing hook before return
     mf.post_kernel(locals())
@@ -264,8 +295,39 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         mf.fock = fock
     # @@@@@@@
 
+    _profiler_summary(mf, scf_conv, e_tot, cycle+1)
     return scf_conv, e_tot, mo_energy, mo_coeff, mo_occ
 
+def _profiler_summary(mf, scf_conv, e_tot, cycles):
+    '''Add the summary of the SCF run to the profiler record (for the
+    outermost SCF only, not the SCFs of the initial guess).'''
+    prof = lib.profiler.current()
+    if prof is None or prof.depth('scf.kernel') > 1:
+        return
+    mol = mf.mol
+    summary = {'method': mf.__class__.__name__, 'natm': mol.natm,
+               'nao': mol.nao_nr(), 'nelectron': mol.nelectron,
+               'converged': bool(scf_conv), 'e_tot': float(e_tot),
+               'cycles': cycles, 'conv_tol': mf.conv_tol}
+    if getattr(mol, 'mesh', None) is not None:
+        summary['mesh'] = [int(x) for x in mol.mesh]
+    lib.profiler.add_scf_summary(**summary)
+
+
+def _dump_chk(mf, envs, writer=None):
+    '''Call mf.dump_chk(envs), in background if writer is given.'''
+    if writer is None:
+        mf.dump_chk(envs)
+    else:
+        # envs of locals() is updated in place by the next call of locals().
+        # The arrays saved by dump_chk are copied, the others are rebound,
+        # not modified, by the SCF iterations.
+        envs = dict(envs)
+        for key in ('mo_energy', 'mo_coeff', 'mo_occ'):
+            if isinstance(envs.get(key), numpy.ndarray):
+                envs[key] = envs[key].copy()
+        writer.submit('dump_chk', mf.dump_chk, envs)
+
 
 def energy_elec(mf, dm=None, h1e=None, vhf=None):
     r'''Electronic part of Hartree-Fock energy, for given core hamiltonian and
@@ -964,7 +1026,8 @@ def get_fock(mf, h1e=None, s1e=None, vhf=None, dm=None, cycle=-1, diis=None,
     if 0 <= cycle < diis_start_cycle-1 and abs(damp_factor) > 1e-4:
         f = damping(s1e, dm*.5, f, damp_factor)
     if diis is not None and cycle >= diis_start_cycle:
-        f = diis.update(s1e, dm, f, mf, h1e, vhf)
+        with lib.profiler.phase('scf.diis'):
+            f = diis.update(s1e, dm, f, mf, h1e, vhf)
     if abs(level_shift_factor) > 1e-4:
         f = level_shift(s1e, dm*.5, f, level_shift_factor)
     return f
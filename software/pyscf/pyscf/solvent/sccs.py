@@ -44,27 +44,62 @@ def _get_log_eps_gradient(cell, eps, Gv=None, mesh=None, method='FFT'):
 def _get_deps_drho(eps, deps_intermediate):
     return lib.multiply(eps, deps_intermediate)
 
+def _get_gspace(sccs, mesh):
+    '''
+    Gv and coulG of mesh, cached in sccs by mesh and lattice vectors.
+    '''
+    cell = sccs.cell
+    key = (tuple(mesh), cell.lattice_vectors().tobytes())
+    if key not in sccs._gspace:
+        sccs._gspace[key] = (cell.get_Gv(mesh=mesh), tools.get_coulG(cell, mesh=mesh))
+    return sccs._gspace[key]
+
+def _get_rho_tot_guess(sccs, rho_solute):
+    '''
+    Initial guess of the total density, using the polarization density
+    from the previous SCF step if it is available on the same mesh.
+    '''
+    rho_pol = sccs.rho_pol
+    if rho_pol is not None and rho_pol.size == rho_solute.size:
+        # the G=0 component is dropped by the Poisson solver. Keep the
+        # guess consistent with its potential, otherwise the residual has
+        # a constant shift that the solvers cannot remove.
+        return rho_pol - rho_pol.mean() + rho_solute
+    else:
+        return rho_solute
+
+def _adaptive_conv_tol(sccs, rho_solute, conv_tol):
+    '''
+    Loosen the solver tolerance in early SCF cycles. The tolerance is
+    sccs.conv_tol_ratio times the relative change of the solute density
+    since the previous call, bounded by conv_tol and sccs.conv_tol_max.
+    '''
+    rho_last = sccs._rho_solute_last
+    sccs._rho_solute_last = rho_solute.copy()
+    if rho_last is None or rho_last.size != rho_solute.size:
+        return max(conv_tol, sccs.conv_tol_max)
+    drho = lib.subtract(rho_solute, rho_last)
+    drho = numpy.sqrt(lib.vdot(drho, drho) / lib.vdot(rho_solute, rho_solute))
+    return min(max(conv_tol, sccs.conv_tol_ratio * drho), max(conv_tol, sccs.conv_tol_max))
+
 def _pgd(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
-         gradient_method=None, mixing_factor=None, conv_tol=1e-5, max_cycle=50):
+         gradient_method=None, mixing_factor=None, conv_tol=1e-5, max_cycle=50,
+         log_eps1=None):
     cell = sccs.cell
     if mesh is None:
         mesh = sccs.mesh
-    if coulG is None:
-        coulG = tools.get_coulG(cell, mesh=mesh)
-    if Gv is None:
-        Gv = cell.get_Gv(mesh=mesh)
+    if coulG is None or Gv is None:
+        Gv, coulG = _get_gspace(sccs, mesh)
     if gradient_method is None:
         gradient_method = sccs.gradient_method
     if mixing_factor is None:
         mixing_factor = sccs.mixing_factor
 
-    log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
-    if sccs.rho_pol is not None:
-        # use the polarization density from previous scf step
-        # as the initial guess
-        rho_tot = sccs.rho_pol + rho_solute
-    else:
-        rho_tot = rho_solute
+    if log_eps1 is None:
+        log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
+    # use the polarization density from previous scf step
+    # as the initial guess
+    rho_tot = _get_rho_tot_guess(sccs, rho_solute)
 
     phi_tot = tools.solve_poisson(cell, rho_tot, coulG=coulG, Gv=Gv, mesh=mesh)[0]
 
@@ -91,10 +126,12 @@ def _pgd(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
 
     fac1 = fac * numpy.sqrt(lib.vdot(rho_solute, rho_solute))
     invs_eps = lib.reciprocal(-fac * eps)
+    ncycle = max_cycle
     for i in range(max_cycle):
         r_norm = numpy.sqrt(lib.vdot(r,r)) / fac1
-        logger.info(sccs, 'cycle= %d  res= %4.3g', i, r_norm)
+        logger.debug(sccs, 'cycle= %d  res= %4.3g', i, r_norm)
         if r_norm < conv_tol:
+            ncycle = i
             break
 
         fake_rho = lib.multiply(r, invs_eps)
@@ -121,7 +158,7 @@ def _pgd(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
         r = lib.subtract(r, lib.multiply(alpha, Av), out=r)
         phi_tot = lib.add(phi_tot, lib.multiply(alpha, v), out=phi_tot)
 
-    return phi_tot
+    return phi_tot, ncycle
 
 def get_multiple_meshes(cell, mesh, ngrids=1, ke_ratio=KE_RATIO):
     a = cell.lattice_vectors()
@@ -136,7 +173,8 @@ def get_multiple_meshes(cell, mesh, ngrids=1, ke_ratio=KE_RATIO):
     return meshes
 
 def _mgpgd(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
-           gradient_method=None, mixing_factor=None, conv_tol=1e-5, max_cycle=50):
+           gradient_method=None, mixing_factor=None, conv_tol=1e-5, max_cycle=50,
+           log_eps1=None):
     cell = sccs.cell
     if mesh is None or coulG is None or Gv is None:
         return _pgd(sccs, rho_solute, eps, coulG=coulG, Gv=Gv, mesh=mesh,
@@ -149,21 +187,19 @@ def _mgpgd(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
 
     ngrids = len(eps)
 
-    if sccs.rho_pol is not None:
-        # use the polarization density from previous scf step
-        # as the initial guess
-        rho_tot = sccs.rho_pol + rho_solute
-    else:
-        rho_tot = rho_solute
+    # use the polarization density from previous scf step
+    # as the initial guess
+    rho_tot = _get_rho_tot_guess(sccs, rho_solute)
 
     fac = 4 * numpy.pi
 
     phi_tot = tools.solve_poisson(cell, rho_tot, coulG=coulG[0], Gv=Gv[0], mesh=mesh[0])[0]
 
-    log_eps1 = []
+    if log_eps1 is None:
+        log_eps1 = [_get_log_eps_gradient(cell, eps[i], Gv[i], mesh[i], gradient_method)
+                    for i in range(ngrids)]
     invs_eps = []
     for i in range(ngrids):
-        log_eps1.append(_get_log_eps_gradient(cell, eps[i], Gv[i], mesh[i], gradient_method))
         invs_eps.append(lib.reciprocal(-fac * eps[i]))
 
     if gradient_method.upper() == "FFT":
@@ -278,24 +314,24 @@ def _mgpgd(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
 
     rhs = lib.multiply(-fac, rho_solute)
     fac1 = numpy.sqrt(lib.vdot(rhs, rhs))
+    ncycle = max_cycle
     for i in range(max_cycle):
         r_norm = numpy.sqrt(lib.vdot(r,r))/fac1
-        logger.info(sccs, 'cycle= %d  res= %4.3g', i, r_norm)
+        logger.debug(sccs, 'cycle= %d  res= %4.3g', i, r_norm)
         if r_norm < conv_tol:
+            ncycle = i
             break
 
         phi_tot, r = v_cycle(phi_tot, rhs, r, mesh, 0)
-    return phi_tot
+    return phi_tot, ncycle
 
 def _pcg(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
-         gradient_method=None, conv_tol=1e-5, max_cycle=50):
+         gradient_method=None, conv_tol=1e-5, max_cycle=50, log_eps1=None):
     cell = sccs.cell
     if mesh is None:
         mesh = sccs.mesh
-    if coulG is None:
-        coulG = tools.get_coulG(cell, mesh=mesh)
-    if Gv is None:
-        Gv = cell.get_Gv(mesh=mesh)
+    if coulG is None or Gv is None:
+        Gv, coulG = _get_gspace(sccs, mesh)
     if gradient_method is None:
         gradient_method = sccs.gradient_method
 
@@ -308,21 +344,13 @@ def _pcg(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
         raise NotImplementedError
     q = lib.multiply(sqrt_eps, lap_sqrt_eps)
 
-    log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
-
-    if sccs.rho_pol is not None:
-        # use the polarization density from previous scf step
-        # as the initial guess
-        rho_tot = sccs.rho_pol + rho_solute
-    else:
-        rho_tot = rho_solute
+    if log_eps1 is None:
+        log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
 
-    '''
-    if sccs.phi_tot is None:
-        phi_tot = tools.solve_poisson(cell, rho_solute, coulG=coulG, Gv=Gv, mesh=mesh)[0]
-    else:
-        phi_tot = sccs.phi_tot
-    '''
+    # use the polarization density from previous scf step as the initial
+    # guess. The potential of rho_pol + rho_solute is the previous phi_tot
+    # corrected for the change of the solute density.
+    rho_tot = _get_rho_tot_guess(sccs, rho_solute)
     phi_tot = tools.solve_poisson(cell, rho_tot, coulG=coulG, Gv=Gv, mesh=mesh)[0]
 
     if gradient_method.upper() == "FFT":
@@ -349,10 +377,12 @@ def _pcg(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
 
     fac1 = fac * numpy.sqrt(lib.vdot(rho_solute, rho_solute))
     invs_sqrt_eps = lib.reciprocal(sqrt_eps)
+    ncycle = max_cycle
     for i in range(max_cycle):
         r_norm = numpy.sqrt(lib.vdot(r,r)) / fac1
-        logger.info(sccs, 'cycle= %d  res= %4.3g', i, r_norm)
+        logger.debug(sccs, 'cycle= %d  res= %4.3g', i, r_norm)
         if r_norm < conv_tol:
+            ncycle = i
             break
 
         fake_rho = lib.multiply(r, invs_sqrt_eps)
@@ -382,28 +412,28 @@ def _pcg(sccs, rho_solute, eps, coulG=None, Gv=None, mesh=None,
     if r_norm > conv_tol:
         logger.warn(sccs, 'SCCS did not converge.')
 
-    return phi_tot
+    return phi_tot, ncycle
 
 def _mixing(sccs, rho_solute, eps, rho_pol=None, coulG=None, Gv=None, mesh=None,
-            gradient_method=None, mixing_factor=None, conv_tol=1e-5, max_cycle=50):
+            gradient_method=None, mixing_factor=None, conv_tol=1e-5, max_cycle=50,
+            log_eps1=None):
     cell = sccs.cell
     if mesh is None:
         mesh = sccs.mesh
-    if coulG is None:
-        coulG = tools.get_coulG(cell, mesh=mesh)
-    if Gv is None:
-        Gv = cell.get_Gv(mesh=mesh)
+    if coulG is None or Gv is None:
+        Gv, coulG = _get_gspace(sccs, mesh)
     if gradient_method is None:
         gradient_method = sccs.gradient_method
     if mixing_factor is None:
         mixing_factor = sccs.mixing_factor
 
     fac = 4. * numpy.pi
-    log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
-    log_eps1 = lib.multiply(1./fac, log_eps1, out=log_eps1)
+    if log_eps1 is None:
+        log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
+    log_eps1 = lib.multiply(1./fac, log_eps1)
 
     rho_solute_over_eps = numpy.divide(rho_solute, eps)
-    if rho_pol is not None:
+    if rho_pol is not None and rho_pol.size == rho_solute.size:
         # use the polarization density from previous scf step
         # as the initial guess
         rho_iter = lib.subtract(rho_pol, rho_solute_over_eps)
@@ -414,6 +444,7 @@ def _mixing(sccs, rho_solute, eps, rho_pol=None, coulG=None, Gv=None, mesh=None,
 
     r_norm = 0
     fac1 = fac * numpy.sqrt(lib.vdot(rho_solute, rho_solute))
+    ncycle = max_cycle
     for i in range(max_cycle):
         rho_tot = lib.add(rho_solute_over_eps, rho_iter)
         if gradient_method.upper() == "FFT":
@@ -434,8 +465,9 @@ def _mixing(sccs, rho_solute, eps, rho_pol=None, coulG=None, Gv=None, mesh=None,
         r = lib.subtract(rho_iter_old, rho_iter)
         r = lib.multiply(eps, r, out=r)
         r_norm = fac * numpy.sqrt(lib.vdot(r,r)) / fac1
-        logger.info(sccs, 'cycle= %d  res= %4.3g', i+1, r_norm)
+        logger.debug(sccs, 'cycle= %d  res= %4.3g', i+1, r_norm)
         if r_norm < conv_tol:
+            ncycle = i + 1
             break
         r = None
 
@@ -447,7 +479,7 @@ def _mixing(sccs, rho_solute, eps, rho_pol=None, coulG=None, Gv=None, mesh=None,
         logger.warn(sccs, 'SCCS did not converge.')
 
     rho_tot = lib.add(rho_solute_over_eps, rho_iter)
-    return rho_tot
+    return rho_tot, ncycle
 
 def kernel(sccs, rho_elec, rho_core=None, method="mixing",
            rho_min=1e-4, rho_max=1.5e-3, conv_tol=1e-5, max_cycle=50):
@@ -472,6 +504,8 @@ def kernel(sccs, rho_elec, rho_core=None, method="mixing",
         rho_solute = rho_elec[0]
     else:
         rho_solute = lib.add(rho_elec[0], rho_core)
+    if sccs.adaptive_conv_tol:
+        conv_tol = _adaptive_conv_tol(sccs, rho_solute, conv_tol)
 
     eps = [None,]
     eps[0], deps_intermediate = _get_eps(rho_elec[0], None, rho_min, rho_max, eps0)
@@ -480,49 +514,56 @@ def kernel(sccs, rho_elec, rho_core=None, method="mixing",
 
     Gv = []
     coulG = []
-    log_eps1 = []    
+    log_eps1 = []
     for i, submesh in enumerate(meshes):
-        Gv.append(cell.get_Gv(mesh=submesh))
-        coulG.append(tools.get_coulG(cell, mesh=submesh))
+        Gv_i, coulG_i = _get_gspace(sccs, submesh)
+        Gv.append(Gv_i)
+        coulG.append(coulG_i)
         log_eps1.append(_get_log_eps_gradient(cell, eps[i], Gv[i], submesh, sccs.gradient_method))
 
     rho_tot = None
     phi_tot = None
     if method.upper() == "PCG":
-        phi_tot = _pcg(sccs, rho_solute, eps[0], coulG=coulG[0], Gv=Gv[0], mesh=meshes[0],
-                       conv_tol=conv_tol, max_cycle=max_cycle)
+        phi_tot, ncycle = _pcg(sccs, rho_solute, eps[0], coulG=coulG[0], Gv=Gv[0],
+                               mesh=meshes[0], conv_tol=conv_tol, max_cycle=max_cycle,
+                               log_eps1=log_eps1[0])
         sccs.phi_tot = phi_tot
     elif method.upper() == "MIXING":
-        rho_tot = _mixing(sccs, rho_solute, eps[0], rho_pol=sccs.rho_pol,
-                          coulG=coulG[0], Gv=Gv[0], mesh=meshes[0],
-                          conv_tol=conv_tol, max_cycle=max_cycle)
+        rho_tot, ncycle = _mixing(sccs, rho_solute, eps[0], rho_pol=sccs.rho_pol,
+                                  coulG=coulG[0], Gv=Gv[0], mesh=meshes[0],
+                                  conv_tol=conv_tol, max_cycle=max_cycle,
+                                  log_eps1=log_eps1[0])
     elif method.upper() == "PGD":
-        phi_tot = _pgd(sccs, rho_solute, eps[0], coulG=coulG[0], Gv=Gv[0], mesh=meshes[0],
-                       conv_tol=conv_tol, max_cycle=max_cycle)
+        phi_tot, ncycle = _pgd(sccs, rho_solute, eps[0], coulG=coulG[0], Gv=Gv[0],
+                               mesh=meshes[0], conv_tol=conv_tol, max_cycle=max_cycle,
+                               log_eps1=log_eps1[0])
         sccs.phi_tot = phi_tot
     elif method.upper() == 'MGPGD':
-        phi_tot = _mgpgd(sccs, rho_solute, eps, coulG=coulG, Gv=Gv, mesh=meshes,
-                         conv_tol=conv_tol, max_cycle=max_cycle)
+        phi_tot, ncycle = _mgpgd(sccs, rho_solute, eps, coulG=coulG, Gv=Gv, mesh=meshes,
+                                 conv_tol=conv_tol, max_cycle=max_cycle,
+                                 log_eps1=log_eps1)
         sccs.phi_tot = phi_tot
     else:
         raise KeyError(f"Unrecognized method: {method}.")
+    sccs.cycles = ncycle
+    sccs.total_cycles += ncycle
+    logger.info(sccs, 'SCCS %s solver: %d cycles (conv_tol = %.3g), %d cycles in total',
+                method, ncycle, conv_tol, sccs.total_cycles)
 
     deps_drho = _get_deps_drho(eps[0], deps_intermediate)
     deps_intermediate = None
 
     e_pol, phi_sccs = get_veff(sccs, rho_solute, eps[0], deps_drho, rho_tot, phi_tot,
-                               coulG[0], Gv[0], meshes[0])
+                               coulG[0], Gv[0], meshes[0], log_eps1=log_eps1[0])
     return e_pol, phi_sccs
 
 def get_veff(sccs, rho_solute, eps, deps_drho, rho_tot=None, phi_tot=None,
-             coulG=None, Gv=None, mesh=None, gradient_method=None):
+             coulG=None, Gv=None, mesh=None, gradient_method=None, log_eps1=None):
     cell = sccs.cell
     if mesh is None:
         mesh = sccs.mesh
-    if Gv is None:
-        Gv = cell.get_Gv(mesh)
-    if coulG is None:
-        coulG = tools.get_coulG(cell, mesh=mesh)
+    if coulG is None or Gv is None:
+        Gv, coulG = _get_gspace(sccs, mesh)
     if gradient_method is None:
         gradient_method = sccs.gradient_method
     if rho_tot is None and phi_tot is None:
@@ -543,8 +584,9 @@ def get_veff(sccs, rho_solute, eps, deps_drho, rho_tot=None, phi_tot=None,
         raise NotImplementedError
 
     if rho_pol is None:
-        log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
-        log_eps1 = lib.multiply(.25/numpy.pi, log_eps1, out=log_eps1)
+        if log_eps1 is None:
+            log_eps1 = _get_log_eps_gradient(cell, eps, Gv, mesh, gradient_method)
+        log_eps1 = lib.multiply(.25/numpy.pi, log_eps1)
 
         rho_iter=None
         for x in range(3):
@@ -577,6 +619,29 @@ def get_veff(sccs, rho_solute, eps, deps_drho, rho_tot=None, phi_tot=None,
 
 
 class SCCS(lib.StreamObject):
+    '''
+    Self-consistent continuum solvation model
+
+    Attributes:
+        method : str
+            Solver of the generalized Poisson equation, one of 'mixing',
+            'pcg', 'pgd' and 'mgpgd'.
+        conv_tol : float
+            Convergence threshold of the relative residual.
+        adaptive_conv_tol : bool
+            Whether to solve loosely in early SCF cycles. The threshold
+            is conv_tol_ratio times the relative change of the solute
+            density since the previous call, between conv_tol and
+            conv_tol_max. Default is True.
+        cycles : int
+            Number of solver iterations in the last call.
+        total_cycles : int
+            Number of solver iterations accumulated over all calls.
+
+    The polarization density of the previous call is the initial guess of
+    the next one, and the G-vectors and Coulomb kernels of the meshes are
+    cached. Call :meth:`reset` to drop both.
+    '''
     def __init__(self, cell, mesh, eps=78.3553, rho_min=1e-4, rho_max=1.5e-3):
         self.cell = cell
         self.mesh = mesh
@@ -597,6 +662,25 @@ class SCCS(lib.StreamObject):
         self.gradient_method = 'fft'
         self.ngrids = 1
         self.ke_ratio = 3.0
+        self.adaptive_conv_tol = True
+        self.conv_tol_ratio = 0.1
+        self.conv_tol_max = 1e-3
+        self.cycles = 0
+        self.total_cycles = 0
+        self._gspace = {}
+        self._rho_solute_last = None
+
+    def reset(self, cell=None):
+        if cell is not None:
+            self.cell = cell
+        self.rho_pol = None
+        self.phi_eps = None
+        self.phi_tot = None
+        self.cycles = 0
+        self.total_cycles = 0
+        self._gspace = {}
+        self._rho_solute_last = None
+        return self
 
     def kernel(self, rho, rho_core=None):
         return kernel(self, rho, rho_core=rho_core, method=self.method,
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Chunked, compressed storage of densities on 3D meshes (.rhoz)
+
+The mesh is cut into chunks (32x32x32 by default) which are compressed
+independently, so that a sub-block can be read by decompressing only the
+chunks it overlaps.  Two modes are available
+
+* 'lossless' : the values are cast to dtype (float32 by default), their
+  bit patterns are differenced (modulo 2**bits) along the last axis, the
+  bytes are shuffled (all first bytes, then all second bytes, ...) and
+  compressed with zlib.  With dtype=float64 the input is reproduced
+  exactly.
+* 'quantized' : the values are rounded to multiples of 2*tol, so that the
+  absolute error is at most tol (plus the rounding to dtype).  The
+  integers are differenced along the last axis, stored in the narrowest
+  integer type of each chunk, shuffled and compressed.  The vacuum regions, which dominate molecular boxes,
+  cost almost nothing.
+
+Layout of the file: b'RHOZ', the length of the JSON header (uint32), the
+JSON header, the offsets of the chunks (int64, nchunks+1) and the
+compressed chunks.  Chunks are ordered C-contiguously by their indices.
+
+Usage::
+
+    density_codec.save('rho_22.rhoz', rho.reshape(mesh))
+    rho = density_codec.load('rho_22.rhoz')
+    with density_codec.DensityFile('rho_22.rhoz') as f:
+        tile = f[32:64, :, 10:42]
+'''
+
+import io
+import sys
+import json
+import zlib
+import struct
+import numpy
+from pyscf import __config__
+
+CHUNK = getattr(__config__, 'tools_density_codec_chunk', (32, 32, 32))
+LEVEL = getattr(__config__, 'tools_density_codec_level', 6)
+
+MAGIC = b'RHOZ'
+VERSION = 1
+_INT_TYPES = (numpy.int8, numpy.int16, numpy.int32, numpy.int64)
+
+def _shuffle(a):
+    a = numpy.ascontiguousarray(a)
+    return a.view(numpy.uint8).reshape(-1, a.itemsize).T.tobytes()
+
+def _unshuffle(buf, dtype, count):
+    dtype = numpy.dtype(dtype)
+    b = numpy.frombuffer(buf, dtype=numpy.uint8).reshape(dtype.itemsize, count)
+    return numpy.ascontiguousarray(b.T).view(dtype).ravel()
+
+def _chunk_slices(shape, chunk):
+    nchunk = [-(-n // c) for n, c in zip(shape, chunk)]
+    for idx in numpy.ndindex(*nchunk):
+        yield tuple(slice(i*c, min((i+1)*c, n))
+                    for i, c, n in zip(idx, chunk, shape))
+
+def _encode_chunk(block, header):
+    level = header['level']
+    if header['mode'] == 'lossless':
+        u = numpy.ascontiguousarray(block, dtype=header['dtype'])
+        u = u.view('u%d' % u.itemsize)
+        d = u.copy()
+        d[..., 1:] -= u[..., :-1]
+        return zlib.compress(_shuffle(d), level)
+    q = numpy.rint(block / header['step']).astype(numpy.int64)
+    q[..., 1:] = numpy.diff(q, axis=-1)
+    lo, hi = q.min(), q.max()
+    for code, t in enumerate(_INT_TYPES):
+        info = numpy.iinfo(t)
+        if info.min <= lo and hi <= info.max:
+            break
+    return bytes([code]) + zlib.compress(_shuffle(q.astype(t)), level)
+
+def _decode_chunk(buf, shape, header):
+    count = int(numpy.prod(shape))
+    if header['mode'] == 'lossless':
+        dtype = numpy.dtype(header['dtype'])
+        u = _unshuffle(zlib.decompress(buf), 'u%d' % dtype.itemsize, count)
+        u = numpy.cumsum(u.reshape(shape), axis=-1, dtype=u.dtype)
+        return u.view(dtype)
+    t = _INT_TYPES[buf[0]]
+    q = _unshuffle(zlib.decompress(buf[1:]), t, count).reshape(shape)
+    q = numpy.cumsum(q, axis=-1, dtype=numpy.int64)
+    return (q * header['step']).astype(header['dtype'])
+
+def encode(rho, chunk=CHUNK, mode='lossless', dtype=numpy.float32, tol=None,
+           level=LEVEL):
+    '''Compress a 3D array. Returns bytes.
+
+    Kwargs:
+        chunk : 3 ints
+            Shape of the independently compressed chunks.
+        mode : str
+            'lossless' or 'quantized'.
+        dtype :
+            dtype of the decoded array.
+        tol : float
+            Maximum absolute error of the quantized mode.
+        level : int
+            zlib compression level.
+    '''
+    rho = numpy.asarray(rho)
+    assert rho.ndim == 3
+    if mode not in ('lossless', 'quantized'):
+        raise ValueError('Unknown mode %s' % mode)
+    header = {'version': VERSION, 'shape': list(rho.shape),
+              'chunk': [int(c) for c in chunk], 'mode': mode,
+              'dtype': numpy.dtype(dtype).str, 'level': int(level)}
+    if mode == 'quantized':
+        if tol is None or tol <= 0:
+            raise ValueError('The quantized mode needs tol > 0')
+        header['tol'] = float(tol)
+        header['step'] = 2 * float(tol)
+
+    chunks = [_encode_chunk(rho[s], header)
+              for s in _chunk_slices(rho.shape, header['chunk'])]
+    offsets = numpy.zeros(len(chunks)+1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(c) for c in chunks])
+    hbuf = json.dumps(header).encode()
+    return b''.join([MAGIC, struct.pack('<I', len(hbuf)), hbuf,
+                     offsets.astype('<i8').tobytes()] + chunks)
+
+
+class DensityFile(object):
+    '''Random access to a .rhoz stream
+
+    Indexing with slices (or integers) decompresses only the chunks
+    overlapping the requested block.
+
+    Args:
+        f : str, bytes or file object
+            File name, the encoded bytes, or a binary file object.
+
+    Kwargs:
+        offset : int
+            Position of the encoded data in the file object.
+
+    Attributes:
+        shape : tuple
+        dtype : numpy.dtype
+        chunk : tuple
+        header : dict
+    '''
+    def __init__(self, f, offset=0):
+        if isinstance(f, str):
+            f = open(f, 'rb')
+            self._own = True
+        else:
+            if isinstance(f, (bytes, bytearray, memoryview)):
+                f = io.BytesIO(f)
+            self._own = False
+        self._f = f
+        f.seek(offset)
+        if f.read(4) != MAGIC:
+            raise ValueError('Not a .rhoz stream')
+        nh = struct.unpack('<I', f.read(4))[0]
+        self.header = header = json.loads(f.read(nh).decode())
+        self.shape = tuple(header['shape'])
+        self.chunk = tuple(header['chunk'])
+        self.dtype = numpy.dtype(header['dtype'])
+        self.nchunk = tuple(-(-n // c) for n, c in zip(self.shape, self.chunk))
+        nchunks = int(numpy.prod(self.nchunk))
+        self.offsets = numpy.frombuffer(f.read(8*(nchunks+1)), dtype='<i8')
+        self._offset = offset
+        self._data_start = offset + 8 + nh + 8*(nchunks+1)
+
+    def close(self):
+        if self._own:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def nbytes(self):
+        '''Size of the encoded stream.'''
+        return self._data_start - self._offset + int(self.offsets[-1])
+
+    def read_chunk(self, idx):
+        '''Decoded chunk of the chunk indices idx (3 ints).'''
+        k = numpy.ravel_multi_index(idx, self.nchunk)
+        self._f.seek(self._data_start + int(self.offsets[k]))
+        buf = self._f.read(int(self.offsets[k+1] - self.offsets[k]))
+        shape = tuple(min(c, n - i*c) for i, c, n in
+                      zip(idx, self.chunk, self.shape))
+        return _decode_chunk(buf, shape, self.header)
+
+    def read(self, box=None):
+        '''Decode the block box = ((x0,x1), (y0,y1), (z0,z1)), or the whole
+        mesh if box is None.'''
+        if box is None:
+            box = [(0, n) for n in self.shape]
+        box = [(int(a), int(b)) for a, b in box]
+        out = numpy.empty([b - a for a, b in box], dtype=self.dtype)
+        if out.size == 0:
+            return out
+        ranges = [range(a // c, -(-b // c)) for (a, b), c in zip(box, self.chunk)]
+        for idx in numpy.ndindex(*[len(r) for r in ranges]):
+            idx = tuple(r[i] for r, i in zip(ranges, idx))
+            block = self.read_chunk(idx)
+            src = []
+            dst = []
+            for i, c, (a, b) in zip(idx, self.chunk, box):
+                lo = max(a, i*c)
+                hi = min(b, (i+1)*c)
+                src.append(slice(lo - i*c, hi - i*c))
+                dst.append(slice(lo - a, hi - a))
+            out[tuple(dst)] = block[tuple(src)]
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        box = []
+        post = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                r = range(*k.indices(n))
+                if len(r) == 0:
+                    box.append((0, 0))
+                else:
+                    # the box spans exactly the selected points
+                    box.append((min(r[0], r[-1]), max(r[0], r[-1]) + 1))
+                post.append(slice(None, None, r.step))
+            else:
+                k = int(k) % n
+                box.append((k, k+1))
+                post.append(0)
+        return self.read(box)[tuple(post)]
+
+
+def decode(buf):
+    '''Decompress the bytes produced by encode.'''
+    with DensityFile(buf) as f:
+        return f.read()
+
+def save(filename, rho, **kwargs):
+    '''Compress rho into filename. See encode for the keyword arguments.'''
+    with open(filename, 'wb') as f:
+        f.write(encode(rho, **kwargs))
+
+def load(filename):
+    '''Decompress the whole mesh of filename.'''
+    with DensityFile(filename) as f:
+        return f.read()
+
+
+if __name__ == '__main__':
+    # python -m pyscf.tools.density_codec rho_22.npy grid_sizes_22.dat [tol]
+    import time
+    rho = numpy.load(sys.argv[1])
+    mesh = numpy.loadtxt(sys.argv[2], dtype=int)
+    rho = rho.reshape(mesh)
+    kwargs = {}
+    if len(sys.argv) > 3:
+        kwargs = {'mode': 'quantized', 'tol': float(sys.argv[3])}
+    buf = encode(rho, **kwargs)
+    t0 = time.perf_counter()
+    rho1 = decode(buf)
+    t1 = time.perf_counter() - t0
+    print('mesh %s  ratio %.1f  max error %.3g  decode %.0f MB/s' %
+          (mesh, rho.nbytes / len(buf), abs(rho1 - rho).max(),
+           rho.nbytes / t1 / 1e6))
@@ -0,0 +1,570 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Append-only store for the results of density scanners
+
+A store is a directory holding
+
+* data.NNNNNN.bin : the density arrays, appended one after another, either
+  raw or compressed with pyscf.tools.density_codec.  A new file is
+  started when the current one exceeds chunk_size bytes.
+* index.sqlite : one row per record with the location of its density and
+  the mesh, box, energy, convergence flag, geometry and provenance.
+* store.lock : serializes the appends to the data files.
+
+Any number of processes on one node may append to the same store
+concurrently.  Records are never modified; if a (name, label) pair is
+stored twice, the latest record is returned.  A record only becomes
+visible once both its data and its index row are written, so an
+interrupted worker leaves at most some unreferenced bytes behind.
+
+Usage in a scanner::
+
+    store = ResultStore('results.store')
+    if not store.claim(name, '22'):
+        exit()      # done, or being computed by another worker
+    try:
+        ...
+        store.put(name, '22', rho, mesh=mf.grids.mesh, box=box,
+                  energy=e_tot, converged=mf.converged, xyz=xyz)
+    finally:
+        store.release(name, '22')   # let others retry if the scan failed
+
+and from the shell (exit status 0 if the record exists)::
+
+    python -m pyscf.tools.result_store done results.store $name 22
+
+or, to filter a list of names in one call::
+
+    cat names | python -m pyscf.tools.result_store pending results.store 22
+'''
+
+import os
+import sys
+import time
+import json
+import glob
+import fcntl
+import socket
+import sqlite3
+import zlib
+import numpy
+from pyscf.lib import logger
+from pyscf import __config__
+
+# size (in bytes) above which a new data file is started
+CHUNK_SIZE = getattr(__config__, 'tools_result_store_chunk_size', 4 * 1024**3)
+# seconds to wait for the index database of a busy store
+TIMEOUT = getattr(__config__, 'tools_result_store_timeout', 600)
+# claims older than this (in seconds) are considered abandoned.  Claims of
+# dead processes on the same host are dropped regardless of their age.
+CLAIM_TIMEOUT = getattr(__config__, 'tools_result_store_claim_timeout', 6 * 3600)
+# whether each append is flushed to disk before the index row is written
+FSYNC = getattr(__config__, 'tools_result_store_fsync', True)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    shard INTEGER,
+    offset INTEGER,
+    nbytes INTEGER,
+    dtype TEXT,
+    shape TEXT,
+    codec TEXT,
+    crc32 INTEGER,
+    mesh TEXT,
+    box TEXT,
+    energy REAL,
+    converged INTEGER,
+    xyz TEXT,
+    provenance TEXT,
+    created REAL);
+CREATE INDEX IF NOT EXISTS records_key ON records (name, label);
+CREATE TABLE IF NOT EXISTS claims (
+    name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    host TEXT,
+    pid INTEGER,
+    time REAL,
+    PRIMARY KEY (name, label));
+'''
+
+_LATEST = 'id IN (SELECT MAX(id) FROM records GROUP BY name, label)'
+
+def _dumps(a):
+    if a is None:
+        return None
+    return json.dumps(numpy.asarray(a).tolist())
+
+def _loads(s, dtype=float):
+    if s is None:
+        return None
+    return numpy.asarray(json.loads(s), dtype=dtype)
+
+def default_provenance():
+    '''Host, process, command line and time of the current process.'''
+    import pyscf
+    return {'host': socket.gethostname(), 'pid': os.getpid(),
+            'argv': list(sys.argv), 'cwd': os.getcwd(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'pyscf': pyscf.__version__}
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ResultStore(object):
+    '''Append-only result store in directory path
+
+    Attributes:
+        path : str
+            Directory of the store.  It is created if it does not exist.
+        chunk_size : int
+            Approximate maximum size (in bytes) of each data file.
+        fsync : bool
+            Whether the density is flushed to disk before the record is
+            indexed.
+    '''
+    def __init__(self, path, chunk_size=CHUNK_SIZE, fsync=FSYNC):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.fsync = fsync
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+        self._db = None
+        self._pid = None
+        self.db.executescript(_SCHEMA)
+
+    @property
+    def db(self):
+        '''sqlite connection of the current process (reopened after fork).'''
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'),
+                                 timeout=TIMEOUT, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def close(self):
+        if self._db is not None and self._pid == os.getpid():
+            self._db.close()
+        self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def shard_file(self, shard):
+        return os.path.join(self.path, 'data.%06d.bin' % shard)
+
+    def _append(self, buf):
+        '''Append buf to the current data file. Returns (shard, offset).'''
+        with open(os.path.join(self.path, 'store.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                shards = sorted(glob.glob(os.path.join(self.path, 'data.*.bin')))
+                if shards:
+                    shard = int(shards[-1][-10:-4])
+                    if os.path.getsize(shards[-1]) >= self.chunk_size:
+                        shard += 1
+                else:
+                    shard = 0
+                with open(self.shard_file(shard), 'ab') as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(buf)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return shard, offset
+
+    def put(self, name, label, density=None, mesh=None, box=None,
+            energy=None, converged=None, xyz=None, provenance=None,
+            codec=None):
+        '''Append one record.
+
+        Args:
+            name : str
+                Name of the molecule (or frame).
+            label : str
+                Kind of result, e.g. the basis/cutoff suffix '22'.
+
+        Kwargs:
+            density : ndarray
+                Density on the real-space mesh.  Stored with its dtype.
+            mesh : (3,) ints
+            box : (3,3) array
+                Lattice vectors.
+            energy : float
+            converged : bool
+            xyz : str
+                Geometry in xyz format.
+            provenance : dict
+                Merged into default_provenance().
+            codec : dict
+                If given, the density is stored in the chunked, compressed
+                format of pyscf.tools.density_codec, and codec is passed
+                to density_codec.encode, e.g. {'mode': 'quantized',
+                'tol': 1e-6}.  Only 3D densities can be compressed.
+
+        Returns:
+            id of the record.
+        '''
+        label = str(label)
+        shard = offset = nbytes = dtype = shape = crc = codec_name = None
+        if density is not None:
+            density = numpy.ascontiguousarray(density)
+            if mesh is not None and density.size == numpy.prod(mesh):
+                density = density.reshape(tuple(mesh))
+            if codec is None:
+                codec_name = 'raw'
+                buf = density.tobytes()
+                dtype = density.dtype.str
+            else:
+                from pyscf.tools import density_codec
+                codec_name = 'rhoz'
+                buf = density_codec.encode(density, **codec)
+                dtype = numpy.dtype(codec.get('dtype', numpy.float32)).str
+            nbytes = len(buf)
+            shape = json.dumps(density.shape)
+            crc = zlib.crc32(buf)
+            shard, offset = self._append(buf)
+        prov = default_provenance()
+        if provenance is not None:
+            prov.update(provenance)
+        if converged is not None:
+            converged = int(bool(converged))
+        if energy is not None:
+            energy = float(numpy.asarray(energy).ravel()[0])
+        db = self.db
+        cur = db.execute(
+            'INSERT INTO records (name, label, shard, offset, nbytes, dtype, '
+            'shape, codec, crc32, mesh, box, energy, converged, xyz, '
+            'provenance, created) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+            (name, label, shard, offset, nbytes, dtype, shape, codec_name, crc,
+             _dumps(mesh), _dumps(box), energy, converged, xyz,
+             json.dumps(prov), time.time()))
+        db.execute('DELETE FROM claims WHERE name=? AND label=?', (name, label))
+        return cur.lastrowid
+
+    def has(self, name, label):
+        '''Whether a record of (name, label) exists.'''
+        row = self.db.execute('SELECT 1 FROM records WHERE name=? AND label=? '
+                              'LIMIT 1', (name, str(label))).fetchone()
+        return row is not None
+
+    def __contains__(self, key):
+        return self.has(*key)
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM records WHERE ' +
+                               _LATEST).fetchone()[0]
+
+    def claim(self, name, label, timeout=CLAIM_TIMEOUT, pid=None):
+        '''Reserve (name, label) for the calling worker.
+
+        Returns False if the record exists, or if another worker claimed
+        it less than timeout seconds ago and, when that worker runs on
+        this host, is still alive.  The claim is released by put or
+        release.  pid is the process owning the claim (default: the
+        calling process).
+        '''
+        label = str(label)
+        host = socket.gethostname()
+        if pid is None:
+            pid = os.getpid()
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if self.has(name, label):
+                ok = False
+            else:
+                now = time.time()
+                db.execute('DELETE FROM claims WHERE name=? AND label=? AND '
+                           'time<?', (name, label, now - timeout))
+                row = db.execute('SELECT host, pid FROM claims WHERE name=? '
+                                 'AND label=?', (name, label)).fetchone()
+                if (row is not None and row['host'] == host and
+                        not _pid_alive(row['pid'])):
+                    db.execute('DELETE FROM claims WHERE name=? AND label=?',
+                               (name, label))
+                cur = db.execute('INSERT OR IGNORE INTO claims VALUES '
+                                 '(?,?,?,?,?)', (name, label, host, pid, now))
+                ok = cur.rowcount == 1
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return ok
+
+    def release(self, name, label):
+        '''Drop the claim on (name, label) without storing a record.'''
+        self.db.execute('DELETE FROM claims WHERE name=? AND label=?',
+                        (name, str(label)))
+
+    def _record(self, row, with_density=True, check=False):
+        rec = {'id': row['id'], 'name': row['name'], 'label': row['label'],
+               'mesh': _loads(row['mesh'], int), 'box': _loads(row['box']),
+               'energy': row['energy'], 'xyz': row['xyz'],
+               'converged': (None if row['converged'] is None
+                             else bool(row['converged'])),
+               'provenance': json.loads(row['provenance']),
+               'created': row['created']}
+        if with_density:
+            rec['density'] = self.load_density(row, check)
+        return rec
+
+    def load_density(self, row, check=False):
+        '''Read the density of an index row. With check=True, the CRC32
+        checksum of the data is verified.'''
+        if row['nbytes'] is None:
+            return None
+        with open(self.shard_file(row['shard']), 'rb') as f:
+            f.seek(row['offset'])
+            buf = f.read(row['nbytes'])
+        if len(buf) != row['nbytes'] or (check and zlib.crc32(buf) != row['crc32']):
+            raise IOError('Corrupted data of record %s %s (id %d)' %
+                          (row['name'], row['label'], row['id']))
+        if row['codec'] == 'rhoz':
+            from pyscf.tools import density_codec
+            return density_codec.decode(buf)
+        dtype = numpy.dtype(row['dtype'])
+        return numpy.frombuffer(buf, dtype=dtype).reshape(json.loads(row['shape']))
+
+    def read_tile(self, name, label, key):
+        '''Sub-block density[key] of the latest record of (name, label).
+        For compressed densities only the chunks overlapping the block are
+        read and decoded.'''
+        row = self._latest_row(name, label)
+        if row is None or row['nbytes'] is None:
+            raise KeyError((name, label))
+        if row['codec'] == 'rhoz':
+            from pyscf.tools import density_codec
+            with open(self.shard_file(row['shard']), 'rb') as f:
+                return density_codec.DensityFile(f, row['offset'])[key]
+        return self.load_density(row)[key]
+
+    def _latest_row(self, name, label):
+        return self.db.execute('SELECT * FROM records WHERE name=? AND label=? '
+                               'ORDER BY id DESC LIMIT 1',
+                               (name, str(label))).fetchone()
+
+    def get(self, name, label, check=False):
+        '''The latest record of (name, label) as a dict, or None.'''
+        row = self._latest_row(name, label)
+        if row is None:
+            return None
+        return self._record(row, check=check)
+
+    def query(self, label=None, converged=None, name=None, with_density=False):
+        '''Latest records matching the given conditions, sorted by name.
+
+        Kwargs:
+            label : str
+            converged : bool
+            name : str
+                A glob pattern, e.g. 'dsgdb9nsd_0000*'.
+            with_density : bool
+                Whether to load the densities.
+        '''
+        sql = 'SELECT * FROM records WHERE ' + _LATEST
+        args = []
+        if label is not None:
+            sql += ' AND label=?'
+            args.append(str(label))
+        if converged is not None:
+            sql += ' AND converged=?'
+            args.append(int(bool(converged)))
+        if name is not None:
+            sql += ' AND name GLOB ?'
+            args.append(name)
+        sql += ' ORDER BY name, label'
+        return [self._record(row, with_density)
+                for row in self.db.execute(sql, args).fetchall()]
+
+    def names(self, label=None):
+        '''Sorted names of the stored records.'''
+        if label is None:
+            rows = self.db.execute('SELECT DISTINCT name FROM records ORDER BY name')
+        else:
+            rows = self.db.execute('SELECT DISTINCT name FROM records WHERE '
+                                   'label=? ORDER BY name', (str(label),))
+        return [r[0] for r in rows]
+
+
+def _read_converged(out):
+    with open(out, errors='replace') as f:
+        text = f.read()
+    if 'not converged' in text:
+        return False
+    if 'converged SCF energy' in text:
+        return True
+    return None
+
+def _scan_converged(dirname, files, prefix, cache):
+    '''Convergence flag of one record from the *.out files in dirname.
+    With a prefix, only the files [prefix]*.out and <prefix>.out belong to
+    the record.  The flag of each file is read once and kept in cache.'''
+    stem = prefix.rstrip('_') + '.out'
+    converged = None
+    for fn in files:
+        if not fn.endswith('.out'):
+            continue
+        if prefix and not (fn.startswith(prefix) or fn == stem):
+            continue
+        if fn not in cache:
+            cache[fn] = _read_converged(os.path.join(dirname, fn))
+        if cache[fn] is False:
+            return False
+        if cache[fn]:
+            converged = True
+    return converged
+
+def import_directory(store, path, label='22', skip_existing=True, codec=None,
+                     verbose=None):
+    '''Import the loose files written by the scanners under path.
+
+    Every file named [prefix]grid_sizes_<label>.dat defines one record.
+    Its name is the directory relative to path, followed by the prefix
+    (without the trailing '_') if there is one, e.g. 'dsgdb9nsd_000001'
+    for results/dsgdb9nsd_000001/grid_sizes_22.dat or '1000/0' for
+    1000/0_grid_sizes_22.dat.  rho_<label>.npy, energy_<label>.dat,
+    centered.xyz, box.dat and box.npy with the same prefix are picked up
+    if present.  The convergence flag is read from the *.out files of the
+    directory, or for a prefix from [prefix]*.out and <prefix>.out, e.g.
+    0_scanner.out or 0.out.
+    codec is passed to ResultStore.put.
+
+    Returns:
+        The number of imported records.
+    '''
+    if not isinstance(store, ResultStore):
+        store = ResultStore(store)
+    log = logger.Logger(sys.stdout, logger.NOTE if verbose is None else verbose)
+    suffix = 'grid_sizes_%s.dat' % label
+    count = 0
+    for dirname, _, files in sorted(os.walk(path)):
+        files = sorted(files)
+        out_cache = {}
+        for fn in files:
+            if not fn.endswith(suffix):
+                continue
+            prefix = fn[:-len(suffix)]
+            reldir = os.path.relpath(dirname, path)
+            name = reldir if reldir != '.' else ''
+            if prefix:
+                name = os.path.join(name, prefix.rstrip('_'))
+            if skip_existing and store.has(name, label):
+                log.debug('skip %s', name)
+                continue
+
+            def fetch(basename):
+                f = os.path.join(dirname, prefix + basename)
+                return f if os.path.isfile(f) else None
+
+            mesh = numpy.loadtxt(fetch(suffix), dtype=int).ravel()
+            density = energy = box = xyz = None
+            if fetch('rho_%s.npy' % label):
+                density = numpy.load(fetch('rho_%s.npy' % label))
+            if fetch('energy_%s.dat' % label):
+                energy = numpy.loadtxt(fetch('energy_%s.dat' % label))
+            if fetch('box.npy'):
+                box = numpy.load(fetch('box.npy'))
+            elif fetch('box.dat'):
+                box = numpy.loadtxt(fetch('box.dat'))
+            if fetch('centered.xyz'):
+                with open(fetch('centered.xyz')) as f:
+                    xyz = f.read()
+            converged = _scan_converged(dirname, files, prefix, out_cache)
+            store.put(name, label, density, mesh=mesh, box=box, energy=energy,
+                      converged=converged, xyz=xyz, codec=codec,
+                      provenance={'source': os.path.abspath(dirname),
+                                  'imported': True})
+            log.debug('import %s', name)
+            count += 1
+    log.note('Imported %d records from %s into %s', count, path, store.path)
+    return count
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m pyscf.tools.result_store')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('done', help='exit status 0 if the record exists')
+    p.add_argument('store')
+    p.add_argument('name')
+    p.add_argument('label', nargs='?', default='22')
+    p = sub.add_parser('claim', help='exit status 0 if the record was claimed')
+    p.add_argument('store')
+    p.add_argument('name')
+    p.add_argument('label', nargs='?', default='22')
+    p = sub.add_parser('pending', help='print the names read from stdin '
+                       'which are not stored yet')
+    p.add_argument('store')
+    p.add_argument('label', nargs='?', default='22')
+    p = sub.add_parser('import', help='import a directory of loose files')
+    p.add_argument('store')
+    p.add_argument('path')
+    p.add_argument('label', nargs='?', default='22')
+    p.add_argument('--compress', action='store_true',
+                   help='store the densities as compressed float32')
+    p.add_argument('--tol', type=float,
+                   help='store the densities quantized to this absolute error')
+    p = sub.add_parser('list', help='print the latest records')
+    p.add_argument('store')
+    p.add_argument('--label')
+    args = parser.parse_args(argv)
+
+    with ResultStore(args.store) as store:
+        if args.command == 'done':
+            return 0 if store.has(args.name, args.label) else 1
+        elif args.command == 'claim':
+            # the claim belongs to the calling shell, not to this process
+            return 0 if store.claim(args.name, args.label, pid=os.getppid()) else 1
+        elif args.command == 'pending':
+            done = set(store.names(args.label))
+            for name in sys.stdin:
+                name = name.strip()
+                if name and name not in done:
+                    print(name)
+        elif args.command == 'import':
+            codec = None
+            if args.tol is not None:
+                codec = {'mode': 'quantized', 'tol': args.tol}
+            elif args.compress:
+                codec = {}
+            import_directory(store, args.path, args.label, codec=codec)
+        elif args.command == 'list':
+            for rec in store.query(label=args.label):
+                print(rec['name'], rec['label'], rec['energy'],
+                      rec['converged'], rec['mesh'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import tempfile
+import numpy
+from pyscf.tools import density_codec
+
+def make_rho(shape):
+    # a few Gaussians in a box, mostly vacuum
+    x, y, z = numpy.meshgrid(*[numpy.linspace(0, 1, n, endpoint=False)
+                               for n in shape], indexing='ij')
+    rho = numpy.zeros(shape)
+    for c, a in (((.3,.4,.5), 200.), ((.6,.5,.45), 120.), ((.5,.7,.5), 300.)):
+        rho += a/20 * numpy.exp(-a*((x-c[0])**2 + (y-c[1])**2 + (z-c[2])**2))
+    return rho
+
+rho = make_rho((37, 30, 45))
+
+class KnownValues(unittest.TestCase):
+    def test_lossless(self):
+        buf = density_codec.encode(rho, chunk=(16,16,16), dtype=numpy.float64)
+        self.assertTrue(abs(density_codec.decode(buf) - rho).max() == 0)
+        self.assertTrue(len(buf) < rho.nbytes)
+
+        buf = density_codec.encode(rho, chunk=(16,16,16))
+        rho1 = density_codec.decode(buf)
+        self.assertEqual(rho1.dtype, numpy.float32)
+        self.assertTrue((rho1 == rho.astype(numpy.float32)).all())
+
+    def test_quantized(self):
+        tol = 1e-6
+        buf = density_codec.encode(rho, chunk=(16,16,16), mode='quantized',
+                                   tol=tol, dtype=numpy.float64)
+        self.assertTrue(abs(density_codec.decode(buf) - rho).max() <= tol * 1.0001)
+        buf1 = density_codec.encode(rho, chunk=(16,16,16), dtype=numpy.float64)
+        self.assertTrue(len(buf) < len(buf1) / 3)
+        self.assertRaises(ValueError, density_codec.encode, rho, mode='quantized')
+
+    def test_random_access(self):
+        with tempfile.NamedTemporaryFile(suffix='.rhoz') as tmpf:
+            density_codec.save(tmpf.name, rho, chunk=(16,16,16),
+                               dtype=numpy.float64)
+            ref = density_codec.load(tmpf.name)
+            self.assertTrue((ref == rho).all())
+
+            nread = [0]
+            class CountingFile(density_codec.DensityFile):
+                def read_chunk(self, idx):
+                    nread[0] += 1
+                    return density_codec.DensityFile.read_chunk(self, idx)
+
+            with CountingFile(tmpf.name) as f:
+                self.assertEqual(f.shape, rho.shape)
+                self.assertTrue((f[10:20, 17:30, 20:31] == rho[10:20, 17:30, 20:31]).all())
+                self.assertEqual(nread[0], 2)
+                for key in [(slice(None),), (5, slice(2, 40, 3)),
+                            (slice(-10, None), -1, slice(None, None, -2)),
+                            (slice(30, 10),), (36, 29, 44)]:
+                    self.assertTrue((f[key] == rho[key]).all())
+
+if __name__ == "__main__":
+    print("Full Tests for density_codec")
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Copyright 2014-2021 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import unittest
+import tempfile
+import multiprocessing
+import numpy
+from pyscf.tools import result_store
+
+def _worker(path, iproc, nrec):
+    store = result_store.ResultStore(path, chunk_size=4000)
+    for i in range(nrec):
+        name = 'mol_%d_%d' % (iproc, i)
+        if store.claim(name, '22'):
+            rho = numpy.full((4,5,6), iproc * 100 + i, dtype=numpy.float32)
+            store.put(name, '22', rho, mesh=(4,5,6), energy=-iproc-i*.1,
+                      converged=True)
+
+class KnownValues(unittest.TestCase):
+    def test_put_get(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = result_store.ResultStore(path)
+            rho = numpy.random.random(60)
+            box = numpy.eye(3) * 5
+            self.assertTrue(store.claim('a', '22'))
+            self.assertFalse(store.claim('a', '22'))
+            store.put('a', '22', rho, mesh=(3,4,5), box=box, energy=-1.5,
+                      converged=False, xyz='1\n\nH 0 0 0\n')
+            self.assertFalse(store.claim('a', '22'))
+            self.assertTrue(('a', '22') in store)
+            self.assertFalse(('a', '11') in store)
+            rec = store.get('a', '22', check=True)
+            self.assertEqual(rec['density'].shape, (3,4,5))
+            self.assertAlmostEqual(abs(rec['density'].ravel() - rho).max(), 0, 14)
+            self.assertAlmostEqual(abs(rec['box'] - box).max(), 0, 14)
+            self.assertEqual(rec['mesh'].tolist(), [3,4,5])
+            self.assertEqual(rec['converged'], False)
+            self.assertEqual(rec['provenance']['pid'], os.getpid())
+
+            # append-only: the latest record wins
+            rho1 = rho.reshape(3,4,5) * 2
+            store.put('a', '22', rho1, mesh=(3,4,5), converged=True)
+            store.put('b', '22', energy=-2.)
+            self.assertEqual(len(store), 2)
+            rec = store.get('a', '22')
+            self.assertAlmostEqual(abs(rec['density'].ravel() - rho*2).max(), 0, 14)
+            self.assertEqual([r['name'] for r in store.query(converged=True)], ['a'])
+            self.assertEqual(store.get('b', '22')['density'], None)
+            self.assertEqual(store.names(), ['a', 'b'])
+
+            rho = numpy.random.random((20,30,40))
+            store.put('c', '22', rho, codec={'dtype': numpy.float64,
+                                             'chunk': (16,16,16)})
+            self.assertTrue((store.get('c', '22', check=True)['density'] == rho).all())
+            self.assertTrue((store.read_tile('c', '22', (slice(3,9), 4)) ==
+                             rho[3:9,4]).all())
+            self.assertTrue((store.read_tile('a', '22', (slice(1,3), 2)) ==
+                             rho1[1:3,2]).all())
+            store.close()
+
+    def test_stale_claim(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = result_store.ResultStore(path)
+            ctx = multiprocessing.get_context('fork')
+            p = ctx.Process(target=store.claim, args=('a', '22'))
+            p.start()
+            p.join()
+            # the claiming process is dead
+            self.assertTrue(store.claim('a', '22'))
+            self.assertFalse(store.claim('a', '22'))
+            store.release('a', '22')
+            self.assertTrue(store.claim('a', '22', pid=os.getppid()))
+            self.assertFalse(store.claim('a', '22'))
+            self.assertTrue(store.claim('a', '22', timeout=-1))
+            store.close()
+
+    def test_concurrent_append(self):
+        nproc, nrec = 4, 6
+        with tempfile.TemporaryDirectory() as path:
+            ctx = multiprocessing.get_context('fork')
+            procs = [ctx.Process(target=_worker, args=(path, i, nrec))
+                     for i in range(nproc)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+            store = result_store.ResultStore(path)
+            self.assertEqual(len(store), nproc * nrec)
+            # 480 bytes per record; a new data file after 9 records
+            self.assertEqual(len(glob.glob(os.path.join(path, 'data.*.bin'))), 3)
+            for rec in store.query(label='22', with_density=True):
+                i, j = map(int, rec['name'].split('_')[1:])
+                self.assertTrue((rec['density'] == i * 100 + j).all())
+                self.assertAlmostEqual(rec['energy'], -i-j*.1, 12)
+            store.close()
+
+    def test_import_directory(self):
+        with tempfile.TemporaryDirectory() as path:
+            src = os.path.join(path, 'results')
+            mol = os.path.join(src, 'dsgdb9nsd_000001')
+            os.makedirs(mol)
+            numpy.savetxt(os.path.join(mol, 'grid_sizes_22.dat'), [2,3,4], fmt='%d')
+            numpy.save(os.path.join(mol, 'rho_22.npy'), numpy.arange(24.))
+            numpy.savetxt(os.path.join(mol, 'energy_22.dat'), [-40.5])
+            numpy.savetxt(os.path.join(mol, 'box.dat'), numpy.eye(3)*7)
+            with open(os.path.join(mol, 'scanner.out'), 'w') as f:
+                f.write('converged SCF energy = -40.5\n')
+            frames = os.path.join(src, '1000')
+            os.makedirs(frames)
+            numpy.savetxt(os.path.join(frames, '0_grid_sizes_22.dat'), [2,2,2], fmt='%d')
+            numpy.savetxt(os.path.join(frames, '0_energy_22.dat'), [-3.])
+            for i, msg in enumerate(['', 'SCF not converged.', 'converged SCF energy']):
+                numpy.savetxt(os.path.join(frames, '%d_grid_sizes_22.dat' % (i+1)),
+                              [2,2,2], fmt='%d')
+                with open(os.path.join(frames, '%d.out' % (i+1)), 'w') as f:
+                    f.write(msg)
+
+            store = result_store.ResultStore(os.path.join(path, 'store'))
+            self.assertEqual(result_store.import_directory(store, src, verbose=0), 5)
+            self.assertEqual(result_store.import_directory(store, src, verbose=0), 0)
+            self.assertEqual(store.names(), ['1000/0', '1000/1', '1000/2', '1000/3',
+                                             'dsgdb9nsd_000001'])
+            self.assertEqual([store.get('1000/%d' % i, '22')['converged']
+                              for i in range(1, 4)], [None, False, True])
+            rec = store.get('dsgdb9nsd_000001', '22')
+            self.assertEqual(rec['density'].shape, (2,3,4))
+            self.assertEqual(rec['density'][1,2,3], 23.)
+            self.assertAlmostEqual(rec['energy'], -40.5, 12)
+            self.assertAlmostEqual(rec['box'][2,2], 7., 12)
+            self.assertTrue(rec['converged'])
+            rec = store.get('1000/0', '22')
+            self.assertEqual(rec['density'], None)
+            self.assertEqual(rec['converged'], None)
+            self.assertEqual(result_store.main(['done', store.path, '1000/0']), 0)
+            self.assertEqual(result_store.main(['done', store.path, '1000/4']), 1)
+            store.close()
+
+if __name__ == "__main__":
+    print("Full Tests for result_store")
+    unittest.main()
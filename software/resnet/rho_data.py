@@ -2,6 +2,16 @@ import torch
 from torch.utils.data import DataLoader, Dataset
 import numpy as np
 
+def load_rho(filename):
+    '''
+    density from a .npy file, or from a chunked, compressed .rhoz file
+    (see pyscf.tools.density_codec)
+    '''
+    if filename.endswith('.rhoz'):
+        from pyscf.tools import density_codec
+        return density_codec.load(filename)
+    return np.load(filename)
+
 class RhoData(Dataset):
     def __init__(self, list_data, list_label, list_data_gridsizes, list_label_gridsizes, data_augmentation=True, downsample_data=1, downsample_label=1):
         self.ds_data = downsample_data
@@ -57,12 +67,12 @@ class RhoData(Dataset):
 
     def __getitem__(self, idx):
         rho1 = torch.tensor(
-            np.load(self.list_data[idx]), dtype=torch.float32)
+            load_rho(self.list_data[idx]), dtype=torch.float32)
         size = np.loadtxt(self.list_data_gs[idx], dtype=int)
         rho1 = rho1.reshape(1, *size)
 
         rho2 = torch.tensor(
-            np.load(self.list_label[idx]), dtype=torch.float32)
+            load_rho(self.list_label[idx]), dtype=torch.float32)
         size = np.loadtxt(self.list_label_gs[idx], dtype=int)
         rho2 = rho2.reshape(1, *size)
 